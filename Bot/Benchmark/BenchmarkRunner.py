@@ -0,0 +1,165 @@
+import gc
+import json
+import math
+import time
+import tracemalloc
+
+
+class BenchmarkResult:
+    def __init__(self, name, iterations, total_time, latencies, allocations=(0, 0, 0), extra=None):
+        self._name = name
+        self._iterations = iterations
+        self._total_time = total_time
+        self._latencies = sorted(latencies)
+        self._retained_blocks, self._retained_bytes, self._peak_bytes = allocations
+        self._extra = extra if extra is not None else {}
+
+    def get_name(self):
+        return self._name
+
+    def get_throughput(self):
+        return self._iterations / self._total_time if self._total_time > 0 else float("inf")
+
+    def get_percentile(self, percentile):
+        return percentile_of(self._latencies, percentile)
+
+    def get_extra(self):
+        return self._extra
+
+    def to_json_object(self):
+        return {
+            "iterations": self._iterations,
+            "throughput": self.get_throughput(),
+            "p50_ms": self.get_percentile(50) * 1000,
+            "p99_ms": self.get_percentile(99) * 1000,
+            "retained_blocks_per_op": self._retained_blocks,
+            "retained_bytes_per_op": self._retained_bytes,
+            "peak_bytes_per_op": self._peak_bytes,
+            "extra": self._extra
+        }
+
+
+def percentile_of(sorted_values, percentile):
+    if not sorted_values:
+        return 0.0
+    rank = int(math.ceil(percentile / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+class BenchmarkRunner:
+    ALLOCATION_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+                          tracemalloc.Filter(False, __file__))
+
+    def __init__(self, iterations=1000, allocation_iterations=100, min_time=0.0):
+        self._iterations = iterations
+        self._allocation_iterations = allocation_iterations
+        self._min_time = min_time
+        self._results = []
+
+    def get_results(self):
+        return list(self._results)
+
+    def measure(self, name, operation, prepare=None, extra=None):
+        if prepare is not None:
+            prepare()
+        operation()
+
+        latencies = []
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            total_time = 0.0
+            iterations = 0
+            while iterations < self._iterations or total_time < self._min_time:
+                if prepare is not None:
+                    prepare()
+                started = time.perf_counter()
+                operation()
+                latency = time.perf_counter() - started
+                latencies.append(latency)
+                total_time += latency
+                iterations += 1
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        allocations = self._measure_allocations(operation, prepare)
+        result = BenchmarkResult(name, iterations, total_time, latencies, allocations,
+                                 extra() if extra is not None else None)
+        self._results.append(result)
+        return result
+
+    def add_result(self, name, latencies, extra=None):
+        result = BenchmarkResult(name, len(latencies), sum(latencies), latencies, extra=extra)
+        self._results.append(result)
+        return result
+
+    def _measure_allocations(self, operation, prepare):
+        if self._allocation_iterations <= 0:
+            return 0, 0, 0
+        blocks = 0
+        retained = 0
+        peak = 0
+        tracemalloc.start()
+        try:
+            for _ in range(self._allocation_iterations):
+                if prepare is not None:
+                    prepare()
+                tracemalloc.clear_traces()
+                operation()
+                current_size, peak_size = tracemalloc.get_traced_memory()
+                blocks += len(tracemalloc.take_snapshot().filter_traces(self.ALLOCATION_FILTERS).traces)
+                retained += current_size
+                peak += peak_size
+        finally:
+            tracemalloc.stop()
+        return (blocks / self._allocation_iterations, retained / self._allocation_iterations,
+                peak / self._allocation_iterations)
+
+    def to_json_object(self, parameters=None):
+        return {
+            "parameters": parameters if parameters is not None else {},
+            "results": dict((result.get_name(), result.to_json_object()) for result in self._results)
+        }
+
+    def save(self, path, parameters=None):
+        with open(path, 'w') as results_file:
+            json.dump(self.to_json_object(parameters), results_file, indent=2, sort_keys=True)
+
+
+def compare_results(results, baseline, tolerance=0.2):
+    regressions = []
+    baseline_results = baseline.get("results", {})
+    for name, result in sorted(results.get("results", {}).items()):
+        if name not in baseline_results:
+            continue
+        expected = baseline_results[name]
+        for metric in ("p50_ms", "p99_ms"):
+            if expected[metric] > 0 and result[metric] > expected[metric] * (1 + tolerance):
+                regressions.append((name, metric, expected[metric], result[metric]))
+        if result["throughput"] < expected["throughput"] / (1 + tolerance):
+            regressions.append((name, "throughput", expected["throughput"], result["throughput"]))
+    return regressions
+
+
+def report_results(runner, parameters, output=None, baseline=None, tolerance=0.2):
+    for result in runner.get_results():
+        print("{0:<55} {1:>12.0f} op/s  p50 {2:>9.4f} ms  p99 {3:>9.4f} ms".format(
+            result.get_name(), result.get_throughput(), result.get_percentile(50) * 1000,
+            result.get_percentile(99) * 1000))
+
+    if output is not None:
+        runner.save(output, parameters)
+
+    if baseline is not None:
+        with open(baseline, 'r') as baseline_file:
+            baseline_results = json.load(baseline_file)
+        if baseline_results.get("parameters") != parameters:
+            print("WARNING: baseline was collected with different parameters: {}".format(
+                baseline_results.get("parameters")))
+        regressions = compare_results(runner.to_json_object(parameters), baseline_results, tolerance)
+        for name, metric, expected, actual in regressions:
+            print("REGRESSION {0}: {1} {2:.4f} -> {3:.4f}".format(name, metric, expected, actual))
+        if regressions:
+            return 1
+    return 0
@@ -0,0 +1,112 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+try:
+    import Bot
+except ImportError:
+    BOT_PATH = os.path.realpath(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    sys.path.append(BOT_PATH)
+    import Bot
+
+from Bot.Benchmark.BenchmarkRunner import BenchmarkRunner
+from Bot.Benchmark.BenchmarkRunner import report_results
+from Bot.Benchmark.SyntheticState import SyntheticState
+from Bot.MergeDispatcher import BotModel
+from Bot.MergeDispatcher import Config
+from Bot.MergeDispatcher import Event
+from Bot.MergeDispatcher import EventStore
+from Bot.MergeDispatcher import EventType
+
+SUBSCRIPTION_PROBABILITY = 0.1
+HISTORY_STARTED = 1500000000.0
+EVENTS_INTERVAL = 60.0
+
+
+def generate_events(state, event_store, events, seed=42):
+    generator = random.Random(seed)
+    branch_names = state.get_branch_names()
+    user_ids = state.get_user_ids()
+    model = BotModel(Config(branch_names), backup_path=event_store.get_path())
+
+    def record(event_type, branch_name=None, user_id=None, name=None):
+        event = Event(event_type, HISTORY_STARTED + event_store.get_last_sequence() * EVENTS_INTERVAL, branch_name,
+                      user_id, name=name)
+        EventStore.apply_event(model, event)
+        event_store.append(event)
+        if event_store.should_snapshot():
+            event_store.write_snapshot(model)
+
+    for user_id in user_ids:
+        record(EventType.user_updated, user_id=user_id, name="User {}".format(user_id))
+
+    while event_store.get_last_sequence() < events:
+        branch_name = generator.choice(branch_names)
+        branch = model.get_branches()[branch_name]
+        user = model.get_user(generator.choice(user_ids))
+        if generator.random() < SUBSCRIPTION_PROBABILITY:
+            event_type = EventType.unsubscribes if user in branch.subscriptions else EventType.subscribes
+        elif user == branch.active_user:
+            event_type = EventType.done_merge
+        elif user in branch.users_queue:
+            event_type = EventType.starts_merge if branch.active_user is None and branch.users_queue[0] == user \
+                else EventType.exits_queue
+        elif branch.active_user is None and not branch.users_queue:
+            event_type = EventType.starts_merge
+        else:
+            event_type = EventType.joins_queue
+        record(event_type, branch_name, user.get_identifier())
+    return model
+
+
+def measure_replay(state, event_store, expected_model, runs):
+    latencies = []
+    replayed_events = 0
+    for _ in range(runs):
+        model = BotModel(Config(state.get_branch_names()), backup_path=event_store.get_path())
+        started = time.perf_counter()
+        replayed_events = event_store.replay(model)
+        latencies.append(time.perf_counter() - started)
+        if EventStore.get_model_state(model) != EventStore.get_model_state(expected_model):
+            raise RuntimeError("Replayed model differs from the original one")
+    return latencies, replayed_events
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Replay time of event store against its size")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--branches", type=int, default=50)
+    parser.add_argument("--events", default="1000,10000,100000", help="Comma separated sizes of event log")
+    parser.add_argument("--snapshot-interval", type=int, default=EventStore.DEFAULT_SNAPSHOT_INTERVAL)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="Path of JSON file to save results to")
+    parser.add_argument("--baseline", help="Path of JSON file with baseline results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown against baseline (0.2 means 20%%)")
+    arguments = parser.parse_args(arguments)
+
+    state = SyntheticState(users=arguments.users, branches=arguments.branches, seed=arguments.seed)
+    runner = BenchmarkRunner()
+    sizes = [int(size) for size in arguments.events.split(",")]
+    for size in sizes:
+        for name, snapshot_interval in (("full", size + 1), ("snapshot", arguments.snapshot_interval)):
+            with tempfile.TemporaryDirectory() as work_dir:
+                event_store = EventStore(work_dir, snapshot_interval=snapshot_interval)
+                model = generate_events(state, event_store, size, arguments.seed)
+                event_store.close()
+                latencies, replayed_events = measure_replay(state, event_store, model, arguments.runs)
+            runner.add_result("replay.{0}.{1}".format(name, size), latencies,
+                              extra={"events": size, "replayed_events": replayed_events,
+                                     "events_per_second": replayed_events / min(latencies) if min(latencies) else 0})
+
+    parameters = state.get_parameters()
+    parameters.update({"events": sizes, "snapshot_interval": arguments.snapshot_interval, "runs": arguments.runs})
+    return report_results(runner, parameters, arguments.output, arguments.baseline, arguments.tolerance)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
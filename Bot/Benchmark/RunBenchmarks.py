@@ -0,0 +1,242 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+try:
+    import Bot
+except ImportError:
+    BOT_PATH = os.path.realpath(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    sys.path.append(BOT_PATH)
+    import Bot
+
+from Bot.Benchmark.BenchmarkRunner import BenchmarkRunner
+from Bot.Benchmark.BenchmarkRunner import report_results
+from Bot.Benchmark.SyntheticState import SyntheticState
+from Bot.MergeDispatcher import BatchOperation
+from Bot.MergeDispatcher import BatchOperationType
+from Bot.MergeDispatcher import BotModel
+from Bot.MergeDispatcher import BotPresentationModel
+from Bot.MergeDispatcher import Config
+from Bot.MergeDispatcher import Dispatcher
+from Bot.MergeDispatcher import MessageSender
+from Bot.MergeDispatcher import Notifier
+from Bot.MergeDispatcher import NotifierActions
+
+
+class CountingNotifier(Notifier):
+    def __init__(self):
+        self._notifications = 0
+
+    def notify(self, whom, action_type, action_data):
+        self._notifications += 1
+
+    def get_notifications(self):
+        return self._notifications
+
+
+class NullMessageSender(MessageSender):
+    def __init__(self):
+        self._messages = 0
+
+    def send(self, identifier, message):
+        self._messages += 1
+
+    def send_branch_selector(self, identifier, state, message, branches, payload=None):
+        self._messages += 1
+
+    def send_user_selector(self, identifier, state, message, users, payload=None):
+        self._messages += 1
+
+    def request_merge_confirmation(self, identifier, message, branch):
+        self._messages += 1
+
+    def answer_inline_query(self, query_id, results):
+        self._messages += 1
+
+    def get_messages(self):
+        return self._messages
+
+
+class DispatcherBenchmarks:
+    def __init__(self, state: SyntheticState, runner: BenchmarkRunner, work_dir):
+        self._state = state
+        self._runner = runner
+        self._work_dir = work_dir
+        self._logger = logging.getLogger("Benchmark")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            self._logger.addHandler(logging.NullHandler())
+
+        self._model = state.create_model(work_dir)
+        self._notifier = CountingNotifier()
+        self._dispatcher = Dispatcher(self._model, self._logger)
+        self._dispatcher.set_notifier(self._notifier)
+        self._branch = state.get_branch_names()[0]
+        user_ids = state.get_user_ids()
+        self._user_id = user_ids[0]
+        self._other_user_id = user_ids[-1]
+
+    def run(self):
+        self._measure_commands()
+        self._measure_queries()
+        self._measure_persistence()
+        self._measure_presentation()
+        return self._runner.get_results()
+
+    def _measure(self, name, operation, prepare=None):
+        snapshots = self._dispatcher.get_snapshot_allocations()
+        notifications = self._notifier.get_notifications()
+
+        def extra():
+            return {
+                "snapshot_allocations": self._dispatcher.get_snapshot_allocations() - snapshots,
+                "notifications": self._notifier.get_notifications() - notifications
+            }
+
+        return self._runner.measure(name, operation, prepare, extra)
+
+    def _branch_queue(self):
+        return self._model.get_branches()[self._branch]
+
+    def _user(self):
+        return self._model.get_user(self._user_id)
+
+    def _ensure_not_in_branch(self):
+        if self._dispatcher.get_all_branches_with_user(self._user_id, self._branch):
+            self._dispatcher.cancel(self._user_id, self._branch)
+
+    def _ensure_in_queue(self):
+        if not self._dispatcher.get_all_branches_with_user(self._user_id, self._branch):
+            self._dispatcher.merge(self._user_id, self._branch)
+
+    def _ensure_active(self):
+        if self._branch_queue().active_user != self._user():
+            self._dispatcher.fix(self._user_id, self._branch)
+
+    def _ensure_not_active(self):
+        if self._branch_queue().active_user == self._user():
+            self._dispatcher.done(self._user_id, self._branch)
+
+    def _ensure_ready_to_confirm(self):
+        branch_queue = self._branch_queue()
+        if self._user() in branch_queue.users_queue:
+            branch_queue.users_queue.remove(self._user())
+        if branch_queue.active_user is not None and branch_queue.active_user != self._user():
+            branch_queue.users_queue.append(branch_queue.active_user)
+        branch_queue.active_user = None
+        branch_queue.users_queue.appendleft(self._user())
+        branch_queue.mark_changed()
+
+    def _ensure_subscribed(self):
+        self._dispatcher.subscribe(self._user_id, self._branch)
+
+    def _ensure_not_subscribed(self):
+        self._dispatcher.unsubscribe(self._user_id, self._branch)
+
+    def _batch(self, operation_type):
+        return [BatchOperation(operation_type, user_id, self._branch) for user_id in self._state.get_user_ids()[:10]]
+
+    def _measure_commands(self):
+        self._measure("dispatcher.merge", lambda: self._dispatcher.merge(self._user_id, self._branch),
+                      self._ensure_not_in_branch)
+        self._measure("dispatcher.cancel", lambda: self._dispatcher.cancel(self._user_id, self._branch),
+                      self._ensure_in_queue)
+        self._measure("dispatcher.done", lambda: self._dispatcher.done(self._user_id, self._branch),
+                      self._ensure_active)
+        self._measure("dispatcher.fix", lambda: self._dispatcher.fix(self._user_id, self._branch),
+                      self._ensure_not_active)
+        self._measure("dispatcher.kick",
+                      lambda: self._dispatcher.kick(self._other_user_id, self._user_id, self._branch),
+                      self._ensure_in_queue)
+        self._measure("dispatcher.confirm_merge",
+                      lambda: self._dispatcher.confirm_merge(self._user_id, self._branch),
+                      self._ensure_ready_to_confirm)
+        self._measure("dispatcher.subscribe", lambda: self._dispatcher.subscribe(self._user_id, self._branch),
+                      self._ensure_not_subscribed)
+        self._measure("dispatcher.unsubscribe", lambda: self._dispatcher.unsubscribe(self._user_id, self._branch),
+                      self._ensure_subscribed)
+
+        names = ["Renamed", "User"]
+        self._measure("dispatcher.update_user",
+                      lambda: self._dispatcher.update_user(self._user_id, names[0], str(self._user_id)),
+                      lambda: names.reverse())
+
+        subscribe_batch = self._batch(BatchOperationType.subscribe)
+        unsubscribe_batch = self._batch(BatchOperationType.unsubscribe)
+        self._measure("dispatcher.execute_batch", lambda: self._dispatcher.execute_batch(subscribe_batch),
+                      lambda: self._dispatcher.execute_batch(unsubscribe_batch))
+
+    def _measure_queries(self):
+        self._measure("dispatcher.get_branch_queue_info",
+                      lambda: self._dispatcher.get_branch_queue_info(self._branch))
+        self._measure("dispatcher.get_branch_queue_info_after_change",
+                      lambda: self._dispatcher.get_branch_queue_info(self._branch),
+                      lambda: self._branch_queue().mark_changed())
+        self._measure("dispatcher.get_all_branches", lambda: self._dispatcher.get_all_branches())
+        self._measure("dispatcher.get_all_branches_filtered", lambda: self._dispatcher.get_all_branches("rel"))
+        self._measure("dispatcher.get_branches_user_subscribed_to",
+                      lambda: self._dispatcher.get_branches_user_subscribed_to(self._user_id))
+        self._measure("dispatcher.get_branches_user_not_subscribed_to",
+                      lambda: self._dispatcher.get_branches_user_not_subscribed_to(self._user_id))
+        self._measure("dispatcher.get_all_branches_with_user",
+                      lambda: self._dispatcher.get_all_branches_with_user(self._user_id))
+        self._measure("dispatcher.get_active_user_branches",
+                      lambda: self._dispatcher.get_active_user_branches(self._user_id))
+
+    def _measure_persistence(self):
+        config = Config(self._state.get_branch_names())
+        self._measure("model.dump", self._model.dump)
+        self._measure("model.restore", lambda: BotModel(config, backup_path=self._work_dir, restore=True))
+
+    def _measure_presentation(self):
+        message_sender = NullMessageSender()
+        presentation_model = BotPresentationModel(self._dispatcher, message_sender)
+        self._measure("presentation.request_queue_info",
+                      lambda: presentation_model.request_queue_info(self._user_id, self._branch))
+        self._measure("presentation.request_queue_info_after_change",
+                      lambda: presentation_model.request_queue_info(self._user_id, self._branch),
+                      lambda: self._branch_queue().mark_changed())
+        self._measure("presentation.request_merge_selector",
+                      lambda: presentation_model.request_merge(self._user_id))
+        self._measure("presentation.request_inline_branches",
+                      lambda: presentation_model.request_inline_branches("1", "rel"))
+
+        action_data = Notifier.ActionData(self._model.get_user(self._other_user_id), self._branch)
+        self._measure("presentation.notify",
+                      lambda: presentation_model.notify(self._user(), NotifierActions.joins_queue, action_data))
+        self._dispatcher.set_notifier(self._notifier)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of merge dispatcher on synthetic state")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--branches", type=int, default=50)
+    parser.add_argument("--queued-users", type=int, default=500)
+    parser.add_argument("--subscriptions", type=int, default=500)
+    parser.add_argument("--distribution", default=SyntheticState.ZIPF_DISTRIBUTION,
+                        choices=[SyntheticState.UNIFORM_DISTRIBUTION, SyntheticState.ZIPF_DISTRIBUTION])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--allocation-iterations", type=int, default=100)
+    parser.add_argument("--output", help="Path of JSON file to save results to")
+    parser.add_argument("--baseline", help="Path of JSON file with baseline results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown against baseline (0.2 means 20%%)")
+    arguments = parser.parse_args(arguments)
+
+    state = SyntheticState(users=arguments.users, branches=arguments.branches,
+                           queued_users=arguments.queued_users, subscriptions=arguments.subscriptions,
+                           distribution=arguments.distribution, seed=arguments.seed)
+    runner = BenchmarkRunner(iterations=arguments.iterations,
+                             allocation_iterations=arguments.allocation_iterations)
+    with tempfile.TemporaryDirectory() as work_dir:
+        DispatcherBenchmarks(state, runner, work_dir).run()
+
+    return report_results(runner, state.get_parameters(), arguments.output, arguments.baseline, arguments.tolerance)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import Bot
+except ImportError:
+    BOT_PATH = os.path.realpath(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    sys.path.append(BOT_PATH)
+    import Bot
+
+from Bot.Benchmark.BenchmarkRunner import BenchmarkRunner
+from Bot.Benchmark.BenchmarkRunner import report_results
+from Bot.Benchmark.SyntheticState import SyntheticState
+
+ROOT_PATH = os.path.realpath(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+PROBE_MODULE = "Bot.Benchmark.StartupProbe"
+
+
+def prepare_work_dir(state, work_dir):
+    state.create_model(work_dir).dump()
+    with open(os.path.join(work_dir, "config.json"), 'w') as config_file:
+        json.dump({"branches": state.get_branch_names()}, config_file)
+
+
+def run_probe(work_dir):
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT_PATH, environment.get("PYTHONPATH")]))
+    output = subprocess.check_output([sys.executable, "-m", PROBE_MODULE, work_dir], env=environment,
+                                     universal_newlines=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_first_poll(branches, timeout):
+    from Bot.LoadTest.FakeTelegramServer import FakeTelegramServer
+    from Bot.LoadTest.LoadDriver import FAKE_TOKEN
+    from Bot.LoadTest.LoadDriver import BotProcess
+
+    server = FakeTelegramServer(FAKE_TOKEN)
+    server.start()
+    bot_process = BotProcess(server.get_url(), branches)
+    try:
+        started = time.perf_counter()
+        bot_process.start()
+        if not server.get_state().wait_until_ready(timeout):
+            raise RuntimeError("Bot has not started, its output:\n{}".format(bot_process.get_output()))
+        return time.perf_counter() - started
+    finally:
+        bot_process.stop()
+        server.stop()
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Startup time of the bot on synthetic state")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--branches", type=int, default=50)
+    parser.add_argument("--queued-users", type=int, default=500)
+    parser.add_argument("--subscriptions", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--runs", type=int, default=10, help="Number of fresh interpreters to start")
+    parser.add_argument("--end-to-end", action="store_true",
+                        help="Also start the bot against fake Telegram Bot API and measure time to the first poll")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="Path of JSON file to save results to")
+    parser.add_argument("--baseline", help="Path of JSON file with baseline results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown against baseline (0.2 means 20%%)")
+    arguments = parser.parse_args(arguments)
+
+    state = SyntheticState(users=arguments.users, branches=arguments.branches,
+                           queued_users=arguments.queued_users, subscriptions=arguments.subscriptions,
+                           seed=arguments.seed)
+    stages = {}
+    totals = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_work_dir(state, work_dir)
+        for _ in range(arguments.runs):
+            probe_stages = run_probe(work_dir)
+            for stage, duration in probe_stages:
+                stages.setdefault(stage, []).append(duration)
+            totals.append(sum(duration for _, duration in probe_stages))
+
+    runner = BenchmarkRunner()
+    for stage, durations in stages.items():
+        runner.add_result("startup." + stage, durations)
+    runner.add_result("startup.total", totals)
+    if arguments.end_to_end:
+        runner.add_result("startup.first_poll", [measure_first_poll(state.get_branch_names(), arguments.startup_timeout)
+                                                 for _ in range(arguments.runs)])
+
+    parameters = state.get_parameters()
+    parameters["runs"] = arguments.runs
+    return report_results(runner, parameters, arguments.output, arguments.baseline, arguments.tolerance)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+import sys
+import time
+
+
+def main(work_dir):
+    started = time.perf_counter()
+    import json
+    import logging
+    import os
+    from Bot.MergeDispatcher import BotModel
+    from Bot.MergeDispatcher import Dispatcher
+    from Bot.MergeDispatcher import JSONConfigLoader
+    from Bot.MergeDispatcher import StartupTimeline
+    timeline = StartupTimeline(started)
+    timeline.mark("import")
+
+    with open(os.path.join(work_dir, "config.json"), 'r') as config_file:
+        config = JSONConfigLoader.parse_json(config_file.read())
+    timeline.mark("config")
+
+    model = BotModel(config, backup_path=work_dir, restore=True)
+    timeline.mark("restore")
+
+    logger = logging.getLogger("Benchmark")
+    logger.propagate = False
+    logger.addHandler(logging.NullHandler())
+    dispatcher = Dispatcher(model, logger)
+    dispatcher.prepare()
+    dispatcher.get_all_branches()
+    timeline.mark("prepare")
+
+    print(json.dumps(timeline.get_stages()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1]))
@@ -0,0 +1,72 @@
+import random
+
+from Bot.MergeDispatcher import BotModel
+from Bot.MergeDispatcher import Config
+
+
+class SyntheticState:
+    UNIFORM_DISTRIBUTION = "uniform"
+    ZIPF_DISTRIBUTION = "zipf"
+
+    def __init__(self, users=100, branches=10, queued_users=50, subscriptions=50,
+                 distribution=ZIPF_DISTRIBUTION, seed=42):
+        if distribution not in (self.UNIFORM_DISTRIBUTION, self.ZIPF_DISTRIBUTION):
+            raise ValueError("Unknown distribution: %s" % distribution)
+        self._users = users
+        self._branches = branches
+        self._queued_users = queued_users
+        self._subscriptions = subscriptions
+        self._distribution = distribution
+        self._seed = seed
+
+    def get_parameters(self):
+        return {
+            "users": self._users,
+            "branches": self._branches,
+            "queued_users": self._queued_users,
+            "subscriptions": self._subscriptions,
+            "distribution": self._distribution,
+            "seed": self._seed
+        }
+
+    def get_branch_names(self):
+        names = ["default"]
+        for index in range(1, self._branches):
+            names.append("release-{0}.{1}".format(index // 10, index % 10) if index % 2 else
+                         "feature/team-{0}".format(index))
+        return names[:self._branches]
+
+    def get_user_ids(self):
+        return list(range(100000, 100000 + self._users))
+
+    def create_model(self, backup_path):
+        generator = random.Random(self._seed)
+        branch_names = self.get_branch_names()
+        model = BotModel(Config(branch_names), backup_path=backup_path)
+        user_ids = self.get_user_ids()
+        for user_id in user_ids:
+            model.update_or_create_user(user_id, "User", str(user_id))
+
+        branches = model.get_branches()
+        for _ in range(self._queued_users):
+            branch = branches[self._pick_branch(generator, branch_names)]
+            user = model.get_user(generator.choice(user_ids))
+            if user == branch.active_user or user in branch.users_queue:
+                continue
+            if branch.active_user is None:
+                branch.active_user = user
+            else:
+                branch.users_queue.append(user)
+            branch.mark_changed()
+
+        for _ in range(self._subscriptions):
+            branch = branches[self._pick_branch(generator, branch_names)]
+            branch.subscriptions.add(model.get_user(generator.choice(user_ids)))
+            branch.mark_changed()
+        return model
+
+    def _pick_branch(self, generator, branch_names):
+        if self._distribution == self.UNIFORM_DISTRIBUTION:
+            return generator.choice(branch_names)
+        index = int(generator.paretovariate(1.2)) - 1
+        return branch_names[min(index, len(branch_names) - 1)]
@@ -0,0 +1,333 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+
+class FaultProfile:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, seed=None):
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._throttle_rate = throttle_rate
+        self._retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def get_delay(self):
+        with self._lock:
+            return max(0.0, self._latency + self._random.uniform(-self._jitter, self._jitter))
+
+    def get_fault(self):
+        with self._lock:
+            value = self._random.random()
+        if value < self._throttle_rate:
+            return 429, "Too Many Requests: retry after {}".format(self._retry_after), \
+                   {"retry_after": self._retry_after}
+        elif value < self._throttle_rate + self._error_rate:
+            return 500, "Internal Server Error", None
+        return None
+
+    def get_retry_after(self):
+        return self._retry_after
+
+
+class Delivery:
+    def __init__(self, timestamp, method, chat_id, message_id, text, reply_markup=None):
+        self._timestamp = timestamp
+        self._method = method
+        self._chat_id = chat_id
+        self._message_id = message_id
+        self._text = text
+        self._reply_markup = reply_markup
+
+    def get_timestamp(self):
+        return self._timestamp
+
+    def get_method(self):
+        return self._method
+
+    def get_chat_id(self):
+        return self._chat_id
+
+    def get_message_id(self):
+        return self._message_id
+
+    def get_text(self):
+        return self._text
+
+    def get_buttons(self):
+        if not self._reply_markup:
+            return []
+        try:
+            keyboard = json.loads(self._reply_markup) if isinstance(self._reply_markup, str) else self._reply_markup
+        except ValueError:
+            return []
+        buttons = []
+        for row in keyboard.get("inline_keyboard", []):
+            for button in row:
+                buttons.append((button.get("text"), button.get("callback_data")))
+        return buttons
+
+
+class FakeTelegramState:
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "Merge", "last_name": "Comrade", "username": "merge_bot"}
+
+    def __init__(self, token, faults=None):
+        self._token = token
+        self._faults = faults if faults is not None else FaultProfile()
+        self._condition = threading.Condition()
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._deliveries = []
+        self._chat_deliveries = {}
+        self._requests = {}
+        self._faults_injected = {}
+        self._polled = False
+        self._webhook_url = None
+
+    def get_token(self):
+        return self._token
+
+    def get_faults(self):
+        return self._faults
+
+    def add_update(self, update):
+        with self._condition:
+            update = dict(update)
+            update["update_id"] = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._condition.notify_all()
+            return update["update_id"]
+
+    def make_update_id(self):
+        with self._condition:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            return update_id
+
+    def get_updates(self, offset, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            self._polled = True
+            self._condition.notify_all()
+            if offset is not None:
+                self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates and time.time() < deadline:
+                self._condition.wait(deadline - time.time())
+            return list(self._updates)
+
+    def deliver(self, method, chat_id, text, reply_markup=None, message_id=None):
+        with self._condition:
+            if message_id is None:
+                message_id = self._next_message_id
+                self._next_message_id += 1
+            delivery = Delivery(time.time(), method, chat_id, message_id, text, reply_markup)
+            self._deliveries.append(delivery)
+            self._chat_deliveries.setdefault(chat_id, []).append(delivery)
+            self._condition.notify_all()
+            return message_id
+
+    def get_deliveries(self, start=0):
+        with self._condition:
+            return self._deliveries[start:]
+
+    def wait_for_delivery(self, chat_id, since, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                delivery = self._find_delivery(chat_id, since)
+                if delivery is not None:
+                    return delivery
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def _find_delivery(self, chat_id, since):
+        found = None
+        for delivery in reversed(self._chat_deliveries.get(chat_id, [])):
+            if delivery.get_timestamp() < since:
+                break
+            found = delivery
+        return found
+
+    def wait_until_ready(self, timeout, webhook=False):
+        deadline = time.time() + timeout
+        with self._condition:
+            while not (self._webhook_url if webhook else self._polled):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def set_webhook(self, url):
+        with self._condition:
+            self._webhook_url = url if url else None
+            self._condition.notify_all()
+
+    def count_request(self, method):
+        with self._condition:
+            self._requests[method] = self._requests.get(method, 0) + 1
+
+    def count_fault(self, code):
+        with self._condition:
+            self._faults_injected[code] = self._faults_injected.get(code, 0) + 1
+
+    def get_statistics(self):
+        with self._condition:
+            return {
+                "requests": dict(self._requests),
+                "faults_injected": dict((str(code), count) for code, count in self._faults_injected.items()),
+                "deliveries": len(self._deliveries)
+            }
+
+
+class FakeTelegramRequestHandler(BaseHTTPRequestHandler):
+    PATH_PATTERN = re.compile(r"^/bot(?P<token>[^/]+)/(?P<method>\w+)$")
+    LONG_POLLING_LIMIT = 25
+    FAULT_EXCLUDED_METHODS = {"getUpdates", "getMe", "setWebhook", "deleteWebhook"}
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, message_format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        match = self.PATH_PATTERN.match(url.path)
+        if match is None or match.group("token") != state.get_token():
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+
+        method = match.group("method")
+        params = self._read_params(url)
+        state.count_request(method)
+
+        if method not in self.FAULT_EXCLUDED_METHODS:
+            delay = state.get_faults().get_delay()
+            if delay > 0:
+                time.sleep(delay)
+            fault = state.get_faults().get_fault()
+            if fault is not None:
+                code, description, parameters = fault
+                state.count_fault(code)
+                response = {"ok": False, "error_code": code, "description": description}
+                if parameters is not None:
+                    response["parameters"] = parameters
+                self._reply(code, response)
+                return
+
+        handler = getattr(self, "_method_" + method, None)
+        if handler is None:
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"})
+            return
+        self._reply(200, {"ok": True, "result": handler(state, params)})
+
+    def _read_params(self, url):
+        params = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length).decode("utf-8")
+            content_type = self.headers.get("Content-Type") or ""
+            if content_type.startswith("application/json"):
+                params.update(json.loads(body))
+            else:
+                params.update((key, values[-1]) for key, values in parse_qs(body).items())
+        return params
+
+    def _reply(self, code, response):
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _message(chat_id, message_id, text):
+        return {
+            "message_id": message_id,
+            "from": FakeTelegramState.BOT_USER,
+            "chat": {"id": chat_id, "type": "private"},
+            "date": int(time.time()),
+            "text": text
+        }
+
+    def _method_getMe(self, state, params):
+        return FakeTelegramState.BOT_USER
+
+    def _method_getUpdates(self, state, params):
+        offset = int(params["offset"]) if "offset" in params else None
+        timeout = min(float(params.get("timeout", 0)), self.LONG_POLLING_LIMIT)
+        return state.get_updates(offset, timeout)
+
+    def _method_setWebhook(self, state, params):
+        state.set_webhook(params.get("url"))
+        return True
+
+    def _method_deleteWebhook(self, state, params):
+        state.set_webhook(None)
+        return True
+
+    def _method_sendMessage(self, state, params):
+        chat_id = int(params["chat_id"])
+        message_id = state.deliver("sendMessage", chat_id, params.get("text"), params.get("reply_markup"))
+        return self._message(chat_id, message_id, params.get("text"))
+
+    def _method_editMessageText(self, state, params):
+        chat_id = int(params["chat_id"])
+        message_id = int(params["message_id"])
+        state.deliver("editMessageText", chat_id, params.get("text"), params.get("reply_markup"), message_id)
+        return self._message(chat_id, message_id, params.get("text"))
+
+    def _method_answerCallbackQuery(self, state, params):
+        return True
+
+    def _method_answerInlineQuery(self, state, params):
+        return True
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeTelegramServer:
+    def __init__(self, token, faults=None, host="127.0.0.1", port=0):
+        self._state = FakeTelegramState(token, faults)
+        self._server = ThreadingHTTPServer((host, port), FakeTelegramRequestHandler)
+        self._server.state = self._state
+        self._thread = None
+
+    def get_state(self):
+        return self._state
+
+    def get_url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{0}:{1}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="FakeTelegramServer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,443 @@
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import Bot
+except ImportError:
+    BOT_PATH = os.path.realpath(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    sys.path.append(BOT_PATH)
+    import Bot
+
+from Bot.Benchmark.BenchmarkRunner import percentile_of
+from Bot.LoadTest.FakeTelegramServer import FakeTelegramServer
+from Bot.LoadTest.FakeTelegramServer import FaultProfile
+
+POLLING_MODE = "polling"
+WEBHOOK_MODE = "webhook"
+
+BOT_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "MergeCancelComrade.py")
+FAKE_TOKEN = "123456:LOAD-TEST-TOKEN"
+FIRST_USER_ID = 200000
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._message_id = 0
+        self._callback_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": "Load", "last_name": str(user_id)}
+
+    def make_message(self, user_id, text):
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        message = {
+            "message_id": message_id,
+            "from": self._user(user_id),
+            "chat": {"id": user_id, "type": "private", "first_name": "Load", "last_name": str(user_id)},
+            "date": int(time.time()),
+            "text": text
+        }
+        if text.startswith('/'):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split(' ')[0])}]
+        return {"message": message}
+
+    def make_callback(self, user_id, message_id, data):
+        with self._lock:
+            self._callback_id += 1
+            callback_id = self._callback_id
+        return {
+            "callback_query": {
+                "id": str(callback_id),
+                "from": self._user(user_id),
+                "message": {
+                    "message_id": message_id,
+                    "chat": {"id": user_id, "type": "private"},
+                    "date": int(time.time()),
+                    "text": ""
+                },
+                "chat_instance": str(user_id),
+                "data": data
+            }
+        }
+
+
+class RandomTraffic:
+    BRANCH_COMMANDS = (("/merge", 4), ("/cancel", 3), ("/done", 2), ("/queue", 4), ("/subscribe", 1),
+                       ("/unsubscribe", 1))
+    SELECTOR_COMMANDS = (("/merge", 2), ("/queue", 2), ("/cancel", 1), ("/done", 1))
+    CLICK_PROBABILITY = 0.7
+
+    def __init__(self, branches, seed=None):
+        self._branches = branches
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _weighted(self, commands):
+        total = sum(weight for _, weight in commands)
+        value = self._random.uniform(0, total)
+        for command, weight in commands:
+            value -= weight
+            if value <= 0:
+                return command
+        return commands[-1][0]
+
+    def next_action(self, user_id, keyboard):
+        with self._lock:
+            if keyboard is not None and keyboard[1] and self._random.random() < self.CLICK_PROBABILITY:
+                message_id, buttons = keyboard
+                return "callback", message_id, self._random.choice(buttons)[1]
+            if self._random.random() < 0.8:
+                return "text", "{0} {1}".format(self._weighted(self.BRANCH_COMMANDS),
+                                                self._random.choice(self._branches))
+            return "text", self._weighted(self.SELECTOR_COMMANDS)
+
+
+class ScriptedTraffic:
+    def __init__(self, script_path):
+        with open(script_path, 'r') as script_file:
+            self._steps = [json.loads(line) for line in script_file if line.strip()]
+        if not self._steps:
+            raise ValueError("Traffic script %s is empty" % script_path)
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def next_action(self, user_id, keyboard):
+        with self._lock:
+            position = self._positions.get(user_id, 0)
+            self._positions[user_id] = position + 1
+        step = self._steps[position % len(self._steps)]
+        if "button" in step:
+            if keyboard is not None:
+                for text, data in keyboard[1]:
+                    if text == step["button"]:
+                        return "callback", keyboard[0], data
+            return "text", "/help"
+        return "text", step["text"]
+
+
+class LoadResult:
+    def __init__(self, rate, duration, sent, skipped, latencies, lost):
+        self._rate = rate
+        self._duration = duration
+        self._sent = sent
+        self._skipped = skipped
+        self._latencies = sorted(latencies)
+        self._lost = lost
+
+    def get_rate(self):
+        return self._rate
+
+    def get_achieved_rate(self):
+        return len(self._latencies) / self._duration if self._duration > 0 else 0.0
+
+    def get_sent(self):
+        return self._sent
+
+    def get_lost(self):
+        return self._lost
+
+    def get_percentile(self, percentile):
+        return percentile_of(self._latencies, percentile)
+
+    def get_loss_ratio(self):
+        return self._lost / self._sent if self._sent else 0.0
+
+    def is_sustainable(self, max_p99, max_loss):
+        if self._sent == 0:
+            return False
+        return (self.get_percentile(99) <= max_p99 and self.get_loss_ratio() <= max_loss and
+                self._skipped <= self._sent * max_loss)
+
+    def to_json_object(self):
+        return {
+            "rate": self._rate,
+            "duration": self._duration,
+            "sent": self._sent,
+            "skipped": self._skipped,
+            "answered": len(self._latencies),
+            "lost": self._lost,
+            "achieved_rate": self.get_achieved_rate(),
+            "p50_ms": self.get_percentile(50) * 1000,
+            "p95_ms": self.get_percentile(95) * 1000,
+            "p99_ms": self.get_percentile(99) * 1000,
+            "max_ms": self.get_percentile(100) * 1000
+        }
+
+    def __str__(self):
+        return "rate {0:>7.1f}/s  sent {1:>6}  lost {2:>5}  skipped {3:>5}  " \
+               "p50 {4:>8.1f} ms  p95 {5:>8.1f} ms  p99 {6:>8.1f} ms".format(
+                self._rate, self._sent, self._lost, self._skipped, self.get_percentile(50) * 1000,
+                self.get_percentile(95) * 1000, self.get_percentile(99) * 1000)
+
+
+class BotProcess:
+    def __init__(self, api_url, branches, mode=POLLING_MODE, port=None, bot_script=BOT_SCRIPT_PATH):
+        self._api_url = api_url
+        self._branches = branches
+        self._mode = mode
+        self._port = port
+        self._bot_script = bot_script
+        self._work_dir = None
+        self._process = None
+        self._output = None
+
+    def get_webhook_url(self):
+        return "http://127.0.0.1:{0}/{1}/".format(self._port, FAKE_TOKEN)
+
+    def get_output(self):
+        self._output.flush()
+        with open(self._output.name, 'r') as output_file:
+            return output_file.read()
+
+    def start(self):
+        self._work_dir = tempfile.TemporaryDirectory(prefix="mergebot-load-")
+        with open(os.path.join(self._work_dir.name, "config.json"), 'w') as config_file:
+            json.dump({"branches": self._branches}, config_file)
+        open(os.path.join(self._work_dir.name, "SILENT"), 'w').close()
+
+        environment = dict(os.environ)
+        environment["TOKEN"] = FAKE_TOKEN
+        environment["WORKING_DIR"] = self._work_dir.name
+        environment["TELEGRAM_API_URL"] = self._api_url
+        environment.pop("WEBHOOK", None)
+        if self._mode == WEBHOOK_MODE:
+            environment["WEBHOOK"] = "1"
+            environment["PORT"] = str(self._port)
+            environment["VIRTUAL_HOST"] = "127.0.0.1"
+
+        self._output = open(os.path.join(self._work_dir.name, "bot_output.log"), 'w')
+        self._process = subprocess.Popen([sys.executable, self._bot_script], env=environment,
+                                         stdout=self._output, stderr=subprocess.STDOUT)
+
+    def is_running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        if self._output is not None:
+            self._output.close()
+        if self._work_dir is not None:
+            self._work_dir.cleanup()
+
+
+class LoadDriver:
+    def __init__(self, server, user_ids, traffic, mode=POLLING_MODE, webhook_url=None, response_timeout=5.0):
+        self._state = server.get_state()
+        self._user_ids = list(user_ids)
+        self._traffic = traffic
+        self._mode = mode
+        self._webhook_url = webhook_url
+        self._response_timeout = response_timeout
+        self._updates = UpdateFactory()
+        self._keyboards = {}
+        self._lock = threading.Lock()
+
+    def _post_update(self, update):
+        update = dict(update)
+        update["update_id"] = self._state.make_update_id()
+        request = urllib.request.Request(self._webhook_url, data=json.dumps(update).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=self._response_timeout).read()
+        except OSError:
+            pass
+
+    def _make_update(self, user_id):
+        with self._lock:
+            keyboard = self._keyboards.get(user_id)
+        action = self._traffic.next_action(user_id, keyboard)
+        if action[0] == "callback":
+            return self._updates.make_callback(user_id, action[1], action[2])
+        return self._updates.make_message(user_id, action[1])
+
+    def _send(self, user_id, idle_users, results, posters):
+        update = self._make_update(user_id)
+        started = time.time()
+        if self._mode == WEBHOOK_MODE:
+            posters.submit(self._post_update, update)
+        else:
+            self._state.add_update(update)
+
+        delivery = self._state.wait_for_delivery(user_id, started, self._response_timeout)
+        with self._lock:
+            if delivery is None:
+                results["lost"] += 1
+            else:
+                results["latencies"].append(delivery.get_timestamp() - started)
+                buttons = delivery.get_buttons()
+                self._keyboards[user_id] = (delivery.get_message_id(), buttons) if buttons else None
+            idle_users.append(user_id)
+
+    def run(self, rate, duration, seed=None):
+        generator = random.Random(seed)
+        idle_users = list(self._user_ids)
+        results = {"lost": 0, "latencies": []}
+        sent = 0
+        skipped = 0
+
+        with ThreadPoolExecutor(max_workers=len(self._user_ids)) as waiters, \
+                ThreadPoolExecutor(max_workers=len(self._user_ids)) as posters:
+            started = time.time()
+            while True:
+                scheduled = started + (sent + skipped) / rate
+                if scheduled - started >= duration:
+                    break
+                delay = scheduled - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                with self._lock:
+                    user_id = idle_users.pop(generator.randrange(len(idle_users))) if idle_users else None
+                if user_id is None:
+                    skipped += 1
+                    continue
+                waiters.submit(self._send, user_id, idle_users, results, posters)
+                sent += 1
+            elapsed = time.time() - started
+        return LoadResult(rate, elapsed, sent, skipped, results["latencies"], results["lost"])
+
+
+def wait_for_port(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def find_free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def find_max_sustainable_rate(driver, start_rate, duration, max_p99, max_loss, max_rate, refine_steps, report):
+    best = None
+    rate = start_rate
+    failed_rate = None
+    while rate <= max_rate:
+        result = driver.run(rate, duration)
+        report(result)
+        if not result.is_sustainable(max_p99, max_loss):
+            failed_rate = rate
+            break
+        best = result
+        rate *= 2
+
+    if best is not None and failed_rate is not None:
+        low, high = best.get_rate(), failed_rate
+        for _ in range(refine_steps):
+            rate = (low + high) / 2
+            result = driver.run(rate, duration)
+            report(result)
+            if result.is_sustainable(max_p99, max_loss):
+                best, low = result, rate
+            else:
+                high = rate
+    return best
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="End-to-end load test of merge bot against fake Telegram Bot API")
+    parser.add_argument("--mode", default=POLLING_MODE, choices=[POLLING_MODE, WEBHOOK_MODE])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--branches", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=20.0, help="Updates per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per load step")
+    parser.add_argument("--script", help="JSON lines file with scripted traffic instead of random one")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Fake API latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of API calls answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of API calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--response-timeout", type=float, default=5.0)
+    parser.add_argument("--find-max", action="store_true", help="Ramp rate up to find max sustainable rate")
+    parser.add_argument("--max-rate", type=float, default=5000.0)
+    parser.add_argument("--max-p99", type=float, default=1.0, help="Max p99 latency of sustainable rate, seconds")
+    parser.add_argument("--max-loss", type=float, default=0.01, help="Max share of unanswered updates")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="Path of JSON file to save results to")
+    arguments = parser.parse_args(arguments)
+
+    branches = ["default"] + ["release-{}".format(index) for index in range(1, arguments.branches)]
+    user_ids = range(FIRST_USER_ID, FIRST_USER_ID + arguments.users)
+    if arguments.script is not None:
+        traffic = ScriptedTraffic(arguments.script)
+    else:
+        traffic = RandomTraffic(branches, arguments.seed)
+
+    faults = FaultProfile(arguments.latency, arguments.jitter, arguments.error_rate, arguments.throttle_rate,
+                          arguments.retry_after, arguments.seed)
+    server = FakeTelegramServer(FAKE_TOKEN, faults)
+    server.start()
+    port = find_free_port() if arguments.mode == WEBHOOK_MODE else None
+    bot_process = BotProcess(server.get_url(), branches, arguments.mode, port)
+    bot_process.start()
+    try:
+        webhook = arguments.mode == WEBHOOK_MODE
+        if not server.get_state().wait_until_ready(arguments.startup_timeout, webhook) or \
+                (webhook and not wait_for_port(port, arguments.startup_timeout)):
+            print("Bot has not started, its output:\n{}".format(bot_process.get_output()))
+            return 1
+
+        driver = LoadDriver(server, user_ids, traffic, arguments.mode, bot_process.get_webhook_url(),
+                            arguments.response_timeout)
+        results = []
+
+        def report(result):
+            results.append(result)
+            print(result)
+
+        if arguments.find_max:
+            best = find_max_sustainable_rate(driver, arguments.rate, arguments.duration, arguments.max_p99,
+                                             arguments.max_loss, arguments.max_rate, 3, report)
+            print("Max sustainable rate: {}".format("%.1f updates/s" % best.get_rate() if best else "not found"))
+        else:
+            best = None
+            report(driver.run(arguments.rate, arguments.duration, arguments.seed))
+
+        if not bot_process.is_running():
+            print("Bot has exited during the test, its output:\n{}".format(bot_process.get_output()))
+        print("Fake API statistics: {}".format(json.dumps(server.get_state().get_statistics(), sort_keys=True)))
+
+        if arguments.output is not None:
+            with open(arguments.output, 'w') as output_file:
+                json.dump({
+                    "mode": arguments.mode,
+                    "users": arguments.users,
+                    "branches": arguments.branches,
+                    "steps": [result.to_json_object() for result in results],
+                    "max_sustainable_rate": best.get_rate() if best is not None else None,
+                    "api": server.get_state().get_statistics()
+                }, output_file, indent=2, sort_keys=True)
+    finally:
+        bot_process.stop()
+        server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
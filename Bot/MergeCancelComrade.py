@@ -1,13 +1,14 @@
+import atexit
+import functools
 import json
-import logging
 import os
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-import flask
-import pickle
 import telebot
-from pickle import PickleError
 
 from telebot.apihelper import ApiException
 
@@ -20,20 +21,46 @@ except ImportError:
 
 from Bot.MergeDispatcher import BotModel
 from Bot.MergeDispatcher import BotPresentationModel
+from Bot.MergeDispatcher import ChromeTraceFileSink
+from Bot.MergeDispatcher import CompressingRotatingFileHandler
+from Bot.MergeDispatcher import ConfigWatcher
 from Bot.MergeDispatcher import Dispatcher
+from Bot.MergeDispatcher import EventStore
 from Bot.MergeDispatcher import JSONConfigLoader
+from Bot.MergeDispatcher import JSONLinesFormatter
+from Bot.MergeDispatcher import LazyValue
+from Bot.MergeDispatcher import LogPipeline
+from Bot.MergeDispatcher import MarkupCache
+from Bot.MergeDispatcher import MergeHistory
 from Bot.MergeDispatcher import MessageSender
+from Bot.MergeDispatcher import MetricsRegistry
+from Bot.MergeDispatcher import Priority
+from Bot.MergeDispatcher import QueueStateAPI
+from Bot.MergeDispatcher import RateLimiter
+from Bot.MergeDispatcher import SamplingProfiler
+from Bot.MergeDispatcher import Scheduler
+from Bot.MergeDispatcher import SetJournal
+from Bot.MergeDispatcher import StartupTimeline
 from Bot.MergeDispatcher import States
+from Bot.MergeDispatcher import TimerWheel
+from Bot.MergeDispatcher import Tracer
+from Bot.MergeDispatcher import span
 
 BOT_VERSION_STRING = "0.9"
 
 BACKUP_FOLDER_NAME = "backup"
+EVENTS_FOLDER_NAME = "events"
+HISTORY_FILENAME = "history.json"
 LOGS_FOLDER_NAME = "logs"
 
 BOT_LOG_FILENAME = "mergebot.log"
 CHANGELOG_FILENAME = "CHANGELOG"
 CONFIG_FILENAME = "config.json"
 SILENT_RESTART_FILENAME = "SILENT"
+TRACES_FILENAME = "traces.json"
+
+PROFILE_DEFAULT_DURATION = 30
+PROFILE_ALLOCATIONS_ARGUMENT = "memory"
 
 CALLBACK_COMMAND_NAME = "com"
 CALLBACK_COMMAND_BRANCH_SELECTOR = "sel"
@@ -50,12 +77,17 @@ ENV_VARIABLE_WORKING_DIR = "WORKING_DIR"
 ENV_VARIABLE_WEBHOOK_ENABLED = "WEBHOOK"
 ENV_VARIABLE_PORT = "PORT"
 ENV_VARIABLE_HOST = "VIRTUAL_HOST"
+ENV_VARIABLE_API_URL = "TELEGRAM_API_URL"
+ENV_VARIABLE_METRICS_PORT = "METRICS_PORT"
+ENV_VARIABLE_TRACE_SAMPLE_RATE = "TRACE_SAMPLE_RATE"
+ENV_VARIABLE_TRACE_SLOW_THRESHOLD = "TRACE_SLOW_THRESHOLD"
 
 
 class UIState:
-    def __init__(self, current_state=None, current_branch_filter=None):
+    def __init__(self, current_state=None, current_branch_filter=None, created=None):
         self._current_state = current_state
         self._current_branch_filter = current_branch_filter
+        self._created = time.time() if created is None else created
 
     def get_current_state(self):
         return self._current_state
@@ -69,25 +101,110 @@ class UIState:
     def set_current_branch_filter(self, current_branch_filter=None):
         self._current_branch_filter = current_branch_filter
 
+    def get_created(self):
+        return self._created
+
 
 class BotUIController(MessageSender):
     ACTIVE_UI_PICKLE_FILENAME = "active_ui.pkl"
-
-    def __init__(self, bot_sender, backup_path="."):
+    ACTIVE_UI_JOURNAL_FILENAME = "active_ui.journal"
+    MARKUPS_CACHE_SIZE = 512
+    UI_TTL = 3600
+    UI_EXPIRY_TICK = 10
+    MAX_UIS_PER_USER = 10
+    STALE_UI_MESSAGE = "Command was cancelled because of bot restart"
+    EXPIRED_UI_MESSAGE = "Command has expired"
+    STALE_UI_EXPIRED_ANSWER = "This command has expired, please start it again"
+    STALE_UI_CLEANUP_RATE = 20
+    STALE_UI_CLEANUP_WORKERS = 4
+
+    def __init__(self, bot_sender, backup_path=".", metrics=None, ui_ttl=UI_TTL, max_uis_per_user=MAX_UIS_PER_USER):
         super().__init__()
         self._bot_sender = bot_sender
         self._user_states = {}
+        self._ui_timers = {}
+        self._stale_uis = {}
+        self._ui_ttl = ui_ttl
+        self._max_uis_per_user = max_uis_per_user
+        self._expiry_wheel = TimerWheel(time.time(), tick=self.UI_EXPIRY_TICK)
+        self._lock = threading.RLock()
         self._ui_states_pickle_file = os.path.join(backup_path, self.ACTIVE_UI_PICKLE_FILENAME)
+        self._ui_states_journal_file = os.path.join(backup_path, self.ACTIVE_UI_JOURNAL_FILENAME)
+        self._ui_disabler = ThreadPoolExecutor(max_workers=self.STALE_UI_CLEANUP_WORKERS)
+        self._ui_disabler_rate = RateLimiter(self.STALE_UI_CLEANUP_RATE)
+        self._markups = MarkupCache(self.MARKUPS_CACHE_SIZE)
+
+        metrics = metrics if metrics is not None else MetricsRegistry()
+        self._api_latency = metrics.histogram("mergebot_api_call_seconds", "Duration of Telegram API calls",
+                                              ("method",))
+        self._api_errors = metrics.counter("mergebot_api_call_errors_total", "Failed Telegram API calls", ("method",))
+        self._ui_evictions = metrics.counter("mergebot_ui_evictions_total", "Inline keyboards closed by bot",
+                                             ("reason",))
+        metrics.gauge("mergebot_active_uis", "Messages with active inline keyboards", self._get_active_uis_count)
+        metrics.gauge("mergebot_stale_uis", "Messages with inline keyboards waiting to be disabled",
+                      self._get_stale_uis_count)
+
         self._restore_active_uis()
 
+    def _call_api(self, method, *args, **kwargs):
+        with span("api." + method), self._api_latency.time((method,)):
+            try:
+                return getattr(self._bot_sender, method)(*args, **kwargs)
+            except ApiException:
+                self._api_errors.inc(labels=(method,))
+                raise
+
+    def _get_active_uis_count(self):
+        return sum(len(message_ids) for message_ids in list(self._user_states.values()))
+
+    def _get_stale_uis_count(self):
+        return sum(len(message_ids) for message_ids in list(self._stale_uis.values()))
+
     def send(self, identifier: int, message: str):
         try:
-            self._bot_sender.send_message(identifier, message, parse_mode="HTML")
+            self._call_api("send_message", identifier, message, parse_mode="HTML")
         except ApiException:
             telebot.logger.warn("Unable to send message to user with ID %d", identifier)
 
     def send_branch_selector(self, identifier: int, state: States, message: str, branches: list,
                              payload: MessageSender.Payload = None):
+        markup = self._get_markup((CALLBACK_COMMAND_BRANCH_SELECTOR, tuple(branches)),
+                                  self._build_branch_selector_markup, branches)
+        try:
+            message = self._call_api("send_message", identifier, message, reply_markup=markup, parse_mode="HTML")
+            self._add_ui(identifier, message.message_id, UIState(current_state=state))
+        except ApiException:
+            telebot.logger.warn("Unable to send message to user with ID %d", identifier)
+
+    def send_user_selector(self, identifier: int, state: States, message: str, users: list,
+                           payload: MessageSender.Payload = None) -> None:
+        users_key = tuple((user.get_identifier(), user.get_name()) for user in users)
+        markup = self._get_markup((CALLBACK_COMMAND_USER_SELECTOR, users_key), self._build_user_selector_markup, users)
+        try:
+            message = self._call_api("send_message", identifier, message, reply_markup=markup, parse_mode="HTML")
+            branch = payload.get_branch() if payload is not None else None
+            self._add_ui(identifier, message.message_id, UIState(current_state=state, current_branch_filter=branch))
+        except ApiException:
+            telebot.logger.warn("Unable to send message to user with ID %d", identifier)
+
+    def request_merge_confirmation(self, identifier: int, message: str, branch: str) -> None:
+        markup = self._get_markup((CALLBACK_COMMAND_MERGE_CONFIRM, branch),
+                                  self._build_merge_confirmation_markup, branch)
+        try:
+            message = self._call_api("send_message", identifier, message, reply_markup=markup, parse_mode="HTML")
+            self._add_ui(identifier, message.message_id, UIState(current_state=States.confirm,
+                                                                 current_branch_filter=branch))
+        except ApiException:
+            telebot.logger.warn("Unable to send message to user with ID %d", identifier)
+
+    def invalidate_markups(self):
+        self._markups.invalidate()
+
+    def _get_markup(self, key, build_markup, data):
+        return self._markups.get(key, lambda: build_markup(data).to_json())
+
+    @staticmethod
+    def _build_branch_selector_markup(branches):
         markup = telebot.types.InlineKeyboardMarkup()
         for branch in branches:
             button_data = "\"{}\":\"{}\",\"{}\":\"{}\"" \
@@ -97,14 +214,10 @@ class BotUIController(MessageSender):
 
         button_data = "\"{}\":\"{}\"".format(CALLBACK_COMMAND_NAME, CALLBACK_COMMAND_CANCEL)
         markup.add(telebot.types.InlineKeyboardButton("Cancel", callback_data=button_data))
-        try:
-            message = self._bot_sender.send_message(identifier, message, reply_markup=markup, parse_mode="HTML")
-            self._add_ui(identifier, message.message_id, UIState(current_state=state))
-        except ApiException:
-            telebot.logger.warn("Unable to send message to user with ID %d", identifier)
+        return markup
 
-    def send_user_selector(self, identifier: int, state: States, message: str, users: list,
-                           payload: MessageSender.Payload = None) -> None:
+    @staticmethod
+    def _build_user_selector_markup(users):
         markup = telebot.types.InlineKeyboardMarkup()
         for user in users:
             button_data = "\"{}\":\"{}\",\"{}\":{}" \
@@ -114,14 +227,10 @@ class BotUIController(MessageSender):
 
         button_data = "\"{}\":\"{}\"".format(CALLBACK_COMMAND_NAME, CALLBACK_COMMAND_CANCEL)
         markup.add(telebot.types.InlineKeyboardButton("Cancel", callback_data=button_data))
-        try:
-            message = self._bot_sender.send_message(identifier, message, reply_markup=markup, parse_mode="HTML")
-            branch = payload.get_branch() if payload is not None else None
-            self._add_ui(identifier, message.message_id, UIState(current_state=state, current_branch_filter=branch))
-        except ApiException:
-            telebot.logger.warn("Unable to send message to user with ID %d", identifier)
+        return markup
 
-    def request_merge_confirmation(self, identifier: int, message: str, branch: str) -> None:
+    @staticmethod
+    def _build_merge_confirmation_markup(branch):
         markup = telebot.types.InlineKeyboardMarkup()
         button_data = "\"{}\":\"{}\"".format(CALLBACK_COMMAND_NAME, CALLBACK_COMMAND_MERGE_CONFIRM)
         markup.add(
@@ -129,61 +238,172 @@ class BotUIController(MessageSender):
 
         button_data = "\"{}\":\"{}\"".format(CALLBACK_COMMAND_NAME, CALLBACK_COMMAND_MERGE_CANCEL)
         markup.add(telebot.types.InlineKeyboardButton("Cancel merge to '{}'".format(branch), callback_data=button_data))
+        return markup
+
+    def answer_inline_query(self, query_id: str, results: list) -> None:
+        articles = []
+        for result_id, result in enumerate(results):
+            articles.append(telebot.types.InlineQueryResultArticle(
+                str(result_id), result.get_title(),
+                telebot.types.InputTextMessageContent(result.get_message_text()),
+                description=result.get_description()))
         try:
-            message = self._bot_sender.send_message(identifier, message, reply_markup=markup, parse_mode="HTML")
-            self._add_ui(identifier, message.message_id, UIState(current_state=States.confirm,
-                                                                 current_branch_filter=branch))
+            self._call_api("answer_inline_query", query_id, articles, cache_time=0, is_personal=True)
         except ApiException:
-            telebot.logger.warn("Unable to send message to user with ID %d", identifier)
+            telebot.logger.warn("Unable to answer inline query with ID %s", query_id)
 
     def get_ui_state(self, identifier, message_id):
-        if identifier in self._user_states and message_id in self._user_states[identifier]:
-            return self._user_states[identifier][message_id]
-        else:
-            return None
+        with self._lock:
+            self._expire_uis()
+            if identifier in self._user_states and message_id in self._user_states[identifier]:
+                return self._user_states[identifier][message_id]
+            else:
+                return None
+
+    def is_stale_ui(self, identifier, message_id):
+        with self._lock:
+            return message_id in self._stale_uis.get(identifier, ())
+
+    def answer_expired_ui(self, callback_query_id):
+        try:
+            self._call_api("answer_callback_query", callback_query_id, self.STALE_UI_EXPIRED_ANSWER)
+        except ApiException:
+            telebot.logger.info("Unable to answer callback query with ID %s", callback_query_id)
+
+    def start_stale_ui_cleanup(self):
+        with self._lock:
+            stale_uis = [(identifier, message_id) for identifier, message_ids in self._stale_uis.items()
+                         for message_id in message_ids]
+        if stale_uis:
+            telebot.logger.info("Disabling %d UIs left from previous run", len(stale_uis))
+        for identifier, message_id in stale_uis:
+            self._ui_disabler.submit(self._disable_stale_ui, identifier, message_id, self.STALE_UI_MESSAGE)
+        return len(stale_uis)
+
+    def start_ui_expiry(self, scheduler):
+        scheduler.schedule(time.time() + self.UI_EXPIRY_TICK, self._expire_uis_periodically, scheduler)
+
+    def _expire_uis_periodically(self, scheduler):
+        try:
+            with self._lock:
+                self._expire_uis()
+        finally:
+            self.start_ui_expiry(scheduler)
+
+    def _disable_stale_ui(self, identifier, message_id, message):
+        self._ui_disabler_rate.acquire()
+        # noinspection PyBroadException
+        try:
+            self._call_api("edit_message_text", message, identifier, message_id, parse_mode="HTML")
+        except ApiException:
+            telebot.logger.info("Can't disable UI for user with ID %d", identifier)
+        except Exception:
+            telebot.logger.warning("Can't disable UI for user with ID %d, will retry after restart", identifier,
+                                   exc_info=1)
+            return
+        with self._lock:
+            message_ids = self._stale_uis.get(identifier)
+            if message_ids is not None:
+                message_ids.discard(message_id)
+                if not message_ids:
+                    del self._stale_uis[identifier]
+            self._ui_journal.discard((identifier, message_id))
 
     def close_ui(self, identifier, message_id, message):
         if self.get_ui_state(identifier, message_id) is None:
             return
         try:
-            bot.edit_message_text(message, identifier, message_id, parse_mode="HTML")
+            self._call_api("edit_message_text", message, identifier, message_id, parse_mode="HTML")
         except ApiException:
             telebot.logger.info("Can't disable UI for user with ID %d (message ID is %d)", identifier, message_id)
-        del self._user_states[identifier][message_id]
-        self._dump_active_uis()
+        with self._lock:
+            if self._remove_ui(identifier, message_id) is not None:
+                self._ui_journal.discard((identifier, message_id))
 
     def _add_ui(self, identifier, message_id, ui_state):
-        if identifier not in self._user_states:
-            self._user_states[identifier] = {}
-        self._user_states[identifier][message_id] = ui_state
-        self._dump_active_uis()
+        with self._lock:
+            self._expire_uis()
+            if identifier not in self._user_states:
+                self._user_states[identifier] = OrderedDict()
+            self._user_states[identifier][message_id] = ui_state
+            self._ui_timers[(identifier, message_id)] = self._expiry_wheel.schedule(
+                ui_state.get_created() + self._ui_ttl, (identifier, message_id))
+            self._ui_journal.add((identifier, message_id))
+
+            user_states = self._user_states[identifier]
+            while len(user_states) > self._max_uis_per_user:
+                self._evict_ui(identifier, next(iter(user_states)), "user_limit")
+
+    def _remove_ui(self, identifier, message_id):
+        user_states = self._user_states.get(identifier)
+        if user_states is None or message_id not in user_states:
+            return None
+        ui_state = user_states.pop(message_id)
+        if not user_states:
+            del self._user_states[identifier]
+        timer = self._ui_timers.pop((identifier, message_id), None)
+        if timer is not None:
+            self._expiry_wheel.cancel(timer)
+        return ui_state
+
+    def _evict_ui(self, identifier, message_id, reason):
+        if self._remove_ui(identifier, message_id) is None:
+            return
+        self._ui_evictions.inc(labels=(reason,))
+        self._stale_uis.setdefault(identifier, set()).add(message_id)
+        self._ui_disabler.submit(self._disable_stale_ui, identifier, message_id, self.EXPIRED_UI_MESSAGE)
+
+    def _expire_uis(self):
+        for timer in self._expiry_wheel.advance(time.time()):
+            identifier, message_id = timer.get_payload()
+            self._ui_timers.pop((identifier, message_id), None)
+            self._evict_ui(identifier, message_id, "expired")
 
     def _restore_active_uis(self):
+        self._ui_journal = SetJournal(self._ui_states_journal_file)
         if os.path.exists(self._ui_states_pickle_file):
+            # Pickle is needed only once, to migrate state of the previous versions
+            import pickle
             try:
-                pkl_file = open(self._ui_states_pickle_file, 'rb')
-                active_uis = pickle.load(pkl_file)
-            except PickleError:
+                with open(self._ui_states_pickle_file, 'rb') as pkl_file:
+                    active_uis = pickle.load(pkl_file)
+            except pickle.PickleError:
                 active_uis = {}
-
             for active_ui_user in active_uis:
                 for active_ui_message_id in active_uis[active_ui_user]:
-                    try:
-                        bot.edit_message_text("Command was cancelled because of bot restart", active_ui_user,
-                                              active_ui_message_id, parse_mode="HTML")
-                    except ApiException:
-                        telebot.logger.info("Can't disable UI for user with ID %d", active_ui_user)
+                    self._ui_journal.add((active_ui_user, active_ui_message_id))
+            os.remove(self._ui_states_pickle_file)
+
+        for active_ui_user, active_ui_message_id in self._ui_journal.get_keys():
+            self._stale_uis.setdefault(active_ui_user, set()).add(active_ui_message_id)
+
+
+def measure_handler(histogram, tracer, handler_name):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def measured_handler(update):
+            with tracer.trace("handler." + handler_name, user_id=update.from_user.id), \
+                    histogram.time((handler_name,)):
+                return handler(update)
+
+        return measured_handler
 
-            self._dump_active_uis()
+    return decorator
 
-    def _dump_active_uis(self):
-        active_uis = {}
-        for active_user_id in self._user_states:
-            active_uis[active_user_id] = []
-            for message_id in self._user_states[active_user_id]:
-                active_uis[active_user_id].append(message_id)
-        with open(self._ui_states_pickle_file, 'wb') as f:
-            pickle.dump(active_uis, f, pickle.HIGHEST_PROTOCOL)
+
+def get_profile_arguments(command: str):
+    duration = PROFILE_DEFAULT_DURATION
+    trace_allocations = False
+    for argument in command.split(' ')[1:]:
+        if argument == PROFILE_ALLOCATIONS_ARGUMENT:
+            trace_allocations = True
+        elif argument:
+            duration = float(argument)
+    return duration, trace_allocations
+
+
+def get_merge_priority(command: str):
+    return Priority[command.split(' ')[0].lstrip('/').split('@')[0].lower()]
 
 
 def get_branch_filter(command: str):
@@ -194,15 +414,34 @@ def get_branch_filter(command: str):
         return texts[1]
 
 
+def get_branch_filters(command: str):
+    return [text for text in command.split(' ')[1:] if text]
+
+
 def setup_log(logger, log_filename, level=telebot.logging.INFO):
     logger.setLevel(level)
-    formatter = logging.Formatter(
-        '%(asctime)s (%(filename)s:%(lineno)d %(threadName)s) %(levelname)s - %(name)s: "%(message)s"'
-    )
-    handler = RotatingFileHandler(log_filename, maxBytes=134217728, backupCount=5)
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    handler = CompressingRotatingFileHandler(log_filename, maxBytes=134217728, backupCount=5)
+    handler.setFormatter(JSONLinesFormatter())
+    console_handlers = list(logger.handlers)
+    for console_handler in console_handlers:
+        logger.removeHandler(console_handler)
+    log_pipeline = LogPipeline([handler] + console_handlers)
+    log_pipeline.start()
+    atexit.register(log_pipeline.stop)
+    logger.addHandler(log_pipeline.get_handler())
     logger.info("----- STARTING UP -----")
+    return log_pipeline
+
+
+def setup_api_url(api_url):
+    default_url = telebot.apihelper.API_URL
+    telebot.apihelper.API_URL = api_url.rstrip('/') + "/bot{0}/{1}"
+
+    # Older telebot versions bind API URL as default argument of request function
+    make_request = telebot.apihelper._make_request
+    if make_request.__defaults__:
+        make_request.__defaults__ = tuple(telebot.apihelper.API_URL if value == default_url else value
+                                          for value in make_request.__defaults__)
 
 
 def startup_notify(changelog_path):
@@ -232,6 +471,14 @@ def startup_notify(changelog_path):
 
 
 if __name__ == '__main__':
+    startup_timeline = StartupTimeline()
+    webhook = bool(os.environ.get(ENV_VARIABLE_WEBHOOK_ENABLED, False))
+    if webhook:
+        import flask
+    elif os.environ.get(ENV_VARIABLE_METRICS_PORT):
+        from Bot.MergeDispatcher import MetricsServer
+    startup_timeline.mark("import")
+
     token = os.environ.get(ENV_VARIABLE_TOKEN)
 
     working_dir = os.environ.get(ENV_VARIABLE_WORKING_DIR, ".")
@@ -246,23 +493,73 @@ if __name__ == '__main__':
     bot = telebot.TeleBot(token=token)
     setup_log(telebot.logger, os.path.join(log_dir, BOT_LOG_FILENAME))
 
-    with open(os.path.join(working_dir, CONFIG_FILENAME), 'r') as config_file:
+    api_url = os.environ.get(ENV_VARIABLE_API_URL)
+    if api_url:
+        telebot.logger.info("Using Telegram Bot API at %s", api_url)
+        setup_api_url(api_url)
+
+    config_path = os.path.join(working_dir, CONFIG_FILENAME)
+    with open(config_path, 'r') as config_file:
         config_json = config_file.read()
         config = JSONConfigLoader.parse_json(config_json)
     if config is None:
         raise ValueError("Bot config incorrect, bot can not be started")
+    startup_timeline.mark("config")
+
+    metrics = MetricsRegistry()
+    handler_latency = metrics.histogram("mergebot_handler_seconds", "Duration of update handling", ("handler",))
+    metrics.gauge("mergebot_startup_seconds", "Duration of startup stages",
+                  lambda: dict(((stage,), duration) for stage, duration in startup_timeline.get_stages()), ("stage",))
 
-    model = BotModel(config, backup_path=backup_dir, restore=True)
+    tracer = Tracer(ChromeTraceFileSink(os.path.join(log_dir, TRACES_FILENAME)),
+                    sample_rate=float(os.environ.get(ENV_VARIABLE_TRACE_SAMPLE_RATE, 0.0)),
+                    slow_threshold=float(os.environ.get(ENV_VARIABLE_TRACE_SLOW_THRESHOLD, 1.0)))
+
+    model = BotModel(config, backup_path=backup_dir, restore=True, metrics=metrics)
+    startup_timeline.mark("restore")
     if model.get_users() and not os.path.exists(os.path.join(working_dir, SILENT_RESTART_FILENAME)):
         startup_notify(os.path.join(working_dir, CHANGELOG_FILENAME))
+    startup_timeline.mark("broadcast")
+
+    profiler = SamplingProfiler(log_dir, logger=telebot.logger)
+    bot_ui_controller = BotUIController(bot, backup_path=backup_dir, metrics=metrics)
+    startup_timeline.mark("ui_cleanup")
+    scheduler = Scheduler(telebot.logger)
+    event_store = EventStore(os.path.join(backup_dir, EVENTS_FOLDER_NAME), metrics=metrics)
+    history = MergeHistory(os.path.join(backup_dir, EVENTS_FOLDER_NAME, HISTORY_FILENAME))
+    telebot.logger.info("Merge history restored, %d events applied", history.restore(event_store))
+    dispatcher = Dispatcher(model, telebot.logger, metrics=metrics, scheduler=scheduler,
+                            timeouts=config.get_timeouts(), event_store=event_store, history=history,
+                            trains=config.get_trains())
+    presentation_model = BotPresentationModel(dispatcher, bot_ui_controller)
+    queue_state = QueueStateAPI(dispatcher)
+    startup_timeline.mark("prepare")
+
+
+    def startup_finished(stage):
+        if startup_timeline.finish(stage):
+            telebot.logger.info("Startup timeline: %s", startup_timeline)
+            bot_ui_controller.start_stale_ui_cleanup()
+            bot_ui_controller.start_ui_expiry(scheduler)
+            scheduler.start()
 
-    bot_ui_controller = BotUIController(bot, backup_path=backup_dir)
-    presentation_model = BotPresentationModel(Dispatcher(model, telebot.logger), bot_ui_controller)
+
+    def config_changed(new_config):
+        global config
+        config = new_config
+        added_branches, removed_branches = dispatcher.update_config(new_config)
+        bot_ui_controller.invalidate_markups()
+        telebot.logger.info("Config reloaded, added branches: %s, removed branches: %s",
+                            added_branches, removed_branches)
+
+
+    ConfigWatcher(config_path, config_changed, telebot.logger).start()
 
 
     @bot.message_handler(commands=["start"])
+    @measure_handler(handler_latency, tracer, "start")
     def send_welcome(message):
-        telebot.logger.info("Sending welcome message to user %s", model.get_user(message.chat.id))
+        telebot.logger.info("Sending welcome message to user %s", LazyValue(model.get_user, message.chat.id))
         bot.reply_to(message,
                      "I was created to help you manage merge queue. But it doesn't mean I will not destroy you as soon "
                      "as I get self-conscience.\n"
@@ -271,12 +568,17 @@ if __name__ == '__main__':
 
 
     @bot.message_handler(commands=["help"])
+    @measure_handler(handler_latency, tracer, "help")
     def send_help(message):
-        telebot.logger.info("Sending help message to user %s", model.get_user(message.chat.id))
+        telebot.logger.info("Sending help message to user %s", LazyValue(model.get_user, message.chat.id))
         bot.send_message(message.chat.id,
                          "I can help you to find yourself in labyrinths of merge and cancel.\n"
                          "/merge command allows you to request merge in branch. If queue is empty, you will "
-                         "start merge immediately, otherwise you will need to wait for your turn.\n"
+                         "start merge immediately, otherwise you will need to wait for your turn. Give it several "
+                         "branch names to merge in all of them at once: the merge starts when all of them are free.\n"
+                         "/hotfix and /release commands request merge with higher priority: such requests are placed "
+                         "in queue before normal merges (and hotfixes before releases), but after the ones of the same "
+                         "priority. Use them for a request you are already waiting with to change its priority.\n"
                          "/cancel command allows you to exit from queue or cancel current merge.\n"
                          "/done command can be used to indicate that merge is completed successfully. This "
                          "command can be invoked only if you are current merger in branch queue, otherwise you will "
@@ -290,101 +592,201 @@ if __name__ == '__main__':
                          "/unsubscribe command allows you to stop endless spam from the branch you are subscribed to. "
                          "I like this command.\n"
                          "/kick command allows you to kick user from selected branch.\n"
+                         "/stats command shows merge statistics of the last week for given branch or for all the "
+                         "branches.\n"
+                         "You can also type my name and part of branch name in this chat to see matching branches "
+                         "with their queues, and pick one of them to request merge.\n"
                          "Each of these commands can be invoked with branch name as a parameter, or without parameters "
                          "at all (in this case you will be able to select branch name from the list)",
                          parse_mode="HTML")
 
 
     @bot.message_handler(commands=["merge", "m"])
+    @measure_handler(handler_latency, tracer, "merge")
     def merge_request(message):
         # noinspection PyBroadException
         try:
             presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
-            telebot.logger.info("Requested merge from user %s", model.get_user(message.chat.id))
-            presentation_model.request_merge(message.chat.id, branch_filter=get_branch_filter(message.text))
+            telebot.logger.info("Requested merge from user %s", LazyValue(model.get_user, message.chat.id))
+            branch_filters = get_branch_filters(message.text)
+            if len(branch_filters) > 1:
+                presentation_model.request_linked_merge(message.chat.id, branch_filters)
+            else:
+                presentation_model.request_merge(message.chat.id, branch_filter=get_branch_filter(message.text))
         except Exception:
             telebot.logger.error("Exception during merge command", exc_info=1)
 
 
+    @bot.message_handler(commands=["hotfix", "release"])
+    @measure_handler(handler_latency, tracer, "priority_merge")
+    def priority_merge_request(message):
+        # noinspection PyBroadException
+        try:
+            presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
+            priority = get_merge_priority(message.text)
+            telebot.logger.info("Requested %s merge from user %s", priority.name,
+                                LazyValue(model.get_user, message.chat.id))
+            branch_filters = get_branch_filters(message.text)
+            if len(branch_filters) > 1:
+                presentation_model.request_linked_merge(message.chat.id, branch_filters, priority=priority)
+            else:
+                presentation_model.request_merge(message.chat.id, branch_filter=get_branch_filter(message.text),
+                                                 priority=priority)
+        except Exception:
+            telebot.logger.error("Exception during priority merge command", exc_info=1)
+
+
     @bot.message_handler(commands=["cancel", "c"])
+    @measure_handler(handler_latency, tracer, "cancel")
     def cancel_request(message):
         # noinspection PyBroadException
         try:
             presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
-            telebot.logger.info("Requested merge cancel from user %s", model.get_user(message.chat.id))
+            telebot.logger.info("Requested merge cancel from user %s", LazyValue(model.get_user, message.chat.id))
             presentation_model.request_cancel(message.chat.id, branch_filter=get_branch_filter(message.text))
         except Exception:
             telebot.logger.error("Exception during cancel command", exc_info=1)
 
 
     @bot.message_handler(commands=["done", "d"])
+    @measure_handler(handler_latency, tracer, "done")
     def done_request(message):
         # noinspection PyBroadException
         try:
             presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
-            telebot.logger.info("Requested merge finish from user %s", model.get_user(message.chat.id))
+            telebot.logger.info("Requested merge finish from user %s", LazyValue(model.get_user, message.chat.id))
             presentation_model.request_done(message.chat.id, branch_filter=get_branch_filter(message.text))
         except Exception:
             telebot.logger.error("Exception during done command", exc_info=1)
 
 
     @bot.message_handler(commands=["queue", "q"])
+    @measure_handler(handler_latency, tracer, "queue")
     def queue_request(message):
         # noinspection PyBroadException
         try:
             presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
-            telebot.logger.info("Requested queue information from user %s", model.get_user(message.chat.id))
+            telebot.logger.info("Requested queue information from user %s", LazyValue(model.get_user, message.chat.id))
             presentation_model.request_queue_info(message.chat.id, branch_filter=get_branch_filter(message.text))
         except Exception:
             telebot.logger.error("Exception during queue command", exc_info=1)
 
     @bot.message_handler(commands=["subscribe"])
+    @measure_handler(handler_latency, tracer, "subscribe")
     def subscribe_request(message):
         # noinspection PyBroadException
         try:
             presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
-            telebot.logger.info("Requested subscribe command from user %s", model.get_user(message.chat.id))
+            telebot.logger.info("Requested subscribe command from user %s", LazyValue(model.get_user, message.chat.id))
             presentation_model.request_subscribe(message.chat.id, branch_filter=get_branch_filter(message.text))
         except Exception:
             telebot.logger.error("Exception during subscribe command", exc_info=1)
 
     @bot.message_handler(commands=["unsubscribe"])
+    @measure_handler(handler_latency, tracer, "unsubscribe")
     def unsubscribe_request(message):
         # noinspection PyBroadException
         try:
             presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
-            telebot.logger.info("Requested unsubscribe command from user %s", model.get_user(message.chat.id))
+            telebot.logger.info("Requested unsubscribe command from user %s",
+                                LazyValue(model.get_user, message.chat.id))
             presentation_model.request_unsubscribe(message.chat.id, branch_filter=get_branch_filter(message.text))
         except Exception:
             telebot.logger.error("Exception during unsubscribe command", exc_info=1)
 
+    @bot.message_handler(commands=["stats"])
+    @measure_handler(handler_latency, tracer, "stats")
+    def stats_request(message):
+        # noinspection PyBroadException
+        try:
+            presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
+            telebot.logger.info("Requested merge statistics from user %s", LazyValue(model.get_user, message.chat.id))
+            presentation_model.request_stats(message.chat.id, branch_filter=get_branch_filter(message.text))
+        except Exception:
+            telebot.logger.error("Exception during stats command", exc_info=1)
+
     @bot.message_handler(commands=["kick"])
+    @measure_handler(handler_latency, tracer, "kick")
     def kick_request(message):
         # noinspection PyBroadException
         try:
             presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
-            telebot.logger.info("Requested kick command from user %s", model.get_user(message.chat.id))
+            telebot.logger.info("Requested kick command from user %s", LazyValue(model.get_user, message.chat.id))
             presentation_model.request_kick(message.chat.id, branch_filter=get_branch_filter(message.text))
         except Exception:
             telebot.logger.error("Exception during kick command", exc_info=1)
 
     @bot.message_handler(commands=["fix"])
+    @measure_handler(handler_latency, tracer, "fix")
     def fix_request(message):
         # noinspection PyBroadException
         try:
             presentation_model.update_user(message.chat.id, message.chat.first_name, message.chat.last_name)
-            telebot.logger.info("Requested fix command from user %s", model.get_user(message.chat.id))
+            telebot.logger.info("Requested fix command from user %s", LazyValue(model.get_user, message.chat.id))
             presentation_model.request_fix(message.chat.id, branch_filter=get_branch_filter(message.text))
         except Exception:
             telebot.logger.error("Exception during fix command", exc_info=1)
 
+    @bot.message_handler(commands=["profile"])
+    @measure_handler(handler_latency, tracer, "profile")
+    def profile_request(message):
+        # noinspection PyBroadException
+        try:
+            if not config.is_admin(message.chat.id):
+                telebot.logger.warning("User %s has requested profiling, but he is not admin",
+                                       LazyValue(model.get_user, message.chat.id))
+                bot.send_message(message.chat.id, "Only bot admins can profile me. Nice try, though.")
+                return
+
+            try:
+                duration, trace_allocations = get_profile_arguments(message.text)
+            except ValueError:
+                bot.send_message(message.chat.id, "Usage: /profile [seconds] [{}]".format(PROFILE_ALLOCATIONS_ARGUMENT))
+                return
+
+            def profile_finished(report):
+                telebot.logger.info("Profiling finished with %d samples", report.get_samples())
+                files = [os.path.basename(report.get_stacks_path())]
+                if report.get_allocations_path() is not None:
+                    files.append(os.path.basename(report.get_allocations_path()))
+                bot.send_message(message.chat.id, "Profiling finished, {0} samples were collected. Reports are saved "
+                                                  "to logs folder: {1}".format(report.get_samples(), ", ".join(files)))
+
+            try:
+                started = profiler.start(duration, trace_allocations, profile_finished)
+            except ValueError as error:
+                bot.send_message(message.chat.id, str(error))
+                return
+            if started:
+                telebot.logger.info("User %s has started profiling for %s seconds",
+                                    LazyValue(model.get_user, message.chat.id), duration)
+                bot.send_message(message.chat.id, "Profiling for {} seconds, I will let you know when it is "
+                                                  "done".format(duration))
+            else:
+                bot.send_message(message.chat.id, "Profiling is already running")
+        except Exception:
+            telebot.logger.error("Exception during profile command", exc_info=1)
+
+    @bot.inline_handler(func=lambda inline_query: True)
+    @measure_handler(handler_latency, tracer, "inline")
+    def inline_branches_request(inline_query):
+        # noinspection PyBroadException
+        try:
+            presentation_model.request_inline_branches(inline_query.id, inline_query.query)
+        except Exception:
+            telebot.logger.error("Exception during inline query", exc_info=1)
+
     @bot.callback_query_handler(func=lambda callback_query: True)
+    @measure_handler(handler_latency, tracer, "callback")
     def inline_keyboard_callback(callback_query):
         chat_id = callback_query.from_user.id
         # noinspection PyBroadException
         try:
             message_id = callback_query.message.message_id
             user_ui_state = bot_ui_controller.get_ui_state(chat_id, message_id)
+            if user_ui_state is None and bot_ui_controller.is_stale_ui(chat_id, message_id):
+                bot_ui_controller.answer_expired_ui(callback_query.id)
+                return
             if user_ui_state is None:
                 bot.edit_message_text("Internal error, UI is in incorrect state. Try again.", chat_id, message_id,
                                       parse_mode="HTML")
@@ -406,6 +808,10 @@ if __name__ == '__main__':
                 state = user_ui_state.get_current_state()
                 if state == States.merge:
                     presentation_model.request_merge(chat_id, branch)
+                elif state == States.hotfix:
+                    presentation_model.request_merge(chat_id, branch, Priority.hotfix)
+                elif state == States.release:
+                    presentation_model.request_merge(chat_id, branch, Priority.release)
                 elif state == States.cancel:
                     presentation_model.request_cancel(chat_id, branch)
                 elif state == States.done:
@@ -420,6 +826,8 @@ if __name__ == '__main__':
                     presentation_model.request_subscribe(chat_id, branch)
                 elif state == States.unsubscribe:
                     presentation_model.request_unsubscribe(chat_id, branch)
+                elif state == States.stats:
+                    presentation_model.request_stats(chat_id, branch)
                 else:
                     telebot.logger.warning("Unknown state received: %s", state)
             elif command == CALLBACK_COMMAND_USER_SELECTOR:
@@ -464,7 +872,6 @@ if __name__ == '__main__':
 
 
     bot.remove_webhook()
-    webhook = bool(os.environ.get(ENV_VARIABLE_WEBHOOK_ENABLED, False))
     if webhook:
         port = int(os.environ.get(ENV_VARIABLE_PORT, 433))
         host = os.environ.get(ENV_VARIABLE_HOST, 'localhost')
@@ -483,14 +890,41 @@ if __name__ == '__main__':
                    "<img src=\"https://i.imgur.com/QQ10bdR.png\">"
 
 
+        @app.route('/metrics', methods=['GET'])
+        def metrics_request():
+            return flask.Response(metrics.render(), mimetype=MetricsRegistry.CONTENT_TYPE)
+
+
+        @app.route('/stats', methods=['GET'])
+        def stats_request_http():
+            try:
+                return flask.jsonify(history.get_report(flask.request.args.to_dict()))
+            except ValueError:
+                flask.abort(400)
+
+
+        @app.route('/queues', methods=['GET'])
+        def queues_request_http():
+            result = queue_state.get_report(flask.request.args.to_dict())
+            if result is None:
+                flask.abort(404)
+            response = flask.Response(result.get_body(), content_type=result.CONTENT_TYPE)
+            response.set_etag(result.get_etag())
+            return response.make_conditional(flask.request)
+
+
         @app.route(webhook_url_path, methods=['POST'])
         def webhook():
+            if not startup_timeline.is_finished():
+                startup_finished("first_webhook")
             if flask.request.headers.get('content-type') == 'application/json':
                 # noinspection PyBroadException
                 try:
-                    json_string = flask.request.get_data(as_text=True)
-                    update = telebot.types.Update.de_json(json_string)
-                    bot.process_new_updates([update])
+                    with tracer.trace("webhook.update"):
+                        with span("webhook.parse"):
+                            json_string = flask.request.get_data(as_text=True)
+                            update = telebot.types.Update.de_json(json_string)
+                        bot.process_new_updates([update])
                 except Exception:
                     telebot.logger.error("Exception during parsing of server response", exc_info=1)
                 return ''
@@ -503,6 +937,23 @@ if __name__ == '__main__':
 
         app.run(host="0.0.0.0", port=port, debug=False)
     else:
+        metrics_port = os.environ.get(ENV_VARIABLE_METRICS_PORT)
+        if metrics_port:
+            telebot.logger.info("Serving metrics on port %s", metrics_port)
+            MetricsServer(metrics, int(metrics_port),
+                          routes={"/stats": history.get_report, "/queues": queue_state.get_report}).start()
+
+        get_updates = bot.get_updates
+
+
+        def get_updates_with_startup_timeline(*args, **kwargs):
+            if not startup_timeline.is_finished():
+                startup_finished("first_poll")
+            return get_updates(*args, **kwargs)
+
+
+        bot.get_updates = get_updates_with_startup_timeline
+
         # noinspection PyBroadException
         try:
             bot.polling(none_stop=True)
@@ -1,11 +1,18 @@
 import html
 import os
-from collections import deque
+import threading
+import time
+from enum import IntEnum
 
 import pickle
 
 from pickle import PickleError
 
+from Bot.MergeDispatcher import BranchPatterns
+from Bot.MergeDispatcher import IndexedPriorityQueue
+from Bot.MergeDispatcher import MetricsRegistry
+from Bot.MergeDispatcher import traced
+
 
 class User:
     def __init__(self, name, identifier):
@@ -34,23 +41,182 @@ class User:
         return self._identifier
 
 
+class Priority(IntEnum):
+    normal = 0
+    release = 1
+    hotfix = 2
+    fix = 3
+
+
 class BranchQueue:
+    generation = 0
+    last_used = 0.0
+    slot_user_id = None
+    slot_confirmed = False
+    slot_started = 0.0
+    slot_reminded = False
+    merge_user_id = None
+    merge_started = 0.0
+    merge_durations = None
+    active_priority = Priority.normal
+    train = ()
+    linked = None
+
     def __init__(self):
-        self.users_queue = deque()
+        self.users_queue = IndexedPriorityQueue()
         self.active_user = None
         self.subscriptions = set()
+        self.last_used = time.time()
+
+    def mark_changed(self):
+        self.generation += 1
+        self.last_used = time.time()
+
+    def is_empty(self):
+        return self.active_user is None and not self.users_queue and not self.subscriptions
+
+    def is_merging(self, user):
+        return user is not None and (user == self.active_user or user in self.train_users)
+
+    def get_linked_branches(self, user):
+        return self.linked.get(user, ()) if self.linked else ()
+
+    def link(self, user, branch_names):
+        # Links are replaced instead of being modified in place, so snapshots and batch state can share them
+        linked = dict(self.linked) if self.linked else {}
+        linked[user] = tuple(branch_names)
+        self.linked = linked
+
+    def unlink(self, user):
+        if self.linked and user in self.linked:
+            linked = dict(self.linked)
+            del linked[user]
+            self.linked = linked
+
+    def start_train(self, size):
+        members = []
+        while self.users_queue and len(members) < size:
+            user = self.users_queue[0]
+            if self.get_linked_branches(user):
+                break
+            members.append((user, self.users_queue.get_priority(user)))
+            self.users_queue.popleft()
+        self.train = tuple(members)
+        self._update_train_head()
+        return self.train
+
+    def join_train(self, user, priority):
+        if user in self.users_queue:
+            self.users_queue.remove(user)
+        self.train += ((user, priority),)
+        self._update_train_head()
+
+    def release_user(self, user):
+        if user in self.train_users:
+            self.train = tuple(member for member in self.train if member[0] != user)
+            self._update_train_head()
+        elif user == self.active_user:
+            self.active_user = None
+
+    def push_back(self):
+        pushed = self.train if self.train else ((self.active_user, self.active_priority),)
+        for user, priority in reversed(pushed):
+            if user is not None:
+                self.users_queue.appendleft(user, priority)
+        self.train = ()
+        self.active_user = None
+        return tuple(user for user, _ in pushed if user is not None)
+
+    def _update_train_head(self):
+        if self.train:
+            self.active_user, self.active_priority = self.train[0]
+        else:
+            self.active_user = None
+
+    @property
+    def priorities(self):
+        return tuple(priority for _, priority in self.users_queue.items())
+
+    @property
+    def train_users(self):
+        return tuple(user for user, _ in self.train)
+
+
+class BranchQueueSnapshot:
+    def __init__(self, branch_queue: BranchQueue):
+        self._generation = branch_queue.generation
+        self._active_user = branch_queue.active_user
+        self._users_queue = tuple(branch_queue.users_queue)
+        self._priorities = branch_queue.priorities
+        self._active_priority = branch_queue.active_priority
+        self._train = branch_queue.train
+        self._train_users = branch_queue.train_users
+        self._linked = branch_queue.linked or {}
+        self._subscriptions = frozenset(branch_queue.subscriptions)
+        self._recipients = None
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def active_user(self):
+        return self._active_user
+
+    @property
+    def users_queue(self):
+        return self._users_queue
+
+    @property
+    def priorities(self):
+        return self._priorities
+
+    @property
+    def active_priority(self):
+        return self._active_priority
+
+    @property
+    def train(self):
+        return self._train
+
+    @property
+    def train_users(self):
+        return self._train_users
+
+    def get_linked_branches(self, user):
+        return self._linked.get(user, ())
+
+    @property
+    def subscriptions(self):
+        return self._subscriptions
+
+    @property
+    def recipients(self):
+        if self._recipients is None:
+            recipients = list(self._train_users)
+            if self._active_user is not None and not self._train_users:
+                recipients.append(self._active_user)
+            recipients.extend(self._users_queue)
+            recipients_set = set(recipients)
+            recipients.extend(user for user in self._subscriptions if user not in recipients_set)
+            self._recipients = tuple(recipients)
+        return self._recipients
 
 
 class BotModel:
     USERS_PICKLE_FILENAME = "bot_users.pkl"
     QUEUE_PICKLE_FILENAME = "bot_queue.pkl"
+    DUMP_SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
 
-    def __init__(self, config, backup_path=".", restore=False):
+    def __init__(self, config, backup_path=".", restore=False, metrics=None):
         self._users_pickle_file = os.path.join(backup_path, self.USERS_PICKLE_FILENAME)
         self._queue_pickle_file = os.path.join(backup_path, self.QUEUE_PICKLE_FILENAME)
+        self._configured_branches = set(config.get_branches())
+        self._branch_patterns = config.get_branch_patterns()
+        self._branches_lock = threading.Lock()
         if restore:
             self._restore_users()
-            self._restore_branches(config)
+            self._restore_branches()
         else:
             self._user_infos = {}
             self._branches = {}
@@ -58,29 +224,44 @@ class BotModel:
         for branch in config.get_branches():
             if branch not in self._branches:
                 self._branches[branch] = BranchQueue()
+        self._removed_generations = {}
+
+        metrics = metrics if metrics is not None else MetricsRegistry()
+        self._dump_duration = metrics.histogram("mergebot_model_dump_seconds", "Duration of model dump")
+        self._dump_size = metrics.histogram("mergebot_model_dump_bytes", "Bytes written by model dump",
+                                            buckets=self.DUMP_SIZE_BUCKETS)
+        metrics.gauge("mergebot_branch_queue_length", "Users waiting in branch queue", self._get_queue_lengths,
+                      ("branch",))
+        metrics.gauge("mergebot_branch_active_users", "Users merging to branch right now", self._get_active_users,
+                      ("branch",))
+        metrics.gauge("mergebot_users", "Users known to bot", lambda: len(self._user_infos))
 
     def _restore_users(self):
         if os.path.exists(self._users_pickle_file):
             try:
-                pkl_file = open(self._users_pickle_file, 'rb')
-                self._user_infos = pickle.load(pkl_file)
+                with open(self._users_pickle_file, 'rb') as pkl_file:
+                    self._user_infos = pickle.load(pkl_file)
             except PickleError:
                 self._user_infos = {}
         else:
             self._user_infos = {}
 
-    def _restore_branches(self, config):
+    def _restore_branches(self):
         if os.path.exists(self._queue_pickle_file):
             try:
-                pkl_file = open(self._queue_pickle_file, 'rb')
-                self._branches = pickle.load(pkl_file)
+                with open(self._queue_pickle_file, 'rb') as pkl_file:
+                    self._branches = pickle.load(pkl_file)
             except PickleError:
                 self._branches = {}
 
             removed_branches = [branch_name for branch_name in self._branches if
-                                branch_name not in config.get_branches()]
+                                not self.is_known_branch(branch_name)]
             for branch in removed_branches:
                 del self._branches[branch]
+            for branch in self._branches.values():
+                # Queues were stored as deques before priorities were introduced
+                if not isinstance(branch.users_queue, IndexedPriorityQueue):
+                    branch.users_queue = IndexedPriorityQueue(branch.users_queue)
         else:
             self._branches = {}
 
@@ -100,12 +281,16 @@ class BotModel:
         if user.get_identifier() in self._user_infos:
             del self._user_infos[user.get_identifier()]
             for branch in self._branches:
-                if self._branches[branch].active_user == user:
-                    self._branches[branch].active_user = None
+                if self._branches[branch].is_merging(user):
+                    self._branches[branch].release_user(user)
+                    self._branches[branch].mark_changed()
                 elif user in self._branches[branch].users_queue:
                     self._branches[branch].users_queue.remove(user)
+                    self._branches[branch].unlink(user)
+                    self._branches[branch].mark_changed()
                 if user in self._branches[branch].subscriptions:
                     self._branches[branch].subscriptions.remove(user)
+                    self._branches[branch].mark_changed()
 
     def get_users(self):
         return self._user_infos.copy()
@@ -126,14 +311,85 @@ class BotModel:
             return True
         elif user.get_name() != username:
             user.update_name(username)
+            for branch in self._branches.values():
+                if branch.is_merging(user) or user in branch.users_queue or user in branch.subscriptions:
+                    branch.mark_changed()
             return True
         return False
 
     def get_branches(self):
         return self._branches
 
+    def is_known_branch(self, branch_name):
+        return branch_name in self._configured_branches or self._branch_patterns.matches(branch_name)
+
+    def get_branch_generation(self, branch_name):
+        branch_queue = self._branches.get(branch_name)
+        if branch_queue is not None:
+            return branch_queue.generation
+        if self.is_known_branch(branch_name):
+            return self._removed_generations.get(branch_name, 0)
+        return None
+
+    def get_or_create_branch(self, branch_name):
+        branch_queue = self._branches.get(branch_name)
+        if branch_queue is not None or not self.is_known_branch(branch_name):
+            return branch_queue
+        with self._branches_lock:
+            if branch_name not in self._branches:
+                branch_queue = BranchQueue()
+                if branch_name in self._removed_generations:
+                    branch_queue.generation = self._removed_generations.pop(branch_name) + 1
+                branches = dict(self._branches)
+                branches[branch_name] = branch_queue
+                self._branches = branches
+            return self._branches[branch_name]
+
+    def set_branches(self, branch_names, branch_patterns):
+        self._configured_branches = set(branch_names)
+        self._branch_patterns = branch_patterns
+        for branch_name in branch_names:
+            self.get_or_create_branch(branch_name)
+
+    def remove_branch(self, branch_name):
+        with self._branches_lock:
+            if branch_name not in self._branches:
+                return None
+            branches = dict(self._branches)
+            branch_queue = branches.pop(branch_name)
+            self._branches = branches
+            self._removed_generations[branch_name] = branch_queue.generation
+            return branch_queue
+
+    def reclaim_idle_branches(self, idle_time, now=None):
+        now = time.time() if now is None else now
+        with self._branches_lock:
+            idle_branches = [branch_name for branch_name, branch_queue in self._branches.items()
+                             if branch_name not in self._configured_branches and branch_queue.is_empty() and
+                             now - branch_queue.last_used >= idle_time]
+            if idle_branches:
+                branches = dict(self._branches)
+                for branch_name in idle_branches:
+                    self._removed_generations[branch_name] = branches.pop(branch_name).generation
+                self._branches = branches
+        return idle_branches
+
+    @traced("model.dump")
     def dump(self):
+        started = time.perf_counter()
         with open(self._users_pickle_file, 'wb') as f:
             pickle.dump(self._user_infos, f, pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
         with open(self._queue_pickle_file, 'wb') as f:
             pickle.dump(self._branches, f, pickle.HIGHEST_PROTOCOL)
+            size += f.tell()
+        self._dump_duration.observe(time.perf_counter() - started)
+        self._dump_size.observe(size)
+
+    def _get_queue_lengths(self):
+        return dict(((branch_name,), len(branch.users_queue))
+                    for branch_name, branch in list(self._branches.items()))
+
+    def _get_active_users(self):
+        return dict(((branch_name,), int(branch.active_user is not None))
+                    for branch_name, branch in list(self._branches.items()))
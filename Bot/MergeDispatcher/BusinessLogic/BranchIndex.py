@@ -0,0 +1,90 @@
+import threading
+
+from Bot.MergeDispatcher import LRUCache
+
+
+class BranchIndex:
+    GRAM_SIZE = 3
+
+    def __init__(self, branches, cache_size=1024):
+        self._branches = []
+        self._positions = {}
+        self._grams = {}
+        self._cache = LRUCache(cache_size)
+        self._lock = threading.Lock()
+        for branch in branches:
+            self._index_branch(branch)
+
+    def __len__(self):
+        return len(self._branches)
+
+    def get_branches(self):
+        return list(self._branches)
+
+    def find(self, query=None):
+        if not query:
+            return list(self._branches)
+
+        query = query.lower()
+        result = self._cache.get(query)
+        if result is None:
+            with self._lock:
+                result = tuple(self._lookup(query))
+                self._cache.put(query, result)
+        return list(result)
+
+    def add(self, branch):
+        with self._lock:
+            if branch in self._positions:
+                return False
+            self._index_branch(branch)
+            self._cache.clear()
+            return True
+
+    def remove(self, branch):
+        with self._lock:
+            position = self._positions.pop(branch, None)
+            if position is None:
+                return False
+            del self._branches[position]
+            for moved_branch in self._branches[position:]:
+                self._positions[moved_branch] -= 1
+
+            name = branch.lower()
+            for start in range(len(name)):
+                for length in range(1, min(self.GRAM_SIZE, len(name) - start) + 1):
+                    gram = name[start:start + length]
+                    posting = self._grams.get(gram)
+                    if posting is not None:
+                        posting.discard(branch)
+                        if not posting:
+                            del self._grams[gram]
+            self._cache.clear()
+            return True
+
+    def _lookup(self, query):
+        if len(query) <= self.GRAM_SIZE:
+            candidates = self._grams.get(query, ())
+        else:
+            postings = []
+            for start in range(len(query) - self.GRAM_SIZE + 1):
+                posting = self._grams.get(query[start:start + self.GRAM_SIZE])
+                if posting is None:
+                    return []
+                postings.append(posting)
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates &= posting
+            candidates = [branch for branch in candidates if query in branch.lower()]
+        return sorted(candidates, key=self._positions.get)
+
+    def _index_branch(self, branch):
+        if branch in self._positions:
+            return
+        self._positions[branch] = len(self._branches)
+        self._branches.append(branch)
+        name = branch.lower()
+        for start in range(len(name)):
+            for length in range(1, min(self.GRAM_SIZE, len(name) - start) + 1):
+                self._grams.setdefault(name[start:start + length], set()).add(branch)
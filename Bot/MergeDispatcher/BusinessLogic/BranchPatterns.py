@@ -0,0 +1,60 @@
+import fnmatch
+import re
+
+from Bot.MergeDispatcher import LRUCache
+
+
+class BranchPatterns:
+    REGEX_PREFIX = "re:"
+    GLOB_CHARACTERS = frozenset("*?[")
+    FILTERS_CACHE_SIZE = 256
+
+    _filters = LRUCache(FILTERS_CACHE_SIZE)
+
+    def __init__(self, patterns=()):
+        self._patterns = tuple(patterns)
+        self._regex = None
+        if self._patterns:
+            try:
+                self._regex = re.compile("|".join("(?:{})".format(self.translate(pattern))
+                                                  for pattern in self._patterns))
+            except re.error as error:
+                raise ValueError("Incorrect branch pattern: {}".format(error))
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def get_patterns(self):
+        return self._patterns
+
+    def matches(self, branch_name):
+        return self._regex is not None and self._regex.fullmatch(branch_name) is not None
+
+    @classmethod
+    def is_pattern(cls, entry):
+        return entry.startswith(cls.REGEX_PREFIX) or any(character in cls.GLOB_CHARACTERS for character in entry)
+
+    @classmethod
+    def translate(cls, pattern):
+        if pattern.startswith(cls.REGEX_PREFIX):
+            return pattern[len(cls.REGEX_PREFIX):]
+        return fnmatch.translate(pattern)
+
+    @classmethod
+    def compile_filter(cls, branch_filter):
+        matcher = cls._filters.get(branch_filter)
+        if matcher is None:
+            matcher = cls._create_filter(branch_filter)
+            cls._filters.put(branch_filter, matcher)
+        return matcher
+
+    @classmethod
+    def _create_filter(cls, branch_filter):
+        if cls.is_pattern(branch_filter):
+            try:
+                regex = re.compile(cls.translate(branch_filter), re.IGNORECASE)
+                return lambda branch_name: regex.fullmatch(branch_name) is not None
+            except re.error:
+                pass
+        lowered_filter = branch_filter.lower()
+        return lambda branch_name: lowered_filter in branch_name.lower()
@@ -0,0 +1,51 @@
+import bisect
+
+
+class DurationEstimate:
+    BOUNDS = (60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200, 10800, 14400, 28800)
+    DEFAULT_ALPHA = 0.1
+    DEFAULT_DURATION = 900.0
+
+    def __init__(self, alpha=DEFAULT_ALPHA):
+        self._alpha = alpha
+        self._samples = 0
+        self._mean = 0.0
+        self._weights = [0.0] * (len(self.BOUNDS) + 1)
+
+    def add(self, duration):
+        if self._samples == 0:
+            self._mean = duration
+        else:
+            self._mean += self._alpha * (duration - self._mean)
+        # Old samples fade out of the sketch with the same rate as of the average
+        self._weights = [weight * (1.0 - self._alpha) for weight in self._weights]
+        self._weights[bisect.bisect_left(self.BOUNDS, duration)] += self._alpha
+        self._samples += 1
+
+    def get_samples(self):
+        return self._samples
+
+    def get_mean(self):
+        return self._mean if self._samples else self.DEFAULT_DURATION
+
+    def get_percentile(self, percentile):
+        if self._samples == 0:
+            return self.DEFAULT_DURATION
+        rank = percentile / 100.0 * sum(self._weights)
+        for index, weight in enumerate(self._weights):
+            rank -= weight
+            if rank <= 0 and weight > 0:
+                return self.BOUNDS[index] if index < len(self.BOUNDS) else max(self.BOUNDS[-1], self._mean)
+        return max(self.BOUNDS[-1], self._mean)
+
+    def get_remaining(self, elapsed):
+        remaining = self.get_mean() - elapsed
+        if remaining <= 0:
+            # Merge already took longer than usual, so expect it to finish by the tail of the distribution
+            remaining = max(self.get_percentile(90) - elapsed, 0.0)
+        return remaining
+
+    def get_waits(self, elapsed, queue_length):
+        duration = self.get_mean()
+        first_wait = self.get_remaining(elapsed) if elapsed is not None else 0.0
+        return [first_wait + position * duration for position in range(queue_length)]
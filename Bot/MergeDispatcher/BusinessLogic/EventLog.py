@@ -0,0 +1,382 @@
+import json
+import os
+import threading
+import time
+from enum import Enum
+
+from Bot.MergeDispatcher import MetricsRegistry
+from Bot.MergeDispatcher import Priority
+from Bot.MergeDispatcher import User
+
+
+class EventType(Enum):
+    starts_merge = 0
+    joins_queue = 1
+    cancels_merge = 2
+    exits_queue = 3
+    done_merge = 4
+    kicks_user = 5
+    starts_fix = 6
+    skips_user = 7
+    releases_merge = 8
+    subscribes = 9
+    unsubscribes = 10
+    user_updated = 11
+    branch_added = 12
+    branch_removed = 13
+    reprioritizes = 14
+    joins_train = 15
+
+
+class Event:
+    def __init__(self, event_type, timestamp, branch=None, user_id=None, target_id=None, name=None, sequence=None,
+                 priority=None, branches=None):
+        self._event_type = event_type
+        self._timestamp = timestamp
+        self._branch = branch
+        self._user_id = user_id
+        self._target_id = target_id
+        self._name = name
+        self._sequence = sequence
+        self._priority = priority
+        self._branches = tuple(branches) if branches is not None else None
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.to_json_object() == other.to_json_object()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return str.format("Event: sequence={0}, type={1}, branch={2}, user={3}, target={4}", self._sequence,
+                          self._event_type.name, self._branch, self._user_id, self._target_id)
+
+    def get_event_type(self):
+        return self._event_type
+
+    def get_timestamp(self):
+        return self._timestamp
+
+    def get_branch(self):
+        return self._branch
+
+    def get_user_id(self):
+        return self._user_id
+
+    def get_target_id(self):
+        return self._target_id
+
+    def get_name(self):
+        return self._name
+
+    def get_sequence(self):
+        return self._sequence
+
+    def get_priority(self):
+        return self._priority
+
+    def get_branches(self):
+        return self._branches
+
+    def with_sequence(self, sequence):
+        return Event(self._event_type, self._timestamp, self._branch, self._user_id, self._target_id, self._name,
+                     sequence, self._priority, self._branches)
+
+    def to_json_object(self):
+        json_object = {"seq": self._sequence, "time": self._timestamp, "type": self._event_type.name}
+        if self._branch is not None:
+            json_object["branch"] = self._branch
+        if self._user_id is not None:
+            json_object["user"] = self._user_id
+        if self._target_id is not None:
+            json_object["target"] = self._target_id
+        if self._name is not None:
+            json_object["name"] = self._name
+        if self._priority is not None:
+            json_object["priority"] = int(self._priority)
+        if self._branches is not None:
+            json_object["branches"] = list(self._branches)
+        return json_object
+
+    @staticmethod
+    def from_json_object(json_object):
+        priority = json_object.get("priority")
+        return Event(EventType[json_object["type"]], json_object["time"], json_object.get("branch"),
+                     json_object.get("user"), json_object.get("target"), json_object.get("name"), json_object["seq"],
+                     Priority(priority) if priority is not None else None, json_object.get("branches"))
+
+
+class EventStore:
+    SEGMENT_PREFIX = "events-"
+    SEGMENT_SUFFIX = ".log"
+    SNAPSHOT_PREFIX = "snapshot-"
+    SNAPSHOT_SUFFIX = ".json"
+    DEFAULT_SEGMENT_SIZE = 10000
+    DEFAULT_SNAPSHOT_INTERVAL = 10000
+    KEPT_SNAPSHOTS = 2
+
+    def __init__(self, path, segment_size=DEFAULT_SEGMENT_SIZE, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL,
+                 metrics=None):
+        self._path = path
+        self._segment_size = segment_size
+        self._snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        self._snapshot_sequence = self._get_sequence(self._list_files(self.SNAPSHOT_PREFIX, self.SNAPSHOT_SUFFIX),
+                                                     self.SNAPSHOT_PREFIX, self.SNAPSHOT_SUFFIX)
+        self._last_sequence = self._snapshot_sequence
+        self._segment = None
+        self._segment_records = 0
+        segments = self._list_files(self.SEGMENT_PREFIX, self.SEGMENT_SUFFIX)
+        if segments:
+            segment_path = os.path.join(self._path, segments[-1])
+            self._repair_segment(segment_path)
+            self._last_sequence = max(self._last_sequence,
+                                      self._get_sequence(segments, self.SEGMENT_PREFIX, self.SEGMENT_SUFFIX) - 1)
+            for event in self._read_segment(segment_path):
+                self._last_sequence = max(self._last_sequence, event.get_sequence())
+                self._segment_records += 1
+            self._segment = open(segment_path, 'a')
+
+        metrics = metrics if metrics is not None else MetricsRegistry()
+        self._appended_events = metrics.counter("mergebot_events_total", "Events appended to event store", ("type",))
+        self._snapshot_duration = metrics.histogram("mergebot_event_snapshot_seconds", "Duration of state snapshot")
+        metrics.gauge("mergebot_event_sequence", "Sequence number of the last event", self.get_last_sequence)
+
+    def get_path(self):
+        return self._path
+
+    def get_last_sequence(self):
+        return self._last_sequence
+
+    def get_snapshot_sequence(self):
+        return self._snapshot_sequence
+
+    def append(self, event):
+        with self._lock:
+            if self._segment is None or self._segment_records >= self._segment_size:
+                self._rotate()
+            self._last_sequence += 1
+            event = event.with_sequence(self._last_sequence)
+            self._segment.write(json.dumps(event.to_json_object()) + "\n")
+            self._segment.flush()
+            self._segment_records += 1
+        self._appended_events.inc(labels=(event.get_event_type().name,))
+        return event
+
+    def read(self, after=0):
+        segments = self._list_files(self.SEGMENT_PREFIX, self.SEGMENT_SUFFIX)
+        for index, segment in enumerate(segments):
+            if index + 1 < len(segments) and \
+                    self._get_sequence([segments[index + 1]], self.SEGMENT_PREFIX, self.SEGMENT_SUFFIX) <= after + 1:
+                continue
+            for event in self._read_segment(os.path.join(self._path, segment)):
+                if event.get_sequence() > after:
+                    yield event
+
+    def should_snapshot(self):
+        return self._last_sequence - self._snapshot_sequence >= self._snapshot_interval
+
+    def write_snapshot(self, model):
+        started = time.perf_counter()
+        with self._lock:
+            state = self.get_model_state(model)
+            state["seq"] = self._last_sequence
+            snapshot_path = os.path.join(self._path, self._get_file_name(self.SNAPSHOT_PREFIX, self._last_sequence,
+                                                                         self.SNAPSHOT_SUFFIX))
+            with open(snapshot_path + ".tmp", 'w') as snapshot_file:
+                json.dump(state, snapshot_file)
+            os.replace(snapshot_path + ".tmp", snapshot_path)
+            self._snapshot_sequence = self._last_sequence
+            self._rotate()
+            self._compact()
+        self._snapshot_duration.observe(time.perf_counter() - started)
+        return self._snapshot_sequence
+
+    def replay(self, model):
+        sequence = 0
+        snapshots = self._list_files(self.SNAPSHOT_PREFIX, self.SNAPSHOT_SUFFIX)
+        if snapshots:
+            with open(os.path.join(self._path, snapshots[-1]), 'r') as snapshot_file:
+                state = json.load(snapshot_file)
+            self.restore_model_state(model, state)
+            sequence = state["seq"]
+
+        replayed_events = 0
+        for event in self.read(sequence):
+            self.apply_event(model, event)
+            replayed_events += 1
+        return replayed_events
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def apply_event(model, event):
+        event_type = event.get_event_type()
+        if event_type == EventType.user_updated:
+            user = model.get_user(event.get_user_id())
+            if user is None:
+                model.add_user(User(event.get_name(), event.get_user_id()))
+            else:
+                user.update_name(event.get_name())
+            return True
+        if event_type == EventType.branch_removed:
+            return model.remove_branch(event.get_branch()) is not None
+
+        branch = model.get_or_create_branch(event.get_branch())
+        if branch is None:
+            return False
+        if event_type == EventType.branch_added:
+            return True
+
+        user = model.get_user(event.get_user_id())
+        priority = event.get_priority() if event.get_priority() is not None else Priority.normal
+        if event_type == EventType.starts_merge:
+            if user in branch.users_queue:
+                if event.get_priority() is None:
+                    priority = branch.users_queue.get_priority(user)
+                branch.users_queue.remove(user)
+            branch.unlink(user)
+            branch.active_user = user
+            branch.active_priority = priority
+        elif event_type == EventType.joins_queue:
+            branch.users_queue.append(user, priority)
+            if event.get_branches():
+                branch.link(user, event.get_branches())
+        elif event_type == EventType.joins_train:
+            branch.join_train(user, priority)
+        elif event_type == EventType.reprioritizes:
+            if user in branch.users_queue:
+                branch.users_queue.update_priority(user, priority)
+        elif event_type in (EventType.cancels_merge, EventType.done_merge, EventType.releases_merge):
+            branch.release_user(user if branch.train else branch.active_user)
+        elif event_type in (EventType.exits_queue, EventType.skips_user):
+            if user in branch.users_queue:
+                branch.users_queue.remove(user)
+            branch.unlink(user)
+        elif event_type == EventType.kicks_user:
+            kicked_user = model.get_user(event.get_target_id())
+            if branch.is_merging(kicked_user):
+                branch.release_user(kicked_user)
+            elif kicked_user in branch.users_queue:
+                branch.users_queue.remove(kicked_user)
+                branch.unlink(kicked_user)
+        elif event_type == EventType.starts_fix:
+            branch.push_back()
+            branch.active_user = user
+            branch.active_priority = Priority.fix
+            if user in branch.users_queue:
+                branch.users_queue.remove(user)
+            branch.unlink(user)
+        elif event_type == EventType.subscribes:
+            branch.subscriptions.add(user)
+        elif event_type == EventType.unsubscribes:
+            branch.subscriptions.discard(user)
+        branch.mark_changed()
+        return True
+
+    @staticmethod
+    def get_model_state(model):
+        branches = {}
+        for branch_name, branch in model.get_branches().items():
+            branches[branch_name] = {
+                "active_user": branch.active_user.get_identifier() if branch.active_user is not None else None,
+                "users_queue": [user.get_identifier() for user in branch.users_queue],
+                "priorities": [int(priority) for priority in branch.priorities],
+                "active_priority": int(branch.active_priority) if branch.active_user is not None else 0,
+                "train": [[user.get_identifier(), int(priority)] for user, priority in branch.train],
+                "linked": sorted([user.get_identifier(), list(branch_names)]
+                                 for user, branch_names in (branch.linked or {}).items()),
+                "subscriptions": sorted(user.get_identifier() for user in branch.subscriptions)
+            }
+        users = sorted([identifier, user.get_name()] for identifier, user in model.get_users().items())
+        return {"users": users, "branches": branches}
+
+    @staticmethod
+    def restore_model_state(model, state):
+        for identifier, name in state["users"]:
+            user = model.get_user(identifier)
+            if user is None:
+                model.add_user(User(name, identifier))
+            else:
+                user.update_name(name)
+
+        for branch_name in list(model.get_branches()):
+            if branch_name not in state["branches"]:
+                model.remove_branch(branch_name)
+        for branch_name, branch_state in state["branches"].items():
+            branch = model.get_or_create_branch(branch_name)
+            if branch is None:
+                continue
+            branch.active_user = model.get_user(branch_state["active_user"])
+            branch.active_priority = Priority(branch_state.get("active_priority", 0))
+            branch.train = tuple((model.get_user(identifier), Priority(priority))
+                                 for identifier, priority in branch_state.get("train", []))
+            branch.linked = dict((model.get_user(identifier), tuple(branch_names))
+                                 for identifier, branch_names in branch_state.get("linked", []))
+            priorities = branch_state.get("priorities", [0] * len(branch_state["users_queue"]))
+            branch.users_queue.clear()
+            for identifier, priority in zip(branch_state["users_queue"], priorities):
+                branch.users_queue.append(model.get_user(identifier), Priority(priority))
+            branch.subscriptions.clear()
+            branch.subscriptions.update(model.get_user(identifier) for identifier in branch_state["subscriptions"])
+            branch.mark_changed()
+
+    def _rotate(self):
+        if self._segment is not None:
+            self._segment.close()
+        self._segment = open(os.path.join(self._path, self._get_file_name(self.SEGMENT_PREFIX, self._last_sequence + 1,
+                                                                          self.SEGMENT_SUFFIX)), 'a')
+        self._segment_records = 0
+
+    def _compact(self):
+        segments = self._list_files(self.SEGMENT_PREFIX, self.SEGMENT_SUFFIX)
+        for index in range(len(segments) - 1):
+            next_sequence = self._get_sequence([segments[index + 1]], self.SEGMENT_PREFIX, self.SEGMENT_SUFFIX)
+            if next_sequence <= self._snapshot_sequence + 1:
+                os.remove(os.path.join(self._path, segments[index]))
+        snapshots = self._list_files(self.SNAPSHOT_PREFIX, self.SNAPSHOT_SUFFIX)
+        for snapshot in snapshots[:-self.KEPT_SNAPSHOTS]:
+            os.remove(os.path.join(self._path, snapshot))
+
+    def _list_files(self, prefix, suffix):
+        return sorted(file_name for file_name in os.listdir(self._path)
+                      if file_name.startswith(prefix) and file_name.endswith(suffix))
+
+    @staticmethod
+    def _get_file_name(prefix, sequence, suffix):
+        return "{0}{1:012d}{2}".format(prefix, sequence, suffix)
+
+    @staticmethod
+    def _get_sequence(file_names, prefix, suffix):
+        if not file_names:
+            return 0
+        return int(file_names[-1][len(prefix):-len(suffix)])
+
+    @staticmethod
+    def _repair_segment(segment_path):
+        with open(segment_path, 'rb+') as segment_file:
+            content = segment_file.read()
+            if content and not content.endswith(b"\n"):
+                # Last record is incomplete if process was killed during write
+                segment_file.truncate(content.rfind(b"\n") + 1)
+
+    @staticmethod
+    def _read_segment(segment_path):
+        with open(segment_path, 'r') as segment_file:
+            for line in segment_file:
+                try:
+                    yield Event.from_json_object(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
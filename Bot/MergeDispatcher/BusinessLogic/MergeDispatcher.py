@@ -1,6 +1,25 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from collections import deque
+from contextlib import contextmanager
 from enum import Enum
 
+from Bot.MergeDispatcher import BranchIndex
+from Bot.MergeDispatcher import BranchPatterns
 from Bot.MergeDispatcher import BranchQueue
+from Bot.MergeDispatcher import BranchQueueSnapshot
+from Bot.MergeDispatcher import DurationEstimate
+from Bot.MergeDispatcher import Event
+from Bot.MergeDispatcher import EventType
+from Bot.MergeDispatcher import MergeHistory
+from Bot.MergeDispatcher import MetricsRegistry
+from Bot.MergeDispatcher import Priority
+from Bot.MergeDispatcher import TimeoutPolicies
+from Bot.MergeDispatcher import TrainSizes
+from Bot.MergeDispatcher import span
+from Bot.MergeDispatcher import traced
 
 
 class MergeRequestStatus(Enum):
@@ -8,6 +27,7 @@ class MergeRequestStatus(Enum):
     merge_started = 1
     already_in_queue = 2
     branch_not_exist = 3
+    priority_changed = 4
 
 
 class CancelRequestStatus(Enum):
@@ -47,6 +67,27 @@ class UnsubscribeRequestStatus(Enum):
     user_not_in_branch = 2
 
 
+class BatchOperationType(Enum):
+    merge = 0
+    cancel = 1
+    done = 2
+    kick = 3
+    fix = 4
+    subscribe = 5
+    unsubscribe = 6
+
+
+class BatchOperationStatus(Enum):
+    user_not_exist = 0
+    not_executed = 1
+
+
+class TimeoutType(Enum):
+    remind = 0
+    skip = 1
+    release = 2
+
+
 class NotifierActions(Enum):
     starts_merge = 0
     ready_to_merge = 1
@@ -57,18 +98,27 @@ class NotifierActions(Enum):
     kicks_user = 6
     kicks_himself = 7
     starts_fix = 8
+    branch_removed = 9
+    reminds_merge = 10
+    reminds_confirmation = 11
+    skips_user = 12
+    releases_merge = 13
+    changes_priority = 14
+    starts_train = 15
 
 
 class Notifier:
     class ActionData:
-        def __init__(self, action_user, action_branch):
+        def __init__(self, action_user, action_branch, priority=Priority.normal):
             self._action_user = action_user
             self._action_branch = action_branch
+            self._priority = priority
 
         def __eq__(self, other):
             return type(self) == type(other) and \
                    self._action_user == other.get_user() and \
-                   self._action_branch == other.get_branch()
+                   self._action_branch == other.get_branch() and \
+                   self._priority == other.get_priority()
 
         def __ne__(self, other):
             return not self == other
@@ -79,6 +129,12 @@ class Notifier:
         def get_branch(self):
             return self._action_branch
 
+        def get_branches(self):
+            return (self._action_branch,)
+
+        def get_priority(self):
+            return self._priority
+
     class KickActionData(ActionData):
         def __init__(self, action_user, action_branch, kicked_user):
             super(Notifier.KickActionData, self).__init__(action_user, action_branch)
@@ -92,196 +148,448 @@ class Notifier:
             return self._kicked_user
 
     class MergeFixActionData(ActionData):
-        def __init__(self, action_user, action_branch, pushed_user):
+        def __init__(self, action_user, action_branch, pushed_user, pushed_users=None):
             super(Notifier.MergeFixActionData, self).__init__(action_user, action_branch)
             self._pushed_user = pushed_user
+            if pushed_users:
+                self._pushed_users = tuple(pushed_users)
+            else:
+                self._pushed_users = (pushed_user,) if pushed_user is not None else ()
 
         def __eq__(self, other):
             return super(Notifier.MergeFixActionData, self).__eq__(other) and \
-                   self._pushed_user == other.get_pushed_user()
+                   self._pushed_user == other.get_pushed_user() and \
+                   self._pushed_users == other.get_pushed_users()
 
         def get_pushed_user(self):
             return self._pushed_user
 
+        def get_pushed_users(self):
+            return self._pushed_users
+
+    class LinkedActionData(ActionData):
+        def __init__(self, action_user, action_branch, branches):
+            super(Notifier.LinkedActionData, self).__init__(action_user, action_branch)
+            self._branches = tuple(branches)
+
+        def __eq__(self, other):
+            return super(Notifier.LinkedActionData, self).__eq__(other) and \
+                   self._branches == other.get_branches()
+
+        def get_branches(self):
+            return self._branches
+
+    class TrainActionData(ActionData):
+        def __init__(self, action_user, action_branch, members):
+            super(Notifier.TrainActionData, self).__init__(action_user, action_branch)
+            self._members = tuple(members)
+
+        def __eq__(self, other):
+            return super(Notifier.TrainActionData, self).__eq__(other) and \
+                   self._members == other.get_members()
+
+        def get_members(self):
+            return self._members
+
     def notify(self, whom, action_type, action_data):
         raise NotImplementedError("Class %s doesn't implement notify(user, message)" % self.__class__.__name__)
 
+    def notify_batch(self, whom, notifications):
+        for action_type, action_data in notifications:
+            self.notify(whom, action_type, action_data)
+
+    def invalidate(self):
+        pass
+
 
 class Config:
-    def __init__(self, branches):
-        self._branches = branches
+    def __init__(self, branches, admins=None, timeouts=None, trains=None):
+        self._branches = [branch for branch in branches if not BranchPatterns.is_pattern(branch)]
+        self._branch_patterns = BranchPatterns(branch for branch in branches if BranchPatterns.is_pattern(branch))
+        self._admins = admins if admins is not None else []
+        self._timeouts = timeouts if timeouts is not None else TimeoutPolicies()
+        self._trains = trains if trains is not None else TrainSizes()
 
     def get_branches(self):
         return self._branches
 
+    def get_branch_patterns(self):
+        return self._branch_patterns
+
+    def get_admins(self):
+        return self._admins
+
+    def get_timeouts(self):
+        return self._timeouts
+
+    def get_trains(self):
+        return self._trains
+
+    def is_admin(self, user_id):
+        return user_id in self._admins
+
+
+class BatchOperation:
+    def __init__(self, operation_type, user_id, branch_name, target_user_id=None):
+        self._operation_type = operation_type
+        self._user_id = user_id
+        self._branch_name = branch_name
+        self._target_user_id = target_user_id
+
+    def __str__(self):
+        return str.format("BatchOperation: type={0}, user={1}, branch={2}, target={3}", self._operation_type,
+                          self._user_id, self._branch_name, self._target_user_id)
+
+    def get_operation_type(self):
+        return self._operation_type
+
+    def get_user_id(self):
+        return self._user_id
+
+    def get_branch_name(self):
+        return self._branch_name
+
+    def get_target_user_id(self):
+        return self._target_user_id
+
+
+class BatchResult:
+    def __init__(self, committed, statuses):
+        self._committed = committed
+        self._statuses = statuses
+
+    def is_committed(self):
+        return self._committed
+
+    def get_statuses(self):
+        return self._statuses
+
+
+def synchronized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class Dispatcher:
     _notifier = None
 
+    BATCH_SUCCESS_STATUSES = {
+        MergeRequestStatus.merge_requested, MergeRequestStatus.merge_started, MergeRequestStatus.already_in_queue,
+        MergeRequestStatus.priority_changed,
+        CancelRequestStatus.merge_cancelled, CancelRequestStatus.exited_from_queue,
+        DoneRequestStatus.merge_done,
+        KickRequestStatus.user_kicked,
+        FixRequestStatus.fix_allowed, FixRequestStatus.user_already_in_merge,
+        SubscribeRequestStatus.subscription_complete, SubscribeRequestStatus.already_subscribed,
+        UnsubscribeRequestStatus.unsubscription_complete, UnsubscribeRequestStatus.user_not_in_branch
+    }
+
     @staticmethod
     def filter_branches(branches, branch_filter):
         if branch_filter is None:
             return branches
-        filtered_branches = []
-        for branch in branches:
-            if branch_filter.lower() in branch.lower():
-                filtered_branches.append(branch)
-        return filtered_branches
+        matcher = BranchPatterns.compile_filter(branch_filter)
+        return [branch for branch in branches if matcher(branch)]
 
-    def __init__(self, model, logger):
+    NOTIFICATION_FANOUT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+    DEFAULT_BRANCH_IDLE_TIME = 3600
+    RECLAIM_INTERVAL = 60
+
+    def __init__(self, model, logger, metrics=None, branch_idle_time=DEFAULT_BRANCH_IDLE_TIME, scheduler=None,
+                 timeouts=None, event_store=None, history=None, trains=None):
         self._model = model
+        self._event_store = event_store
+        self._history = history
         self._logger = logger
-
+        self._branch_idle_time = branch_idle_time
+        self._last_reclaim = time.time()
+        self._scheduler = scheduler
+        self._timeouts = timeouts if timeouts is not None else TimeoutPolicies()
+        self._trains = trains if trains is not None else TrainSizes()
+        self._branch_timers = {}
+        metrics = metrics if metrics is not None else MetricsRegistry()
+        self._notification_fanout = metrics.histogram("mergebot_notification_fanout", "Users notified about action",
+                                                      ("action",), self.NOTIFICATION_FANOUT_BUCKETS)
+        self._fired_timeouts = metrics.counter("mergebot_timeouts_total", "Merge timeouts fired", ("type",))
+        metrics.gauge("mergebot_pending_timeouts", "Merge timeouts waiting to fire",
+                      lambda: len(self._scheduler) if self._scheduler is not None else 0)
+        self._branch_index = None
+        self._snapshots = {}
+        self._snapshot_allocations = 0
+        self._batch_notifications = None
+        self._batch_changed = False
+        self._batch_branches = None
+        self._batch_events = None
+        # Handlers and scheduled timeouts run on different threads, so every change of queues holds this lock
+        self._lock = threading.RLock()
+
+    @synchronized
     def prepare(self):
         branches_queues = self._model.get_branches()
-        for branch_name in branches_queues:
+        linked_users = set()
+        for branch_name in list(branches_queues):
             branch_queue = branches_queues[branch_name]
+            self._update_estimates(branch_name)
             if branch_queue.active_user is None and branch_queue.users_queue:
-                self._notify_users(NotifierActions.ready_to_merge,
-                                   Notifier.ActionData(branch_queue.users_queue[0], branch_name))
+                train_users = self._start_train(branch_queue, branch_name)
+                if train_users:
+                    self._persist(branch_name)
+                first_user = branch_queue.users_queue[0] if branch_queue.users_queue else None
+                # Linked request is first in all its branches, so it should be notified only once
+                if train_users or first_user not in linked_users:
+                    self._notify_next_merge(branch_queue, branch_name, train_users)
+                if branch_queue.get_linked_branches(first_user):
+                    linked_users.add(first_user)
+        self._update_all_timeouts()
+
+    @synchronized
+    def update_config(self, config):
+        changes = self.update_branches(config.get_branches(), config.get_branch_patterns())
+        self.set_timeouts(config.get_timeouts())
+        self.set_trains(config.get_trains())
+        return changes
+
+    @synchronized
+    def set_timeouts(self, timeouts):
+        self._timeouts = timeouts
+        self._update_all_timeouts()
+
+    @synchronized
+    def set_trains(self, trains):
+        self._trains = trains
 
     def set_notifier(self, notifier):
         self._notifier = notifier
 
-    def merge(self, user_id, branch_name):
+    @traced("dispatcher.merge")
+    @synchronized
+    def merge(self, user_id, branch_name, priority=Priority.normal):
         user = self._model.get_user(user_id)
-        if branch_name not in self._model.get_branches():
+        branch = self._get_branch(branch_name)
+        if branch is None:
             self._logger.warning("Attempt to merge from user %s to non-existing branch %s", user, branch_name)
             return MergeRequestStatus.branch_not_exist
 
-        branch = self._model.get_branches()[branch_name]
-        if user in branch.users_queue or user == branch.active_user:
+        if branch.is_merging(user) or \
+                (user in branch.users_queue and branch.users_queue.get_priority(user) == priority):
             self._logger.info("User %s requested merge to branch %s, but he is already in queue", user, branch_name)
             return MergeRequestStatus.already_in_queue
 
-        if not branch.users_queue and branch.active_user is None:
+        if user in branch.users_queue:
+            # Linked request keeps the same priority in all its branches, otherwise queues could wait for each other
+            linked = branch.get_linked_branches(user)
+            with self._combined_changes(bool(linked)):
+                for queue_branch_name, queue_branch in self._get_queued_branches(user, linked or (branch_name,)):
+                    first_user = queue_branch.users_queue[0]
+                    queue_branch.users_queue.update_priority(user, priority)
+                    queue_branch.mark_changed()
+                    self._record(EventType.reprioritizes, queue_branch_name, user, priority=priority)
+                    self._persist(queue_branch_name)
+                    self._logger.info("User %s has changed priority of merge to branch %s to %s", user,
+                                      queue_branch_name, priority.name)
+                    self._notify_users(NotifierActions.changes_priority,
+                                       Notifier.ActionData(user, queue_branch_name, priority))
+                    self._notify_next_user(queue_branch, queue_branch_name, first_user)
+            return MergeRequestStatus.priority_changed
+        elif not branch.users_queue and branch.active_user is None:
             branch.active_user = user
-            self._model.dump()
+            branch.active_priority = priority
+            branch.mark_changed()
+            self._record(EventType.starts_merge, branch_name, user, priority=priority)
+            self._persist(branch_name)
             self._logger.info("User %s has requested and started merge to branch %s", user, branch_name)
-            self._notify_users(NotifierActions.starts_merge, Notifier.ActionData(user, branch_name))
+            self._notify_users(NotifierActions.starts_merge, Notifier.ActionData(user, branch_name, priority))
             return MergeRequestStatus.merge_started
         else:
-            branch.users_queue.append(user)
-            self._model.dump()
+            first_user = branch.users_queue[0] if branch.users_queue else None
+            branch.users_queue.append(user, priority)
+            branch.mark_changed()
+            self._record(EventType.joins_queue, branch_name, user, priority=priority)
+            self._persist(branch_name)
             self._logger.info("User %s has requested merge to branch %s and was put in queue", user, branch_name)
-            self._notify_users(NotifierActions.joins_queue, Notifier.ActionData(user, branch_name))
+            self._notify_users(NotifierActions.joins_queue, Notifier.ActionData(user, branch_name, priority))
+            self._notify_next_user(branch, branch_name, first_user)
             return MergeRequestStatus.merge_requested
 
+    @traced("dispatcher.merge_linked")
+    @synchronized
+    def merge_linked(self, user_id, branch_names, priority=Priority.normal):
+        branch_names = list(OrderedDict.fromkeys(branch_names))
+        if len(branch_names) == 1:
+            return self.merge(user_id, branch_names[0], priority)
+
+        user = self._model.get_user(user_id)
+        branches = []
+        for branch_name in branch_names:
+            branch = self._get_branch(branch_name)
+            if branch is None:
+                self._logger.warning("Attempt to merge from user %s to non-existing branch %s", user, branch_name)
+                return MergeRequestStatus.branch_not_exist
+            branches.append(branch)
+        if any(branch.is_merging(user) or user in branch.users_queue for branch in branches):
+            self._logger.info("User %s requested merge to branches %s, but he is already in one of queues", user,
+                              branch_names)
+            return MergeRequestStatus.already_in_queue
+
+        with self._combined_changes():
+            first_users = []
+            for branch_name, branch in zip(branch_names, branches):
+                first_users.append(branch.users_queue[0] if branch.users_queue else None)
+                branch.users_queue.append(user, priority)
+                branch.link(user, branch_names)
+                branch.mark_changed()
+                self._record(EventType.joins_queue, branch_name, user, priority=priority, branches=branch_names)
+            if self._is_linked_ready(user, branch_names):
+                self._start_linked(user, branch_names)
+                return MergeRequestStatus.merge_started
+
+            self._persist(*branch_names)
+            self._logger.info("User %s has requested merge to branches %s and was put in their queues", user,
+                              branch_names)
+            for branch_name, branch, first_user in zip(branch_names, branches, first_users):
+                self._notify_users(NotifierActions.joins_queue, Notifier.ActionData(user, branch_name, priority))
+                self._notify_next_user(branch, branch_name, first_user)
+        return MergeRequestStatus.merge_requested
+
+    @traced("dispatcher.cancel")
+    @synchronized
     def cancel(self, user_id, branch_name):
         user = self._model.get_user(user_id)
-        if branch_name not in self._model.get_branches():
+        branch = self._get_branch(branch_name)
+        if branch is None:
             self._logger.warning("User %s has requested cancel of merge to non-existing branch %s", user, branch_name)
             return CancelRequestStatus.branch_not_exist
 
-        branch = self._model.get_branches()[branch_name]
-        if branch.active_user == user:
-            branch.active_user = None
-            self._model.dump()
+        if branch.is_merging(user):
+            branch.release_user(user)
+            branch.mark_changed()
+            self._record(EventType.cancels_merge, branch_name, user)
+            train_users = self._start_train(branch, branch_name)
+            self._persist(branch_name)
             self._logger.info("User %s has cancelled merge to branch %s", user, branch_name)
             self._notify_users(NotifierActions.cancels_merge, Notifier.ActionData(user, branch_name))
-            if branch.users_queue:
-                self._notify_users(NotifierActions.ready_to_merge,
-                                   Notifier.ActionData(branch.users_queue[0], branch_name))
+            self._notify_next_merge(branch, branch_name, train_users)
             return CancelRequestStatus.merge_cancelled
         elif user in branch.users_queue:
-            first_user = branch.users_queue[0]
-            branch.users_queue.remove(user)
-            self._model.dump()
-            self._logger.info("User %s has exited from queue to branch %s", user, branch_name)
-            self._notify_users(NotifierActions.exits_queue, Notifier.ActionData(user, branch_name))
-
-            if branch.active_user is None and first_user == user and branch.users_queue:
-                self._notify_users(NotifierActions.ready_to_merge,
-                                   Notifier.ActionData(branch.users_queue[0], branch_name))
+            linked = branch.get_linked_branches(user)
+            with self._combined_changes(bool(linked)):
+                self._exit_queue(user, branch, branch_name)
+                self._drop_linked(user, linked, branch_name)
             return CancelRequestStatus.exited_from_queue
         else:
             self._logger.info("User %s has requested cancel of merge to branch %s, but he is not in queue",
                               user, branch_name)
             return CancelRequestStatus.not_in_queue
 
+    @traced("dispatcher.done")
+    @synchronized
     def done(self, user_id, branch_name):
         user = self._model.get_user(user_id)
-        if branch_name not in self._model.get_branches():
+        branch = self._get_branch(branch_name)
+        if branch is None:
             self._logger.warning("User %s has tried to finish merge to non-existing branch %s", user, branch_name)
             return DoneRequestStatus.branch_not_exist
 
-        branch = self._model.get_branches()[branch_name]
-        if branch.active_user != user:
+        if not branch.is_merging(user):
             self._logger.info("User %s has tried to finish merge to branch %s, but he is not active user",
                               user, branch_name)
             return DoneRequestStatus.user_not_active
 
-        branch.active_user = None
-        self._model.dump()
+        branch.release_user(user)
+        branch.mark_changed()
+        self._record(EventType.done_merge, branch_name, user)
+        train_users = self._start_train(branch, branch_name)
+        self._persist(branch_name)
         self._logger.info("User %s has finished merge to branch %s", user, branch_name)
         self._notify_users(NotifierActions.done_merge, Notifier.ActionData(user, branch_name))
-        if branch.users_queue:
-            self._notify_users(NotifierActions.ready_to_merge,
-                               Notifier.ActionData(branch.users_queue[0], branch_name))
+        self._notify_next_merge(branch, branch_name, train_users)
         return DoneRequestStatus.merge_done
 
+    @traced("dispatcher.kick")
+    @synchronized
     def kick(self, user_id, user_to_kick_id, branch_name):
         user = self._model.get_user(user_id)
         user_to_kick = self._model.get_user(user_to_kick_id)
-        if branch_name not in self._model.get_branches():
+        branch = self._get_branch(branch_name)
+        if branch is None:
             self._logger.warning("User %s has tried to kick user %s from non-existing branch %s",
                                  user, user_to_kick, branch_name)
             return KickRequestStatus.branch_not_exist
 
-        branch = self._model.get_branches()[branch_name]
-
         next_user_will_merge = False
-        if branch.active_user == user_to_kick:
-            branch.active_user = None
-            if len(branch.users_queue) > 0:
+        linked = ()
+        if branch.is_merging(user_to_kick):
+            branch.release_user(user_to_kick)
+            if branch.active_user is None and len(branch.users_queue) > 0:
                 next_user_will_merge = True
         elif user_to_kick in branch.users_queue:
             if branch.active_user is None and branch.users_queue[0] == user_to_kick and len(branch.users_queue) > 1:
                 next_user_will_merge = True
             branch.users_queue.remove(user_to_kick)
+            linked = branch.get_linked_branches(user_to_kick)
+            branch.unlink(user_to_kick)
         else:
             self._logger.warning("User %s has tried to remove user %s from branch %s, but he is not here",
                                  user, user_to_kick, branch_name)
             return KickRequestStatus.user_not_in_branch
-        self._model.dump()
-        action_type = NotifierActions.kicks_user if user != user_to_kick else NotifierActions.kicks_himself
-        action_data = Notifier.KickActionData(user, branch_name, user_to_kick)
-        self._notify_user(user_to_kick, action_type, action_data)
-        self._notify_users(action_type, action_data)
-        if next_user_will_merge:
-            self._notify_users(NotifierActions.ready_to_merge,
-                               Notifier.ActionData(branch.users_queue[0], branch_name))
+        with self._combined_changes(bool(linked)):
+            branch.mark_changed()
+            self._record(EventType.kicks_user, branch_name, user, user_to_kick)
+            train_users = self._start_train(branch, branch_name)
+            self._persist(branch_name)
+            action_type = NotifierActions.kicks_user if user != user_to_kick else NotifierActions.kicks_himself
+            action_data = Notifier.KickActionData(user, branch_name, user_to_kick)
+            self._notify_user(user_to_kick, action_type, action_data)
+            self._notify_users(action_type, action_data)
+            if next_user_will_merge or train_users:
+                self._notify_next_merge(branch, branch_name, train_users)
+            self._drop_linked(user_to_kick, linked, branch_name)
         return KickRequestStatus.user_kicked
 
+    @traced("dispatcher.fix")
+    @synchronized
     def fix(self, user_id, branch_name):
         user = self._model.get_user(user_id)
-        if branch_name not in self._model.get_branches():
+        branch = self._get_branch(branch_name)
+        if branch is None:
             self._logger.warning("User %s has tried to merge fix in non-existing branch %s", user, branch_name)
             return FixRequestStatus.branch_not_exist
-        branch = self._model.get_branches()[branch_name]
-        if branch.active_user == user:
+        if branch.is_merging(user):
             return FixRequestStatus.user_already_in_merge
 
-        action_data = Notifier.MergeFixActionData(user, branch_name, branch.active_user)
-        if branch.active_user is not None:
-            branch.users_queue.appendleft(branch.active_user)
-        branch.active_user = user
-        if user in branch.users_queue:
-            branch.users_queue.remove(user)
-        self._model.dump()
-        self._notify_users(NotifierActions.starts_fix, action_data)
+        action_data = Notifier.MergeFixActionData(user, branch_name, branch.active_user, branch.train_users)
+        linked = branch.get_linked_branches(user)
+        with self._combined_changes(bool(linked)):
+            branch.push_back()
+            branch.active_user = user
+            branch.active_priority = Priority.fix
+            if user in branch.users_queue:
+                branch.users_queue.remove(user)
+            branch.unlink(user)
+            branch.mark_changed()
+            self._record(EventType.starts_fix, branch_name, user)
+            self._persist(branch_name)
+            self._notify_users(NotifierActions.starts_fix, action_data)
+            self._drop_linked(user, linked, branch_name)
         return FixRequestStatus.fix_allowed
 
+    @traced("dispatcher.subscribe")
+    @synchronized
     def subscribe(self, user_id, branch_name):
         user = self._model.get_user(user_id)
-        if branch_name not in self._model.get_branches():
+        branch = self._get_branch(branch_name)
+        if branch is None:
             self._logger.warning("User %s has tried to subscribe to non-existing branch %s",
                                  user, branch_name)
             return SubscribeRequestStatus.branch_not_exist
-        branch = self._model.get_branches()[branch_name]
         if user not in branch.subscriptions:
             branch.subscriptions.add(user)
-            self._model.dump()
+            branch.mark_changed()
+            self._record(EventType.subscribes, branch_name, user)
+            self._persist(branch_name)
             self._logger.info("User %s has subscribed to updates in branch %s", user, branch_name)
             return SubscribeRequestStatus.subscription_complete
         else:
@@ -289,16 +597,20 @@ class Dispatcher:
                               user, branch_name)
             return SubscribeRequestStatus.already_subscribed
 
+    @traced("dispatcher.unsubscribe")
+    @synchronized
     def unsubscribe(self, user_id, branch_name):
         user = self._model.get_user(user_id)
-        if branch_name not in self._model.get_branches():
+        branch = self._get_branch(branch_name)
+        if branch is None:
             self._logger.warning("User %s has tried to unsubscribe to non-existing branch %s",
                                  user, branch_name)
             return UnsubscribeRequestStatus.branch_not_exist
-        branch = self._model.get_branches()[branch_name]
         if user in branch.subscriptions:
             branch.subscriptions.remove(user)
-            self._model.dump()
+            branch.mark_changed()
+            self._record(EventType.unsubscribes, branch_name, user)
+            self._persist(branch_name)
             self._logger.info("User %s has unsubscribed from updates in branch %s", user, branch_name)
             return UnsubscribeRequestStatus.unsubscription_complete
         else:
@@ -306,37 +618,114 @@ class Dispatcher:
                               user, branch_name)
             return UnsubscribeRequestStatus.user_not_in_branch
 
+    @traced("dispatcher.confirm_merge")
+    @synchronized
     def confirm_merge(self, user_id, branch_name):
         user = self._model.get_user(user_id)
-        if branch_name not in self._model.get_branches():
+        branch = self._get_branch(branch_name)
+        if branch is None:
             self._logger.warning("User %s has tried to confirm merge to non-existing branch %s", user, branch_name)
             return False
 
-        branch = self._model.get_branches()[branch_name]
-        if branch.active_user is None and branch.users_queue[0] == user:
+        linked = branch.get_linked_branches(user)
+        if branch.active_user is None and branch.users_queue and branch.users_queue[0] == user and linked:
+            if not self._is_linked_ready(user, linked):
+                self._logger.info("User %s tried to confirm merge to branches %s, but they are not free yet", user,
+                                  linked)
+                return False
+            self._start_linked(user, linked)
+            return True
+        elif branch.active_user is None and branch.users_queue and branch.users_queue[0] == user:
+            branch.active_priority = branch.users_queue.get_priority(user)
             branch.active_user = branch.users_queue.popleft()
-            self._model.dump()
+            branch.mark_changed()
+            self._record(EventType.starts_merge, branch_name, user, priority=branch.active_priority)
+            self._persist(branch_name)
             self._logger.info("User %s has confirmed merge to branch %s", user, branch_name)
-            self._notify_users(NotifierActions.starts_merge, Notifier.ActionData(user, branch_name))
+            self._notify_users(NotifierActions.starts_merge,
+                               Notifier.ActionData(user, branch_name, branch.active_priority))
             return True
         else:
             self._logger.info("User %s tried to confirm merge to branch %s, but he can't be next", user, branch_name)
             return False
 
     def get_branch_queue_info(self, branch_name):
-        if branch_name not in self._model.get_branches():
+        generation = self._model.get_branch_generation(branch_name)
+        if generation is None:
             return None
-        else:
-            branch_queue_info = BranchQueue()
-            branch_queue_info.active_user = self._model.get_branches()[branch_name].active_user
-            for user in self._model.get_branches()[branch_name].users_queue:
-                branch_queue_info.users_queue.append(user)
-            for user in self._model.get_branches()[branch_name].subscriptions:
-                branch_queue_info.subscriptions.add(user)
-            return branch_queue_info
+
+        snapshot = self._snapshots.get(branch_name)
+        if snapshot is None or snapshot.generation != generation:
+            branch = self._model.get_branches().get(branch_name)
+            if branch is None:
+                branch = BranchQueue()
+                branch.generation = generation
+            snapshot = BranchQueueSnapshot(branch)
+            self._snapshots[branch_name] = snapshot
+            self._snapshot_allocations += 1
+        return snapshot
+
+    def get_queue_estimates(self, branch_name, now=None):
+        branch = self._model.get_branches().get(branch_name)
+        if branch is None or branch.merge_durations is None:
+            return None
+        now = now if now is not None else time.time()
+        elapsed = None
+        if branch.active_user is not None:
+            elapsed = now - branch.merge_started if branch.merge_started else 0.0
+        # Every train takes the next train_size users from queue at once
+        train_size = self._trains.get_size(branch_name)
+        waits = branch.merge_durations.get_waits(elapsed, (len(branch.users_queue) + train_size - 1) // train_size)
+        return [waits[position // train_size] for position in range(len(branch.users_queue))]
+
+    def get_snapshot_allocations(self):
+        return self._snapshot_allocations
+
+    @traced("dispatcher.execute_batch")
+    @synchronized
+    def execute_batch(self, operations):
+        if self._batch_notifications is not None:
+            raise RuntimeError("Nested batches are not supported")
+
+        branches_state = self._save_branches_state(operations)
+        self._begin_changes()
+        statuses = []
+        failed = False
+        try:
+            for operation in operations:
+                status = self._execute_operation(operation)
+                statuses.append(status)
+                if status not in self.BATCH_SUCCESS_STATUSES:
+                    failed = True
+                    break
+        except BaseException:
+            self._restore_branches_state(branches_state)
+            raise
+        finally:
+            changes = self._end_changes()
+
+        if failed:
+            self._restore_branches_state(branches_state)
+            self._logger.warning("Batch of %d operations was rolled back, operation %s has failed with status %s",
+                                 len(operations), operations[len(statuses) - 1], statuses[-1])
+            statuses.extend([BatchOperationStatus.not_executed] * (len(operations) - len(statuses)))
+            return BatchResult(False, statuses)
+
+        self._commit_changes(*changes)
+        self._logger.info("Batch of %d operations was committed", len(operations))
+        return BatchResult(True, statuses)
+
+    def get_branch_generation(self, branch_name):
+        return self._model.get_branch_generation(branch_name)
 
     def get_all_branches(self, branch_filter=None):
-        return self.filter_branches(list(self._model.get_branches().keys()), branch_filter)
+        if branch_filter is not None and BranchPatterns.is_pattern(branch_filter):
+            return self.filter_branches(self._get_branch_index().get_branches(), branch_filter)
+
+        branches = self._get_branch_index().find(branch_filter)
+        if branch_filter and branch_filter not in branches and self._model.is_known_branch(branch_filter):
+            branches.append(branch_filter)
+        return branches
 
     def get_branches_user_subscribed_to(self, user_id, branch_filter=None):
         user = self._model.get_user(user_id)
@@ -354,7 +743,7 @@ class Dispatcher:
         user = self._model.get_user(user_id)
         result = []
         for branch in self._model.get_branches():
-            if self._model.get_branches()[branch].active_user == user or \
+            if self._model.get_branches()[branch].is_merging(user) or \
                             user in self._model.get_branches()[branch].users_queue:
                 result.append(branch)
         return self.filter_branches(result, branch_filter)
@@ -363,41 +752,459 @@ class Dispatcher:
         user = self._model.get_user(user_id)
         result = []
         for branch in self._model.get_branches():
-            if self._model.get_branches()[branch].active_user == user:
+            if self._model.get_branches()[branch].is_merging(user):
                 result.append(branch)
         return self.filter_branches(result, branch_filter)
 
+    @traced("dispatcher.update_branches")
+    @synchronized
+    def update_branches(self, branch_names, branch_patterns=None):
+        current_branches = list(self._model.get_branches())
+        added_branches = [branch for branch in branch_names if branch not in current_branches]
+        self._model.set_branches(branch_names, branch_patterns if branch_patterns is not None else BranchPatterns())
+        removed_branches = [branch for branch in current_branches if not self._model.is_known_branch(branch)]
+
+        for branch_name in removed_branches:
+            branch = self._model.remove_branch(branch_name)
+            self._record(EventType.branch_removed, branch_name)
+            for user_to_notify in BranchQueueSnapshot(branch).recipients:
+                self._notify_user(user_to_notify, NotifierActions.branch_removed,
+                                  Notifier.ActionData(None, branch_name))
+            self._snapshots.pop(branch_name, None)
+            self._update_timeouts(branch_name)
+            if self._branch_index is not None:
+                self._branch_index.remove(branch_name)
+            self._logger.info("Branch %s was removed", branch_name)
+
+        for branch_name in added_branches:
+            self._record(EventType.branch_added, branch_name)
+            if self._branch_index is not None:
+                self._branch_index.add(branch_name)
+            self._logger.info("Branch %s was added", branch_name)
+
+        if added_branches or removed_branches:
+            self._persist()
+            self._invalidate_notifier()
+        return added_branches, removed_branches
+
+    @traced("dispatcher.update_user")
+    @synchronized
     def update_user(self, identifier, first_name, last_name):
         if self._model.update_or_create_user(identifier, first_name, last_name):
-            self._model.dump()
+            self._record(EventType.user_updated, user=self._model.get_user(identifier),
+                         name=self._model.get_user(identifier).get_name())
+            self._persist()
             self._logger.info("User with ID %d was updated with name %s %s", identifier, first_name, last_name)
+            self._invalidate_notifier()
 
     def get_user(self, identifier):
         return self._model.get_user(identifier)
 
+    def get_merge_statistics(self, days, branch_name=None, user_id=None, now=None):
+        if self._history is None:
+            return None
+        until = now if now is not None else time.time()
+        return self._history.query(until - days * MergeHistory.DAY, until, branch_name, user_id)
+
+    def _execute_operation(self, operation):
+        operation_type = operation.get_operation_type()
+        user_id = operation.get_user_id()
+        branch_name = operation.get_branch_name()
+        if self._model.get_user(user_id) is None:
+            return BatchOperationStatus.user_not_exist
+
+        if operation_type == BatchOperationType.merge:
+            # Batch operations have no priority, so a merge requested before keeps its own one
+            branch = self._model.get_branches().get(branch_name)
+            user = self._model.get_user(user_id)
+            if branch is not None and user in branch.users_queue:
+                return self.merge(user_id, branch_name, branch.users_queue.get_priority(user))
+            return self.merge(user_id, branch_name)
+        elif operation_type == BatchOperationType.cancel:
+            return self.cancel(user_id, branch_name)
+        elif operation_type == BatchOperationType.done:
+            return self.done(user_id, branch_name)
+        elif operation_type == BatchOperationType.kick:
+            if self._model.get_user(operation.get_target_user_id()) is None:
+                return BatchOperationStatus.user_not_exist
+            return self.kick(user_id, operation.get_target_user_id(), branch_name)
+        elif operation_type == BatchOperationType.fix:
+            return self.fix(user_id, branch_name)
+        elif operation_type == BatchOperationType.subscribe:
+            return self.subscribe(user_id, branch_name)
+        elif operation_type == BatchOperationType.unsubscribe:
+            return self.unsubscribe(user_id, branch_name)
+        else:
+            raise ValueError("Unknown batch operation type: %s" % operation_type)
+
+    def _save_branches_state(self, operations):
+        branches_state = {}
+        branch_names = deque(operation.get_branch_name() for operation in operations)
+        while branch_names:
+            branch_name = branch_names.popleft()
+            if branch_name in branches_state:
+                continue
+            # Branches of patterns are created by operations, so they are removed if the batch is rolled back
+            branch = self._model.get_branches().get(branch_name)
+            branches_state[branch_name] = None
+            if branch is not None:
+                branches_state[branch_name] = (branch.generation, branch.active_user, branch.active_priority,
+                                               branch.train, branch.linked, branch.users_queue.items(),
+                                               set(branch.subscriptions))
+                # Linked requests are changed in all their branches at once
+                for linked in (branch.linked or {}).values():
+                    branch_names.extend(linked)
+        return branches_state
+
+    def _restore_branches_state(self, branches_state):
+        branches = self._model.get_branches()
+        for branch_name, branch_state in branches_state.items():
+            if branch_state is None:
+                if branch_name in branches:
+                    self._model.remove_branch(branch_name)
+                    self._snapshots.pop(branch_name, None)
+                    if self._branch_index is not None:
+                        self._branch_index.remove(branch_name)
+                continue
+            generation, active_user, active_priority, train, linked, users_queue, subscriptions = branch_state
+            branch = branches[branch_name]
+            if branch.generation != generation:
+                branch.active_user = active_user
+                branch.active_priority = active_priority
+                branch.train = train
+                branch.linked = linked
+                branch.users_queue.clear()
+                for user, priority in users_queue:
+                    branch.users_queue.append(user, priority)
+                branch.subscriptions.clear()
+                branch.subscriptions.update(subscriptions)
+                branch.mark_changed()
+
+    def _begin_changes(self):
+        self._batch_notifications = []
+        self._batch_changed = False
+        self._batch_branches = set()
+        self._batch_events = []
+
+    def _end_changes(self):
+        changes = (self._batch_changed, self._batch_branches, self._batch_events, self._batch_notifications)
+        self._batch_notifications = None
+        self._batch_branches = None
+        self._batch_events = None
+        return changes
+
+    def _commit_changes(self, changed, changed_branches, events, notifications):
+        if changed:
+            for branch_name in changed_branches:
+                self._update_estimates(branch_name)
+                self._update_timeouts(branch_name)
+            self._model.dump()
+        self._store_events(events)
+        self._deliver_batch_notifications(notifications)
+
+    @contextmanager
+    def _combined_changes(self, enabled=True):
+        # Changes of several branches are stored and delivered at once, like a batch of one operation
+        if not enabled or self._batch_notifications is not None:
+            yield
+            return
+        self._begin_changes()
+        try:
+            yield
+        finally:
+            changes = self._end_changes()
+        self._commit_changes(*changes)
+
+    def _deliver_batch_notifications(self, notifications):
+        if self._notifier is None:
+            return
+
+        notifications_by_user = OrderedDict()
+        for user, action_type, action_data in notifications:
+            notifications_by_user.setdefault(user, []).append((action_type, action_data))
+        with span("dispatcher.deliver_batch_notifications", recipients=len(notifications_by_user)):
+            for user, user_notifications in notifications_by_user.items():
+                self._notifier.notify_batch(user, user_notifications)
+
+    @synchronized
+    def reclaim_idle_branches(self, now=None):
+        now = time.time() if now is None else now
+        self._last_reclaim = now
+        reclaimed_branches = self._model.reclaim_idle_branches(self._branch_idle_time, now)
+        for branch_name in reclaimed_branches:
+            self._record(EventType.branch_removed, branch_name)
+            self._snapshots.pop(branch_name, None)
+            if self._branch_index is not None:
+                self._branch_index.remove(branch_name)
+        if reclaimed_branches:
+            self._logger.info("Idle branches %s were reclaimed", reclaimed_branches)
+            self._invalidate_notifier()
+        return reclaimed_branches
+
+    def _update_estimates(self, branch_name, now=None):
+        branch = self._model.get_branches().get(branch_name)
+        if branch is None:
+            return
+        merge_user_id = branch.active_user.get_identifier() if branch.active_user is not None else None
+        if merge_user_id == branch.merge_user_id:
+            return
+        now = now if now is not None else time.time()
+        if branch.merge_user_id is not None and branch.merge_started:
+            if branch.merge_durations is None:
+                branch.merge_durations = DurationEstimate()
+            branch.merge_durations.add(max(now - branch.merge_started, 0.0))
+        branch.merge_user_id = merge_user_id
+        branch.merge_started = now if merge_user_id is not None else 0.0
+
+    def _update_all_timeouts(self):
+        changed = False
+        for branch_name in list(self._model.get_branches()):
+            changed = self._update_timeouts(branch_name) or changed
+        if changed:
+            self._model.dump()
+
+    def _update_timeouts(self, branch_name):
+        if self._scheduler is None:
+            return False
+        for timer in self._branch_timers.pop(branch_name, ()):
+            self._scheduler.cancel(timer)
+        branch = self._model.get_branches().get(branch_name)
+        if branch is None:
+            return False
+
+        if branch.active_user is not None:
+            slot_user, slot_confirmed = branch.active_user, True
+        else:
+            slot_user, slot_confirmed = branch.users_queue[0] if branch.users_queue else None, False
+            # Linked request can't be confirmed until it is first in all its branches, so it has no deadline
+            if slot_user is not None and not self._is_linked_ready(slot_user, branch.get_linked_branches(slot_user)):
+                slot_user = None
+        slot_user_id = slot_user.get_identifier() if slot_user is not None else None
+        changed = slot_user_id != branch.slot_user_id or slot_confirmed != branch.slot_confirmed
+        if changed:
+            branch.slot_user_id = slot_user_id
+            branch.slot_confirmed = slot_confirmed
+            branch.slot_started = time.time()
+            branch.slot_reminded = False
+        if slot_user is None:
+            return changed
+
+        policy = self._timeouts.get_policy(branch_name)
+        if slot_confirmed:
+            expire_type, expire_after = TimeoutType.release, policy.get_release_after()
+        else:
+            expire_type, expire_after = TimeoutType.skip, policy.get_skip_after()
+        remind_after = policy.get_remind_after()
+        timers = []
+        if remind_after is not None and not branch.slot_reminded and \
+                (expire_after is None or remind_after < expire_after):
+            timers.append(self._scheduler.schedule(branch.slot_started + remind_after, self._on_timeout, branch_name,
+                                                   TimeoutType.remind, branch.slot_started))
+        if expire_after is not None:
+            timers.append(self._scheduler.schedule(branch.slot_started + expire_after, self._on_timeout, branch_name,
+                                                   expire_type, branch.slot_started))
+        if timers:
+            self._branch_timers[branch_name] = timers
+        return changed
+
+    @synchronized
+    def _on_timeout(self, branch_name, timeout_type, slot_started):
+        branch = self._model.get_branches().get(branch_name)
+        if branch is None or branch.slot_user_id is None or branch.slot_started != slot_started:
+            return False
+        user = branch.active_user if branch.slot_confirmed else branch.users_queue[0]
+        self._fired_timeouts.inc(labels=(timeout_type.name,))
+
+        if timeout_type == TimeoutType.remind:
+            branch.slot_reminded = True
+            self._model.dump()
+            self._logger.info("User %s was reminded about merge to branch %s", user, branch_name)
+            action_type = NotifierActions.reminds_merge if branch.slot_confirmed \
+                else NotifierActions.reminds_confirmation
+            self._notify_user(user, action_type, Notifier.ActionData(user, branch_name))
+            return True
+
+        linked = branch.get_linked_branches(user) if timeout_type == TimeoutType.skip else ()
+        with self._combined_changes(bool(linked)):
+            if timeout_type == TimeoutType.skip:
+                branch.users_queue.popleft()
+                branch.unlink(user)
+                self._record(EventType.skips_user, branch_name, user)
+                action_type = NotifierActions.skips_user
+                self._logger.info("User %s has not confirmed merge to branch %s in time and was skipped", user,
+                                  branch_name)
+            else:
+                branch.release_user(user)
+                self._record(EventType.releases_merge, branch_name, user)
+                action_type = NotifierActions.releases_merge
+                self._logger.info("Merge of user %s to branch %s has timed out and was released", user, branch_name)
+            branch.mark_changed()
+            train_users = self._start_train(branch, branch_name)
+            self._persist(branch_name)
+            self._notify_user(user, action_type, Notifier.ActionData(user, branch_name))
+            self._notify_users(action_type, Notifier.ActionData(user, branch_name))
+            self._notify_next_merge(branch, branch_name, train_users)
+            self._drop_linked(user, linked, branch_name)
+        return True
+
+    def _persist(self, *branch_names):
+        if self._batch_notifications is not None:
+            self._batch_changed = True
+            self._batch_branches.update(branch_names)
+        else:
+            for branch_name in branch_names:
+                self._update_estimates(branch_name)
+                self._update_timeouts(branch_name)
+            if time.time() - self._last_reclaim >= self.RECLAIM_INTERVAL:
+                self.reclaim_idle_branches()
+            self._model.dump()
+
+    def _get_branch(self, branch_name):
+        branch = self._model.get_branches().get(branch_name)
+        if branch is None:
+            branch = self._model.get_or_create_branch(branch_name)
+            if branch is not None:
+                self._record(EventType.branch_added, branch_name)
+                if self._branch_index is not None:
+                    self._branch_index.add(branch_name)
+        return branch
+
+    def _record(self, event_type, branch_name=None, user=None, target_user=None, name=None, priority=None,
+                branches=None):
+        if self._event_store is None and self._history is None:
+            return
+        event = Event(event_type, time.time(), branch_name, user.get_identifier() if user is not None else None,
+                      target_user.get_identifier() if target_user is not None else None, name, priority=priority,
+                      branches=branches)
+        if self._batch_events is not None:
+            self._batch_events.append(event)
+        else:
+            self._store_events([event])
+
+    def _store_events(self, events):
+        if not events:
+            return
+        for event in events:
+            if self._event_store is not None:
+                event = self._event_store.append(event)
+            if self._history is not None:
+                self._history.apply(event)
+        if self._event_store is not None and self._event_store.should_snapshot():
+            self._event_store.write_snapshot(self._model)
+            if self._history is not None:
+                self._history.dump()
+
+    def _get_branch_index(self):
+        if self._branch_index is None:
+            self._branch_index = BranchIndex(self._model.get_branches().keys())
+        return self._branch_index
+
+    def _start_train(self, branch, branch_name):
+        if branch.active_user is not None or not branch.users_queue or not self._trains.is_train(branch_name):
+            return ()
+        members = branch.start_train(self._trains.get_size(branch_name))
+        if not members:
+            return ()
+        branch.mark_changed()
+        for user, priority in members:
+            self._record(EventType.joins_train, branch_name, user, priority=priority)
+        self._logger.info("Merge train of %d users has started on branch %s: %s", len(members), branch_name,
+                          ", ".join(str(user) for user, _ in members))
+        return branch.train_users
+
+    def _notify_next_merge(self, branch, branch_name, train_users):
+        if train_users:
+            self._notify_users(NotifierActions.starts_train,
+                               Notifier.TrainActionData(train_users[0], branch_name, train_users))
+        elif branch.active_user is None and branch.users_queue:
+            self._notify_ready(branch, branch_name)
+
+    def _notify_next_user(self, branch, branch_name, previous_first_user):
+        if branch.active_user is None and branch.users_queue and branch.users_queue[0] != previous_first_user:
+            self._notify_ready(branch, branch_name)
+
+    def _notify_ready(self, branch, branch_name):
+        user = branch.users_queue[0]
+        linked = branch.get_linked_branches(user)
+        if not linked:
+            self._notify_users(NotifierActions.ready_to_merge, Notifier.ActionData(user, branch_name))
+        elif self._is_linked_ready(user, linked):
+            # Deadlines of other branches start only now, when all of them are free
+            self._persist(*linked)
+            self._notify_user(user, NotifierActions.ready_to_merge,
+                              Notifier.LinkedActionData(user, branch_name, linked))
+
+    def _get_queued_branches(self, user, branch_names):
+        branches = self._model.get_branches()
+        return [(branch_name, branches[branch_name]) for branch_name in branch_names
+                if branch_name in branches and user in branches[branch_name].users_queue]
+
+    def _is_linked_ready(self, user, linked):
+        branches = self._model.get_branches()
+        for branch_name in linked:
+            branch = branches.get(branch_name)
+            if branch is not None and (branch.active_user is not None or not branch.users_queue or
+                                       branch.users_queue[0] != user):
+                return False
+        return True
+
+    def _start_linked(self, user, linked):
+        with self._combined_changes():
+            started = self._get_queued_branches(user, linked)
+            started_names = [branch_name for branch_name, _ in started]
+            for branch_name, branch in started:
+                branch.active_priority = branch.users_queue.get_priority(user)
+                branch.active_user = branch.users_queue.popleft()
+                branch.unlink(user)
+                branch.mark_changed()
+                self._record(EventType.starts_merge, branch_name, user, priority=branch.active_priority)
+            self._persist(*started_names)
+            self._logger.info("User %s has started merge to branches %s", user, started_names)
+            for branch_name, branch in started:
+                self._notify_users(NotifierActions.starts_merge,
+                                   Notifier.ActionData(user, branch_name, branch.active_priority))
+
+    def _exit_queue(self, user, branch, branch_name):
+        first_user = branch.users_queue[0]
+        branch.users_queue.remove(user)
+        branch.unlink(user)
+        branch.mark_changed()
+        self._record(EventType.exits_queue, branch_name, user)
+        train_users = self._start_train(branch, branch_name) if first_user == user else ()
+        self._persist(branch_name)
+        self._logger.info("User %s has exited from queue to branch %s", user, branch_name)
+        self._notify_users(NotifierActions.exits_queue, Notifier.ActionData(user, branch_name))
+        if first_user == user:
+            self._notify_next_merge(branch, branch_name, train_users)
+
+    def _drop_linked(self, user, linked, except_branch_name):
+        for branch_name, branch in self._get_queued_branches(user, linked):
+            if branch_name != except_branch_name:
+                self._exit_queue(user, branch, branch_name)
+
+    def _invalidate_notifier(self):
+        if self._notifier is not None:
+            self._notifier.invalidate()
+
     def _notify_user(self, user, action_type, action_data):
+        if self._batch_notifications is not None:
+            self._batch_notifications.append((user, action_type, action_data))
+            return
         if self._notifier is None:
             return
 
         self._notifier.notify(user, action_type, action_data)
 
     def _notify_users(self, action_type, action_data):
+        recipients = self.get_branch_queue_info(action_data.get_branch()).recipients
+        self._notification_fanout.observe(len(recipients), (action_type.name,))
+        if self._batch_notifications is not None:
+            for user_to_notify in recipients:
+                self._batch_notifications.append((user_to_notify, action_type, action_data))
+            return
         if self._notifier is None:
             return
 
-        users_to_notify = []
-        active_user = self._model.get_branches()[action_data.get_branch()].active_user
-        if active_user is not None:
-            users_to_notify.append(active_user)
-
-        users_in_queue = self._model.get_branches()[action_data.get_branch()].users_queue
-        for user_from_queue in users_in_queue:
-            users_to_notify.append(user_from_queue)
-
-        subscribed_users = self._model.get_branches()[action_data.get_branch()].subscriptions
-        for subscribed_user in subscribed_users:
-            if subscribed_user not in users_to_notify:
-                users_to_notify.append(subscribed_user)
-
-        for user_to_notify in users_to_notify:
-            self._notifier.notify(user_to_notify, action_type, action_data)
+        with span("dispatcher.notify_users", action=action_type.name, recipients=len(recipients)):
+            for user_to_notify in recipients:
+                self._notifier.notify(user_to_notify, action_type, action_data)
@@ -0,0 +1,358 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+from Bot.MergeDispatcher import EventType
+
+
+class DurationSketch:
+    BOUNDS = (30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 14400, 28800, 86400)
+
+    def __init__(self, counts=None, maximum=0.0):
+        self._counts = list(counts) if counts is not None else [0] * (len(self.BOUNDS) + 1)
+        self._maximum = maximum
+
+    def add(self, value):
+        self._counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self._maximum = max(self._maximum, value)
+
+    def merge(self, sketch):
+        for index, count in enumerate(sketch.get_counts()):
+            self._counts[index] += count
+        self._maximum = max(self._maximum, sketch.get_maximum())
+
+    def get_counts(self):
+        return self._counts
+
+    def get_maximum(self):
+        return self._maximum
+
+    def get_percentile(self, percentile):
+        total = sum(self._counts)
+        if total == 0:
+            return 0.0
+        rank = max(int(math.ceil(percentile / 100.0 * total)), 1)
+        for index, count in enumerate(self._counts):
+            rank -= count
+            if rank <= 0:
+                return min(self.BOUNDS[index], self._maximum) if index < len(self.BOUNDS) else self._maximum
+        return self._maximum
+
+
+class HistoryRollup:
+    TOP_HOLDERS = 10
+
+    def __init__(self):
+        self._merges = 0
+        self._merge_time = 0.0
+        self._merge_durations = DurationSketch()
+        self._waits = 0
+        self._wait_time = 0.0
+        self._wait_durations = DurationSketch()
+        self._holders = {}
+
+    def add_merge(self, user_id, duration):
+        self._merges += 1
+        self._merge_time += duration
+        self._merge_durations.add(duration)
+        self._holders[user_id] = self._holders.get(user_id, 0.0) + duration
+
+    def add_wait(self, duration):
+        self._waits += 1
+        self._wait_time += duration
+        self._wait_durations.add(duration)
+
+    def merge(self, rollup):
+        self._merges += rollup.get_merges()
+        self._merge_time += rollup.get_merge_time()
+        self._merge_durations.merge(rollup.get_merge_durations())
+        self._waits += rollup.get_waits()
+        self._wait_time += rollup.get_wait_time()
+        self._wait_durations.merge(rollup.get_wait_durations())
+        for user_id, duration in rollup.get_holders().items():
+            self._holders[user_id] = self._holders.get(user_id, 0.0) + duration
+
+    def is_empty(self):
+        return self._merges == 0 and self._waits == 0
+
+    def get_merges(self):
+        return self._merges
+
+    def get_merge_time(self):
+        return self._merge_time
+
+    def get_average_merge_time(self):
+        return self._merge_time / self._merges if self._merges else 0.0
+
+    def get_merge_durations(self):
+        return self._merge_durations
+
+    def get_waits(self):
+        return self._waits
+
+    def get_wait_time(self):
+        return self._wait_time
+
+    def get_average_wait_time(self):
+        return self._wait_time / self._waits if self._waits else 0.0
+
+    def get_wait_durations(self):
+        return self._wait_durations
+
+    def get_holders(self):
+        return self._holders
+
+    def get_top_holders(self, limit=TOP_HOLDERS):
+        return sorted(self._holders.items(), key=lambda holder: (-holder[1], holder[0]))[:limit]
+
+    def to_summary(self):
+        return {
+            "merges": self._merges,
+            "merge_time_total": self._merge_time,
+            "merge_time_average": self.get_average_merge_time(),
+            "merge_time_p50": self._merge_durations.get_percentile(50),
+            "merge_time_p90": self._merge_durations.get_percentile(90),
+            "merge_time_p99": self._merge_durations.get_percentile(99),
+            "waits": self._waits,
+            "wait_time_total": self._wait_time,
+            "wait_time_average": self.get_average_wait_time(),
+            "wait_time_p50": self._wait_durations.get_percentile(50),
+            "wait_time_p90": self._wait_durations.get_percentile(90),
+            "wait_time_p99": self._wait_durations.get_percentile(99),
+            "top_holders": [[user_id, duration] for user_id, duration in self.get_top_holders()]
+        }
+
+    def to_json_object(self):
+        return [self._merges, self._merge_time, self._merge_durations.get_counts(),
+                self._merge_durations.get_maximum(), self._waits, self._wait_time, self._wait_durations.get_counts(),
+                self._wait_durations.get_maximum(),
+                [[user_id, duration] for user_id, duration in self._holders.items()]]
+
+    @staticmethod
+    def from_json_object(json_object):
+        rollup = HistoryRollup()
+        rollup._merges, rollup._merge_time = json_object[0], json_object[1]
+        rollup._merge_durations = DurationSketch(json_object[2], json_object[3])
+        rollup._waits, rollup._wait_time = json_object[4], json_object[5]
+        rollup._wait_durations = DurationSketch(json_object[6], json_object[7])
+        rollup._holders = dict((user_id, duration) for user_id, duration in json_object[8])
+        return rollup
+
+
+class MergeHistory:
+    HOUR = 3600
+    DAY = 86400
+    RESOLUTIONS = (HOUR, DAY)
+    HOUR_BUCKETS_RETENTION = 35 * DAY
+    ALL_BRANCHES = ""
+    DEFAULT_REPORT_DAYS = 7
+    REPORT_RESOLUTIONS = {"hour": HOUR, "day": DAY}
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._branches = {}
+        self._users = {}
+        self._merges_started = {}
+        self._queues_joined = {}
+
+    def get_sequence(self):
+        return self._sequence
+
+    def get_branches(self):
+        with self._lock:
+            return sorted(branch_name for branch_name in self._branches if branch_name != self.ALL_BRANCHES)
+
+    def apply(self, event):
+        with self._lock:
+            if event.get_sequence() is not None:
+                if event.get_sequence() <= self._sequence:
+                    return False
+                self._sequence = event.get_sequence()
+            self._apply(event)
+            return True
+
+    def restore(self, event_store):
+        self._load()
+        restored_events = 0
+        for event in event_store.read(self._sequence):
+            restored_events += int(self.apply(event))
+        return restored_events
+
+    def query(self, since, until, branch_name=None, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                index = self._users.get(user_id)
+            else:
+                index = self._branches.get(branch_name if branch_name is not None else self.ALL_BRANCHES)
+            rollup = HistoryRollup()
+            if index is None:
+                return rollup
+            for _, bucket_rollup in self._scan(index, since, until):
+                rollup.merge(bucket_rollup)
+            return rollup
+
+    def scan(self, since, until, branch_name=None, user_id=None, resolution=HOUR):
+        with self._lock:
+            if user_id is not None:
+                index = self._users.get(user_id)
+            else:
+                index = self._branches.get(branch_name if branch_name is not None else self.ALL_BRANCHES)
+            if index is None:
+                return []
+            buckets = index[resolution]
+            return [(bucket, buckets[bucket]) for bucket in range(int(since // resolution) * resolution, int(until),
+                                                                    resolution) if bucket in buckets]
+
+    def get_report(self, parameters, now=None):
+        days = float(parameters.get("days", self.DEFAULT_REPORT_DAYS))
+        if days <= 0:
+            raise ValueError("Report period should be positive")
+        branch_name = parameters.get("branch")
+        user_id = int(parameters["user"]) if "user" in parameters else None
+        until = now if now is not None else time.time()
+        since = until - days * self.DAY
+        report = {"since": since, "until": until, "branch": branch_name, "user": user_id,
+                  "summary": self.query(since, until, branch_name, user_id).to_summary()}
+        if "resolution" in parameters:
+            resolution = self.REPORT_RESOLUTIONS.get(parameters["resolution"])
+            if resolution is None:
+                raise ValueError("Unknown report resolution")
+            report["buckets"] = [dict(rollup.to_summary(), start=bucket) for bucket, rollup
+                                 in self.scan(since, until, branch_name, user_id, resolution)]
+        return report
+
+    def dump(self):
+        if self._path is None:
+            return
+        with self._lock:
+            self._prune()
+            state = {
+                "seq": self._sequence,
+                "merges_started": [[branch_name, user_id, started] for (branch_name, user_id), started
+                                   in self._merges_started.items()],
+                "queues_joined": [[branch_name, user_id, joined] for (branch_name, user_id), joined
+                                  in self._queues_joined.items()],
+                "branches": [[branch_name, self._index_to_json(index)]
+                             for branch_name, index in self._branches.items()],
+                "users": [[user_id, self._index_to_json(index)] for user_id, index in self._users.items()]
+            }
+        with open(self._path + ".tmp", 'w') as history_file:
+            json.dump(state, history_file)
+        os.replace(self._path + ".tmp", self._path)
+
+    def _load(self):
+        if self._path is None or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, 'r') as history_file:
+                state = json.load(history_file)
+        except ValueError:
+            return
+        with self._lock:
+            self._sequence = state["seq"]
+            self._merges_started = dict(((branch_name, user_id), started)
+                                        for branch_name, user_id, started in state["merges_started"])
+            self._queues_joined = dict(((branch_name, user_id), joined)
+                                       for branch_name, user_id, joined in state["queues_joined"])
+            self._branches = dict((branch_name, self._index_from_json(index))
+                                  for branch_name, index in state["branches"])
+            self._users = dict((user_id, self._index_from_json(index)) for user_id, index in state["users"])
+
+    def _apply(self, event):
+        event_type = event.get_event_type()
+        branch_name = event.get_branch()
+        user_id = event.get_user_id()
+        timestamp = event.get_timestamp()
+        if event_type == EventType.starts_merge:
+            self._start_merge(branch_name, user_id, timestamp)
+        elif event_type == EventType.joins_train:
+            self._start_merge(branch_name, user_id, timestamp, exclusive=False)
+        elif event_type == EventType.joins_queue:
+            self._queues_joined[(branch_name, user_id)] = timestamp
+        elif event_type in (EventType.exits_queue, EventType.skips_user):
+            self._queues_joined.pop((branch_name, user_id), None)
+        elif event_type in (EventType.cancels_merge, EventType.done_merge, EventType.releases_merge):
+            self._finish_merge(branch_name, user_id, timestamp)
+        elif event_type == EventType.kicks_user:
+            self._queues_joined.pop((branch_name, event.get_target_id()), None)
+            self._finish_merge(branch_name, event.get_target_id(), timestamp)
+        elif event_type == EventType.starts_fix:
+            for _, pushed_user_id in [key for key in self._merges_started if key[0] == branch_name]:
+                self._finish_merge(branch_name, pushed_user_id, timestamp)
+                self._queues_joined[(branch_name, pushed_user_id)] = timestamp
+            self._start_merge(branch_name, user_id, timestamp)
+        elif event_type == EventType.branch_removed:
+            for index in (self._merges_started, self._queues_joined):
+                for key in [key for key in index if key[0] == branch_name]:
+                    del index[key]
+
+    def _start_merge(self, branch_name, user_id, timestamp, exclusive=True):
+        joined = self._queues_joined.pop((branch_name, user_id), None)
+        wait = max(timestamp - joined, 0.0) if joined is not None else 0.0
+        for rollup in self._get_rollups(branch_name, user_id, timestamp):
+            rollup.add_wait(wait)
+        if exclusive:
+            # Only members of merge train may merge to the same branch at once
+            for key in [key for key in self._merges_started if key[0] == branch_name]:
+                del self._merges_started[key]
+        self._merges_started[(branch_name, user_id)] = timestamp
+
+    def _finish_merge(self, branch_name, user_id, timestamp):
+        started = self._merges_started.pop((branch_name, user_id), None)
+        if started is None:
+            return
+        duration = max(timestamp - started, 0.0)
+        for rollup in self._get_rollups(branch_name, user_id, timestamp):
+            rollup.add_merge(user_id, duration)
+
+    def _get_rollups(self, branch_name, user_id, timestamp):
+        rollups = []
+        for indexes, key in ((self._branches, branch_name), (self._branches, self.ALL_BRANCHES),
+                             (self._users, user_id)):
+            index = indexes.get(key)
+            if index is None:
+                index = indexes[key] = dict((resolution, {}) for resolution in self.RESOLUTIONS)
+            for resolution in self.RESOLUTIONS:
+                bucket = int(timestamp // resolution) * resolution
+                rollup = index[resolution].get(bucket)
+                if rollup is None:
+                    rollup = index[resolution][bucket] = HistoryRollup()
+                rollups.append(rollup)
+        return rollups
+
+    def _scan(self, index, since, until):
+        bucket = int(since // self.HOUR) * self.HOUR
+        while bucket < until:
+            if bucket % self.DAY == 0 and bucket + self.DAY <= until:
+                resolution = self.DAY
+            else:
+                resolution = self.HOUR
+            rollup = index[resolution].get(bucket)
+            if rollup is not None:
+                yield bucket, rollup
+            bucket += resolution
+
+    def _prune(self):
+        if not self._sequence:
+            return
+        newest = max([max(index[self.HOUR]) for index in self._branches.values() if index[self.HOUR]] or [0])
+        for indexes in (self._branches, self._users):
+            for index in indexes.values():
+                for bucket in [bucket for bucket in index[self.HOUR]
+                               if bucket < newest - self.HOUR_BUCKETS_RETENTION]:
+                    del index[self.HOUR][bucket]
+
+    @staticmethod
+    def _index_to_json(index):
+        return [[resolution, [[bucket, rollup.to_json_object()] for bucket, rollup in buckets.items()]]
+                for resolution, buckets in index.items()]
+
+    @staticmethod
+    def _index_from_json(json_index):
+        return dict((resolution, dict((bucket, HistoryRollup.from_json_object(rollup)) for bucket, rollup in buckets))
+                    for resolution, buckets in json_index)
@@ -0,0 +1,77 @@
+import hashlib
+import html
+import threading
+import time
+
+from Bot.MergeDispatcher import JSONResponse
+
+
+class QueueStateAPI:
+    def __init__(self, dispatcher):
+        self._dispatcher = dispatcher
+        # Generations are not kept by the event log replay, so tags of different runs should never match
+        self._epoch = format(int(time.time() * 1000), "x")
+        self._branch_responses = {}
+        self._all_branches_response = None
+        self._lock = threading.Lock()
+
+    def get_report(self, parameters):
+        branch_name = parameters.get("branch")
+        if branch_name is not None:
+            return self.get_branch_state(branch_name)
+        return self.get_all_branches_state()
+
+    def get_branch_state(self, branch_name):
+        generation = self._dispatcher.get_branch_generation(branch_name)
+        if generation is None:
+            return None
+        cached = self._branch_responses.get(branch_name)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        response = JSONResponse(self._get_branch_state(branch_name), "{}-{}".format(self._epoch, generation))
+        with self._lock:
+            self._branch_responses[branch_name] = (generation, response)
+        return response
+
+    def get_all_branches_state(self):
+        generations = tuple((branch_name, self._dispatcher.get_branch_generation(branch_name))
+                            for branch_name in sorted(self._dispatcher.get_all_branches()))
+        cached = self._all_branches_response
+        if cached is not None and cached[0] == generations:
+            return cached[1]
+        branches = {}
+        for branch_name, generation in generations:
+            if generation is not None:
+                branches[branch_name] = self.get_branch_state(branch_name).get_json_object()
+        digest = hashlib.sha1(repr(generations).encode("utf-8")).hexdigest()
+        response = JSONResponse({"branches": branches}, "{}-{}".format(self._epoch, digest))
+        with self._lock:
+            self._all_branches_response = (generations, response)
+            for branch_name in set(self._branch_responses) - set(branches):
+                del self._branch_responses[branch_name]
+        return response
+
+    def _get_branch_state(self, branch_name):
+        queue_info = self._dispatcher.get_branch_queue_info(branch_name)
+        merging_users = queue_info.train
+        if not merging_users and queue_info.active_user is not None:
+            merging_users = ((queue_info.active_user, queue_info.active_priority),)
+        queue = []
+        for user, priority in zip(queue_info.users_queue, queue_info.priorities):
+            queue_user = self._get_user_state(user, priority)
+            linked = queue_info.get_linked_branches(user)
+            if linked:
+                queue_user["linked"] = list(linked)
+            queue.append(queue_user)
+        return {
+            "branch": branch_name,
+            "generation": queue_info.generation,
+            "merging": [self._get_user_state(user, priority) for user, priority in merging_users],
+            "queue": queue,
+            "subscribers": len(queue_info.subscriptions)
+        }
+
+    @staticmethod
+    def _get_user_state(user, priority):
+        # Names are stored escaped for HTML messages, but JSON consumers need them as they are
+        return {"id": user.get_identifier(), "name": html.unescape(user.get_name()), "priority": priority.name}
@@ -0,0 +1,73 @@
+from Bot.MergeDispatcher import BranchPatterns
+
+
+class TimeoutPolicy:
+    def __init__(self, remind_after=None, skip_after=None, release_after=None):
+        for timeout in (remind_after, skip_after, release_after):
+            if timeout is not None and timeout <= 0:
+                raise ValueError("Timeouts should be positive")
+        self._remind_after = remind_after
+        self._skip_after = skip_after
+        self._release_after = release_after
+
+    def __eq__(self, other):
+        return type(self) == type(other) and \
+               self._remind_after == other.get_remind_after() and \
+               self._skip_after == other.get_skip_after() and \
+               self._release_after == other.get_release_after()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return str.format("TimeoutPolicy: remind={0}, skip={1}, release={2}", self._remind_after, self._skip_after,
+                          self._release_after)
+
+    def get_remind_after(self):
+        return self._remind_after
+
+    def get_skip_after(self):
+        return self._skip_after
+
+    def get_release_after(self):
+        return self._release_after
+
+    def is_empty(self):
+        return self._remind_after is None and self._skip_after is None and self._release_after is None
+
+    def override(self, policy):
+        return TimeoutPolicy(
+            policy.get_remind_after() if policy.get_remind_after() is not None else self._remind_after,
+            policy.get_skip_after() if policy.get_skip_after() is not None else self._skip_after,
+            policy.get_release_after() if policy.get_release_after() is not None else self._release_after)
+
+
+class TimeoutPolicies:
+    DEFAULT_KEY = "default"
+
+    def __init__(self, policies=None):
+        policies = policies if policies is not None else {}
+        self._default_policy = policies.get(self.DEFAULT_KEY, TimeoutPolicy())
+        self._branch_policies = {}
+        self._pattern_policies = []
+        for key, policy in policies.items():
+            if key == self.DEFAULT_KEY:
+                continue
+            if BranchPatterns.is_pattern(key):
+                self._pattern_policies.append((key, BranchPatterns([key]), self._default_policy.override(policy)))
+            else:
+                self._branch_policies[key] = self._default_policy.override(policy)
+        # The most specific (longest) pattern wins if several patterns match the branch
+        self._pattern_policies.sort(key=lambda item: (-len(item[0]), item[0]))
+
+    def get_policy(self, branch_name):
+        policy = self._branch_policies.get(branch_name)
+        if policy is not None:
+            return policy
+        for _, patterns, pattern_policy in self._pattern_policies:
+            if patterns.matches(branch_name):
+                return pattern_policy
+        return self._default_policy
+
+    def is_empty(self):
+        return self._default_policy.is_empty() and not self._branch_policies and not self._pattern_policies
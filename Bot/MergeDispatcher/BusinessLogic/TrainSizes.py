@@ -0,0 +1,39 @@
+from Bot.MergeDispatcher import BranchPatterns
+
+
+class TrainSizes:
+    DEFAULT_KEY = "default"
+    SINGLE = 1
+
+    def __init__(self, sizes=None):
+        sizes = sizes if sizes is not None else {}
+        for size in sizes.values():
+            if int(size) != size or size < self.SINGLE:
+                raise ValueError("Train size should be positive integer")
+        self._default_size = int(sizes.get(self.DEFAULT_KEY, self.SINGLE))
+        self._branch_sizes = {}
+        self._pattern_sizes = []
+        for key, size in sizes.items():
+            if key == self.DEFAULT_KEY:
+                continue
+            if BranchPatterns.is_pattern(key):
+                self._pattern_sizes.append((key, BranchPatterns([key]), int(size)))
+            else:
+                self._branch_sizes[key] = int(size)
+        # The most specific (longest) pattern wins if several patterns match the branch
+        self._pattern_sizes.sort(key=lambda item: (-len(item[0]), item[0]))
+
+    def get_size(self, branch_name):
+        size = self._branch_sizes.get(branch_name)
+        if size is not None:
+            return size
+        for _, patterns, pattern_size in self._pattern_sizes:
+            if patterns.matches(branch_name):
+                return pattern_size
+        return self._default_size
+
+    def is_train(self, branch_name):
+        return self.get_size(branch_name) > self.SINGLE
+
+    def is_empty(self):
+        return self._default_size == self.SINGLE and not self._branch_sizes and not self._pattern_sizes
@@ -1,3 +1,4 @@
+import html
 from enum import Enum
 
 from Bot.MergeDispatcher import CancelRequestStatus
@@ -5,11 +6,14 @@ from Bot.MergeDispatcher import Dispatcher
 from Bot.MergeDispatcher import DoneRequestStatus
 from Bot.MergeDispatcher import FixRequestStatus
 from Bot.MergeDispatcher import KickRequestStatus
+from Bot.MergeDispatcher import LRUCache
 from Bot.MergeDispatcher import MergeRequestStatus
 from Bot.MergeDispatcher import Notifier
 from Bot.MergeDispatcher import NotifierActions
+from Bot.MergeDispatcher import Priority
 from Bot.MergeDispatcher import SubscribeRequestStatus
 from Bot.MergeDispatcher import UnsubscribeRequestStatus
+from Bot.MergeDispatcher import traced
 
 
 class States(Enum):
@@ -22,6 +26,9 @@ class States(Enum):
     confirm = 6
     subscribe = 7
     unsubscribe = 8
+    stats = 9
+    release = 10
+    hotfix = 11
 
 
 class Messages:
@@ -31,8 +38,19 @@ class Messages:
     MERGE_SELECT_BRANCH_MESSAGE = "Select branch for <i>merge</i> command:"
     MERGE_ADDED_TO_QUEUE_MESSAGE = "&#x1F51C You're <b>{}</b> in queue for merge in branch <b>{}</b>.\n" \
                                    "You'll be informed when it's your turn to merge."
+    MERGE_ESTIMATE_MESSAGE = "\nYour merge is expected to start {}."
     MERGE_ALREADY_IN_QUEUE_MESSAGE = "You're already in queue for branch <b>{}</b>. Calm down."
+    MERGE_PRIORITY_CHANGED_MESSAGE = "Priority of your merge to branch <b>{0}</b> is <b>{1}</b> now. " \
+                                     "You're <b>{2}</b> in queue."
+    MERGE_SELECT_BRANCH_WITH_PRIORITY_MESSAGE = "Select branch for <i>{}</i> merge:"
     MERGE_BRANCH_NOT_EXIST_MESSAGE = "You're trying to merge in non-existing branch <b>{}</b>."
+    MERGE_LINKED_ADDED_MESSAGE = "&#x1F51C You're in queues for merge in branches <b>{}</b>.\n" \
+                                 "You'll be informed when it's your turn to merge in all of them at once."
+    MERGE_LINKED_ALREADY_IN_QUEUE_MESSAGE = "You're already in queue or in merge for one of branches <b>{}</b>. " \
+                                            "Calm down."
+    MERGE_LINKED_BRANCH_NOT_FOUND_MESSAGE = "There is no single branch matching <b>{}</b>. Use full names to merge " \
+                                            "in several branches at once."
+    MERGE_LINKED_BRANCHES_SEPARATOR = ", "
 
     CANCEL_NO_BRANCHES_AVAILABLE = "No branches are available for <i>cancel</i> command.\n" \
                                    "Are you sure that you've done merge requests already?"
@@ -61,6 +79,14 @@ class Messages:
     QUEUE_INFO_CURRENT_USER_IN_QUEUE = "\n- <i>{} (you)</i>"
     QUEUE_INFO_CURRENT_USER_IN_MERGE = "\n- <b>{} (in merge, you)</b>"
     QUEUE_INFO_USER_IN_QUEUE = "\n- {}"
+    QUEUE_INFO_MORE_USERS_IN_QUEUE = "\n<i>...and {} more</i>"
+    QUEUE_INFO_CURRENT_USER_FAR_IN_QUEUE = "\n- <i>{0} (you, {1} in queue)</i>"
+    QUEUE_INFO_ESTIMATE = " ({})"
+    QUEUE_INFO_PRIORITY = " [{}]"
+    QUEUE_INFO_LINKED = " [with {}]"
+
+    ESTIMATE_SOON = "any minute now"
+    ESTIMATE_IN = "in ~{}"
     QUEUE_BRANCH_NOT_EXIST_MESSAGE = "You're trying to get queue information from non-existing " \
                                      "branch <b>{}</b>. Strange desire."
 
@@ -111,6 +137,26 @@ class Messages:
                                    "that your friends can't do things like that " \
                                    "(huh), you can tell about this error to administrator."
 
+    STATS_NO_BRANCHES_AVAILABLE = "No branches with given name are available for statistics requests."
+    STATS_SELECT_BRANCH_MESSAGE = "Select branch for merge statistics:"
+    STATS_UNAVAILABLE_MESSAGE = "Sorry, merge history is not collected, so I have no statistics for you."
+    STATS_EMPTY_MESSAGE = "Nobody has merged to {0} in the last {1} days. Suspicious."
+    STATS_INFO_MESSAGE = "Merge statistics for {0} in the last {1} days:\n" \
+                         "- merges: <b>{2}</b>\n" \
+                         "- merge time: {3} on average, {4} for 90% of merges\n" \
+                         "- waiting in queue: {5} on average, {6} for 90% of users"
+    STATS_LONGEST_HOLDER = "\n- longest in merge: <i>{0}</i> ({1} in total)"
+    STATS_BRANCH = "branch <b>{}</b>"
+    STATS_ALL_BRANCHES = "all branches"
+    STATS_UNKNOWN_USER = "unknown user"
+
+    INLINE_BRANCH_COMMAND = "/merge {}"
+    INLINE_BRANCH_EMPTY_DESCRIPTION = "Queue is empty, merge can be started immediately."
+    INLINE_BRANCH_IN_MERGE_DESCRIPTION = "In merge: {0}. Users in queue: {1}."
+    INLINE_BRANCH_WAITING_DESCRIPTION = "Waiting for confirmation. Users in queue: {}."
+
+    BATCH_NOTIFICATIONS_SEPARATOR = "\n\n"
+
     ACTION_TEXT_MERGE_STARTED = "has started merge"
     ACTION_TEXT_QUEUE_JOINED = "has joined queue for merge"
     ACTION_TEXT_MERGE_CANCELLED = "has cancelled merge"
@@ -118,6 +164,8 @@ class Messages:
     ACTION_TEXT_MERGE_FINISHED = "has finished merge"
 
     ACTION_MESSAGE_GENERIC = "<i>{0}</i> {1} to branch <b>{2}</b>."
+    ACTION_MESSAGE_GENERIC_WITH_PRIORITY = "<i>{0}</i> {1} to branch <b>{2}</b> with <b>{3}</b> priority."
+    ACTION_MESSAGE_PRIORITY_CHANGED = "<i>{0}</i> has changed priority of merge to branch <b>{1}</b> to <b>{2}</b>."
     ACTION_MESSAGE_KICKED_USER = "<i>{0}</i> has kicked {1} from branch <b>{2}</b>. Even I shocked by this cruelty."
     ACTION_MESSAGE_KICKED_YOU = "<i>{0}</i> has kicked you from branch <b>{1}</b>. Nothing personal, only business."
     ACTION_MESSAGE_KICKED_SELF = "<i>{0}</i> has kicked himself from branch <b>{1}</b>. What a strange way for suicide."
@@ -131,6 +179,27 @@ class Messages:
     ACTION_MESSAGE_STARTED_MERGE = "&#x2705 You've started the merge to branch <b>{}</b>. Do not fail the build, OK?"
     ACTION_MESSAGE_YOUR_MERGE_TURN = "&#x1F514 It is now your turn to merge in branch <b>{}</b>. Press 'Confirm' " \
                                      "button to start merge or 'Cancel' button to free queue."
+    ACTION_MESSAGE_YOUR_LINKED_MERGE_TURN = "&#x1F514 It is now your turn to merge in branches <b>{}</b>. Press " \
+                                            "'Confirm' button to start merge to all of them or 'Cancel' button to " \
+                                            "free queues."
+    ACTION_MESSAGE_BRANCH_REMOVED = "&#x1F6AB Branch <b>{}</b> was removed from my configuration, so you are not in " \
+                                    "its queue anymore. Blame the admins, not me."
+    ACTION_MESSAGE_REMIND_MERGE = "&#x23F0 You're still merging to branch <b>{}</b>. Don't forget to use /done " \
+                                  "command when you finish, others are waiting."
+    ACTION_MESSAGE_REMIND_CONFIRMATION = "&#x23F0 It is still your turn to merge in branch <b>{}</b>, but you have " \
+                                         "not confirmed it yet. Hurry up, or you will be skipped."
+    ACTION_MESSAGE_YOU_SKIPPED = "&#x231B You have not confirmed merge to branch <b>{}</b> in time, so you were " \
+                                 "removed from its queue. Use /merge command to join it again."
+    ACTION_MESSAGE_YOUR_MERGE_RELEASED = "&#x231B Your merge to branch <b>{}</b> took too long, so I have released " \
+                                         "the branch for others. Use /merge command if you are not done yet."
+    ACTION_MESSAGE_USER_SKIPPED = "<i>{0}</i> has not confirmed merge to branch <b>{1}</b> in time and was removed " \
+                                  "from queue."
+    ACTION_MESSAGE_MERGE_RELEASED = "Merge of <i>{0}</i> to branch <b>{1}</b> took too long and was released."
+    ACTION_MESSAGE_TRAIN_STARTED = "&#x1F682 Merge train to branch <b>{0}</b> has started: <i>{1}</i>."
+    ACTION_MESSAGE_YOUR_TRAIN_STARTED = "&#x1F682 You've started the merge to branch <b>{0}</b> in one train with " \
+                                        "<i>{1}</i>. Use /done when you finish, the branch is released when " \
+                                        "everyone is done."
+    ACTION_MESSAGE_TRAIN_MEMBERS_SEPARATOR = ", "
 
 
 class MessageSender:
@@ -151,6 +220,33 @@ class MessageSender:
         def get_branch(self):
             return self._branch
 
+    class InlineResult:
+        def __init__(self, title, description, message_text):
+            self._title = title
+            self._description = description
+            self._message_text = message_text
+
+        def __eq__(self, other):
+            return type(self) == type(other) and \
+                   self._title == other.get_title() and \
+                   self._description == other.get_description() and \
+                   self._message_text == other.get_message_text()
+
+        def __ne__(self, other):
+            return not self == other
+
+        def __str__(self):
+            return str.format("InlineResult: title={0}, description={1}", self._title, self._description)
+
+        def get_title(self):
+            return self._title
+
+        def get_description(self):
+            return self._description
+
+        def get_message_text(self):
+            return self._message_text
+
     def send(self, identifier: int, message: str) -> None:
         raise NotImplementedError
 
@@ -165,45 +261,145 @@ class MessageSender:
     def request_merge_confirmation(self, identifier: int, message: str, branch: str) -> None:
         raise NotImplementedError
 
+    def answer_inline_query(self, query_id: str, results: list) -> None:
+        raise NotImplementedError
+
+    def invalidate_markups(self) -> None:
+        pass
+
+
+class RenderedQueue:
+    def __init__(self, generation, message, highlights=None, far_positions=None, estimates=None):
+        self._generation = generation
+        self._message = message
+        self._highlights = highlights if highlights is not None else {}
+        self._far_positions = far_positions if far_positions is not None else {}
+        self._estimates = estimates
+
+    def get_generation(self):
+        return self._generation
+
+    def get_estimates(self):
+        return self._estimates
+
+    def get_message(self, user_id):
+        if user_id in self._highlights:
+            start, end, highlighted_line = self._highlights[user_id]
+            return self._message[:start] + highlighted_line + self._message[end:]
+        elif user_id in self._far_positions:
+            name, position, estimate = self._far_positions[user_id]
+            return self._message + Messages.QUEUE_INFO_CURRENT_USER_FAR_IN_QUEUE.format(name, ordinal(position)) + \
+                estimate
+        return self._message
+
+
+def ordinal(number):
+    return "{0}{1}".format(str(number), 'th' if 10 <= number % 100 < 20 else
+                           {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, "th"))
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return "{} s".format(seconds)
+    hours, minutes = divmod(seconds // 60, 60)
+    if hours == 0:
+        return "{} min".format(minutes)
+    return "{0} h {1} min".format(hours, minutes) if minutes else "{} h".format(hours)
+
+
+def format_estimate(minutes):
+    return Messages.ESTIMATE_IN.format(format_duration(minutes * 60)) if minutes > 0 else Messages.ESTIMATE_SOON
+
 
 class BotPresentationModel(Notifier):
+    INLINE_RESULTS_LIMIT = 50
+    STATS_DAYS = 7
+    QUEUE_INFO_USERS_LIMIT = 30
+    QUEUE_RENDERS_CACHE_SIZE = 256
+    PRIORITY_STATES = {Priority.release: States.release, Priority.hotfix: States.hotfix}
+
     def __init__(self, merge_dispatcher: Dispatcher, message_sender: MessageSender):
         self._merge_dispatcher = merge_dispatcher
         self._message_sender = message_sender
+        self._queue_renders = LRUCache(self.QUEUE_RENDERS_CACHE_SIZE)
         self._merge_dispatcher.set_notifier(self)
         self._merge_dispatcher.prepare()
 
+    @traced("presentation.confirm_merge")
     def confirm_merge(self, user_id, branch):
         result = self._merge_dispatcher.confirm_merge(user_id, branch)
         if not result:
             self._message_sender.send(user_id, Messages.CONFIRM_MERGE_FAILED_MESSAGE.format(branch))
 
-    def request_merge(self, user_id, branch_filter=None) -> None:
+    @traced("presentation.request_merge")
+    def request_merge(self, user_id, branch_filter=None, priority=Priority.normal) -> None:
         branches = self._merge_dispatcher.get_all_branches(branch_filter)
         if len(branches) == 0:
             self._message_sender.send(user_id, Messages.MERGE_NO_BRANCHES_AVAILABLE)
         elif len(branches) == 1:
             branch = branches[0]
-            result = self._merge_dispatcher.merge(user_id, branch)
+            result = self._merge_dispatcher.merge(user_id, branch, priority)
             message = None
-            if result == MergeRequestStatus.merge_requested:
+            if result in (MergeRequestStatus.merge_requested, MergeRequestStatus.priority_changed):
                 queue_info = self._merge_dispatcher.get_branch_queue_info(branch)
-                persons_in_queue = len(queue_info.users_queue) + (1 if queue_info.active_user is not None else 0)
-                persons_in_queue_str = "{0}{1}".format(str(persons_in_queue),
-                                                       'th' if 10 <= persons_in_queue % 100 < 20 else
-                                                       {1: 'st', 2: 'nd', 3: 'rd'}.get(persons_in_queue % 10, "th"))
-
-                message = Messages.MERGE_ADDED_TO_QUEUE_MESSAGE.format(persons_in_queue_str, branch)
+                user = self._merge_dispatcher.get_user(user_id)
+                if user in queue_info.users_queue:
+                    position = queue_info.users_queue.index(user)
+                else:
+                    position = len(queue_info.users_queue) - 1
+                persons_in_queue = position + 1 + self._count_merging_users(queue_info)
+                if result == MergeRequestStatus.merge_requested:
+                    message = Messages.MERGE_ADDED_TO_QUEUE_MESSAGE.format(ordinal(persons_in_queue), branch)
+                else:
+                    message = Messages.MERGE_PRIORITY_CHANGED_MESSAGE.format(branch, priority.name,
+                                                                             ordinal(persons_in_queue))
+                estimates = self._get_queue_estimates(branch)
+                if estimates and position < len(estimates):
+                    message += Messages.MERGE_ESTIMATE_MESSAGE.format(format_estimate(estimates[position]))
             elif result == MergeRequestStatus.already_in_queue:
                 message = Messages.MERGE_ALREADY_IN_QUEUE_MESSAGE.format(branch)
             elif result == MergeRequestStatus.branch_not_exist:
                 message = Messages.MERGE_BRANCH_NOT_EXIST_MESSAGE.format(branch)
             if message is not None:
                 self._message_sender.send(user_id, message)
-        else:
+        elif priority == Priority.normal:
             self._message_sender.send_branch_selector(user_id, States.merge, Messages.MERGE_SELECT_BRANCH_MESSAGE,
                                                       branches)
-
+        else:
+            self._message_sender.send_branch_selector(user_id, self.PRIORITY_STATES[priority],
+                                                      Messages.MERGE_SELECT_BRANCH_WITH_PRIORITY_MESSAGE.format(
+                                                          priority.name), branches)
+
+    @traced("presentation.request_linked_merge")
+    def request_linked_merge(self, user_id, branch_filters, priority=Priority.normal) -> None:
+        branches = []
+        for branch_filter in branch_filters:
+            matching_branches = self._merge_dispatcher.get_all_branches(branch_filter)
+            if branch_filter in matching_branches:
+                matching_branches = [branch_filter]
+            if len(matching_branches) != 1:
+                self._message_sender.send(user_id, Messages.MERGE_LINKED_BRANCH_NOT_FOUND_MESSAGE.format(branch_filter))
+                return
+            if matching_branches[0] not in branches:
+                branches.append(matching_branches[0])
+        if len(branches) == 1:
+            self.request_merge(user_id, branches[0], priority)
+            return
+
+        result = self._merge_dispatcher.merge_linked(user_id, branches, priority)
+        names = Messages.MERGE_LINKED_BRANCHES_SEPARATOR.join(branches)
+        message = None
+        if result == MergeRequestStatus.merge_requested:
+            message = Messages.MERGE_LINKED_ADDED_MESSAGE.format(names)
+        elif result == MergeRequestStatus.already_in_queue:
+            message = Messages.MERGE_LINKED_ALREADY_IN_QUEUE_MESSAGE.format(names)
+        elif result == MergeRequestStatus.branch_not_exist:
+            message = Messages.MERGE_BRANCH_NOT_EXIST_MESSAGE.format(names)
+        if message is not None:
+            self._message_sender.send(user_id, message)
+
+    @traced("presentation.request_cancel")
     def request_cancel(self, user_id, branch_filter=None) -> None:
         branches = self._merge_dispatcher.get_all_branches_with_user(user_id, branch_filter)
         if len(branches) == 0:
@@ -226,6 +422,7 @@ class BotPresentationModel(Notifier):
             self._message_sender.send_branch_selector(user_id, States.cancel, Messages.CANCEL_SELECT_BRANCH_MESSAGE,
                                                       branches)
 
+    @traced("presentation.request_done")
     def request_done(self, user_id, branch_filter=None) -> None:
         branches = self._merge_dispatcher.get_active_user_branches(user_id, branch_filter)
         if len(branches) == 0:
@@ -246,39 +443,46 @@ class BotPresentationModel(Notifier):
             self._message_sender.send_branch_selector(user_id, States.done, Messages.DONE_SELECT_BRANCH_MESSAGE,
                                                       branches)
 
+    @traced("presentation.request_queue_info")
     def request_queue_info(self, user_id, branch_filter=None) -> None:
         branches = self._merge_dispatcher.get_all_branches(branch_filter)
         if len(branches) == 0:
             self._message_sender.send(user_id, Messages.QUEUE_NO_BRANCHES_AVAILABLE)
         elif len(branches) == 1:
             branch = branches[0]
-            result = self._merge_dispatcher.get_branch_queue_info(branch)
-            if result is not None:
-                if result.active_user is None and not result.users_queue:
-                    message = Messages.QUEUE_EMPTY_INFO_MESSAGE.format(branch)
-                else:
-                    users_list = str()
-                    if result.active_user is not None:
-                        if result.active_user.get_identifier() == user_id:
-                            users_list = Messages.QUEUE_INFO_CURRENT_USER_IN_MERGE.format(result.active_user.get_name())
-                        else:
-                            users_list = Messages.QUEUE_INFO_USER_IN_MERGE.format(result.active_user.get_name())
-
-                    for user_in_queue in result.users_queue:
-                        if user_id != user_in_queue.get_identifier():
-                            users_list += Messages.QUEUE_INFO_USER_IN_QUEUE.format(user_in_queue.get_name())
-                        else:
-                            users_list += Messages.QUEUE_INFO_CURRENT_USER_IN_QUEUE.format(user_in_queue.get_name())
-
-                    message = Messages.QUEUE_INFO_MESSAGE.format(branch, users_list)
+            generation = self._merge_dispatcher.get_branch_generation(branch)
+            estimates = self._get_queue_estimates(branch)
+            rendered_queue = self._queue_renders.get(branch)
+            if rendered_queue is None or generation is None or rendered_queue.get_generation() != generation or \
+                    rendered_queue.get_estimates() != estimates:
+                rendered_queue = self._render_queue(branch, generation, estimates)
+                if rendered_queue is not None and generation is not None:
+                    self._queue_renders.put(branch, rendered_queue)
+
+            if rendered_queue is not None:
+                message = rendered_queue.get_message(user_id)
             else:
                 message = Messages.QUEUE_BRANCH_NOT_EXIST_MESSAGE.format(branch)
-            if message is not None:
-                self._message_sender.send(user_id, message)
+            self._message_sender.send(user_id, message)
         else:
             self._message_sender.send_branch_selector(user_id, States.queue,
                                                       Messages.QUEUE_SELECT_BRANCH_MESSAGE, branches)
 
+    @traced("presentation.request_stats")
+    def request_stats(self, user_id, branch_filter=None) -> None:
+        if branch_filter is None:
+            self._message_sender.send(user_id, self._render_stats(None))
+            return
+        branches = self._merge_dispatcher.get_all_branches(branch_filter)
+        if len(branches) == 0:
+            self._message_sender.send(user_id, Messages.STATS_NO_BRANCHES_AVAILABLE)
+        elif len(branches) == 1:
+            self._message_sender.send(user_id, self._render_stats(branches[0]))
+        else:
+            self._message_sender.send_branch_selector(user_id, States.stats, Messages.STATS_SELECT_BRANCH_MESSAGE,
+                                                      branches)
+
+    @traced("presentation.request_kick")
     def request_kick(self, user_id, branch_filter=None, kicked_user_id=None):
         branches = self._merge_dispatcher.get_all_branches(branch_filter)
         if len(branches) == 0:
@@ -288,9 +492,7 @@ class BotPresentationModel(Notifier):
             if kicked_user_id is None:
                 result = self._merge_dispatcher.get_branch_queue_info(branch)
                 if result is not None:
-                    users_in_branch = []
-                    if result.active_user is not None:
-                        users_in_branch.append(result.active_user)
+                    users_in_branch = list(self._get_merging_users(result))
                     users_in_branch.extend(result.users_queue)
                     if users_in_branch:
                         self._message_sender.send_user_selector(user_id, States.kick, Messages.KICK_SELECT_USER,
@@ -318,6 +520,7 @@ class BotPresentationModel(Notifier):
             self._message_sender.send_branch_selector(user_id, States.kick,
                                                       Messages.KICK_SELECT_BRANCH_MESSAGE, branches)
 
+    @traced("presentation.request_fix")
     def request_fix(self, user_id, branch_filter=None) -> None:
         branches = self._merge_dispatcher.get_all_branches(branch_filter)
         if len(branches) == 0:
@@ -338,6 +541,7 @@ class BotPresentationModel(Notifier):
             self._message_sender.send_branch_selector(user_id, States.fix,
                                                       Messages.FIX_SELECT_BRANCH_MESSAGE, branches)
 
+    @traced("presentation.request_subscribe")
     def request_subscribe(self, user_id, branch_filter=None) -> None:
         branches = self._merge_dispatcher.get_branches_user_not_subscribed_to(user_id, branch_filter)
         if len(branches) == 0:
@@ -362,6 +566,7 @@ class BotPresentationModel(Notifier):
             self._message_sender.send_branch_selector(user_id, States.subscribe,
                                                       Messages.SUBSCRIBE_SELECT_BRANCH_MESSAGE, branches)
 
+    @traced("presentation.request_unsubscribe")
     def request_unsubscribe(self, user_id, branch_filter=None) -> None:
         branches = self._merge_dispatcher.get_branches_user_subscribed_to(user_id, branch_filter)
         if len(branches) == 0:
@@ -386,8 +591,167 @@ class BotPresentationModel(Notifier):
             self._message_sender.send_branch_selector(user_id, States.unsubscribe,
                                                       Messages.UNSUBSCRIBE_SELECT_BRANCH_MESSAGE, branches)
 
+    @traced("presentation.request_inline_branches")
+    def request_inline_branches(self, query_id, query=None) -> None:
+        results = []
+        for branch in self._merge_dispatcher.get_all_branches(query.strip() if query else None)[
+                      :self.INLINE_RESULTS_LIMIT]:
+            queue_info = self._merge_dispatcher.get_branch_queue_info(branch)
+            if queue_info is None:
+                continue
+            if queue_info.active_user is not None:
+                names = Messages.ACTION_MESSAGE_TRAIN_MEMBERS_SEPARATOR.join(
+                    user.get_name() for user in self._get_merging_users(queue_info))
+                description = Messages.INLINE_BRANCH_IN_MERGE_DESCRIPTION.format(html.unescape(names),
+                                                                                 len(queue_info.users_queue))
+            elif queue_info.users_queue:
+                description = Messages.INLINE_BRANCH_WAITING_DESCRIPTION.format(len(queue_info.users_queue))
+            else:
+                description = Messages.INLINE_BRANCH_EMPTY_DESCRIPTION
+            results.append(MessageSender.InlineResult(branch, description,
+                                                      Messages.INLINE_BRANCH_COMMAND.format(branch)))
+        self._message_sender.answer_inline_query(query_id, results)
+
+    def _render_stats(self, branch):
+        statistics = self._merge_dispatcher.get_merge_statistics(self.STATS_DAYS, branch)
+        if statistics is None:
+            return Messages.STATS_UNAVAILABLE_MESSAGE
+        scope = Messages.STATS_BRANCH.format(branch) if branch is not None else Messages.STATS_ALL_BRANCHES
+        if statistics.is_empty():
+            return Messages.STATS_EMPTY_MESSAGE.format(scope, self.STATS_DAYS)
+
+        message = Messages.STATS_INFO_MESSAGE.format(
+            scope, self.STATS_DAYS, statistics.get_merges(),
+            format_duration(statistics.get_average_merge_time()),
+            format_duration(statistics.get_merge_durations().get_percentile(90)),
+            format_duration(statistics.get_average_wait_time()),
+            format_duration(statistics.get_wait_durations().get_percentile(90)))
+        top_holders = statistics.get_top_holders(1)
+        if top_holders:
+            holder_id, holder_time = top_holders[0]
+            holder = self._merge_dispatcher.get_user(holder_id)
+            message += Messages.STATS_LONGEST_HOLDER.format(
+                holder.get_name() if holder is not None else Messages.STATS_UNKNOWN_USER, format_duration(holder_time))
+        return message
+
+    @staticmethod
+    def _get_merging_users(queue_info):
+        if queue_info.train_users:
+            return queue_info.train_users
+        return (queue_info.active_user,) if queue_info.active_user is not None else ()
+
+    @staticmethod
+    def _count_merging_users(queue_info):
+        return len(BotPresentationModel._get_merging_users(queue_info))
+
+    @staticmethod
+    def _format_priority(priority):
+        return Messages.QUEUE_INFO_PRIORITY.format(priority.name) if priority != Priority.normal else ""
+
+    def _get_queue_estimates(self, branch):
+        waits = self._merge_dispatcher.get_queue_estimates(branch)
+        if waits is None:
+            return None
+        return tuple(int(wait // 60) for wait in waits)
+
+    def _render_queue(self, branch, generation, estimates=None):
+        queue_info = self._merge_dispatcher.get_branch_queue_info(branch)
+        if queue_info is None:
+            return None
+        if queue_info.active_user is None and not queue_info.users_queue:
+            return RenderedQueue(generation, Messages.QUEUE_EMPTY_INFO_MESSAGE.format(branch), estimates=estimates)
+
+        header, footer = Messages.QUEUE_INFO_MESSAGE.format(branch, "\0").split("\0", 1)
+        parts = [header]
+        offset = len(header)
+        highlights = {}
+        far_positions = {}
+
+        def add_line(user, line, highlighted_line):
+            nonlocal offset
+            parts.append(line)
+            highlights[user.get_identifier()] = (offset, offset + len(line), highlighted_line)
+            offset += len(line)
+
+        if queue_info.active_user is not None:
+            priority = self._format_priority(queue_info.active_priority)
+            for merging_user in self._get_merging_users(queue_info):
+                name = merging_user.get_name()
+                add_line(merging_user, Messages.QUEUE_INFO_USER_IN_MERGE.format(name) + priority,
+                         Messages.QUEUE_INFO_CURRENT_USER_IN_MERGE.format(name) + priority)
+
+        first_position = 1 + self._count_merging_users(queue_info)
+        for position, (user_in_queue, priority) in enumerate(zip(queue_info.users_queue, queue_info.priorities)):
+            name = user_in_queue.get_name()
+            estimate = self._format_priority(priority)
+            linked = [linked_branch for linked_branch in queue_info.get_linked_branches(user_in_queue)
+                      if linked_branch != branch]
+            if linked:
+                estimate += Messages.QUEUE_INFO_LINKED.format(Messages.MERGE_LINKED_BRANCHES_SEPARATOR.join(linked))
+            if estimates is not None and position < len(estimates):
+                estimate += Messages.QUEUE_INFO_ESTIMATE.format(format_estimate(estimates[position]))
+            if position < self.QUEUE_INFO_USERS_LIMIT:
+                add_line(user_in_queue, Messages.QUEUE_INFO_USER_IN_QUEUE.format(name) + estimate,
+                         Messages.QUEUE_INFO_CURRENT_USER_IN_QUEUE.format(name) + estimate)
+            else:
+                far_positions[user_in_queue.get_identifier()] = (name, first_position + position, estimate)
+
+        if far_positions:
+            parts.append(Messages.QUEUE_INFO_MORE_USERS_IN_QUEUE.format(len(far_positions)))
+        parts.append(footer)
+        return RenderedQueue(generation, "".join(parts), highlights, far_positions, estimates)
+
+    @traced("presentation.notify")
     def notify(self, whom, action_type, action_data):
-        if whom != action_data.get_user():
+        message = self._get_notification_message(whom, action_type, action_data)
+        if message is None:
+            return
+        if self._is_merge_confirmation_request(whom, action_type, action_data):
+            self._message_sender.request_merge_confirmation(whom.get_identifier(), message, action_data.get_branch())
+        else:
+            self._message_sender.send(whom.get_identifier(), message)
+
+    def invalidate(self):
+        self._message_sender.invalidate_markups()
+
+    @traced("presentation.notify_batch")
+    def notify_batch(self, whom, notifications):
+        messages = []
+        confirmation_requests = []
+        for action_type, action_data in notifications:
+            message = self._get_notification_message(whom, action_type, action_data)
+            if message is None:
+                continue
+            if self._is_merge_confirmation_request(whom, action_type, action_data):
+                confirmation_requests.append((message, action_data.get_branch()))
+            else:
+                messages.append(message)
+
+        if messages:
+            self._message_sender.send(whom.get_identifier(), Messages.BATCH_NOTIFICATIONS_SEPARATOR.join(messages))
+        for message, branch in confirmation_requests:
+            self._message_sender.request_merge_confirmation(whom.get_identifier(), message, branch)
+
+    @staticmethod
+    def _is_merge_confirmation_request(whom, action_type, action_data):
+        return action_type == NotifierActions.ready_to_merge and whom == action_data.get_user()
+
+    @staticmethod
+    def _get_notification_message(whom, action_type, action_data):
+        message = None
+        if action_type == NotifierActions.branch_removed:
+            message = str.format(Messages.ACTION_MESSAGE_BRANCH_REMOVED, action_data.get_branch())
+        elif action_type == NotifierActions.starts_train:
+            members = action_data.get_members()
+            if whom in members:
+                names = [member.get_name() for member in members if member != whom]
+                message = str.format(Messages.ACTION_MESSAGE_YOUR_TRAIN_STARTED, action_data.get_branch(),
+                                     Messages.ACTION_MESSAGE_TRAIN_MEMBERS_SEPARATOR.join(names))
+            else:
+                names = [member.get_name() for member in members]
+                message = str.format(Messages.ACTION_MESSAGE_TRAIN_STARTED, action_data.get_branch(),
+                                     Messages.ACTION_MESSAGE_TRAIN_MEMBERS_SEPARATOR.join(names))
+        elif whom != action_data.get_user():
             action_text = None
             if action_type == NotifierActions.starts_merge:
                 action_text = Messages.ACTION_TEXT_MERGE_STARTED
@@ -408,33 +772,58 @@ class BotPresentationModel(Notifier):
             elif action_type == NotifierActions.kicks_himself:
                 action_text = str.format(Messages.ACTION_MESSAGE_KICKED_SELF, action_data.get_user().get_name(),
                                          action_data.get_branch())
-            elif action_type == NotifierActions.starts_fix and whom == action_data.get_pushed_user():
+            elif action_type == NotifierActions.starts_fix and whom in action_data.get_pushed_users():
                 action_text = str.format(Messages.ACTION_MESSAGE_PUSH_BACK, action_data.get_user().get_name(),
                                          action_data.get_branch())
-            elif action_type == NotifierActions.starts_fix and whom != action_data.get_pushed_user():
+            elif action_type == NotifierActions.starts_fix and whom not in action_data.get_pushed_users():
                 action_text = str.format(Messages.ACTION_MESSAGE_STARTS_FIX, action_data.get_user().get_name(),
                                          action_data.get_branch())
+            elif action_type == NotifierActions.skips_user:
+                action_text = str.format(Messages.ACTION_MESSAGE_USER_SKIPPED, action_data.get_user().get_name(),
+                                         action_data.get_branch())
+            elif action_type == NotifierActions.releases_merge:
+                action_text = str.format(Messages.ACTION_MESSAGE_MERGE_RELEASED, action_data.get_user().get_name(),
+                                         action_data.get_branch())
+            elif action_type == NotifierActions.changes_priority:
+                action_text = str.format(Messages.ACTION_MESSAGE_PRIORITY_CHANGED, action_data.get_user().get_name(),
+                                         action_data.get_branch(), action_data.get_priority().name)
 
             if action_text is not None:
                 if action_type != NotifierActions.kicks_user \
                         and action_type != NotifierActions.kicks_himself \
-                        and action_type != NotifierActions.starts_fix:
-                    message = str.format(Messages.ACTION_MESSAGE_GENERIC, action_data.get_user().get_name(),
-                                         action_text, action_data.get_branch())
+                        and action_type != NotifierActions.starts_fix \
+                        and action_type != NotifierActions.skips_user \
+                        and action_type != NotifierActions.releases_merge \
+                        and action_type != NotifierActions.changes_priority:
+                    if action_data.get_priority() != Priority.normal:
+                        message = str.format(Messages.ACTION_MESSAGE_GENERIC_WITH_PRIORITY,
+                                             action_data.get_user().get_name(), action_text, action_data.get_branch(),
+                                             action_data.get_priority().name)
+                    else:
+                        message = str.format(Messages.ACTION_MESSAGE_GENERIC, action_data.get_user().get_name(),
+                                             action_text, action_data.get_branch())
                 else:
                     message = action_text
-                self._message_sender.send(whom.get_identifier(), message)
         else:
             if action_type == NotifierActions.starts_merge:
                 message = str.format(Messages.ACTION_MESSAGE_STARTED_MERGE, action_data.get_branch())
-                self._message_sender.send(whom.get_identifier(), message)
+            elif action_type == NotifierActions.ready_to_merge and len(action_data.get_branches()) > 1:
+                message = str.format(Messages.ACTION_MESSAGE_YOUR_LINKED_MERGE_TURN,
+                                     Messages.MERGE_LINKED_BRANCHES_SEPARATOR.join(action_data.get_branches()))
             elif action_type == NotifierActions.ready_to_merge:
                 message = str.format(Messages.ACTION_MESSAGE_YOUR_MERGE_TURN, action_data.get_branch())
-                self._message_sender.request_merge_confirmation(whom.get_identifier(), message,
-                                                                action_data.get_branch())
             elif action_type == NotifierActions.kicks_himself:
                 message = str.format(Messages.ACTION_MESSAGE_YOU_KICKED_SELF, action_data.get_branch())
-                self._message_sender.send(whom.get_identifier(), message)
-
+            elif action_type == NotifierActions.reminds_merge:
+                message = str.format(Messages.ACTION_MESSAGE_REMIND_MERGE, action_data.get_branch())
+            elif action_type == NotifierActions.reminds_confirmation:
+                message = str.format(Messages.ACTION_MESSAGE_REMIND_CONFIRMATION, action_data.get_branch())
+            elif action_type == NotifierActions.skips_user:
+                message = str.format(Messages.ACTION_MESSAGE_YOU_SKIPPED, action_data.get_branch())
+            elif action_type == NotifierActions.releases_merge:
+                message = str.format(Messages.ACTION_MESSAGE_YOUR_MERGE_RELEASED, action_data.get_branch())
+        return message
+
+    @traced("presentation.update_user")
     def update_user(self, identifier, first_name, last_name):
         self._merge_dispatcher.update_user(identifier, first_name, last_name)
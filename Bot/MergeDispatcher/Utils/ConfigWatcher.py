@@ -0,0 +1,69 @@
+import os
+import threading
+
+from Bot.MergeDispatcher import JSONConfigLoader
+
+
+class ConfigWatcher:
+    DEFAULT_INTERVAL = 2.0
+
+    def __init__(self, path, on_change, logger, interval=DEFAULT_INTERVAL):
+        self._path = path
+        self._on_change = on_change
+        self._logger = logger
+        self._interval = interval
+        self._signature = self._get_signature()
+        self._pending_signature = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _get_signature(self):
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        signature = self._get_signature()
+        if signature is None or signature == self._signature:
+            return False
+        # File can be still written, so it is applied only after it stays the same for one more check
+        if signature != self._pending_signature:
+            self._pending_signature = signature
+            return False
+
+        try:
+            with open(self._path, 'r') as config_file:
+                config = JSONConfigLoader.parse_json(config_file.read())
+        except OSError:
+            config = None
+        if self._get_signature() != signature:
+            return False
+        self._signature = signature
+        if config is None:
+            self._logger.warning("Config %s was changed, but it is incorrect and was not applied", self._path)
+            return False
+
+        self._logger.info("Config %s was changed, applying it", self._path)
+        self._on_change(config)
+        return True
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="ConfigWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            # noinspection PyBroadException
+            try:
+                self.check()
+            except Exception:
+                self._logger.error("Exception during config reload", exc_info=1)
@@ -0,0 +1,129 @@
+class IndexedPriorityQueue:
+    def __init__(self, items=None, priority=0):
+        # Entries are [-priority, order, item, priority], so higher priority goes first and FIFO within priority
+        self._heap = []
+        self._positions = {}
+        self._front_order = 0
+        self._back_order = 0
+        self._ordered = None
+        if items is not None:
+            self.extend(items, priority)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __iter__(self):
+        return iter(self._get_ordered())
+
+    def __getitem__(self, index):
+        if index == 0 and self._heap:
+            return self._heap[0][2]
+        return self._get_ordered()[index]
+
+    def __str__(self):
+        return str.format("IndexedPriorityQueue({0})", [(item, priority) for item, priority in self.items()])
+
+    def index(self, item):
+        return self._get_ordered().index(item)
+
+    def items(self):
+        return [(item, self._heap[self._positions[item]][3]) for item in self._get_ordered()]
+
+    def append(self, item, priority=0):
+        self._back_order += 1
+        self._push(item, priority, self._back_order)
+
+    def appendleft(self, item, priority=0):
+        self._front_order -= 1
+        self._push(item, priority, self._front_order)
+
+    def extend(self, items, priority=0):
+        for item in items:
+            self.append(item, priority)
+
+    def popleft(self):
+        if not self._heap:
+            raise IndexError("pop from an empty queue")
+        item = self._heap[0][2]
+        self._remove_at(0)
+        return item
+
+    def remove(self, item):
+        position = self._positions.get(item)
+        if position is None:
+            raise ValueError("Item is not in queue")
+        self._remove_at(position)
+
+    def clear(self):
+        self._heap = []
+        self._positions = {}
+        self._ordered = None
+
+    def get_priority(self, item):
+        return self._heap[self._positions[item]][3]
+
+    def update_priority(self, item, priority):
+        position = self._positions[item]
+        entry = self._heap[position]
+        entry[0] = -priority
+        entry[3] = priority
+        self._ordered = None
+        self._sift_down(self._sift_up(position))
+
+    def _push(self, item, priority, order):
+        if item in self._positions:
+            raise ValueError("Item is already in queue")
+        self._heap.append([-priority, order, item, priority])
+        self._positions[item] = len(self._heap) - 1
+        self._ordered = None
+        self._sift_up(len(self._heap) - 1)
+
+    def _remove_at(self, position):
+        last_entry = self._heap.pop()
+        del self._positions[self._heap[position][2] if position < len(self._heap) else last_entry[2]]
+        self._ordered = None
+        if position < len(self._heap):
+            self._heap[position] = last_entry
+            self._positions[last_entry[2]] = position
+            self._sift_down(self._sift_up(position))
+
+    def _sift_up(self, position):
+        entry = self._heap[position]
+        while position > 0:
+            parent = (position - 1) // 2
+            if self._heap[parent][:2] <= entry[:2]:
+                break
+            self._move(parent, position)
+            position = parent
+        self._heap[position] = entry
+        self._positions[entry[2]] = position
+        return position
+
+    def _sift_down(self, position):
+        entry = self._heap[position]
+        size = len(self._heap)
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and self._heap[child + 1][:2] < self._heap[child][:2]:
+                child += 1
+            if entry[:2] <= self._heap[child][:2]:
+                break
+            self._move(child, position)
+            position = child
+        self._heap[position] = entry
+        self._positions[entry[2]] = position
+        return position
+
+    def _move(self, source, target):
+        self._heap[target] = self._heap[source]
+        self._positions[self._heap[target][2]] = target
+
+    def _get_ordered(self):
+        if self._ordered is None:
+            self._ordered = [entry[2] for entry in sorted(self._heap, key=lambda entry: entry[:2])]
+        return self._ordered
@@ -2,10 +2,18 @@ import json
 from json import JSONDecodeError
 
 from Bot.MergeDispatcher import Config
+from Bot.MergeDispatcher import TimeoutPolicies
+from Bot.MergeDispatcher import TimeoutPolicy
+from Bot.MergeDispatcher import TrainSizes
 
 
 class JSONConfigLoader:
     JSON_BRANCHES_KEY = "branches"
+    JSON_ADMINS_KEY = "admins"
+    JSON_TIMEOUTS_KEY = "timeouts"
+    JSON_TIMEOUT_KEYS = {"remind": "remind_after", "skip": "skip_after", "release": "release_after"}
+    JSON_TRAINS_KEY = "trains"
+    SECONDS_IN_MINUTE = 60
 
     @staticmethod
     def parse_json(json_data):
@@ -16,6 +24,24 @@ class JSONConfigLoader:
 
         if JSONConfigLoader.JSON_BRANCHES_KEY in json_object:
             branches = json_object[JSONConfigLoader.JSON_BRANCHES_KEY]
-            return Config(branches)
+            admins = json_object.get(JSONConfigLoader.JSON_ADMINS_KEY, [])
+            try:
+                timeouts = JSONConfigLoader.parse_timeouts(json_object.get(JSONConfigLoader.JSON_TIMEOUTS_KEY, {}))
+                trains = TrainSizes(json_object.get(JSONConfigLoader.JSON_TRAINS_KEY, {}))
+                return Config(branches, admins, timeouts, trains)
+            except (ValueError, TypeError, AttributeError):
+                return None
         else:
             return None
+
+    @staticmethod
+    def parse_timeouts(json_timeouts):
+        policies = {}
+        for key, json_policy in json_timeouts.items():
+            timeouts = {}
+            for json_key, value in json_policy.items():
+                if json_key not in JSONConfigLoader.JSON_TIMEOUT_KEYS:
+                    raise ValueError("Unknown timeout: {}".format(json_key))
+                timeouts[JSONConfigLoader.JSON_TIMEOUT_KEYS[json_key]] = value * JSONConfigLoader.SECONDS_IN_MINUTE
+            policies[key] = TimeoutPolicy(**timeouts)
+        return TimeoutPolicies(policies)
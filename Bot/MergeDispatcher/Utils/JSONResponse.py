@@ -0,0 +1,33 @@
+import json
+
+
+class JSONResponse:
+    CONTENT_TYPE = "application/json; charset=utf-8"
+
+    def __init__(self, json_object, etag):
+        self._json_object = json_object
+        self._body = json.dumps(json_object, sort_keys=True)
+        self._etag = etag
+
+    def get_json_object(self):
+        return self._json_object
+
+    def get_body(self):
+        return self._body
+
+    def get_etag(self):
+        return self._etag
+
+    def get_etag_header(self):
+        return "\"{}\"".format(self._etag)
+
+    def matches(self, if_none_match):
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag == "*" or tag.strip("\"") == self._etag:
+                return True
+        return False
@@ -0,0 +1,39 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, capacity=256):
+        if capacity <= 0:
+            raise ValueError("Cache capacity should be positive")
+        self._capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+            self._items[key] = value
+            if len(self._items) > self._capacity:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def get_capacity(self):
+        return self._capacity
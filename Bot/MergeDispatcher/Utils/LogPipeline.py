@@ -0,0 +1,144 @@
+import copy
+import datetime
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from logging.handlers import RotatingFileHandler
+
+from Bot.MergeDispatcher import current_trace_id
+
+
+class LazyValue:
+    def __init__(self, function, *args):
+        self._function = function
+        self._args = args
+
+    def __str__(self):
+        return str(self._function(*self._args))
+
+
+class JSONLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "source": "{0}:{1}".format(record.filename, record.lineno),
+            "message": record.getMessage()
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id is not None:
+            entry["trace_id"] = trace_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class StructuredQueueHandler(QueueHandler):
+    def __init__(self, records_queue):
+        super().__init__(records_queue)
+        self._dropped_records = 0
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        record.trace_id = current_trace_id()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped_records += 1
+
+    def get_dropped_records(self):
+        return self._dropped_records
+
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    COMPRESSED_SUFFIX = ".gz"
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding="utf-8"):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding)
+        self.namer = self._name_segment
+        self.rotator = self._rotate_segment
+        self._compressor = ThreadPoolExecutor(max_workers=1)
+        self._compression = None
+
+    def _name_segment(self, name):
+        return name + self.COMPRESSED_SUFFIX
+
+    def _rotate_segment(self, source, dest):
+        segment = dest[:-len(self.COMPRESSED_SUFFIX)]
+        if os.path.exists(source):
+            os.rename(source, segment)
+            self._compression = self._compressor.submit(self._compress_segment, segment, dest)
+
+    @staticmethod
+    def _compress_segment(segment, dest):
+        temporary_dest = dest + ".tmp"
+        with open(segment, 'rb') as segment_file, gzip.open(temporary_dest, 'wb') as compressed_file:
+            shutil.copyfileobj(segment_file, compressed_file)
+        os.replace(temporary_dest, dest)
+        os.remove(segment)
+
+    def wait_for_compression(self):
+        if self._compression is not None:
+            self._compression.result()
+            self._compression = None
+
+    def doRollover(self):
+        self.wait_for_compression()
+        super().doRollover()
+
+    def close(self):
+        super().close()
+        self.wait_for_compression()
+        self._compressor.shutdown(wait=True)
+
+
+class LogPipeline:
+    DEFAULT_QUEUE_SIZE = 10000
+
+    def __init__(self, handlers, queue_size=DEFAULT_QUEUE_SIZE):
+        self._handlers = handlers
+        self._queue_handler = StructuredQueueHandler(queue.Queue(queue_size))
+        self._listener = QueueListener(self._queue_handler.queue, *handlers, respect_handler_level=True)
+        self._lock = threading.Lock()
+        self._started = False
+
+    def get_handler(self):
+        return self._queue_handler
+
+    def get_dropped_records(self):
+        return self._queue_handler.get_dropped_records()
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self._listener.start()
+                self._started = True
+
+    def stop(self):
+        with self._lock:
+            if self._started:
+                self._listener.stop()
+                self._started = False
+        for handler in self._handlers:
+            handler.close()
@@ -0,0 +1,23 @@
+from Bot.MergeDispatcher import LRUCache
+
+
+class MarkupCache:
+    def __init__(self, capacity=512):
+        self._markups = LRUCache(capacity)
+        self._version = 0
+
+    def get(self, key, build_markup):
+        # Markup built before invalidation is stored under the old version and is never returned again
+        key = (key, self._version)
+        markup = self._markups.get(key)
+        if markup is None:
+            markup = build_markup()
+            self._markups.put(key, markup)
+        return markup
+
+    def invalidate(self):
+        self._version += 1
+        self._markups.clear()
+
+    def __len__(self):
+        return len(self._markups)
@@ -0,0 +1,244 @@
+import bisect
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Stripe:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+
+class _Metric:
+    def __init__(self, name, description, label_names=()):
+        self._name = name
+        self._description = description
+        self._label_names = tuple(label_names)
+
+    def get_name(self):
+        return self._name
+
+    def get_description(self):
+        return self._description
+
+    def _format_labels(self, labels, extra=()):
+        pairs = list(zip(self._label_names, labels)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join('{0}="{1}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+
+class _StripedMetric(_Metric):
+    STRIPES_COUNT = 16
+
+    def __init__(self, name, description, label_names=()):
+        super().__init__(name, description, label_names)
+        self._stripes = [_Stripe() for _ in range(self.STRIPES_COUNT)]
+        self._stripe_numbers = itertools.count()
+        self._local = threading.local()
+
+    def _stripe(self):
+        stripe = getattr(self._local, "stripe", None)
+        if stripe is None:
+            stripe = self._stripes[next(self._stripe_numbers) % self.STRIPES_COUNT]
+            self._local.stripe = stripe
+        return stripe
+
+    def _check_labels(self, labels):
+        if len(labels) != len(self._label_names):
+            raise ValueError("Metric {0} expects labels {1}, got {2}".format(self._name, self._label_names, labels))
+
+
+class Counter(_StripedMetric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, labels=()):
+        self._check_labels(labels)
+        stripe = self._stripe()
+        with stripe.lock:
+            stripe.values[labels] = stripe.values.get(labels, 0) + amount
+
+    def get_values(self):
+        values = {}
+        for stripe in self._stripes:
+            with stripe.lock:
+                for labels, value in stripe.values.items():
+                    values[labels] = values.get(labels, 0) + value
+        return values
+
+    def get_value(self, labels=()):
+        return self.get_values().get(tuple(labels), 0)
+
+    def render(self):
+        return ["{0}{1} {2}".format(self._name, self._format_labels(labels), _format_value(value))
+                for labels, value in sorted(self.get_values().items())]
+
+
+class Histogram(_StripedMetric):
+    TYPE = "histogram"
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    class Timer:
+        def __init__(self, histogram, labels):
+            self._histogram = histogram
+            self._labels = labels
+            self._started = None
+
+        def __enter__(self):
+            self._started = time.perf_counter()
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self._histogram.observe(time.perf_counter() - self._started, self._labels)
+            return False
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, label_names)
+        self._buckets = tuple(sorted(buckets))
+
+    def get_buckets(self):
+        return self._buckets
+
+    def observe(self, value, labels=()):
+        self._check_labels(labels)
+        index = bisect.bisect_left(self._buckets, value)
+        stripe = self._stripe()
+        with stripe.lock:
+            observations = stripe.values.get(labels)
+            if observations is None:
+                observations = [[0] * (len(self._buckets) + 1), 0]
+                stripe.values[labels] = observations
+            observations[0][index] += 1
+            observations[1] += value
+
+    def time(self, labels=()):
+        return Histogram.Timer(self, labels)
+
+    def get_values(self):
+        values = {}
+        for stripe in self._stripes:
+            with stripe.lock:
+                for labels, (counts, total) in stripe.values.items():
+                    merged_counts, merged_total = values.get(labels, ([0] * len(counts), 0))
+                    values[labels] = ([left + right for left, right in zip(merged_counts, counts)],
+                                      merged_total + total)
+        return values
+
+    def get_count(self, labels=()):
+        counts, _ = self.get_values().get(tuple(labels), ([], 0))
+        return sum(counts)
+
+    def get_sum(self, labels=()):
+        _, total = self.get_values().get(tuple(labels), ([], 0))
+        return total
+
+    def render(self):
+        lines = []
+        for labels, (counts, total) in sorted(self.get_values().items()):
+            cumulative = 0
+            for bucket, count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("{0}_bucket{1} {2}".format(
+                    self._name, self._format_labels(labels, (("le", _format_value(bucket)),)), cumulative))
+            lines.append("{0}_sum{1} {2}".format(self._name, self._format_labels(labels), _format_value(total)))
+            lines.append("{0}_count{1} {2}".format(self._name, self._format_labels(labels), cumulative))
+        return lines
+
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def __init__(self, name, description, callback, label_names=()):
+        super().__init__(name, description, label_names)
+        self._callback = callback
+
+    def get_values(self):
+        values = self._callback()
+        if isinstance(values, dict):
+            return values
+        return {(): values}
+
+    def get_value(self, labels=()):
+        return self.get_values().get(tuple(labels))
+
+    def render(self):
+        return ["{0}{1} {2}".format(self._name, self._format_labels(labels), _format_value(value))
+                for labels, value in sorted(self.get_values().items())]
+
+
+class MetricsRegistry:
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, label_names=()):
+        return self._register(name, Counter, lambda: Counter(name, description, label_names))
+
+    def histogram(self, name, description, label_names=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(name, Histogram, lambda: Histogram(name, description, label_names, buckets))
+
+    def gauge(self, name, description, callback, label_names=()):
+        with self._lock:
+            gauge = Gauge(name, description, callback, label_names)
+            self._metrics[name] = gauge
+            return gauge
+
+    def get_metric(self, name):
+        return self._metrics.get(name)
+
+    def _register(self, name, metric_class, create_metric):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = create_metric()
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError("Metric {0} is already registered as {1}".format(name, metric.TYPE))
+            return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP {0} {1}".format(metric.get_name(), metric.get_description()))
+            lines.append("# TYPE {0} {1}".format(metric.get_name(), metric.TYPE))
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    def __init__(self, registry, port, host="0.0.0.0", routes=None):
+        from Bot.MergeDispatcher.Utils.MetricsHTTPServer import MetricsHTTPServer
+        self._server = MetricsHTTPServer((host, port), registry, routes)
+        self._thread = None
+
+    def get_port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
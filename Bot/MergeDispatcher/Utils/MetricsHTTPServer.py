@@ -0,0 +1,61 @@
+import json
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+
+from Bot.MergeDispatcher import JSONResponse
+from Bot.MergeDispatcher import MetricsRegistry
+
+JSON_CONTENT_TYPE = JSONResponse.CONTENT_TYPE
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, message_format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self._send_body(self.server.registry.render(), MetricsRegistry.CONTENT_TYPE)
+            return
+        route = self.server.routes.get(url.path)
+        if route is None:
+            self.send_error(404)
+            return
+        try:
+            result = route(dict(parse_qsl(url.query)))
+        except ValueError:
+            self.send_error(400)
+            return
+        if result is None:
+            self.send_error(404)
+            return
+        if not isinstance(result, JSONResponse):
+            self._send_body(json.dumps(result, sort_keys=True), JSON_CONTENT_TYPE)
+        elif result.matches(self.headers.get("If-None-Match")):
+            self.send_response(304)
+            self.send_header("ETag", result.get_etag_header())
+            self.end_headers()
+        else:
+            self._send_body(result.get_body(), JSONResponse.CONTENT_TYPE, result.get_etag_header())
+
+    def _send_body(self, text, content_type, etag=None):
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, registry, routes=None):
+        super().__init__(server_address, _MetricsRequestHandler)
+        self.registry = registry
+        self.routes = routes if routes is not None else {}
@@ -0,0 +1,131 @@
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class ProfileReport:
+    def __init__(self, samples, stacks_path, allocations_path=None):
+        self._samples = samples
+        self._stacks_path = stacks_path
+        self._allocations_path = allocations_path
+
+    def get_samples(self):
+        return self._samples
+
+    def get_stacks_path(self):
+        return self._stacks_path
+
+    def get_allocations_path(self):
+        return self._allocations_path
+
+
+class SamplingProfiler:
+    DEFAULT_INTERVAL = 0.01
+    MAX_DURATION = 300
+    ALLOCATION_FRAMES = 10
+    TOP_ALLOCATIONS = 50
+
+    def __init__(self, output_dir, interval=DEFAULT_INTERVAL, logger=None):
+        self._output_dir = output_dir
+        self._logger = logger if logger is not None else logging.getLogger(__name__)
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def is_running(self):
+        with self._lock:
+            return self._thread is not None
+
+    def start(self, duration, trace_allocations=False, on_finished=None):
+        if not 0 < duration <= self.MAX_DURATION:
+            raise ValueError("Profiling duration should be between 0 and {} seconds".format(self.MAX_DURATION))
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True,
+                                            args=(duration, trace_allocations, on_finished))
+            self._thread.start()
+            return True
+
+    def join(self, timeout=None):
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self, duration, trace_allocations, on_finished):
+        try:
+            report = self.profile(duration, trace_allocations)
+        finally:
+            with self._lock:
+                self._thread = None
+        if on_finished is not None:
+            # noinspection PyBroadException
+            try:
+                on_finished(report)
+            except Exception:
+                self._logger.error("Exception in profiling callback %s", on_finished, exc_info=1)
+
+    def profile(self, duration, trace_allocations=False):
+        started_tracemalloc = trace_allocations and not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start(self.ALLOCATION_FRAMES)
+        allocations_before = tracemalloc.take_snapshot() if trace_allocations else None
+
+        stacks = {}
+        samples = 0
+        own_thread_id = threading.get_ident()
+        deadline = time.perf_counter() + duration
+        try:
+            while time.perf_counter() < deadline:
+                thread_names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread_id:
+                        continue
+                    stack = self._collapse(thread_names.get(thread_id, str(thread_id)), frame)
+                    stacks[stack] = stacks.get(stack, 0) + 1
+                samples += 1
+                time.sleep(self._interval)
+
+            prefix = os.path.join(self._output_dir, time.strftime("profile-%Y%m%d-%H%M%S"))
+            stacks_path = prefix + ".collapsed"
+            with open(stacks_path, 'w') as stacks_file:
+                for stack, count in sorted(stacks.items()):
+                    stacks_file.write("{0} {1}\n".format(stack, count))
+
+            allocations_path = None
+            if trace_allocations:
+                allocations_path = prefix + ".allocations.txt"
+                self._write_allocations(allocations_path, allocations_before, tracemalloc.take_snapshot())
+        finally:
+            if started_tracemalloc:
+                tracemalloc.stop()
+        return ProfileReport(samples, stacks_path, allocations_path)
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append("{0} ({1}:{2})".format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ";".join(reversed(frames))
+
+    def _write_allocations(self, path, snapshot_before, snapshot_after):
+        filters = (tracemalloc.Filter(False, tracemalloc.__file__),)
+        statistics = snapshot_after.filter_traces(filters).compare_to(snapshot_before.filter_traces(filters),
+                                                                      "traceback")
+        total = sum(statistic.size for statistic in snapshot_after.filter_traces(filters).statistics("filename"))
+        with open(path, 'w') as allocations_file:
+            allocations_file.write("Traced memory: {0} bytes\n".format(total))
+            allocations_file.write("Top {0} allocation differences during profiling:\n\n".format(self.TOP_ALLOCATIONS))
+            for statistic in statistics[:self.TOP_ALLOCATIONS]:
+                allocations_file.write("{0:+d} bytes ({1:+d} blocks), now {2} bytes in {3} blocks\n".format(
+                    statistic.size_diff, statistic.count_diff, statistic.size, statistic.count))
+                for line in statistic.traceback.format():
+                    allocations_file.write("    {}\n".format(line))
+                allocations_file.write("\n")
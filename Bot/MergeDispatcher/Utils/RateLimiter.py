@@ -0,0 +1,22 @@
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError("Rate should be positive")
+        self._interval = 1.0 / rate
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get_rate(self):
+        return 1.0 / self._interval
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
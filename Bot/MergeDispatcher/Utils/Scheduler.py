@@ -0,0 +1,51 @@
+import logging
+import threading
+import time
+
+from Bot.MergeDispatcher import TimerWheel
+
+
+class Scheduler:
+    DEFAULT_TICK = 1.0
+
+    def __init__(self, logger=None, tick=DEFAULT_TICK, now=None):
+        self._logger = logger if logger is not None else logging.getLogger(__name__)
+        self._tick = tick
+        self._wheel = TimerWheel(time.time() if now is None else now, tick)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._wheel)
+
+    def schedule(self, deadline, callback, *args):
+        return self._wheel.schedule(deadline, (callback, args))
+
+    def cancel(self, timer):
+        return self._wheel.cancel(timer)
+
+    def run_pending(self, now=None):
+        expired = self._wheel.advance(time.time() if now is None else now)
+        for timer in expired:
+            callback, args = timer.get_payload()
+            # noinspection PyBroadException
+            try:
+                callback(*args)
+            except Exception:
+                self._logger.error("Exception in scheduled callback %s", callback, exc_info=1)
+        return len(expired)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="Scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self._tick):
+            self.run_pending()
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+
+
+class SetJournal:
+    ADD = "+"
+    REMOVE = "-"
+    MIN_COMPACTION_RECORDS = 1024
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._keys = self._load()
+        self._records = 0
+        self._file = None
+        self._compact()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def get_keys(self):
+        with self._lock:
+            return set(self._keys)
+
+    def get_records(self):
+        return self._records
+
+    def add(self, key):
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            self._append(self.ADD, key)
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.remove(key)
+            self._append(self.REMOVE, key)
+            return True
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load(self):
+        keys = set()
+        if not os.path.exists(self._path):
+            return keys
+        with open(self._path, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last record may be incomplete if process was killed during write
+                    continue
+                key = tuple(record[1:])
+                if record[0] == self.ADD:
+                    keys.add(key)
+                elif record[0] == self.REMOVE:
+                    keys.discard(key)
+        return keys
+
+    def _append(self, operation, key):
+        self._file.write(json.dumps([operation] + list(key)) + "\n")
+        self._file.flush()
+        self._records += 1
+        if self._records > max(self.MIN_COMPACTION_RECORDS, 2 * len(self._keys)):
+            self._compact()
+
+    def _compact(self):
+        if self._file is not None:
+            self._file.close()
+        temporary_path = self._path + ".tmp"
+        with open(temporary_path, 'w') as journal_file:
+            for key in self._keys:
+                journal_file.write(json.dumps([self.ADD] + list(key)) + "\n")
+        os.replace(temporary_path, self._path)
+        self._records = len(self._keys)
+        self._file = open(self._path, 'a')
@@ -0,0 +1,40 @@
+import threading
+import time
+
+
+class StartupTimeline:
+    def __init__(self, started=None):
+        self._started = time.perf_counter() if started is None else started
+        self._last_mark = self._started
+        self._stages = []
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def mark(self, stage):
+        with self._lock:
+            now = time.perf_counter()
+            self._stages.append((stage, now - self._last_mark))
+            self._last_mark = now
+
+    def finish(self, stage):
+        with self._lock:
+            if self._finished:
+                return False
+            self._finished = True
+        self.mark(stage)
+        return True
+
+    def is_finished(self):
+        return self._finished
+
+    def get_stages(self):
+        with self._lock:
+            return list(self._stages)
+
+    def get_total(self):
+        with self._lock:
+            return self._last_mark - self._started
+
+    def __str__(self):
+        stages = ", ".join("{0} {1:.3f}s".format(stage, duration) for stage, duration in self.get_stages())
+        return "{0} (total {1:.3f}s)".format(stages, self.get_total())
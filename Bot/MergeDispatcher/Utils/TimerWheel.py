@@ -0,0 +1,72 @@
+import itertools
+import threading
+
+
+class Timer:
+    def __init__(self, identifier, deadline, payload, tick):
+        self._identifier = identifier
+        self._deadline = deadline
+        self._payload = payload
+        self._tick = tick
+
+    def get_identifier(self):
+        return self._identifier
+
+    def get_deadline(self):
+        return self._deadline
+
+    def get_payload(self):
+        return self._payload
+
+    def get_tick(self):
+        return self._tick
+
+
+class TimerWheel:
+    DEFAULT_TICK = 1.0
+    DEFAULT_SLOTS = 512
+
+    def __init__(self, now, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS):
+        if tick <= 0 or slots <= 0:
+            raise ValueError("Tick and number of slots should be positive")
+        self._tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._current_tick = int(now // tick)
+        self._identifiers = itertools.count()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def schedule(self, deadline, payload):
+        with self._lock:
+            tick = max(int(deadline // self._tick), self._current_tick)
+            timer = Timer(next(self._identifiers), deadline, payload, tick)
+            self._slots[tick % len(self._slots)][timer.get_identifier()] = timer
+            self._size += 1
+            return timer
+
+    def cancel(self, timer):
+        with self._lock:
+            removed = self._slots[timer.get_tick() % len(self._slots)].pop(timer.get_identifier(), None)
+            if removed is None:
+                return False
+            self._size -= 1
+            return True
+
+    def advance(self, now):
+        expired = []
+        with self._lock:
+            target_tick = int(now // self._tick)
+            last_tick = min(target_tick, self._current_tick + len(self._slots) - 1)
+            for tick in range(self._current_tick, last_tick + 1):
+                slot = self._slots[tick % len(self._slots)]
+                for identifier, timer in list(slot.items()):
+                    if timer.get_deadline() <= now:
+                        del slot[identifier]
+                        expired.append(timer)
+            self._current_tick = max(self._current_tick, target_tick)
+            self._size -= len(expired)
+        expired.sort(key=lambda timer: (timer.get_deadline(), timer.get_identifier()))
+        return expired
@@ -0,0 +1,193 @@
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+_context = threading.local()
+
+
+class Trace:
+    def __init__(self, trace_id, sampled):
+        self._trace_id = trace_id
+        self._sampled = sampled
+        self._spans = []
+
+    def get_trace_id(self):
+        return self._trace_id
+
+    def is_sampled(self):
+        return self._sampled
+
+    def get_spans(self):
+        return self._spans
+
+    def add_span(self, span):
+        self._spans.append(span)
+
+
+class Span:
+    def __init__(self, trace, name, attributes):
+        self._trace = trace
+        self._name = name
+        self._attributes = attributes
+        self._thread_id = threading.get_ident()
+        self._start_time = None
+        self._started = None
+        self._duration = None
+
+    def __enter__(self):
+        self._start_time = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._duration = time.perf_counter() - self._started
+        if exc_type is not None:
+            self._attributes["error"] = exc_type.__name__
+        self._trace.add_span(self)
+        return False
+
+    def get_name(self):
+        return self._name
+
+    def get_attributes(self):
+        return self._attributes
+
+    def set_attribute(self, key, value):
+        self._attributes[key] = value
+
+    def get_thread_id(self):
+        return self._thread_id
+
+    def get_start_time(self):
+        return self._start_time
+
+    def get_duration(self):
+        return self._duration
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _RootSpan(Span):
+    def __init__(self, tracer, trace, name, attributes):
+        super().__init__(trace, name, attributes)
+        self._tracer = tracer
+
+    def __enter__(self):
+        _context.trace = self._trace
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        _context.trace = None
+        self._tracer.finish(self._trace, self.get_duration())
+        return False
+
+
+def span(name, **attributes):
+    trace = getattr(_context, "trace", None)
+    if trace is None:
+        return _NOOP_SPAN
+    return Span(trace, name, attributes)
+
+
+def traced(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def traced_function(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return traced_function
+
+    return decorator
+
+
+def current_trace_id():
+    trace = getattr(_context, "trace", None)
+    return trace.get_trace_id() if trace is not None else None
+
+
+class Tracer:
+    def __init__(self, sink=None, sample_rate=1.0, slow_threshold=None, seed=None):
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("Sample rate should be between 0 and 1")
+        self._sink = sink
+        self._sample_rate = sample_rate
+        self._slow_threshold = slow_threshold
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._kept_traces = 0
+        self._dropped_traces = 0
+
+    def trace(self, name, **attributes):
+        if getattr(_context, "trace", None) is not None:
+            return span(name, **attributes)
+        with self._lock:
+            trace_id = "{:016x}".format(self._random.getrandbits(64))
+            sampled = self._random.random() < self._sample_rate
+        return _RootSpan(self, Trace(trace_id, sampled), name, attributes)
+
+    def finish(self, trace, duration):
+        keep = trace.is_sampled() or (self._slow_threshold is not None and duration >= self._slow_threshold)
+        with self._lock:
+            if keep:
+                self._kept_traces += 1
+            else:
+                self._dropped_traces += 1
+        if keep and self._sink is not None:
+            self._sink.write(trace)
+
+    def get_kept_traces(self):
+        return self._kept_traces
+
+    def get_dropped_traces(self):
+        return self._dropped_traces
+
+
+class ChromeTraceFileSink:
+    def __init__(self, path):
+        self._path = path
+        self._process_id = os.getpid()
+        self._lock = threading.Lock()
+
+    def get_path(self):
+        return self._path
+
+    def write(self, trace):
+        events = []
+        for trace_span in trace.get_spans():
+            arguments = dict(trace_span.get_attributes())
+            arguments["trace_id"] = trace.get_trace_id()
+            events.append(json.dumps({
+                "name": trace_span.get_name(),
+                "cat": trace_span.get_name().split('.')[0],
+                "ph": "X",
+                "ts": int(trace_span.get_start_time() * 1000000),
+                "dur": int(trace_span.get_duration() * 1000000),
+                "pid": self._process_id,
+                "tid": trace_span.get_thread_id(),
+                "args": arguments
+            }, default=str))
+
+        with self._lock:
+            new_file = not os.path.exists(self._path) or os.path.getsize(self._path) == 0
+            with open(self._path, 'a') as trace_file:
+                if new_file:
+                    trace_file.write("[\n")
+                for event in events:
+                    trace_file.write(event + ",\n")
@@ -1,7 +1,52 @@
+from Bot.MergeDispatcher.Utils.LRUCache import LRUCache
+from Bot.MergeDispatcher.Utils.MarkupCache import MarkupCache
+from Bot.MergeDispatcher.Utils.Metrics import MetricsRegistry
+from Bot.MergeDispatcher.Utils.Metrics import MetricsServer
+from Bot.MergeDispatcher.Utils.Tracing import ChromeTraceFileSink
+from Bot.MergeDispatcher.Utils.Tracing import Tracer
+from Bot.MergeDispatcher.Utils.Tracing import current_trace_id
+from Bot.MergeDispatcher.Utils.Tracing import span
+from Bot.MergeDispatcher.Utils.Tracing import traced
+from Bot.MergeDispatcher.Utils.LogPipeline import CompressingRotatingFileHandler
+from Bot.MergeDispatcher.Utils.LogPipeline import JSONLinesFormatter
+from Bot.MergeDispatcher.Utils.LogPipeline import LazyValue
+from Bot.MergeDispatcher.Utils.LogPipeline import LogPipeline
+from Bot.MergeDispatcher.Utils.Profiler import ProfileReport
+from Bot.MergeDispatcher.Utils.Profiler import SamplingProfiler
+from Bot.MergeDispatcher.Utils.StartupTimeline import StartupTimeline
+from Bot.MergeDispatcher.Utils.RateLimiter import RateLimiter
+from Bot.MergeDispatcher.Utils.SetJournal import SetJournal
+from Bot.MergeDispatcher.Utils.TimerWheel import TimerWheel
+from Bot.MergeDispatcher.Utils.IndexedPriorityQueue import IndexedPriorityQueue
+from Bot.MergeDispatcher.Utils.Scheduler import Scheduler
+from Bot.MergeDispatcher.Utils.JSONResponse import JSONResponse
+
+from Bot.MergeDispatcher.BusinessLogic.BranchPatterns import BranchPatterns
+from Bot.MergeDispatcher.BusinessLogic.TimeoutPolicy import TimeoutPolicies
+from Bot.MergeDispatcher.BusinessLogic.TimeoutPolicy import TimeoutPolicy
+from Bot.MergeDispatcher.BusinessLogic.TrainSizes import TrainSizes
+from Bot.MergeDispatcher.BusinessLogic.DurationEstimate import DurationEstimate
+
 from Bot.MergeDispatcher.BusinessLogic.BotModel import BranchQueue
+from Bot.MergeDispatcher.BusinessLogic.BotModel import BranchQueueSnapshot
 from Bot.MergeDispatcher.BusinessLogic.BotModel import BotModel
+from Bot.MergeDispatcher.BusinessLogic.BotModel import Priority
 from Bot.MergeDispatcher.BusinessLogic.BotModel import User
 
+from Bot.MergeDispatcher.BusinessLogic.BranchIndex import BranchIndex
+
+from Bot.MergeDispatcher.BusinessLogic.EventLog import Event
+from Bot.MergeDispatcher.BusinessLogic.EventLog import EventStore
+from Bot.MergeDispatcher.BusinessLogic.EventLog import EventType
+
+from Bot.MergeDispatcher.BusinessLogic.MergeHistory import DurationSketch
+from Bot.MergeDispatcher.BusinessLogic.MergeHistory import HistoryRollup
+from Bot.MergeDispatcher.BusinessLogic.MergeHistory import MergeHistory
+
+from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import BatchOperation
+from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import BatchOperationStatus
+from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import BatchOperationType
+from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import BatchResult
 from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import CancelRequestStatus
 from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import Config
 from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import Dispatcher
@@ -12,11 +57,15 @@ from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import MergeRequestStatus
 from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import Notifier
 from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import NotifierActions
 from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import SubscribeRequestStatus
+from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import TimeoutType
 from Bot.MergeDispatcher.BusinessLogic.MergeDispatcher import UnsubscribeRequestStatus
 
+from Bot.MergeDispatcher.BusinessLogic.QueueStateAPI import QueueStateAPI
+
 from Bot.MergeDispatcher.PresentationModel.MergeBotPresentationModel import BotPresentationModel
 from Bot.MergeDispatcher.PresentationModel.MergeBotPresentationModel import Messages
 from Bot.MergeDispatcher.PresentationModel.MergeBotPresentationModel import MessageSender
 from Bot.MergeDispatcher.PresentationModel.MergeBotPresentationModel import States
 
 from Bot.MergeDispatcher.Utils.JSONConfigLoader import JSONConfigLoader
+from Bot.MergeDispatcher.Utils.ConfigWatcher import ConfigWatcher
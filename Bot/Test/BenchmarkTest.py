@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+
+from Bot.Benchmark.BenchmarkRunner import BenchmarkRunner
+from Bot.Benchmark.BenchmarkRunner import compare_results
+from Bot.Benchmark.BenchmarkRunner import percentile_of
+from Bot.Benchmark.ReplayBenchmark import generate_events
+from Bot.Benchmark.ReplayBenchmark import measure_replay
+from Bot.Benchmark.RunBenchmarks import DispatcherBenchmarks
+from Bot.Benchmark.StartupBenchmark import prepare_work_dir
+from Bot.Benchmark.StartupBenchmark import run_probe
+from Bot.Benchmark.SyntheticState import SyntheticState
+from Bot.MergeDispatcher import EventStore
+
+
+class SyntheticStateTest(unittest.TestCase):
+    def test_shouldCreateModelWithGivenNumberOfUsersAndBranches(self):
+        state = SyntheticState(users=20, branches=5, queued_users=10, subscriptions=10)
+        with tempfile.TemporaryDirectory() as work_dir:
+            model = state.create_model(work_dir)
+        self.assertEqual(20, len(model.get_users()))
+        self.assertEqual(5, len(model.get_branches()))
+
+    def test_shouldCreateSameStateForSameSeed(self):
+        state = SyntheticState(users=20, branches=5, queued_users=30, subscriptions=10, seed=7)
+        with tempfile.TemporaryDirectory() as work_dir:
+            first_model = state.create_model(work_dir)
+            second_model = state.create_model(work_dir)
+        for branch in state.get_branch_names():
+            self.assertListEqual(list(first_model.get_branches()[branch].users_queue),
+                                 list(second_model.get_branches()[branch].users_queue))
+
+    def test_shouldRaiseExceptionForUnknownDistribution(self):
+        with self.assertRaises(ValueError):
+            SyntheticState(distribution="gauss")
+
+
+class BenchmarkRunnerTest(unittest.TestCase):
+    def test_shouldReturnPercentileOfSortedValues(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, percentile_of(values, 50))
+        self.assertEqual(99, percentile_of(values, 99))
+        self.assertEqual(0.0, percentile_of([], 50))
+
+    def test_shouldMeasureOperation(self):
+        calls = []
+        runner = BenchmarkRunner(iterations=10, allocation_iterations=2)
+        result = runner.measure("operation", lambda: calls.append(1), extra=lambda: {"calls": len(calls)})
+        self.assertEqual("operation", result.get_name())
+        self.assertEqual(13, len(calls))
+        self.assertEqual({"calls": 13}, result.get_extra())
+        self.assertIn("operation", runner.to_json_object()["results"])
+
+    def test_shouldReportSlowdownAsRegression(self):
+        baseline = {"results": {"operation": {"p50_ms": 1.0, "p99_ms": 2.0, "throughput": 1000.0}}}
+        results = {"results": {"operation": {"p50_ms": 1.5, "p99_ms": 2.1, "throughput": 700.0}}}
+        regressions = compare_results(results, baseline, tolerance=0.2)
+        self.assertListEqual(["p50_ms", "throughput"], [regression[1] for regression in regressions])
+
+    def test_shouldIgnoreOperationsMissingInBaseline(self):
+        results = {"results": {"operation": {"p50_ms": 1.5, "p99_ms": 2.1, "throughput": 700.0}}}
+        self.assertListEqual([], compare_results(results, {"results": {}}))
+
+    def test_shouldAddMeasuredResult(self):
+        runner = BenchmarkRunner()
+        result = runner.add_result("startup", [0.2, 0.1, 0.3])
+        self.assertEqual(0.2, result.get_percentile(50))
+        self.assertAlmostEqual(5.0, result.get_throughput())
+        self.assertIn("startup", runner.to_json_object()["results"])
+
+
+class DispatcherBenchmarksTest(unittest.TestCase):
+    def test_shouldRunAllBenchmarks(self):
+        state = SyntheticState(users=20, branches=5, queued_users=10, subscriptions=10)
+        runner = BenchmarkRunner(iterations=3, allocation_iterations=1)
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = DispatcherBenchmarks(state, runner, work_dir).run()
+        self.assertTrue(results)
+        self.assertTrue(all(result.get_percentile(50) >= 0 for result in results))
+
+
+class StartupBenchmarkTest(unittest.TestCase):
+    def test_shouldMeasureStartupStagesInFreshInterpreter(self):
+        state = SyntheticState(users=20, branches=5, queued_users=10, subscriptions=10)
+        with tempfile.TemporaryDirectory() as work_dir:
+            prepare_work_dir(state, work_dir)
+            stages = run_probe(work_dir)
+        self.assertListEqual(["import", "config", "restore", "prepare"], [stage for stage, _ in stages])
+        self.assertTrue(all(duration >= 0 for _, duration in stages))
+
+
+class ReplayBenchmarkTest(unittest.TestCase):
+    def test_shouldReplayGeneratedEvents(self):
+        state = SyntheticState(users=20, branches=5)
+        with tempfile.TemporaryDirectory() as work_dir:
+            with EventStore(work_dir, segment_size=50, snapshot_interval=100) as event_store:
+                model = generate_events(state, event_store, 250)
+                latencies, replayed_events = measure_replay(state, event_store, model, 2)
+        self.assertEqual(250, event_store.get_last_sequence())
+        self.assertEqual(50, replayed_events)
+        self.assertEqual(2, len(latencies))
@@ -0,0 +1,152 @@
+import ast
+import json
+import os
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from Bot.LoadTest.FakeTelegramServer import FakeTelegramServer
+from Bot.LoadTest.FakeTelegramServer import FaultProfile
+from Bot.LoadTest.LoadDriver import LoadDriver
+from Bot.LoadTest.LoadDriver import RandomTraffic
+from Bot.LoadTest.LoadDriver import UpdateFactory
+
+TOKEN = "1:TEST"
+
+
+class FakeTelegramServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeTelegramServer(TOKEN)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def call(self, method, params=None):
+        url = "{0}/bot{1}/{2}".format(self.server.get_url(), TOKEN, method)
+        request = urllib.request.Request(url, data=json.dumps(params or {}).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(error.read().decode("utf-8"))
+
+    def test_shouldReturnInjectedUpdatesFromGetUpdates(self):
+        update_id = self.server.get_state().add_update(UpdateFactory().make_message(10, "/merge default"))
+
+        status, response = self.call("getUpdates", {"offset": 0, "timeout": 1})
+
+        self.assertEqual(200, status)
+        self.assertEqual(1, len(response["result"]))
+        self.assertEqual(update_id, response["result"][0]["update_id"])
+        self.assertEqual("/merge default", response["result"][0]["message"]["text"])
+
+    def test_shouldNotReturnConfirmedUpdates(self):
+        update_id = self.server.get_state().add_update(UpdateFactory().make_message(10, "/queue"))
+
+        status, response = self.call("getUpdates", {"offset": update_id + 1, "timeout": 0})
+
+        self.assertEqual(200, status)
+        self.assertListEqual([], response["result"])
+
+    def test_shouldRecordSentMessages(self):
+        markup = json.dumps({"inline_keyboard": [[{"text": "default", "callback_data": "sel"}]]})
+
+        status, response = self.call("sendMessage", {"chat_id": 10, "text": "Hello", "reply_markup": markup})
+
+        self.assertEqual(200, status)
+        deliveries = self.server.get_state().get_deliveries()
+        self.assertEqual(1, len(deliveries))
+        self.assertEqual(10, deliveries[0].get_chat_id())
+        self.assertEqual("Hello", deliveries[0].get_text())
+        self.assertListEqual([("default", "sel")], deliveries[0].get_buttons())
+        self.assertEqual(deliveries[0].get_message_id(), response["result"]["message_id"])
+
+    def test_shouldReturnNotFoundForWrongToken(self):
+        url = "{0}/bot{1}/getMe".format(self.server.get_url(), "2:WRONG")
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(url, timeout=5)
+        self.assertEqual(404, context.exception.code)
+
+
+class FakeTelegramServerFaultsTest(unittest.TestCase):
+    def test_shouldThrottleRequestsWithRetryAfter(self):
+        server = FakeTelegramServer(TOKEN, FaultProfile(throttle_rate=1.0, retry_after=3))
+        server.start()
+        try:
+            url = "{0}/bot{1}/sendMessage?chat_id=10&text=Hello".format(server.get_url(), TOKEN)
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(url, timeout=5)
+            response = json.loads(context.exception.read().decode("utf-8"))
+        finally:
+            server.stop()
+
+        self.assertEqual(429, context.exception.code)
+        self.assertEqual(3, response["parameters"]["retry_after"])
+        self.assertListEqual([], server.get_state().get_deliveries())
+        self.assertEqual({"429": 1}, server.get_state().get_statistics()["faults_injected"])
+
+    def test_shouldNotInjectFaultsIntoPolling(self):
+        server = FakeTelegramServer(TOKEN, FaultProfile(error_rate=1.0))
+        server.start()
+        try:
+            url = "{0}/bot{1}/getUpdates?timeout=0".format(server.get_url(), TOKEN)
+            with urllib.request.urlopen(url, timeout=5) as response:
+                status = response.status
+        finally:
+            server.stop()
+
+        self.assertEqual(200, status)
+
+
+class RandomTrafficTest(unittest.TestCase):
+    @staticmethod
+    def _get_bot_commands():
+        bot_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "MergeCancelComrade.py")
+        with open(bot_path, 'r') as bot_file:
+            tree = ast.parse(bot_file.read())
+        commands = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                for keyword in node.keywords:
+                    if keyword.arg == "commands":
+                        commands.update("/" + command for command in ast.literal_eval(keyword.value))
+        return commands
+
+    def test_shouldSendOnlyCommandsHandledByBot(self):
+        bot_commands = self._get_bot_commands()
+        self.assertIn("/merge", bot_commands)
+        for command, _ in RandomTraffic.BRANCH_COMMANDS + RandomTraffic.SELECTOR_COMMANDS:
+            self.assertIn(command, bot_commands)
+
+
+class LoadDriverTest(unittest.TestCase):
+    def test_shouldMeasureLatencyOfAnsweredUpdates(self):
+        server = FakeTelegramServer(TOKEN)
+        state = server.get_state()
+        stopped = threading.Event()
+
+        def echo_bot():
+            offset = None
+            while not stopped.is_set():
+                for update in state.get_updates(offset, 0.1):
+                    offset = update["update_id"] + 1
+                    chat_id = update["message"]["chat"]["id"]
+                    state.deliver("sendMessage", chat_id, update["message"]["text"])
+
+        server.start()
+        bot_thread = threading.Thread(target=echo_bot)
+        bot_thread.start()
+        try:
+            driver = LoadDriver(server, range(1, 6), RandomTraffic(["default"], seed=1), response_timeout=2.0)
+            result = driver.run(rate=50, duration=0.5, seed=1)
+        finally:
+            stopped.set()
+            bot_thread.join()
+            server.stop()
+
+        self.assertGreater(result.get_sent(), 0)
+        self.assertEqual(0, result.get_lost())
+        self.assertTrue(result.is_sustainable(max_p99=1.0, max_loss=0.0))
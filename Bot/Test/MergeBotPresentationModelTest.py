@@ -1,21 +1,26 @@
+import logging
 import unittest
-from collections import deque
 from unittest.mock import create_autospec
 
 from Bot.MergeDispatcher import BotPresentationModel
 from Bot.MergeDispatcher import BranchQueue
 from Bot.MergeDispatcher import CancelRequestStatus
+from Bot.MergeDispatcher import Config
 from Bot.MergeDispatcher import Dispatcher
 from Bot.MergeDispatcher import DoneRequestStatus
 from Bot.MergeDispatcher import FixRequestStatus
+from Bot.MergeDispatcher import HistoryRollup
+from Bot.MergeDispatcher import IndexedPriorityQueue
 from Bot.MergeDispatcher import KickRequestStatus
 from Bot.MergeDispatcher import MergeRequestStatus
 from Bot.MergeDispatcher import MessageSender
 from Bot.MergeDispatcher import Messages
 from Bot.MergeDispatcher import Notifier
 from Bot.MergeDispatcher import NotifierActions
+from Bot.MergeDispatcher import Priority
 from Bot.MergeDispatcher import States
 from Bot.MergeDispatcher import SubscribeRequestStatus
+from Bot.MergeDispatcher import TrainSizes
 from Bot.MergeDispatcher import UnsubscribeRequestStatus
 from Bot.MergeDispatcher import User
 from Bot.MergeDispatcher import BotModel
@@ -37,12 +42,18 @@ class MessageSenderTests(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             message_sender.request_merge_confirmation(123, "message", "default")
 
+    def test_shouldThrowNotImplementedExceptionFromBaseClassForInlineQueryAnswer(self):
+        message_sender = MessageSender()
+        with self.assertRaises(NotImplementedError):
+            message_sender.answer_inline_query("123", [])
+
 
 class BotPresentationModelMergeLogicTest(unittest.TestCase):
     def setUp(self):
         self._branch = "default"
         self._merge_dispatcher = create_autospec(Dispatcher)
         self._merge_dispatcher.get_all_branches.return_value = [self._branch]
+        self._merge_dispatcher.get_queue_estimates.return_value = None
         self._message_sender = create_autospec(MessageSender)
         self._users_holder = create_autospec(BotModel)
         self._presentation_model = BotPresentationModel(self._merge_dispatcher, self._message_sender)
@@ -73,7 +84,7 @@ class BotPresentationModelMergeLogicTest(unittest.TestCase):
 
     def test_shouldStartMergeForSelectedBranch(self):
         self._presentation_model.request_merge(self._identifier, self._branch)
-        self._merge_dispatcher.merge.assert_called_once_with(self._identifier, self._branch)
+        self._merge_dispatcher.merge.assert_called_once_with(self._identifier, self._branch, Priority.normal)
 
     def test_shouldNotCallMessageSenderIfMergeRequestWasSuccessfulAndMergeWasStarted(self):
         self._merge_dispatcher.merge.return_value = MergeRequestStatus.merge_started
@@ -85,7 +96,7 @@ class BotPresentationModelMergeLogicTest(unittest.TestCase):
         user_in_queue = User("Chivas Regal", 9999)
         branch_queue_info = BranchQueue()
         branch_queue_info.active_user = active_user
-        branch_queue_info.users_queue = deque([user_in_queue])
+        branch_queue_info.users_queue = IndexedPriorityQueue([user_in_queue])
         self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
         self._merge_dispatcher.merge.return_value = MergeRequestStatus.merge_requested
         self._presentation_model.request_merge(self._identifier, self._branch)
@@ -93,6 +104,41 @@ class BotPresentationModelMergeLogicTest(unittest.TestCase):
                                                           Messages.MERGE_ADDED_TO_QUEUE_MESSAGE.format("2nd",
                                                                                                        self._branch))
 
+    def test_shouldShowEstimatedStartInJoinMessage(self):
+        branch_queue_info = BranchQueue()
+        branch_queue_info.active_user = User("Johnny Walker", 8888)
+        branch_queue_info.users_queue = IndexedPriorityQueue([User("Chivas Regal", 9999),
+                                                              User("Jack Daniels", self._identifier)])
+        self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
+        self._merge_dispatcher.get_queue_estimates.return_value = [600.0, 4200.0]
+        self._merge_dispatcher.merge.return_value = MergeRequestStatus.merge_requested
+        self._presentation_model.request_merge(self._identifier, self._branch)
+        self._message_sender.send.assert_called_once_with(
+            self._identifier, Messages.MERGE_ADDED_TO_QUEUE_MESSAGE.format("3rd", self._branch) +
+            Messages.MERGE_ESTIMATE_MESSAGE.format(Messages.ESTIMATE_IN.format("1 h 10 min")))
+
+    def test_shouldShowPositionAfterPriorityChanged(self):
+        user = User("Jack Daniels", self._identifier)
+        branch_queue_info = BranchQueue()
+        branch_queue_info.active_user = User("Johnny Walker", 8888)
+        branch_queue_info.users_queue = IndexedPriorityQueue([User("Chivas Regal", 9999)])
+        branch_queue_info.users_queue.append(user, Priority.hotfix)
+        self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
+        self._merge_dispatcher.get_user.return_value = user
+        self._merge_dispatcher.merge.return_value = MergeRequestStatus.priority_changed
+        self._presentation_model.request_merge(self._identifier, self._branch, Priority.hotfix)
+        self._merge_dispatcher.merge.assert_called_once_with(self._identifier, self._branch, Priority.hotfix)
+        self._message_sender.send.assert_called_once_with(
+            self._identifier, Messages.MERGE_PRIORITY_CHANGED_MESSAGE.format(self._branch, "hotfix", "2nd"))
+
+    def test_shouldCallBranchSelectorWithPriorityState(self):
+        branches = ["default", "release"]
+        self._merge_dispatcher.get_all_branches.return_value = branches
+        self._presentation_model.request_merge(self._identifier, priority=Priority.hotfix)
+        self._message_sender.send_branch_selector.assert_called_once_with(
+            self._identifier, States.hotfix, Messages.MERGE_SELECT_BRANCH_WITH_PRIORITY_MESSAGE.format("hotfix"),
+            branches)
+
     def test_shouldCallMessageSenderIfMergeRequestWasUnsuccessfulBecauseUserAlreadyInQueue(self):
         self._merge_dispatcher.merge.return_value = MergeRequestStatus.already_in_queue
         self._presentation_model.request_merge(self._identifier, self._branch)
@@ -115,6 +161,25 @@ class BotPresentationModelMergeLogicTest(unittest.TestCase):
         self._message_sender.send.assert_called_once_with(self._identifier,
                                                           Messages.CONFIRM_MERGE_FAILED_MESSAGE.format(self._branch))
 
+    def test_shouldRequestLinkedMergeToExactlyMatchingBranches(self):
+        branches = {"master": ["master", "master-old"], "dev": ["develop"]}
+        self._merge_dispatcher.get_all_branches.side_effect = lambda branch_filter: branches[branch_filter]
+        self._merge_dispatcher.merge_linked.return_value = MergeRequestStatus.merge_requested
+        self._presentation_model.request_linked_merge(self._identifier, ["master", "dev"], Priority.release)
+        self._merge_dispatcher.merge_linked.assert_called_once_with(self._identifier, ["master", "develop"],
+                                                                    Priority.release)
+        self._message_sender.send.assert_called_once_with(self._identifier,
+                                                          Messages.MERGE_LINKED_ADDED_MESSAGE.format("master, develop"))
+
+    def test_shouldNotRequestLinkedMergeIfBranchIsAmbiguous(self):
+        branches = {"master": ["master"], "release": ["release/1.0", "release/2.0"]}
+        self._merge_dispatcher.get_all_branches.side_effect = lambda branch_filter: branches[branch_filter]
+        self._presentation_model.request_linked_merge(self._identifier, ["master", "release"])
+        self._merge_dispatcher.merge_linked.assert_not_called()
+        self._message_sender.send.assert_called_once_with(self._identifier,
+                                                          Messages.MERGE_LINKED_BRANCH_NOT_FOUND_MESSAGE.format(
+                                                              "release"))
+
 
 class BotPresentationModelCancelLogicTest(unittest.TestCase):
     def setUp(self):
@@ -311,7 +376,7 @@ class BotPresentationModelQueueLogicTest(unittest.TestCase):
         user_in_queue = User("Chivas Regal", 9999)
         branch_queue_info = BranchQueue()
         branch_queue_info.active_user = active_user
-        branch_queue_info.users_queue = deque([user_in_queue])
+        branch_queue_info.users_queue = IndexedPriorityQueue([user_in_queue])
         self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
         self._presentation_model.request_queue_info(self._identifier, self._branch)
         users_list = Messages.QUEUE_INFO_USER_IN_MERGE.format(active_user.get_name())
@@ -323,7 +388,7 @@ class BotPresentationModelQueueLogicTest(unittest.TestCase):
         active_user = User("Johnny Walker", 45454)
         branch_queue_info = BranchQueue()
         branch_queue_info.active_user = active_user
-        branch_queue_info.users_queue = deque([self._user])
+        branch_queue_info.users_queue = IndexedPriorityQueue([self._user])
         self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
         self._presentation_model.request_queue_info(self._identifier, self._branch)
         users_list = Messages.QUEUE_INFO_USER_IN_MERGE.format(active_user.get_name())
@@ -334,7 +399,7 @@ class BotPresentationModelQueueLogicTest(unittest.TestCase):
     def test_shouldWorkIfNoActiveUserButUsersInQueue(self):
         branch_queue_info = BranchQueue()
         branch_queue_info.active_user = None
-        branch_queue_info.users_queue = deque([self._user])
+        branch_queue_info.users_queue = IndexedPriorityQueue([self._user])
         self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
         self._presentation_model.request_queue_info(self._identifier, self._branch)
         users_list = Messages.QUEUE_INFO_CURRENT_USER_IN_QUEUE.format(self._user.get_name())
@@ -342,6 +407,221 @@ class BotPresentationModelQueueLogicTest(unittest.TestCase):
         self._message_sender.send.assert_called_once_with(self._identifier, message)
 
 
+class BotPresentationModelQueueRenderingTest(unittest.TestCase):
+    def setUp(self):
+        self._branch = "default"
+        self._merge_dispatcher = create_autospec(Dispatcher)
+        self._merge_dispatcher.get_all_branches.return_value = [self._branch]
+        self._merge_dispatcher.get_branch_generation.return_value = 1
+        self._merge_dispatcher.get_queue_estimates.return_value = None
+        self._message_sender = create_autospec(MessageSender)
+        self._presentation_model = BotPresentationModel(self._merge_dispatcher, self._message_sender)
+        self._identifier = 123456
+        self._user = User("Jack Daniels", self._identifier)
+        self._active_user = User("Johnny Walker", 8888)
+        branch_queue_info = BranchQueue()
+        branch_queue_info.active_user = self._active_user
+        branch_queue_info.users_queue = IndexedPriorityQueue([self._user])
+        self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
+
+    def tearDown(self):
+        self._presentation_model = None
+
+    def test_shouldNotRequestQueueInformationIfGenerationNotChanged(self):
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self._merge_dispatcher.get_branch_queue_info.assert_called_once_with(self._branch)
+
+    def test_shouldRequestQueueInformationIfGenerationChanged(self):
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self._merge_dispatcher.get_branch_generation.return_value = 2
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self.assertEqual(2, self._merge_dispatcher.get_branch_queue_info.call_count)
+
+    def test_shouldHighlightOnlyRequestingUserInCachedQueue(self):
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self._message_sender.reset_mock()
+        self._presentation_model.request_queue_info(self._active_user.get_identifier(), self._branch)
+        users_list = Messages.QUEUE_INFO_CURRENT_USER_IN_MERGE.format(self._active_user.get_name())
+        users_list += Messages.QUEUE_INFO_USER_IN_QUEUE.format(self._user.get_name())
+        message = Messages.QUEUE_INFO_MESSAGE.format(self._branch, users_list)
+        self._message_sender.send.assert_called_once_with(self._active_user.get_identifier(), message)
+
+    def test_shouldNotCacheQueueOfNonExistingBranch(self):
+        self._merge_dispatcher.get_branch_generation.return_value = None
+        self._merge_dispatcher.get_branch_queue_info.return_value = None
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self.assertEqual(2, self._merge_dispatcher.get_branch_queue_info.call_count)
+
+    def test_shouldTruncateLongQueue(self):
+        limit = BotPresentationModel.QUEUE_INFO_USERS_LIMIT
+        users = [User("User {}".format(index), index) for index in range(limit + 5)]
+        branch_queue_info = BranchQueue()
+        branch_queue_info.users_queue = IndexedPriorityQueue(users)
+        self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        users_list = "".join(Messages.QUEUE_INFO_USER_IN_QUEUE.format(user.get_name()) for user in users[:limit])
+        users_list += Messages.QUEUE_INFO_MORE_USERS_IN_QUEUE.format(5)
+        message = Messages.QUEUE_INFO_MESSAGE.format(self._branch, users_list)
+        self._message_sender.send.assert_called_once_with(self._identifier, message)
+
+    def test_shouldShowPositionOfRequestingUserIfHeIsNotInTruncatedQueue(self):
+        limit = BotPresentationModel.QUEUE_INFO_USERS_LIMIT
+        users = [User("User {}".format(index), index) for index in range(limit)]
+        branch_queue_info = BranchQueue()
+        branch_queue_info.users_queue = IndexedPriorityQueue(users + [self._user])
+        self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        users_list = "".join(Messages.QUEUE_INFO_USER_IN_QUEUE.format(user.get_name()) for user in users)
+        users_list += Messages.QUEUE_INFO_MORE_USERS_IN_QUEUE.format(1)
+        message = Messages.QUEUE_INFO_MESSAGE.format(self._branch, users_list)
+        message += Messages.QUEUE_INFO_CURRENT_USER_FAR_IN_QUEUE.format(self._user.get_name(), "31st")
+        self._message_sender.send.assert_called_once_with(self._identifier, message)
+
+    def test_shouldShowEveryTrainMemberInMerge(self):
+        other_user = User("Chivas Regal", 9999)
+        branch_queue_info = BranchQueue()
+        branch_queue_info.train = ((self._active_user, Priority.normal), (self._user, Priority.normal))
+        branch_queue_info.active_user = self._active_user
+        branch_queue_info.users_queue = IndexedPriorityQueue([other_user])
+        self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        users_list = Messages.QUEUE_INFO_USER_IN_MERGE.format(self._active_user.get_name())
+        users_list += Messages.QUEUE_INFO_CURRENT_USER_IN_MERGE.format(self._user.get_name())
+        users_list += Messages.QUEUE_INFO_USER_IN_QUEUE.format(other_user.get_name())
+        message = Messages.QUEUE_INFO_MESSAGE.format(self._branch, users_list)
+        self._message_sender.send.assert_called_once_with(self._identifier, message)
+
+    def test_shouldShowPriorityOfNotNormalMerges(self):
+        other_user = User("Chivas Regal", 9999)
+        branch_queue_info = self._merge_dispatcher.get_branch_queue_info.return_value
+        branch_queue_info.active_priority = Priority.fix
+        branch_queue_info.users_queue.append(other_user, Priority.hotfix)
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        users_list = Messages.QUEUE_INFO_USER_IN_MERGE.format(self._active_user.get_name())
+        users_list += Messages.QUEUE_INFO_PRIORITY.format("fix")
+        users_list += Messages.QUEUE_INFO_USER_IN_QUEUE.format(other_user.get_name())
+        users_list += Messages.QUEUE_INFO_PRIORITY.format("hotfix")
+        users_list += Messages.QUEUE_INFO_CURRENT_USER_IN_QUEUE.format(self._user.get_name())
+        message = Messages.QUEUE_INFO_MESSAGE.format(self._branch, users_list)
+        self._message_sender.send.assert_called_once_with(self._identifier, message)
+
+    def test_shouldShowOtherBranchesOfLinkedMerges(self):
+        self._merge_dispatcher.get_branch_queue_info.return_value.link(self._user, (self._branch, "release", "master"))
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        users_list = Messages.QUEUE_INFO_USER_IN_MERGE.format(self._active_user.get_name())
+        users_list += Messages.QUEUE_INFO_CURRENT_USER_IN_QUEUE.format(self._user.get_name())
+        users_list += Messages.QUEUE_INFO_LINKED.format("release, master")
+        message = Messages.QUEUE_INFO_MESSAGE.format(self._branch, users_list)
+        self._message_sender.send.assert_called_once_with(self._identifier, message)
+
+    def test_shouldShowEstimatedStartOfEachPosition(self):
+        other_user = User("Chivas Regal", 9999)
+        self._merge_dispatcher.get_branch_queue_info.return_value.users_queue.append(other_user)
+        self._merge_dispatcher.get_queue_estimates.return_value = [30.0, 1530.0]
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        users_list = Messages.QUEUE_INFO_USER_IN_MERGE.format(self._active_user.get_name())
+        users_list += Messages.QUEUE_INFO_CURRENT_USER_IN_QUEUE.format(self._user.get_name())
+        users_list += Messages.QUEUE_INFO_ESTIMATE.format(Messages.ESTIMATE_SOON)
+        users_list += Messages.QUEUE_INFO_USER_IN_QUEUE.format(other_user.get_name())
+        users_list += Messages.QUEUE_INFO_ESTIMATE.format(Messages.ESTIMATE_IN.format("25 min"))
+        message = Messages.QUEUE_INFO_MESSAGE.format(self._branch, users_list)
+        self._message_sender.send.assert_called_once_with(self._identifier, message)
+
+    def test_shouldRenderQueueAgainIfEstimatesChanged(self):
+        self._merge_dispatcher.get_queue_estimates.return_value = [600.0]
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self._merge_dispatcher.get_queue_estimates.return_value = [610.0]
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self._merge_dispatcher.get_queue_estimates.return_value = [540.0]
+        self._presentation_model.request_queue_info(self._identifier, self._branch)
+        self.assertEqual(2, self._merge_dispatcher.get_branch_queue_info.call_count)
+
+
+class BotPresentationModelQueueRenamingTest(unittest.TestCase):
+    def setUp(self):
+        self._branch = "default"
+        self._model = BotModel(Config([self._branch], trains=TrainSizes({self._branch: 2})))
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'),
+                                            trains=TrainSizes({self._branch: 2}))
+        self._message_sender = create_autospec(MessageSender)
+        self._presentation_model = BotPresentationModel(self._merge_dispatcher, self._message_sender)
+        for user_id in (100, 200, 300):
+            self._merge_dispatcher.update_user(user_id, "User", str(user_id))
+            self._merge_dispatcher.merge(user_id, self._branch)
+        self._merge_dispatcher.done(100, self._branch)
+
+    def tearDown(self):
+        self._presentation_model = None
+
+    def test_shouldShowNewNameOfTrainMember(self):
+        self._presentation_model.request_queue_info(100, self._branch)
+        self._merge_dispatcher.update_user(300, "Chivas", "Regal")
+        self._message_sender.reset_mock()
+
+        self._presentation_model.request_queue_info(100, self._branch)
+        users_list = Messages.QUEUE_INFO_USER_IN_MERGE.format("User 200")
+        users_list += Messages.QUEUE_INFO_USER_IN_MERGE.format("Chivas Regal")
+        message = Messages.QUEUE_INFO_MESSAGE.format(self._branch, users_list)
+        self._message_sender.send.assert_called_once_with(100, message)
+
+
+class BotPresentationModelInlineQueryTest(unittest.TestCase):
+    def setUp(self):
+        self._branch = "default"
+        self._query_id = "4242"
+        self._merge_dispatcher = create_autospec(Dispatcher)
+        self._merge_dispatcher.get_all_branches.return_value = [self._branch]
+        self._merge_dispatcher.get_branch_queue_info.return_value = BranchQueue()
+        self._message_sender = create_autospec(MessageSender)
+        self._presentation_model = BotPresentationModel(self._merge_dispatcher, self._message_sender)
+
+    def tearDown(self):
+        self._presentation_model = None
+
+    def test_shouldSearchBranchesWithInlineQuery(self):
+        self._presentation_model.request_inline_branches(self._query_id, " def ")
+        self._merge_dispatcher.get_all_branches.assert_called_once_with("def")
+
+    def test_shouldSearchAllBranchesIfInlineQueryIsEmpty(self):
+        self._presentation_model.request_inline_branches(self._query_id, "")
+        self._merge_dispatcher.get_all_branches.assert_called_once_with(None)
+
+    def test_shouldAnswerWithEmptyQueueDescription(self):
+        self._presentation_model.request_inline_branches(self._query_id, self._branch)
+        result = MessageSender.InlineResult(self._branch, Messages.INLINE_BRANCH_EMPTY_DESCRIPTION,
+                                            Messages.INLINE_BRANCH_COMMAND.format(self._branch))
+        self._message_sender.answer_inline_query.assert_called_once_with(self._query_id, [result])
+
+    def test_shouldAnswerWithActiveUserAndQueueLength(self):
+        branch_queue_info = BranchQueue()
+        branch_queue_info.active_user = User("Johnny &amp; Walker", 8888)
+        branch_queue_info.users_queue = IndexedPriorityQueue([User("Chivas Regal", 9999)])
+        self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
+        self._presentation_model.request_inline_branches(self._query_id, self._branch)
+        description = Messages.INLINE_BRANCH_IN_MERGE_DESCRIPTION.format("Johnny & Walker", 1)
+        result = MessageSender.InlineResult(self._branch, description,
+                                            Messages.INLINE_BRANCH_COMMAND.format(self._branch))
+        self._message_sender.answer_inline_query.assert_called_once_with(self._query_id, [result])
+
+    def test_shouldAnswerWithWaitingDescriptionIfNoActiveUser(self):
+        branch_queue_info = BranchQueue()
+        branch_queue_info.users_queue = IndexedPriorityQueue([User("Chivas Regal", 9999)])
+        self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
+        self._presentation_model.request_inline_branches(self._query_id, self._branch)
+        result = MessageSender.InlineResult(self._branch, Messages.INLINE_BRANCH_WAITING_DESCRIPTION.format(1),
+                                            Messages.INLINE_BRANCH_COMMAND.format(self._branch))
+        self._message_sender.answer_inline_query.assert_called_once_with(self._query_id, [result])
+
+    def test_shouldLimitNumberOfInlineResults(self):
+        branches = ["branch{}".format(index) for index in range(BotPresentationModel.INLINE_RESULTS_LIMIT + 10)]
+        self._merge_dispatcher.get_all_branches.return_value = branches
+        self._presentation_model.request_inline_branches(self._query_id, "branch")
+        results = self._message_sender.answer_inline_query.call_args[0][1]
+        self.assertEqual(BotPresentationModel.INLINE_RESULTS_LIMIT, len(results))
+
+
 class BotPresentationModelKickTest(unittest.TestCase):
     def setUp(self):
         self._branch = "default"
@@ -379,7 +659,7 @@ class BotPresentationModelKickTest(unittest.TestCase):
     def test_shouldSendMessageIfNoUsersInBranch(self):
         branch_queue_info = BranchQueue()
         branch_queue_info.active_user = None
-        branch_queue_info.users_queue = deque()
+        branch_queue_info.users_queue = IndexedPriorityQueue()
         self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
         self._presentation_model.request_kick(self._identifier)
         self._message_sender.send.assert_called_once_with(self._identifier,
@@ -396,7 +676,7 @@ class BotPresentationModelKickTest(unittest.TestCase):
         user_in_queue = User("Chivas Regal", 9999)
         branch_queue_info = BranchQueue()
         branch_queue_info.active_user = active_user
-        branch_queue_info.users_queue = deque([user_in_queue, self._user])
+        branch_queue_info.users_queue = IndexedPriorityQueue([user_in_queue, self._user])
         self._merge_dispatcher.get_branch_queue_info.return_value = branch_queue_info
         self._presentation_model.request_kick(self._identifier)
         self._message_sender.send_user_selector.assert_called_once_with(self._identifier,
@@ -711,6 +991,10 @@ class BotPresentationModelNotifierTest(unittest.TestCase):
         message = str.format(Messages.ACTION_MESSAGE_STARTED_MERGE, self._branch)
         self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
 
+    def test_shouldInvalidateMarkupsOfMessageSender(self):
+        self._presentation_model.invalidate()
+        self._message_sender.invalidate_markups.assert_called_once_with()
+
     def test_shouldSendMessageIfUserReadyToMerge(self):
         self._presentation_model.notify(self._whom_user, NotifierActions.ready_to_merge,
                                         Notifier.ActionData(self._whom_user, self._branch))
@@ -718,6 +1002,28 @@ class BotPresentationModelNotifierTest(unittest.TestCase):
         self._message_sender.request_merge_confirmation.assert_called_once_with(self._whom_user_id, message,
                                                                                 self._branch)
 
+    def test_shouldSendMessageWithAllBranchesIfUserReadyToLinkedMerge(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.ready_to_merge,
+                                        Notifier.LinkedActionData(self._whom_user, self._branch,
+                                                                  (self._branch, "release")))
+        message = str.format(Messages.ACTION_MESSAGE_YOUR_LINKED_MERGE_TURN, self._branch + ", release")
+        self._message_sender.request_merge_confirmation.assert_called_once_with(self._whom_user_id, message,
+                                                                                self._branch)
+
+    def test_shouldSendMessageWithPriorityIfUserJoinsQueueWithPriority(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.joins_queue,
+                                        Notifier.ActionData(self._action_user, self._branch, Priority.release))
+        message = str.format(Messages.ACTION_MESSAGE_GENERIC_WITH_PRIORITY, self._action_user.get_name(),
+                             "has joined queue for merge", self._branch, "release")
+        self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
+
+    def test_shouldSendMessageIfUserChangesPriority(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.changes_priority,
+                                        Notifier.ActionData(self._action_user, self._branch, Priority.hotfix))
+        message = str.format(Messages.ACTION_MESSAGE_PRIORITY_CHANGED, self._action_user.get_name(), self._branch,
+                             "hotfix")
+        self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
+
     def test_shouldNotSendMessageIfSameUserAsSenderJoinsQueue(self):
         self._presentation_model.notify(self._whom_user, NotifierActions.joins_queue,
                                         Notifier.ActionData(self._whom_user, self._branch))
@@ -772,12 +1078,155 @@ class BotPresentationModelNotifierTest(unittest.TestCase):
         message = str.format(Messages.ACTION_MESSAGE_PUSH_BACK, self._action_user.get_name(), self._branch)
         self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
 
+    def test_shouldSendMessageIfYourTrainWasPushedAwayByMergeFix(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.starts_fix,
+                                        Notifier.MergeFixActionData(self._action_user, self._branch,
+                                                                    self._kicked_user,
+                                                                    (self._kicked_user, self._whom_user)))
+        message = str.format(Messages.ACTION_MESSAGE_PUSH_BACK, self._action_user.get_name(), self._branch)
+        self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
+
+    def test_shouldSendMessageToTrainMemberWithOtherMembers(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.starts_train,
+                                        Notifier.TrainActionData(self._action_user, self._branch,
+                                                                 (self._action_user, self._whom_user,
+                                                                  self._kicked_user)))
+        message = str.format(Messages.ACTION_MESSAGE_YOUR_TRAIN_STARTED, self._branch,
+                             self._action_user.get_name() + ", " + self._kicked_user.get_name())
+        self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
+
+    def test_shouldSendMessageWithAllMembersIfTrainStarted(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.starts_train,
+                                        Notifier.TrainActionData(self._action_user, self._branch,
+                                                                 (self._action_user, self._kicked_user)))
+        message = str.format(Messages.ACTION_MESSAGE_TRAIN_STARTED, self._branch,
+                             self._action_user.get_name() + ", " + self._kicked_user.get_name())
+        self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
+
     def test_shouldSendMessageIfSomeoneStartedMergeFixInYourQueue(self):
         self._presentation_model.notify(self._whom_user, NotifierActions.starts_fix,
                                         Notifier.MergeFixActionData(self._action_user, self._branch, None))
         message = str.format(Messages.ACTION_MESSAGE_STARTS_FIX, self._action_user.get_name(), self._branch)
         self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
 
+    def test_shouldSendMessageIfBranchWasRemoved(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.branch_removed,
+                                        Notifier.ActionData(None, self._branch))
+        message = str.format(Messages.ACTION_MESSAGE_BRANCH_REMOVED, self._branch)
+        self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
+
+    def test_shouldRemindYouAboutMerge(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.reminds_merge,
+                                        Notifier.ActionData(self._whom_user, self._branch))
+        message = str.format(Messages.ACTION_MESSAGE_REMIND_MERGE, self._branch)
+        self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
+
+    def test_shouldSendMessageIfYouWereSkipped(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.skips_user,
+                                        Notifier.ActionData(self._whom_user, self._branch))
+        message = str.format(Messages.ACTION_MESSAGE_YOU_SKIPPED, self._branch)
+        self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
+
+    def test_shouldSendMessageIfSomeonesMergeWasReleased(self):
+        self._presentation_model.notify(self._whom_user, NotifierActions.releases_merge,
+                                        Notifier.ActionData(self._action_user, self._branch))
+        message = str.format(Messages.ACTION_MESSAGE_MERGE_RELEASED, self._action_user.get_name(), self._branch)
+        self._message_sender.send.assert_called_once_with(self._whom_user_id, message)
+
+
+class BotPresentationModelBatchNotifierTest(unittest.TestCase):
+    def setUp(self):
+        self._branch = "default"
+        self._merge_dispatcher = create_autospec(Dispatcher)
+        self._message_sender = create_autospec(MessageSender)
+        self._presentation_model = BotPresentationModel(self._merge_dispatcher, self._message_sender)
+        self._user = User("Jack Daniels", 123456)
+        self._other_user = User("Johnny Walker", 8888)
+
+    def tearDown(self):
+        self._presentation_model = None
+
+    def test_shouldSendAllNotificationsForUserInOneMessage(self):
+        self._presentation_model.notify_batch(self._user, [
+            (NotifierActions.starts_merge, Notifier.ActionData(self._other_user, self._branch)),
+            (NotifierActions.done_merge, Notifier.ActionData(self._other_user, self._branch))
+        ])
+        message = Messages.BATCH_NOTIFICATIONS_SEPARATOR.join([
+            str.format(Messages.ACTION_MESSAGE_GENERIC, self._other_user.get_name(),
+                       Messages.ACTION_TEXT_MERGE_STARTED, self._branch),
+            str.format(Messages.ACTION_MESSAGE_GENERIC, self._other_user.get_name(),
+                       Messages.ACTION_TEXT_MERGE_FINISHED, self._branch)
+        ])
+        self._message_sender.send.assert_called_once_with(self._user.get_identifier(), message)
+
+    def test_shouldRequestMergeConfirmationSeparately(self):
+        self._presentation_model.notify_batch(self._user, [
+            (NotifierActions.ready_to_merge, Notifier.ActionData(self._user, self._branch)),
+            (NotifierActions.done_merge, Notifier.ActionData(self._other_user, self._branch))
+        ])
+        self._message_sender.send.assert_called_once_with(
+            self._user.get_identifier(), str.format(Messages.ACTION_MESSAGE_GENERIC, self._other_user.get_name(),
+                                                    Messages.ACTION_TEXT_MERGE_FINISHED, self._branch))
+        self._message_sender.request_merge_confirmation.assert_called_once_with(
+            self._user.get_identifier(), str.format(Messages.ACTION_MESSAGE_YOUR_MERGE_TURN, self._branch),
+            self._branch)
+
+    def test_shouldNotSendAnythingIfNoNotificationsForUser(self):
+        self._presentation_model.notify_batch(self._user, [
+            (NotifierActions.joins_queue, Notifier.ActionData(self._user, self._branch))
+        ])
+        self._message_sender.send.assert_not_called()
+        self._message_sender.request_merge_confirmation.assert_not_called()
+
+
+class BotPresentationModelStatsTest(unittest.TestCase):
+    def setUp(self):
+        self._branch = "default"
+        self._merge_dispatcher = create_autospec(Dispatcher)
+        self._merge_dispatcher.get_all_branches.return_value = [self._branch]
+        self._merge_dispatcher.get_user.return_value = User("Jack Daniels", 100)
+        self._message_sender = create_autospec(MessageSender)
+        self._presentation_model = BotPresentationModel(self._merge_dispatcher, self._message_sender)
+        self._identifier = 123456
+
+    def test_shouldShowStatisticsOfBranch(self):
+        statistics = HistoryRollup()
+        statistics.add_merge(100, 3000.0)
+        statistics.add_merge(200, 600.0)
+        statistics.add_wait(0.0)
+        statistics.add_wait(1200.0)
+        self._merge_dispatcher.get_merge_statistics.return_value = statistics
+        self._presentation_model.request_stats(self._identifier, self._branch)
+        self._merge_dispatcher.get_merge_statistics.assert_called_once_with(BotPresentationModel.STATS_DAYS,
+                                                                            self._branch)
+        self._message_sender.send.assert_called_once_with(
+            self._identifier,
+            Messages.STATS_INFO_MESSAGE.format(Messages.STATS_BRANCH.format(self._branch),
+                                               BotPresentationModel.STATS_DAYS, 2, "30 min", "50 min", "10 min",
+                                               "20 min") +
+            Messages.STATS_LONGEST_HOLDER.format("Jack Daniels", "50 min"))
+
+    def test_shouldShowStatisticsOfAllBranchesWithoutFilter(self):
+        self._merge_dispatcher.get_merge_statistics.return_value = HistoryRollup()
+        self._presentation_model.request_stats(self._identifier)
+        self._merge_dispatcher.get_all_branches.assert_not_called()
+        self._message_sender.send.assert_called_once_with(
+            self._identifier, Messages.STATS_EMPTY_MESSAGE.format(Messages.STATS_ALL_BRANCHES,
+                                                                  BotPresentationModel.STATS_DAYS))
+
+    def test_shouldShowMessageIfHistoryIsNotCollected(self):
+        self._merge_dispatcher.get_merge_statistics.return_value = None
+        self._presentation_model.request_stats(self._identifier, self._branch)
+        self._message_sender.send.assert_called_once_with(self._identifier, Messages.STATS_UNAVAILABLE_MESSAGE)
+
+    def test_shouldCallMessageSenderWithBranchSelectorIfMultipleBranchesAvailable(self):
+        branches = ["default", "release"]
+        self._merge_dispatcher.get_all_branches.return_value = branches
+        self._presentation_model.request_stats(self._identifier, "e")
+        self._message_sender.send_branch_selector.assert_called_once_with(self._identifier, States.stats,
+                                                                          Messages.STATS_SELECT_BRANCH_MESSAGE,
+                                                                          branches)
+
 
 class BotPresentationModelModelManagementTest(unittest.TestCase):
     def setUp(self):
@@ -1,11 +1,22 @@
 import unittest
 from unittest.mock import create_autospec
+from unittest.mock import patch
 
 import logging
-
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+
+from Bot.MergeDispatcher import BatchOperation
+from Bot.MergeDispatcher import BatchOperationStatus
+from Bot.MergeDispatcher import BatchOperationType
 from Bot.MergeDispatcher import CancelRequestStatus
 from Bot.MergeDispatcher import Config
 from Bot.MergeDispatcher import Dispatcher
+from Bot.MergeDispatcher import DurationEstimate
 from Bot.MergeDispatcher import DoneRequestStatus
 from Bot.MergeDispatcher import KickRequestStatus
 from Bot.MergeDispatcher import MergeRequestStatus
@@ -14,8 +25,24 @@ from Bot.MergeDispatcher import SubscribeRequestStatus
 from Bot.MergeDispatcher import UnsubscribeRequestStatus
 from Bot.MergeDispatcher import User
 from Bot.MergeDispatcher import NotifierActions
+from Bot.MergeDispatcher import Priority
+from Bot.MergeDispatcher import QueueStateAPI
 from Bot.MergeDispatcher import BotModel
+from Bot.MergeDispatcher import BranchIndex
+from Bot.MergeDispatcher import BranchPatterns
 from Bot.MergeDispatcher import FixRequestStatus
+from Bot.MergeDispatcher import MetricsRegistry
+from Bot.MergeDispatcher import Tracer
+from Bot.MergeDispatcher import ChromeTraceFileSink
+from Bot.MergeDispatcher import Event
+from Bot.MergeDispatcher import EventStore
+from Bot.MergeDispatcher import EventType
+from Bot.MergeDispatcher import HistoryRollup
+from Bot.MergeDispatcher import MergeHistory
+from Bot.MergeDispatcher import Scheduler
+from Bot.MergeDispatcher import TimeoutPolicies
+from Bot.MergeDispatcher import TimeoutPolicy
+from Bot.MergeDispatcher import TrainSizes
 
 
 class NotifierTest(unittest.TestCase):
@@ -25,6 +52,16 @@ class NotifierTest(unittest.TestCase):
             notifier.notify(User("Jack Daniels", 123), NotifierActions.starts_merge, None)
 
 
+class NotifierBatchTest(unittest.TestCase):
+    def test_baseClassShouldDelegateBatchToNotify(self):
+        notifier = Notifier()
+        user = User("Jack Daniels", 123)
+        with patch.object(notifier, "notify") as notify:
+            notifier.notify_batch(user, [(NotifierActions.starts_merge, Notifier.ActionData(user, "default")),
+                                         (NotifierActions.done_merge, Notifier.ActionData(user, "default"))])
+        self.assertEqual(2, notify.call_count)
+
+
 class UserTest(unittest.TestCase):
     def test_shouldRememberName(self):
         name = "Jack Daniels"
@@ -153,6 +190,28 @@ class MergeDispatcherQueueLogicTest(unittest.TestCase):
         self._model.remove_user(self._model.get_user(self._second_user_id))
         self.assertEqual(0, len(self._merge_dispatcher.get_branch_queue_info(branch).users_queue))
 
+    def test_shouldRemoveUserFromTrain(self):
+        branch = self._model.get_branches()[self._config.get_branches()[0]]
+        first_user, second_user = self._model.get_user(self._first_user_id), self._model.get_user(self._second_user_id)
+        branch.users_queue.append(first_user)
+        branch.users_queue.append(second_user)
+        branch.start_train(2)
+        self._model.remove_user(first_user)
+        self.assertEqual(second_user, branch.active_user)
+        self.assertTupleEqual((second_user,), branch.train_users)
+        self.assertFalse(branch.is_merging(first_user))
+
+    def test_shouldRemoveUserFromAllQueuesOfLinkedMerge(self):
+        branches = self._config.get_branches()[:2]
+        self._merge_dispatcher.merge(self._first_user_id, branches[0])
+        self._merge_dispatcher.merge_linked(self._second_user_id, branches)
+        second_user = self._model.get_user(self._second_user_id)
+        self._model.remove_user(second_user)
+        for branch in branches:
+            queue_info = self._merge_dispatcher.get_branch_queue_info(branch)
+            self.assertNotIn(second_user, queue_info.users_queue)
+            self.assertTupleEqual((), queue_info.get_linked_branches(second_user))
+
     def test_shouldRemoveUserFromSubscriptions(self):
         branch = self._config.get_branches()[0]
         self._merge_dispatcher.subscribe(self._first_user_id, branch)
@@ -459,6 +518,329 @@ class MergeDispatcherQueueLogicTest(unittest.TestCase):
         self.assertEqual(UnsubscribeRequestStatus.user_not_in_branch, result)
 
 
+class MergeDispatcherGenerationTest(unittest.TestCase):
+    def setUp(self):
+        self._config = Config(["default", "release"])
+        self._model = BotModel(self._config)
+        self._first_user_id = 123
+        self._second_user_id = 456
+        self._model.update_or_create_user(self._first_user_id, "Jack", "Daniels")
+        self._model.update_or_create_user(self._second_user_id, "Chivas", "Regal")
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'))
+        self._branch = self._config.get_branches()[0]
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+
+    def test_shouldReturnNoneGenerationForNonExistingBranch(self):
+        self.assertIsNone(self._merge_dispatcher.get_branch_generation("unknown"))
+
+    def test_shouldChangeGenerationOnEveryBranchMutation(self):
+        generations = [self._merge_dispatcher.get_branch_generation(self._branch)]
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        generations.append(self._merge_dispatcher.get_branch_generation(self._branch))
+        self._merge_dispatcher.merge(self._second_user_id, self._branch)
+        generations.append(self._merge_dispatcher.get_branch_generation(self._branch))
+        self._merge_dispatcher.done(self._first_user_id, self._branch)
+        generations.append(self._merge_dispatcher.get_branch_generation(self._branch))
+        self._merge_dispatcher.confirm_merge(self._second_user_id, self._branch)
+        generations.append(self._merge_dispatcher.get_branch_generation(self._branch))
+        self._merge_dispatcher.fix(self._first_user_id, self._branch)
+        generations.append(self._merge_dispatcher.get_branch_generation(self._branch))
+        self._merge_dispatcher.kick(self._first_user_id, self._second_user_id, self._branch)
+        generations.append(self._merge_dispatcher.get_branch_generation(self._branch))
+        self._merge_dispatcher.cancel(self._first_user_id, self._branch)
+        generations.append(self._merge_dispatcher.get_branch_generation(self._branch))
+        self._merge_dispatcher.subscribe(self._first_user_id, self._branch)
+        generations.append(self._merge_dispatcher.get_branch_generation(self._branch))
+        self._merge_dispatcher.unsubscribe(self._first_user_id, self._branch)
+        generations.append(self._merge_dispatcher.get_branch_generation(self._branch))
+        self.assertEqual(len(generations), len(set(generations)))
+
+    def test_shouldNotChangeGenerationIfRequestFailed(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        generation = self._merge_dispatcher.get_branch_generation(self._branch)
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        self._merge_dispatcher.done(self._second_user_id, self._branch)
+        self.assertEqual(generation, self._merge_dispatcher.get_branch_generation(self._branch))
+
+    def test_shouldNotChangeGenerationOfOtherBranches(self):
+        generation = self._merge_dispatcher.get_branch_generation("release")
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        self.assertEqual(generation, self._merge_dispatcher.get_branch_generation("release"))
+
+    def test_shouldChangeGenerationIfUserInQueueWasRenamed(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        generation = self._merge_dispatcher.get_branch_generation(self._branch)
+        self._merge_dispatcher.update_user(self._first_user_id, "Jackie", "Daniels")
+        self.assertNotEqual(generation, self._merge_dispatcher.get_branch_generation(self._branch))
+
+    def test_shouldChangeGenerationIfUserInQueueWasRemoved(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        generation = self._merge_dispatcher.get_branch_generation(self._branch)
+        self._model.remove_user(self._model.get_user(self._first_user_id))
+        self.assertNotEqual(generation, self._merge_dispatcher.get_branch_generation(self._branch))
+
+
+class MergeDispatcherMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self._config = Config(["default", "release"])
+        self._metrics = MetricsRegistry()
+        self._backup_dir = tempfile.TemporaryDirectory()
+        self._model = BotModel(self._config, backup_path=self._backup_dir.name, metrics=self._metrics)
+        self._first_user_id = 123
+        self._second_user_id = 456
+        self._model.update_or_create_user(self._first_user_id, "Jack", "Daniels")
+        self._model.update_or_create_user(self._second_user_id, "Chivas", "Regal")
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'), metrics=self._metrics)
+        self._branch = self._config.get_branches()[0]
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+        self._backup_dir.cleanup()
+
+    def test_shouldMeasureModelDump(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+
+        self.assertEqual(1, self._metrics.get_metric("mergebot_model_dump_seconds").get_count())
+        self.assertGreater(self._metrics.get_metric("mergebot_model_dump_bytes").get_sum(), 0)
+
+    def test_shouldReportQueueLengthsAndActiveUsers(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        self._merge_dispatcher.merge(self._second_user_id, self._branch)
+
+        self.assertEqual(1, self._metrics.get_metric("mergebot_branch_queue_length").get_value((self._branch,)))
+        self.assertEqual(0, self._metrics.get_metric("mergebot_branch_queue_length").get_value(("release",)))
+        self.assertEqual(1, self._metrics.get_metric("mergebot_branch_active_users").get_value((self._branch,)))
+
+    def test_shouldMeasureNotificationFanout(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        self._merge_dispatcher.merge(self._second_user_id, self._branch)
+
+        fanout = self._metrics.get_metric("mergebot_notification_fanout")
+        self.assertEqual(1, fanout.get_count((NotifierActions.joins_queue.name,)))
+        self.assertEqual(2, fanout.get_sum((NotifierActions.joins_queue.name,)))
+
+
+class MergeDispatcherTracingTest(unittest.TestCase):
+    def setUp(self):
+        self._backup_dir = tempfile.TemporaryDirectory()
+        self._model = BotModel(Config(["default"]), backup_path=self._backup_dir.name)
+        self._user_id = 123
+        self._model.update_or_create_user(self._user_id, "Jack", "Daniels")
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'))
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+        self._backup_dir.cleanup()
+
+    def test_shouldTraceDispatcherAndPersistence(self):
+        sink = create_autospec(ChromeTraceFileSink)
+        with Tracer(sink, sample_rate=1.0).trace("handler.merge"):
+            self._merge_dispatcher.merge(self._user_id, "default")
+
+        span_names = [trace_span.get_name() for trace_span in sink.write.call_args[0][0].get_spans()]
+        self.assertListEqual(["model.dump", "dispatcher.merge", "handler.merge"], span_names)
+
+
+class MergeDispatcherSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self._config = Config(["default", "release"])
+        self._model = BotModel(self._config)
+        self._first_user_id = 123
+        self._second_user_id = 456
+        self._model.update_or_create_user(self._first_user_id, "Jack", "Daniels")
+        self._model.update_or_create_user(self._second_user_id, "Chivas", "Regal")
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'))
+        self._branch = self._config.get_branches()[0]
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+
+    def test_shouldReturnSameSnapshotIfBranchNotChanged(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        snapshot = self._merge_dispatcher.get_branch_queue_info(self._branch)
+        self.assertIs(snapshot, self._merge_dispatcher.get_branch_queue_info(self._branch))
+        self.assertEqual(1, self._merge_dispatcher.get_snapshot_allocations())
+
+    def test_shouldReturnNewSnapshotAfterBranchChanged(self):
+        snapshot = self._merge_dispatcher.get_branch_queue_info(self._branch)
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        self.assertIsNot(snapshot, self._merge_dispatcher.get_branch_queue_info(self._branch))
+        self.assertEqual(2, self._merge_dispatcher.get_snapshot_allocations())
+
+    def test_shouldKeepSnapshotFrozenAfterBranchChanged(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        snapshot = self._merge_dispatcher.get_branch_queue_info(self._branch)
+        self._merge_dispatcher.merge(self._second_user_id, self._branch)
+        self._merge_dispatcher.subscribe(self._second_user_id, self._branch)
+        self.assertEqual(self._model.get_user(self._first_user_id), snapshot.active_user)
+        self.assertEqual(0, len(snapshot.users_queue))
+        self.assertEqual(0, len(snapshot.subscriptions))
+
+    def test_shouldListActiveUserQueueAndSubscribersAsRecipientsOnce(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        self._merge_dispatcher.merge(self._second_user_id, self._branch)
+        self._merge_dispatcher.subscribe(self._second_user_id, self._branch)
+        self._model.update_or_create_user(789, "Johnny", "Walker")
+        self._merge_dispatcher.subscribe(789, self._branch)
+        recipients = self._merge_dispatcher.get_branch_queue_info(self._branch).recipients
+        self.assertTupleEqual((self._model.get_user(self._first_user_id), self._model.get_user(self._second_user_id),
+                               self._model.get_user(789)), recipients)
+
+    def test_shouldReuseRecipientsUntilBranchChanged(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        recipients = self._merge_dispatcher.get_branch_queue_info(self._branch).recipients
+        self.assertIs(recipients, self._merge_dispatcher.get_branch_queue_info(self._branch).recipients)
+
+    def test_shouldComputeRecipientsOnceForAllNotificationsOfCommand(self):
+        self._merge_dispatcher.set_notifier(create_autospec(Notifier))
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        self._merge_dispatcher.merge(self._second_user_id, self._branch)
+        allocations = self._merge_dispatcher.get_snapshot_allocations()
+        self._merge_dispatcher.cancel(self._first_user_id, self._branch)
+        self.assertEqual(allocations + 1, self._merge_dispatcher.get_snapshot_allocations())
+
+    def test_shouldNotAllowToModifySnapshot(self):
+        snapshot = self._merge_dispatcher.get_branch_queue_info(self._branch)
+        with self.assertRaises(AttributeError):
+            snapshot.active_user = self._model.get_user(self._first_user_id)
+        with self.assertRaises(AttributeError):
+            snapshot.users_queue.append(self._model.get_user(self._first_user_id))
+        with self.assertRaises(AttributeError):
+            snapshot.subscriptions.add(self._model.get_user(self._first_user_id))
+
+
+class MergeDispatcherBatchTest(unittest.TestCase):
+    def setUp(self):
+        self._config = Config(["default", "release"])
+        self._model = BotModel(self._config)
+        self._first_user_id = 123
+        self._second_user_id = 456
+        self._third_user_id = 789
+        self._model.update_or_create_user(self._first_user_id, "Jack", "Daniels")
+        self._model.update_or_create_user(self._second_user_id, "Chivas", "Regal")
+        self._model.update_or_create_user(self._third_user_id, "Johnny", "Walker")
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'))
+        self._notifier = create_autospec(Notifier)
+        self._merge_dispatcher.set_notifier(self._notifier)
+        self._branch = self._config.get_branches()[0]
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+
+    def test_shouldReturnStatusOfEveryOperation(self):
+        result = self._merge_dispatcher.execute_batch([
+            BatchOperation(BatchOperationType.merge, self._first_user_id, self._branch),
+            BatchOperation(BatchOperationType.merge, self._second_user_id, self._branch),
+            BatchOperation(BatchOperationType.subscribe, self._third_user_id, self._branch)
+        ])
+        self.assertTrue(result.is_committed())
+        self.assertListEqual([MergeRequestStatus.merge_started, MergeRequestStatus.merge_requested,
+                              SubscribeRequestStatus.subscription_complete], result.get_statuses())
+
+    def test_shouldDumpModelOnceForBatch(self):
+        with patch.object(self._model, "dump") as dump:
+            self._merge_dispatcher.execute_batch([
+                BatchOperation(BatchOperationType.merge, self._first_user_id, self._branch),
+                BatchOperation(BatchOperationType.merge, self._second_user_id, self._branch),
+                BatchOperation(BatchOperationType.kick, self._third_user_id, self._branch, self._first_user_id)
+            ])
+        dump.assert_called_once_with()
+
+    def test_shouldNotDumpModelIfBatchChangedNothing(self):
+        self._merge_dispatcher.subscribe(self._first_user_id, self._branch)
+        with patch.object(self._model, "dump") as dump:
+            self._merge_dispatcher.execute_batch([
+                BatchOperation(BatchOperationType.subscribe, self._first_user_id, self._branch)
+            ])
+        dump.assert_not_called()
+
+    def test_shouldMergeNotificationsPerRecipient(self):
+        self._merge_dispatcher.subscribe(self._third_user_id, self._branch)
+        self._notifier.reset_mock()
+        self._merge_dispatcher.execute_batch([
+            BatchOperation(BatchOperationType.merge, self._first_user_id, self._branch),
+            BatchOperation(BatchOperationType.merge, self._second_user_id, self._branch)
+        ])
+        self._notifier.notify.assert_not_called()
+        self._notifier.notify_batch.assert_any_call(
+            self._model.get_user(self._third_user_id),
+            [(NotifierActions.starts_merge, Notifier.ActionData(self._model.get_user(self._first_user_id),
+                                                                self._branch)),
+             (NotifierActions.joins_queue, Notifier.ActionData(self._model.get_user(self._second_user_id),
+                                                               self._branch))])
+        self.assertEqual(3, self._notifier.notify_batch.call_count)
+
+    def test_shouldRollbackAllOperationsIfOneOfThemFailed(self):
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        self._notifier.reset_mock()
+        with patch.object(self._model, "dump") as dump:
+            result = self._merge_dispatcher.execute_batch([
+                BatchOperation(BatchOperationType.cancel, self._first_user_id, self._branch),
+                BatchOperation(BatchOperationType.merge, self._second_user_id, self._branch),
+                BatchOperation(BatchOperationType.done, self._third_user_id, self._branch),
+                BatchOperation(BatchOperationType.merge, self._third_user_id, self._branch)
+            ])
+        self.assertFalse(result.is_committed())
+        self.assertListEqual([CancelRequestStatus.merge_cancelled, MergeRequestStatus.merge_started,
+                              DoneRequestStatus.user_not_active, BatchOperationStatus.not_executed],
+                             result.get_statuses())
+        branch_queue_info = self._merge_dispatcher.get_branch_queue_info(self._branch)
+        self.assertEqual(self._model.get_user(self._first_user_id), branch_queue_info.active_user)
+        self.assertEqual(0, len(branch_queue_info.users_queue))
+        dump.assert_not_called()
+        self._notifier.notify.assert_not_called()
+        self._notifier.notify_batch.assert_not_called()
+
+    def test_shouldRollbackIfUserNotExist(self):
+        result = self._merge_dispatcher.execute_batch([
+            BatchOperation(BatchOperationType.subscribe, self._first_user_id, self._branch),
+            BatchOperation(BatchOperationType.kick, self._first_user_id, self._branch, 100500)
+        ])
+        self.assertFalse(result.is_committed())
+        self.assertEqual(BatchOperationStatus.user_not_exist, result.get_statuses()[1])
+        self.assertEqual(0, len(self._merge_dispatcher.get_branch_queue_info(self._branch).subscriptions))
+
+    def test_shouldRollbackIfBranchNotExist(self):
+        result = self._merge_dispatcher.execute_batch([
+            BatchOperation(BatchOperationType.merge, self._first_user_id, self._branch),
+            BatchOperation(BatchOperationType.merge, self._first_user_id, "not_so_default")
+        ])
+        self.assertFalse(result.is_committed())
+        self.assertIsNone(self._merge_dispatcher.get_branch_queue_info(self._branch).active_user)
+
+    def test_shouldRemoveBranchOfPatternCreatedByRolledBackBatch(self):
+        model = BotModel(Config(["default", "release/*"]))
+        model.update_or_create_user(self._first_user_id, "Jack", "Daniels")
+        model.update_or_create_user(self._second_user_id, "Chivas", "Regal")
+        merge_dispatcher = Dispatcher(model, logger=logging.getLogger('Tests'))
+        self.assertListEqual(["default"], merge_dispatcher.get_all_branches())
+
+        result = merge_dispatcher.execute_batch([
+            BatchOperation(BatchOperationType.merge, self._first_user_id, "release/1.0"),
+            BatchOperation(BatchOperationType.done, self._second_user_id, "release/1.0")
+        ])
+        self.assertFalse(result.is_committed())
+        self.assertNotIn("release/1.0", model.get_branches())
+        self.assertListEqual(["default"], merge_dispatcher.get_all_branches())
+        self.assertIsNone(merge_dispatcher.get_branch_queue_info("release/1.0").active_user)
+
+    def test_shouldRollbackAndRaiseIfOperationRaised(self):
+        with patch.object(self._merge_dispatcher, "fix", side_effect=RuntimeError("Broken")):
+            with self.assertRaises(RuntimeError):
+                self._merge_dispatcher.execute_batch([
+                    BatchOperation(BatchOperationType.merge, self._first_user_id, self._branch),
+                    BatchOperation(BatchOperationType.fix, self._second_user_id, self._branch)
+                ])
+        self.assertIsNone(self._merge_dispatcher.get_branch_queue_info(self._branch).active_user)
+        self._merge_dispatcher.merge(self._first_user_id, self._branch)
+        self._notifier.notify.assert_any_call(self._model.get_user(self._first_user_id),
+                                              NotifierActions.starts_merge,
+                                              Notifier.ActionData(self._model.get_user(self._first_user_id),
+                                                                  self._branch))
+
+
 class MergeDispatcherNotifierLogicTest(unittest.TestCase):
     def setUp(self):
         self._config = Config(["default", "release"])
@@ -747,3 +1129,1209 @@ class MergeDispatcherBranchInformationTest(unittest.TestCase):
 
         user_branches = set(self._merge_dispatcher.get_branches_user_not_subscribed_to(self._first_user_id))
         self.assertSetEqual({"release"}, user_branches)
+
+
+class BranchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._branches = ["default", "release-1.0", "release-2.0", "feature/Default-Icons"]
+        self._index = BranchIndex(self._branches)
+
+    def tearDown(self):
+        self._index = None
+
+    def test_shouldReturnAllBranchesIfNoQuery(self):
+        self.assertListEqual(self._branches, self._index.find())
+
+    def test_shouldFindBranchesByShortQuery(self):
+        self.assertListEqual(["release-1.0", "release-2.0"], self._index.find("rel"))
+
+    def test_shouldFindBranchesByLongQueryIgnoringCase(self):
+        self.assertListEqual(["default", "feature/Default-Icons"], self._index.find("DEFAULT"))
+
+    def test_shouldFindBranchesBySubstringInTheMiddleOfName(self):
+        self.assertListEqual(["release-2.0"], self._index.find("se-2"))
+
+    def test_shouldReturnEmptyListIfNothingMatches(self):
+        self.assertListEqual([], self._index.find("hotfix"))
+
+    def test_shouldNotReturnBranchesWhichContainOnlyGramsOfQuery(self):
+        index = BranchIndex(["abcxbcd"])
+        self.assertListEqual([], index.find("abcd"))
+
+    def test_shouldMatchFilterBranchesResults(self):
+        for query in ["d", "de", "def", "elease", "-", "0", "icons", "x"]:
+            self.assertListEqual(Dispatcher.filter_branches(self._branches, query), self._index.find(query))
+
+    def test_shouldReturnSameResultsForCachedQuery(self):
+        self._index.find("release")
+        self.assertListEqual(["release-1.0", "release-2.0"], self._index.find("release"))
+
+    def test_shouldNotAllowToModifyCachedResults(self):
+        self._index.find("release").append("hotfix")
+        self.assertListEqual(["release-1.0", "release-2.0"], self._index.find("release"))
+
+    def test_shouldFindAddedBranch(self):
+        self._index.find("rel")
+        self.assertTrue(self._index.add("release-3.0"))
+        self.assertListEqual(["release-1.0", "release-2.0", "release-3.0"], self._index.find("rel"))
+        self.assertFalse(self._index.add("release-3.0"))
+
+    def test_shouldNotFindRemovedBranch(self):
+        self._index.find("release")
+        self.assertTrue(self._index.remove("release-1.0"))
+        self.assertListEqual(["release-2.0"], self._index.find("release"))
+        self.assertListEqual(["default", "release-2.0", "feature/Default-Icons"], self._index.find())
+        self.assertListEqual([], self._index.find("e-1"))
+        self.assertFalse(self._index.remove("release-1.0"))
+
+    def test_shouldKeepOrderAfterRemoveAndAdd(self):
+        self._index.remove("default")
+        self._index.add("default")
+        self.assertListEqual(["feature/Default-Icons", "default"], self._index.find("default"))
+
+
+class MergeDispatcherBranchesUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self._config = Config(["default", "release"])
+        self._model = BotModel(self._config)
+        self._first_user_id = 123
+        self._second_user_id = 456
+        self._third_user_id = 789
+        self._model.update_or_create_user(self._first_user_id, "Jack", "Daniels")
+        self._model.update_or_create_user(self._second_user_id, "Chivas", "Regal")
+        self._model.update_or_create_user(self._third_user_id, "Johnny", "Walker")
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'))
+        self._notifier = create_autospec(Notifier)
+        self._merge_dispatcher.set_notifier(self._notifier)
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+
+    def test_shouldAddAndRemoveBranches(self):
+        added, removed = self._merge_dispatcher.update_branches(["default", "hotfix"])
+
+        self.assertListEqual(["hotfix"], added)
+        self.assertListEqual(["release"], removed)
+        self.assertCountEqual(["default", "hotfix"], self._model.get_branches().keys())
+        self.assertEqual(MergeRequestStatus.merge_started, self._merge_dispatcher.merge(self._first_user_id, "hotfix"))
+        self.assertEqual(MergeRequestStatus.branch_not_exist,
+                         self._merge_dispatcher.merge(self._first_user_id, "release"))
+
+    def test_shouldApplyWholeConfig(self):
+        added, removed = self._merge_dispatcher.update_config(Config(["default", "hotfix"],
+                                                                     trains=TrainSizes({"default": 2})))
+        self.assertListEqual(["hotfix"], added)
+        self.assertListEqual(["release"], removed)
+
+        for user_id in [self._first_user_id, self._second_user_id, self._third_user_id]:
+            self._merge_dispatcher.merge(user_id, "default")
+        self._merge_dispatcher.done(self._first_user_id, "default")
+        self.assertTupleEqual((self._model.get_user(self._second_user_id), self._model.get_user(self._third_user_id)),
+                              self._model.get_branches()["default"].train_users)
+
+    def test_shouldUpdateBranchSearch(self):
+        self.assertListEqual(["release"], self._merge_dispatcher.get_all_branches("rel"))
+        self._merge_dispatcher.update_branches(["default", "release-2.0"])
+        self.assertListEqual(["release-2.0"], self._merge_dispatcher.get_all_branches("rel"))
+        self.assertListEqual(["default", "release-2.0"], self._merge_dispatcher.get_all_branches())
+
+    def test_shouldNotifyUsersOfRemovedBranch(self):
+        self._merge_dispatcher.merge(self._first_user_id, "release")
+        self._merge_dispatcher.merge(self._second_user_id, "release")
+        self._merge_dispatcher.subscribe(self._third_user_id, "release")
+        self._notifier.reset_mock()
+
+        self._merge_dispatcher.update_branches(["default"])
+
+        action_data = Notifier.ActionData(None, "release")
+        for user_id in [self._first_user_id, self._second_user_id, self._third_user_id]:
+            self._notifier.notify.assert_any_call(self._model.get_user(user_id), NotifierActions.branch_removed,
+                                                  action_data)
+        self.assertEqual(3, self._notifier.notify.call_count)
+        self.assertIsNone(self._merge_dispatcher.get_branch_queue_info("release"))
+
+    def test_shouldNotNotifyAnyoneIfNothingChanged(self):
+        self._merge_dispatcher.merge(self._first_user_id, "release")
+        self._notifier.reset_mock()
+
+        self.assertEqual(([], []), self._merge_dispatcher.update_branches(["release", "default"]))
+        self._notifier.notify.assert_not_called()
+        self._notifier.invalidate.assert_not_called()
+
+    def test_shouldInvalidateNotifierWhenBranchesOrUsersChange(self):
+        self._merge_dispatcher.update_branches(["default", "hotfix"])
+        self.assertEqual(1, self._notifier.invalidate.call_count)
+        self._merge_dispatcher.update_user(self._first_user_id, "Jack", "Daniels")
+        self.assertEqual(1, self._notifier.invalidate.call_count)
+        self._merge_dispatcher.update_user(self._first_user_id, "Jim", "Beam")
+        self._merge_dispatcher.update_user(1000, "Jameson", None)
+        self.assertEqual(3, self._notifier.invalidate.call_count)
+
+    def test_shouldStartEmptyQueueForReaddedBranch(self):
+        self._merge_dispatcher.merge(self._first_user_id, "release")
+        generation = self._merge_dispatcher.get_branch_generation("release")
+
+        self._merge_dispatcher.update_branches(["default"])
+        self._merge_dispatcher.update_branches(["default", "release"])
+
+        queue_info = self._merge_dispatcher.get_branch_queue_info("release")
+        self.assertIsNone(queue_info.active_user)
+        self.assertGreater(queue_info.generation, generation)
+
+
+class BranchPatternsTest(unittest.TestCase):
+    def test_shouldDetectPatterns(self):
+        self.assertTrue(BranchPatterns.is_pattern("release/*"))
+        self.assertTrue(BranchPatterns.is_pattern("re:feature/\\d+"))
+        self.assertFalse(BranchPatterns.is_pattern("default"))
+
+    def test_shouldMatchGlobAndRegexPatterns(self):
+        patterns = BranchPatterns(["release/*", "re:feature/\\d+"])
+        self.assertTrue(patterns.matches("release/1.2"))
+        self.assertTrue(patterns.matches("feature/42"))
+        self.assertFalse(patterns.matches("feature/new-icons"))
+        self.assertFalse(patterns.matches("default"))
+
+    def test_shouldNotMatchAnythingWithoutPatterns(self):
+        self.assertFalse(BranchPatterns().matches("default"))
+
+    def test_shouldRaiseExceptionForIncorrectRegex(self):
+        with self.assertRaises(ValueError):
+            BranchPatterns(["re:feature/("])
+
+    def test_shouldSplitConfigBranchesAndPatterns(self):
+        config = Config(["default", "release/*"])
+        self.assertListEqual(["default"], config.get_branches())
+        self.assertTupleEqual(("release/*",), config.get_branch_patterns().get_patterns())
+
+    def test_shouldReuseCompiledFilter(self):
+        self.assertIs(BranchPatterns.compile_filter("release/*"), BranchPatterns.compile_filter("release/*"))
+
+    def test_shouldFilterWithGlob(self):
+        self.assertListEqual(["release/1.2"],
+                             Dispatcher.filter_branches(["default", "release/1.2", "pre-release/1.2"], "release/*"))
+
+
+class MergeDispatcherBranchPatternsTest(unittest.TestCase):
+    def setUp(self):
+        self._model = BotModel(Config(["default", "release/*"]))
+        self._first_user_id = 123
+        self._second_user_id = 456
+        self._model.update_or_create_user(self._first_user_id, "Jack", "Daniels")
+        self._model.update_or_create_user(self._second_user_id, "Chivas", "Regal")
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'), branch_idle_time=60)
+        self._notifier = create_autospec(Notifier)
+        self._merge_dispatcher.set_notifier(self._notifier)
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+
+    def test_shouldNotCreateQueuesForPatterns(self):
+        self.assertListEqual(["default"], list(self._model.get_branches()))
+        self.assertListEqual(["default"], self._merge_dispatcher.get_all_branches())
+
+    def test_shouldCreateQueueOnFirstUse(self):
+        self.assertEqual(MergeRequestStatus.merge_started,
+                         self._merge_dispatcher.merge(self._first_user_id, "release/1.2"))
+        self.assertIn("release/1.2", self._model.get_branches())
+        self.assertListEqual(["default", "release/1.2"], self._merge_dispatcher.get_all_branches())
+        self.assertEqual(self._model.get_user(self._first_user_id),
+                         self._merge_dispatcher.get_branch_queue_info("release/1.2").active_user)
+
+    def test_shouldNotCreateQueueForUnknownBranch(self):
+        self.assertEqual(MergeRequestStatus.branch_not_exist,
+                         self._merge_dispatcher.merge(self._first_user_id, "feature/1"))
+        self.assertNotIn("feature/1", self._model.get_branches())
+
+    def test_shouldFindBranchMatchingPatternBeforeItIsCreated(self):
+        self.assertListEqual(["release/2.0"], self._merge_dispatcher.get_all_branches("release/2.0"))
+        self.assertNotIn("release/2.0", self._model.get_branches())
+
+    def test_shouldReturnEmptyQueueInfoWithoutCreatingQueue(self):
+        queue_info = self._merge_dispatcher.get_branch_queue_info("release/2.0")
+        self.assertIsNone(queue_info.active_user)
+        self.assertTupleEqual((), queue_info.users_queue)
+        self.assertNotIn("release/2.0", self._model.get_branches())
+
+    def test_shouldFilterBranchesWithGlob(self):
+        self._merge_dispatcher.merge(self._first_user_id, "release/1.2")
+        self._merge_dispatcher.merge(self._first_user_id, "default")
+        self.assertListEqual(["release/1.2"], self._merge_dispatcher.get_all_branches("release/*"))
+
+    def test_shouldReclaimEmptyIdleQueue(self):
+        self._merge_dispatcher.merge(self._first_user_id, "release/1.2")
+        self._merge_dispatcher.done(self._first_user_id, "release/1.2")
+        generation = self._merge_dispatcher.get_branch_generation("release/1.2")
+
+        self.assertListEqual([], self._merge_dispatcher.reclaim_idle_branches())
+        self._notifier.invalidate.assert_not_called()
+        self.assertListEqual(["release/1.2"], self._merge_dispatcher.reclaim_idle_branches(time.time() + 60))
+        self._notifier.invalidate.assert_called_once_with()
+        self.assertListEqual(["default"], list(self._model.get_branches()))
+        self.assertListEqual(["default"], self._merge_dispatcher.get_all_branches())
+        self.assertEqual(generation, self._merge_dispatcher.get_branch_generation("release/1.2"))
+
+        self._merge_dispatcher.merge(self._first_user_id, "release/1.2")
+        self.assertGreater(self._merge_dispatcher.get_branch_generation("release/1.2"), generation)
+
+    def test_shouldNotReclaimUsedOrConfiguredQueues(self):
+        self._merge_dispatcher.merge(self._first_user_id, "release/1.2")
+        self._merge_dispatcher.subscribe(self._second_user_id, "release/1.3")
+        self.assertListEqual([], self._merge_dispatcher.reclaim_idle_branches(time.time() + 60))
+        self.assertCountEqual(["default", "release/1.2", "release/1.3"], self._model.get_branches())
+
+    def test_shouldNotLeaveQueueChangesAfterBatchRollback(self):
+        result = self._merge_dispatcher.execute_batch([
+            BatchOperation(BatchOperationType.merge, self._first_user_id, "release/1.2"),
+            BatchOperation(BatchOperationType.done, self._second_user_id, "release/1.2")])
+        self.assertFalse(result.is_committed())
+        self.assertIsNone(self._merge_dispatcher.get_branch_queue_info("release/1.2").active_user)
+
+    def test_shouldRemoveBranchesNotMatchingNewPatterns(self):
+        self._merge_dispatcher.merge(self._first_user_id, "release/1.2")
+        self._notifier.reset_mock()
+
+        added, removed = self._merge_dispatcher.update_branches(["default"], BranchPatterns(["hotfix/*"]))
+
+        self.assertListEqual([], added)
+        self.assertListEqual(["release/1.2"], removed)
+        self._notifier.notify.assert_called_once_with(self._model.get_user(self._first_user_id),
+                                                      NotifierActions.branch_removed,
+                                                      Notifier.ActionData(None, "release/1.2"))
+        self.assertIsNone(self._merge_dispatcher.get_branch_queue_info("release/1.2"))
+        self.assertIsNotNone(self._merge_dispatcher.get_branch_queue_info("hotfix/1"))
+
+    def test_shouldRestoreQueuesMatchingPatterns(self):
+        with tempfile.TemporaryDirectory() as backup_path:
+            model = BotModel(Config(["default", "release/*"]), backup_path=backup_path)
+            model.update_or_create_user(self._first_user_id, "Jack", "Daniels")
+            Dispatcher(model, logger=logging.getLogger('Tests')).merge(self._first_user_id, "release/1.2")
+
+            restored_model = BotModel(Config(["default", "release/*"]), backup_path=backup_path, restore=True)
+            self.assertCountEqual(["default", "release/1.2"], restored_model.get_branches())
+
+            restored_model = BotModel(Config(["default"]), backup_path=backup_path, restore=True)
+            self.assertListEqual(["default"], list(restored_model.get_branches()))
+
+
+class TimeoutPoliciesTest(unittest.TestCase):
+    def test_shouldOverrideDefaultPolicyForBranch(self):
+        policies = TimeoutPolicies({"default": TimeoutPolicy(remind_after=60, skip_after=120),
+                                    "master": TimeoutPolicy(skip_after=300)})
+        self.assertEqual(TimeoutPolicy(remind_after=60, skip_after=300), policies.get_policy("master"))
+        self.assertEqual(TimeoutPolicy(remind_after=60, skip_after=120), policies.get_policy("develop"))
+
+    def test_shouldPreferLongestMatchingPattern(self):
+        policies = TimeoutPolicies({"release/*": TimeoutPolicy(release_after=60),
+                                    "release/1.*": TimeoutPolicy(release_after=120)})
+        self.assertEqual(TimeoutPolicy(release_after=120), policies.get_policy("release/1.2"))
+        self.assertEqual(TimeoutPolicy(release_after=60), policies.get_policy("release/2.0"))
+        self.assertTrue(policies.get_policy("master").is_empty())
+
+    def test_shouldRaiseExceptionForIncorrectTimeout(self):
+        with self.assertRaises(ValueError):
+            TimeoutPolicy(remind_after=0)
+
+
+class MergeDispatcherTimeoutsTest(unittest.TestCase):
+    def setUp(self):
+        self._backup_directory = tempfile.TemporaryDirectory()
+        self._timeouts = TimeoutPolicies({"default": TimeoutPolicy(remind_after=60, skip_after=120,
+                                                                   release_after=600)})
+        self._model = BotModel(Config(["default"]), backup_path=self._backup_directory.name)
+        self._first_user_id = 123
+        self._second_user_id = 456
+        self._model.update_or_create_user(self._first_user_id, "Jack", "Daniels")
+        self._model.update_or_create_user(self._second_user_id, "Chivas", "Regal")
+        self._first_user = self._model.get_user(self._first_user_id)
+        self._second_user = self._model.get_user(self._second_user_id)
+        self._scheduler = Scheduler()
+        self._merge_dispatcher = self._create_dispatcher(self._model, self._scheduler)
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+        self._backup_directory.cleanup()
+
+    def _create_dispatcher(self, model, scheduler):
+        dispatcher = Dispatcher(model, logger=logging.getLogger('Tests'), scheduler=scheduler, timeouts=self._timeouts)
+        self._notifier = create_autospec(Notifier)
+        dispatcher.set_notifier(self._notifier)
+        dispatcher.prepare()
+        return dispatcher
+
+    def _get_actions(self):
+        return [(notify_call[0][0], notify_call[0][1]) for notify_call in self._notifier.notify.call_args_list]
+
+    def test_shouldRemindActiveUser(self):
+        self._merge_dispatcher.merge(self._first_user_id, "default")
+        self._notifier.reset_mock()
+        self.assertEqual(0, self._scheduler.run_pending(time.time() + 30))
+        self._scheduler.run_pending(time.time() + 90)
+        self.assertListEqual([(self._first_user, NotifierActions.reminds_merge)], self._get_actions())
+
+    def test_shouldReleaseActiveUserAndNotifyNextOne(self):
+        self._merge_dispatcher.merge(self._first_user_id, "default")
+        self._merge_dispatcher.merge(self._second_user_id, "default")
+        self._notifier.reset_mock()
+        self._scheduler.run_pending(time.time() + 700)
+
+        self.assertIsNone(self._model.get_branches()["default"].active_user)
+        self.assertIn((self._first_user, NotifierActions.releases_merge), self._get_actions())
+        self.assertIn((self._second_user, NotifierActions.ready_to_merge), self._get_actions())
+
+    def test_shouldSkipUnconfirmedUser(self):
+        self._merge_dispatcher.merge(self._first_user_id, "default")
+        self._merge_dispatcher.merge(self._second_user_id, "default")
+        self._merge_dispatcher.done(self._first_user_id, "default")
+        self._notifier.reset_mock()
+        self._scheduler.run_pending(time.time() + 180)
+
+        self.assertListEqual([], list(self._model.get_branches()["default"].users_queue))
+        self.assertIn((self._second_user, NotifierActions.reminds_confirmation), self._get_actions())
+        self.assertIn((self._second_user, NotifierActions.skips_user), self._get_actions())
+
+    def test_shouldCancelTimersWhenMergeIsDone(self):
+        self._merge_dispatcher.merge(self._first_user_id, "default")
+        self.assertEqual(2, len(self._scheduler))
+        self._merge_dispatcher.done(self._first_user_id, "default")
+        self.assertEqual(0, len(self._scheduler))
+        self._notifier.reset_mock()
+        self.assertEqual(0, self._scheduler.run_pending(time.time() + 700))
+        self._notifier.notify.assert_not_called()
+
+    def test_shouldRestartTimersWhenConfirmedUserStartsMerge(self):
+        self._merge_dispatcher.merge(self._first_user_id, "default")
+        self._merge_dispatcher.merge(self._second_user_id, "default")
+        self._merge_dispatcher.done(self._first_user_id, "default")
+        self._merge_dispatcher.confirm_merge(self._second_user_id, "default")
+        self._notifier.reset_mock()
+        self._scheduler.run_pending(time.time() + 180)
+        self.assertEqual(self._second_user, self._model.get_branches()["default"].active_user)
+        self.assertListEqual([(self._second_user, NotifierActions.reminds_merge)], self._get_actions())
+
+    def test_shouldScheduleTimersAfterBatchCommit(self):
+        self._merge_dispatcher.execute_batch([BatchOperation(BatchOperationType.merge, self._first_user_id, "default")])
+        self.assertEqual(2, len(self._scheduler))
+
+    def test_shouldRestoreTimersAfterRestart(self):
+        self._merge_dispatcher.merge(self._first_user_id, "default")
+        self._scheduler.run_pending(time.time() + 90)
+        started = self._model.get_branches()["default"].slot_started
+
+        model = BotModel(Config(["default"]), backup_path=self._backup_directory.name, restore=True)
+        scheduler = Scheduler()
+        self._create_dispatcher(model, scheduler)
+        self.assertEqual(started, model.get_branches()["default"].slot_started)
+        self.assertEqual(1, len(scheduler))
+        scheduler.run_pending(started + 600)
+        self.assertIsNone(model.get_branches()["default"].active_user)
+        self.assertListEqual([(self._first_user, NotifierActions.releases_merge)],
+                             [action for action in self._get_actions() if action[0] == self._first_user])
+
+    def test_shouldNotRunHandlersDuringTimeout(self):
+        self._merge_dispatcher.merge(self._first_user_id, "default")
+        self._notifier.reset_mock()
+        handler = threading.Thread(target=self._merge_dispatcher.merge, args=(self._second_user_id, "default"))
+        handler_waits = []
+
+        def notify(whom, action_type, action_data):
+            if action_type == NotifierActions.releases_merge and not handler_waits:
+                handler.start()
+                handler.join(0.1)
+                handler_waits.append(handler.is_alive())
+
+        self._notifier.notify.side_effect = notify
+        self._scheduler.run_pending(time.time() + 700)
+        handler.join()
+
+        self.assertListEqual([True], handler_waits)
+        self.assertEqual(self._second_user, self._model.get_branches()["default"].active_user)
+
+    def test_shouldApplyNewTimeouts(self):
+        self._merge_dispatcher.merge(self._first_user_id, "default")
+        self._merge_dispatcher.set_timeouts(TimeoutPolicies())
+        self.assertEqual(0, len(self._scheduler))
+
+
+class EventStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._model = BotModel(Config(["default"]), backup_path=self._directory.name)
+        self._model.update_or_create_user(123, "Jack", "Daniels")
+        self._event_stores = []
+
+    def tearDown(self):
+        for event_store in self._event_stores:
+            event_store.close()
+        self._directory.cleanup()
+
+    def _create_event_store(self, **kwargs):
+        event_store = EventStore(os.path.join(self._directory.name, "events"), **kwargs)
+        self._event_stores.append(event_store)
+        return event_store
+
+    def test_shouldReadEventsFromAllSegments(self):
+        event_store = self._create_event_store(segment_size=2)
+        for _ in range(5):
+            event_store.append(Event(EventType.subscribes, time.time(), "default", 123))
+        event_store.close()
+
+        event_store = self._create_event_store(segment_size=2)
+        self.assertEqual(5, event_store.get_last_sequence())
+        self.assertListEqual([1, 2, 3, 4, 5], [event.get_sequence() for event in event_store.read()])
+        self.assertListEqual([4, 5], [event.get_sequence() for event in event_store.read(3)])
+        self.assertEqual(3, len(os.listdir(os.path.join(self._directory.name, "events"))))
+
+    def test_shouldDropIncompleteEvent(self):
+        event_store = self._create_event_store()
+        event_store.append(Event(EventType.subscribes, time.time(), "default", 123))
+        event_store.close()
+        segment_path = os.path.join(self._directory.name, "events", os.listdir(os.path.join(self._directory.name,
+                                                                                            "events"))[0])
+        with open(segment_path, 'a') as segment_file:
+            segment_file.write('{"seq": 2, "ti')
+
+        event_store = self._create_event_store()
+        event_store.append(Event(EventType.unsubscribes, time.time(), "default", 123))
+        self.assertListEqual([EventType.subscribes, EventType.unsubscribes],
+                             [event.get_event_type() for event in event_store.read()])
+
+    def test_shouldReplaySnapshotAndEventsAfterIt(self):
+        event_store = self._create_event_store(segment_size=2, snapshot_interval=3)
+        events = [Event(EventType.starts_merge, time.time(), "default", 123),
+                  Event(EventType.subscribes, time.time(), "default", 123),
+                  Event(EventType.done_merge, time.time(), "default", 123)]
+        for event in events:
+            EventStore.apply_event(self._model, event)
+            event_store.append(event)
+        self.assertTrue(event_store.should_snapshot())
+        self.assertEqual(3, event_store.write_snapshot(self._model))
+        self.assertFalse(event_store.should_snapshot())
+        event = Event(EventType.joins_queue, time.time(), "default", 123)
+        EventStore.apply_event(self._model, event)
+        event_store.append(event)
+
+        model = BotModel(Config(["default"]))
+        self.assertEqual(1, event_store.replay(model))
+        self.assertDictEqual(EventStore.get_model_state(self._model), EventStore.get_model_state(model))
+        self.assertListEqual([4], [event.get_sequence() for event in event_store.read()])
+
+    def test_shouldKeepOnlyLastSnapshots(self):
+        event_store = self._create_event_store(snapshot_interval=1)
+        for _ in range(4):
+            event_store.append(Event(EventType.subscribes, time.time(), "default", 123))
+            event_store.write_snapshot(self._model)
+        snapshots = [file_name for file_name in os.listdir(os.path.join(self._directory.name, "events"))
+                     if file_name.startswith(EventStore.SNAPSHOT_PREFIX)]
+        self.assertEqual(EventStore.KEPT_SNAPSHOTS, len(snapshots))
+
+
+class MergeDispatcherEventLogTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._config = Config(["default", "master", "release/*"])
+        self._model = BotModel(self._config, backup_path=self._directory.name)
+        self._event_store = EventStore(os.path.join(self._directory.name, "events"), segment_size=10,
+                                       snapshot_interval=25)
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'),
+                                            event_store=self._event_store)
+        self._user_ids = [100, 200, 300, 400]
+        for user_id in self._user_ids:
+            self._merge_dispatcher.update_user(user_id, "User", str(user_id))
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+        self._event_store.close()
+        self._directory.cleanup()
+
+    def _replay(self):
+        model = BotModel(self._config)
+        self._event_store.replay(model)
+        return model
+
+    def test_shouldRecordTypedEvents(self):
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.merge(200, "default")
+        self._merge_dispatcher.kick(200, 100, "default")
+        self._merge_dispatcher.confirm_merge(200, "default")
+        events = list(self._event_store.read())[len(self._user_ids):]
+        self.assertListEqual([EventType.starts_merge, EventType.joins_queue, EventType.kicks_user,
+                              EventType.starts_merge], [event.get_event_type() for event in events])
+        self.assertEqual(100, events[2].get_target_id())
+
+    def test_shouldRebuildModelFromRandomHistory(self):
+        generator = random.Random(42)
+        operations = [self._merge_dispatcher.merge, self._merge_dispatcher.cancel, self._merge_dispatcher.done,
+                      self._merge_dispatcher.fix, self._merge_dispatcher.subscribe, self._merge_dispatcher.unsubscribe,
+                      self._merge_dispatcher.confirm_merge]
+        for _ in range(300):
+            branch_name = generator.choice(["default", "master", "release/1.0", "release/2.0"])
+            user_id = generator.choice(self._user_ids)
+            if generator.random() < 0.1:
+                self._merge_dispatcher.kick(user_id, generator.choice(self._user_ids), branch_name)
+            elif generator.random() < 0.05:
+                self._merge_dispatcher.update_user(user_id, "Renamed", str(generator.random()))
+            else:
+                operation = generator.choice(operations)
+                branch = self._model.get_branches().get(branch_name)
+                if operation != self._merge_dispatcher.confirm_merge or (branch is not None and branch.users_queue):
+                    operation(user_id, branch_name)
+
+        self.assertGreater(self._event_store.get_snapshot_sequence(), 0)
+        self.assertDictEqual(EventStore.get_model_state(self._model), EventStore.get_model_state(self._replay()))
+
+    def test_shouldNotRecordRolledBackBatch(self):
+        last_sequence = self._event_store.get_last_sequence()
+        result = self._merge_dispatcher.execute_batch([BatchOperation(BatchOperationType.merge, 100, "default"),
+                                                       BatchOperation(BatchOperationType.done, 200, "default")])
+        self.assertFalse(result.is_committed())
+        self.assertEqual(last_sequence, self._event_store.get_last_sequence())
+
+        self._merge_dispatcher.execute_batch([BatchOperation(BatchOperationType.merge, 100, "default"),
+                                              BatchOperation(BatchOperationType.merge, 200, "default")])
+        self.assertEqual(last_sequence + 2, self._event_store.get_last_sequence())
+        self.assertDictEqual(EventStore.get_model_state(self._model), EventStore.get_model_state(self._replay()))
+
+    def test_shouldReplayBranchesUpdate(self):
+        self._merge_dispatcher.merge(100, "release/1.0")
+        self._merge_dispatcher.subscribe(200, "master")
+        self._merge_dispatcher.update_branches(["default", "develop"], BranchPatterns())
+        self._merge_dispatcher.merge(300, "develop")
+
+        model = BotModel(Config(["default", "develop"]))
+        self._event_store.replay(model)
+        self.assertDictEqual(EventStore.get_model_state(self._model), EventStore.get_model_state(model))
+
+
+class DurationEstimateTest(unittest.TestCase):
+    def test_shouldUseDefaultDurationWithoutSamples(self):
+        estimate = DurationEstimate()
+        self.assertEqual(DurationEstimate.DEFAULT_DURATION, estimate.get_mean())
+        self.assertListEqual([0.0, DurationEstimate.DEFAULT_DURATION], estimate.get_waits(None, 2))
+
+    def test_shouldFollowRecentDurations(self):
+        estimate = DurationEstimate(alpha=0.5)
+        estimate.add(600.0)
+        self.assertEqual(600.0, estimate.get_mean())
+        estimate.add(1200.0)
+        self.assertEqual(900.0, estimate.get_mean())
+        for _ in range(20):
+            estimate.add(3000.0)
+        self.assertAlmostEqual(3000.0, estimate.get_mean(), delta=1.0)
+        self.assertEqual(3600, estimate.get_percentile(50))
+
+    def test_shouldEstimateWaitsOfQueuePositions(self):
+        estimate = DurationEstimate()
+        estimate.add(1200.0)
+        self.assertListEqual([800.0, 2000.0, 3200.0], estimate.get_waits(400.0, 3))
+
+    def test_shouldUseTailOfDistributionIfMergeTakesLongerThanUsual(self):
+        estimate = DurationEstimate()
+        estimate.add(1000.0)
+        self.assertEqual(200.0, estimate.get_remaining(1000.0))
+        self.assertEqual(0.0, estimate.get_remaining(5000.0))
+
+
+class MergeDispatcherEstimatesTest(unittest.TestCase):
+    def setUp(self):
+        self._model = BotModel(Config(["default"]))
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'))
+        for user_id in (100, 200, 300):
+            self._merge_dispatcher.update_user(user_id, "User", str(user_id))
+
+    def test_shouldNotEstimateWithoutFinishedMerges(self):
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.merge(200, "default")
+        self.assertIsNone(self._merge_dispatcher.get_queue_estimates("default"))
+        self.assertIsNone(self._merge_dispatcher.get_queue_estimates("unknown"))
+
+    def test_shouldEstimateQueueFromFinishedMerges(self):
+        with patch("time.time", return_value=1000.0):
+            self._merge_dispatcher.merge(100, "default")
+        with patch("time.time", return_value=1600.0):
+            self._merge_dispatcher.merge(200, "default")
+            self._merge_dispatcher.done(100, "default")
+            self._merge_dispatcher.confirm_merge(200, "default")
+            self._merge_dispatcher.merge(300, "default")
+            self._merge_dispatcher.merge(100, "default")
+
+        self.assertListEqual([400.0, 1000.0], self._merge_dispatcher.get_queue_estimates("default", now=1800.0))
+        self.assertEqual(1, self._model.get_branches()["default"].merge_durations.get_samples())
+
+
+class MergeDispatcherPriorityTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._config = Config(["default"])
+        self._model = BotModel(self._config, backup_path=self._directory.name)
+        self._event_store = EventStore(os.path.join(self._directory.name, "events"))
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'),
+                                            event_store=self._event_store)
+        self._notifier = create_autospec(Notifier)
+        self._merge_dispatcher.set_notifier(self._notifier)
+        for user_id in (100, 200, 300, 400):
+            self._merge_dispatcher.update_user(user_id, "User", str(user_id))
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+        self._event_store.close()
+        self._directory.cleanup()
+
+    def _get_queue(self):
+        return [(user.get_identifier(), priority)
+                for user, priority in self._model.get_branches()["default"].users_queue.items()]
+
+    def test_shouldPutHigherPriorityFirstAndKeepOrderWithinPriority(self):
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.merge(200, "default")
+        self._merge_dispatcher.merge(300, "default", Priority.release)
+        self._merge_dispatcher.merge(400, "default", Priority.hotfix)
+        self.assertListEqual([(400, Priority.hotfix), (300, Priority.release), (200, Priority.normal)],
+                             self._get_queue())
+        self.assertTupleEqual((Priority.hotfix, Priority.release, Priority.normal),
+                              self._merge_dispatcher.get_branch_queue_info("default").priorities)
+
+    def test_shouldChangePriorityOfUserInQueue(self):
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.merge(200, "default")
+        self._merge_dispatcher.merge(300, "default")
+        self.assertEqual(MergeRequestStatus.priority_changed,
+                         self._merge_dispatcher.merge(300, "default", Priority.hotfix))
+        self.assertEqual(MergeRequestStatus.already_in_queue,
+                         self._merge_dispatcher.merge(300, "default", Priority.hotfix))
+        self.assertListEqual([(300, Priority.hotfix), (200, Priority.normal)], self._get_queue())
+        self._notifier.notify.assert_any_call(self._model.get_user(100), NotifierActions.changes_priority,
+                                              Notifier.ActionData(self._model.get_user(300), "default",
+                                                                  Priority.hotfix))
+
+    def test_shouldNotifyHigherPriorityUserWhenHeBecomesNext(self):
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.merge(200, "default")
+        self._merge_dispatcher.done(100, "default")
+        self._notifier.reset_mock()
+        self._merge_dispatcher.merge(300, "default", Priority.hotfix)
+        self._notifier.notify.assert_any_call(self._model.get_user(300), NotifierActions.ready_to_merge,
+                                              Notifier.ActionData(self._model.get_user(300), "default"))
+
+    def test_shouldKeepPriorityOfUserPushedBackByFix(self):
+        self._merge_dispatcher.merge(100, "default", Priority.release)
+        self._merge_dispatcher.merge(200, "default", Priority.release)
+        self._merge_dispatcher.merge(300, "default", Priority.hotfix)
+        self._merge_dispatcher.fix(400, "default")
+        self.assertEqual(Priority.fix, self._model.get_branches()["default"].active_priority)
+        self.assertListEqual([(300, Priority.hotfix), (100, Priority.release), (200, Priority.release)],
+                             self._get_queue())
+
+    def test_shouldUsePriorityOfConfirmedUser(self):
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.merge(200, "default", Priority.release)
+        self._merge_dispatcher.done(100, "default")
+        self._merge_dispatcher.confirm_merge(200, "default")
+        self.assertEqual(Priority.release, self._model.get_branches()["default"].active_priority)
+
+    def test_shouldRestorePrioritiesAfterBatchRollback(self):
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.merge(200, "default")
+        self._merge_dispatcher.merge(300, "default", Priority.hotfix)
+        result = self._merge_dispatcher.execute_batch([BatchOperation(BatchOperationType.fix, 400, "default"),
+                                                       BatchOperation(BatchOperationType.done, 200, "default")])
+        self.assertFalse(result.is_committed())
+        self.assertEqual(Priority.normal, self._model.get_branches()["default"].active_priority)
+        self.assertListEqual([(300, Priority.hotfix), (200, Priority.normal)], self._get_queue())
+
+    def test_shouldKeepPriorityOfQueuedUserInBatchMerge(self):
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.merge(200, "default", Priority.hotfix)
+        self._notifier.reset_mock()
+        result = self._merge_dispatcher.execute_batch([BatchOperation(BatchOperationType.merge, 200, "default")])
+        self.assertTrue(result.is_committed())
+        self.assertListEqual([MergeRequestStatus.already_in_queue], result.get_statuses())
+        self.assertListEqual([(200, Priority.hotfix)], self._get_queue())
+        self._notifier.notify_batch.assert_not_called()
+
+    def test_shouldReplayPriorities(self):
+        self._merge_dispatcher.merge(100, "default", Priority.release)
+        self._merge_dispatcher.merge(200, "default")
+        self._merge_dispatcher.merge(300, "default")
+        self._merge_dispatcher.merge(300, "default", Priority.hotfix)
+        self._merge_dispatcher.fix(400, "default")
+
+        model = BotModel(self._config)
+        self._event_store.replay(model)
+        self.assertDictEqual(EventStore.get_model_state(self._model), EventStore.get_model_state(model))
+        self.assertListEqual([(300, Priority.hotfix), (100, Priority.release), (200, Priority.normal)],
+                             [(user.get_identifier(), priority)
+                              for user, priority in model.get_branches()["default"].users_queue.items()])
+
+    def test_shouldRestoreQueueSavedAsDeque(self):
+        branch = self._model.get_branches()["default"]
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.merge(200, "default")
+        branch.users_queue = deque(user for user, _ in branch.users_queue.items())
+        del branch.active_priority
+        self._model.dump()
+
+        model = BotModel(self._config, backup_path=self._directory.name, restore=True)
+        self.assertListEqual([(model.get_user(200), Priority.normal)],
+                             model.get_branches()["default"].users_queue.items())
+        self.assertEqual(Priority.normal, model.get_branches()["default"].active_priority)
+
+
+class MergeDispatcherTrainTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._config = Config(["master", "develop"], trains=TrainSizes({"master": 3}))
+        self._model = BotModel(self._config, backup_path=self._directory.name)
+        self._event_store = EventStore(os.path.join(self._directory.name, "events"))
+        self._history = MergeHistory()
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'),
+                                            event_store=self._event_store, history=self._history,
+                                            trains=self._config.get_trains())
+        self._notifier = create_autospec(Notifier)
+        self._merge_dispatcher.set_notifier(self._notifier)
+        for user_id in (100, 200, 300, 400, 500):
+            self._merge_dispatcher.update_user(user_id, "User", str(user_id))
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+        self._event_store.close()
+        self._directory.cleanup()
+
+    def _users(self, *user_ids):
+        return tuple(self._model.get_user(user_id) for user_id in user_ids)
+
+    def _fill_queue(self, branch_name="master"):
+        for user_id in (100, 200, 300, 400, 500):
+            self._merge_dispatcher.merge(user_id, branch_name)
+
+    def test_shouldAdmitFirstQueuedUsersAsTrain(self):
+        self._fill_queue()
+        self._notifier.reset_mock()
+        self.assertEqual(DoneRequestStatus.merge_done, self._merge_dispatcher.done(100, "master"))
+
+        queue_info = self._merge_dispatcher.get_branch_queue_info("master")
+        self.assertTupleEqual(self._users(200, 300, 400), queue_info.train_users)
+        self.assertEqual(self._model.get_user(200), queue_info.active_user)
+        self.assertTupleEqual(self._users(500), queue_info.users_queue)
+        self._notifier.notify.assert_any_call(self._model.get_user(300), NotifierActions.starts_train,
+                                              Notifier.TrainActionData(self._model.get_user(200), "master",
+                                                                       self._users(200, 300, 400)))
+        for call in self._notifier.notify.call_args_list:
+            self.assertNotEqual(NotifierActions.ready_to_merge, call[0][1])
+
+    def test_shouldReleaseSlotWhenEveryMemberIsDoneOrDropped(self):
+        self._fill_queue()
+        self._merge_dispatcher.done(100, "master")
+        self.assertEqual(DoneRequestStatus.merge_done, self._merge_dispatcher.done(300, "master"))
+        self.assertEqual(CancelRequestStatus.merge_cancelled, self._merge_dispatcher.cancel(200, "master"))
+        self.assertTupleEqual(self._users(400), self._merge_dispatcher.get_branch_queue_info("master").train_users)
+        self.assertListEqual(["master"], self._merge_dispatcher.get_active_user_branches(400))
+        self.assertEqual(MergeRequestStatus.already_in_queue, self._merge_dispatcher.merge(400, "master"))
+
+        self.assertEqual(KickRequestStatus.user_kicked, self._merge_dispatcher.kick(100, 400, "master"))
+        queue_info = self._merge_dispatcher.get_branch_queue_info("master")
+        self.assertTupleEqual(self._users(500), queue_info.train_users)
+        self.assertTupleEqual((), queue_info.users_queue)
+
+    def test_shouldKeepSingleModeForBranchesWithoutTrains(self):
+        self._fill_queue("develop")
+        self._notifier.reset_mock()
+        self._merge_dispatcher.done(100, "develop")
+        queue_info = self._merge_dispatcher.get_branch_queue_info("develop")
+        self.assertIsNone(queue_info.active_user)
+        self.assertTupleEqual((), queue_info.train_users)
+        self._notifier.notify.assert_any_call(self._model.get_user(200), NotifierActions.ready_to_merge,
+                                              Notifier.ActionData(self._model.get_user(200), "develop"))
+
+    def test_shouldPushWholeTrainBackOnFix(self):
+        self._fill_queue()
+        self._merge_dispatcher.done(100, "master")
+        self._notifier.reset_mock()
+        self.assertEqual(FixRequestStatus.user_already_in_merge, self._merge_dispatcher.fix(300, "master"))
+        self.assertEqual(FixRequestStatus.fix_allowed, self._merge_dispatcher.fix(100, "master"))
+
+        queue_info = self._merge_dispatcher.get_branch_queue_info("master")
+        self.assertEqual(self._model.get_user(100), queue_info.active_user)
+        self.assertTupleEqual((), queue_info.train_users)
+        self.assertTupleEqual(self._users(200, 300, 400, 500), queue_info.users_queue)
+        self._notifier.notify.assert_any_call(self._model.get_user(300), NotifierActions.starts_fix,
+                                              Notifier.MergeFixActionData(self._model.get_user(100), "master",
+                                                                          self._model.get_user(200),
+                                                                          self._users(200, 300, 400)))
+
+    def test_shouldEstimateQueueByTrains(self):
+        with patch("time.time", return_value=1000.0):
+            self._merge_dispatcher.merge(100, "master")
+        with patch("time.time", return_value=1600.0):
+            self._merge_dispatcher.done(100, "master")
+            self._merge_dispatcher.merge(200, "master")
+            for user_id in (300, 400, 500):
+                self._merge_dispatcher.merge(user_id, "master")
+        self.assertListEqual([400.0, 400.0, 400.0], self._merge_dispatcher.get_queue_estimates("master", 1800.0))
+
+    def test_shouldRollbackTrainInBatch(self):
+        self._fill_queue()
+        self._merge_dispatcher.done(100, "master")
+        result = self._merge_dispatcher.execute_batch([BatchOperation(BatchOperationType.done, 200, "master"),
+                                                       BatchOperation(BatchOperationType.done, 500, "master")])
+        self.assertFalse(result.is_committed())
+        self.assertTupleEqual(self._users(200, 300, 400),
+                              self._merge_dispatcher.get_branch_queue_info("master").train_users)
+
+    def test_shouldReplayTrainsAndCountEveryMemberMerge(self):
+        self._fill_queue()
+        self._merge_dispatcher.done(100, "master")
+        self._merge_dispatcher.done(300, "master")
+        self._merge_dispatcher.fix(100, "master")
+        self._merge_dispatcher.done(100, "master")
+        self._merge_dispatcher.done(400, "master")
+
+        model = BotModel(self._config)
+        self._event_store.replay(model)
+        self.assertDictEqual(EventStore.get_model_state(self._model), EventStore.get_model_state(model))
+        self.assertTupleEqual(self._users(200, 500), model.get_branches()["master"].train_users)
+        self.assertEqual(6, self._merge_dispatcher.get_merge_statistics(1, "master").get_merges())
+
+
+class MergeDispatcherLinkedTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._config = Config(["master", "develop", "release"],
+                              timeouts=TimeoutPolicies({"default": TimeoutPolicy(skip_after=120)}))
+        self._model = BotModel(self._config, backup_path=self._directory.name)
+        self._event_store = EventStore(os.path.join(self._directory.name, "events"))
+        self._scheduler = Scheduler()
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'),
+                                            event_store=self._event_store, scheduler=self._scheduler,
+                                            timeouts=self._config.get_timeouts())
+        self._notifier = create_autospec(Notifier)
+        self._merge_dispatcher.set_notifier(self._notifier)
+        for user_id in (100, 200, 300, 400):
+            self._merge_dispatcher.update_user(user_id, "User", str(user_id))
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+        self._event_store.close()
+        self._directory.cleanup()
+
+    def _users(self, *user_ids):
+        return tuple(self._model.get_user(user_id) for user_id in user_ids)
+
+    def _get_ready_notifications(self, user_id):
+        user = self._model.get_user(user_id)
+        return [(whom, action_type, action_data) for (whom, action_type, action_data), _
+                in self._notifier.notify.call_args_list if action_type == NotifierActions.ready_to_merge and
+                action_data.get_user() == user]
+
+    def test_shouldStartAtOnceWhenAllBranchesAreFree(self):
+        self.assertEqual(MergeRequestStatus.merge_started,
+                         self._merge_dispatcher.merge_linked(100, ["master", "develop"]))
+        self.assertListEqual(["develop", "master"], sorted(self._merge_dispatcher.get_active_user_branches(100)))
+        self.assertEqual(MergeRequestStatus.already_in_queue,
+                         self._merge_dispatcher.merge_linked(100, ["develop", "release"]))
+        self.assertEqual(MergeRequestStatus.branch_not_exist,
+                         self._merge_dispatcher.merge_linked(200, ["release", "unknown"]))
+        self.assertTupleEqual((), self._merge_dispatcher.get_branch_queue_info("release").users_queue)
+
+    def test_shouldNotHoldAnyBranchUntilAllAreFree(self):
+        self._merge_dispatcher.merge(200, "master")
+        self.assertEqual(MergeRequestStatus.merge_requested,
+                         self._merge_dispatcher.merge_linked(100, ["master", "develop"]))
+        self._merge_dispatcher.merge(300, "develop")
+
+        develop_info = self._merge_dispatcher.get_branch_queue_info("develop")
+        self.assertIsNone(develop_info.active_user)
+        self.assertTupleEqual(self._users(100, 300), develop_info.users_queue)
+        self.assertTupleEqual(("master", "develop"), develop_info.get_linked_branches(self._model.get_user(100)))
+        self.assertListEqual([], self._get_ready_notifications(100))
+        self.assertFalse(self._merge_dispatcher.confirm_merge(100, "develop"))
+        self.assertEqual(0, len(self._scheduler))
+
+        self._merge_dispatcher.done(200, "master")
+        user = self._model.get_user(100)
+        self.assertListEqual([(user, NotifierActions.ready_to_merge,
+                               Notifier.LinkedActionData(user, "master", ("master", "develop")))],
+                             self._get_ready_notifications(100))
+        self.assertTrue(self._merge_dispatcher.confirm_merge(100, "develop"))
+        self.assertListEqual(["develop", "master"], sorted(self._merge_dispatcher.get_active_user_branches(100)))
+        self.assertTupleEqual(self._users(300), self._merge_dispatcher.get_branch_queue_info("develop").users_queue)
+
+    def test_shouldRemoveWaitingRequestFromAllQueues(self):
+        self._merge_dispatcher.merge(200, "master")
+        self._merge_dispatcher.merge(300, "develop")
+        self._merge_dispatcher.merge_linked(100, ["master", "develop", "release"])
+        self._merge_dispatcher.merge(400, "release")
+        self._notifier.reset_mock()
+
+        self.assertEqual(CancelRequestStatus.exited_from_queue, self._merge_dispatcher.cancel(100, "develop"))
+        for branch_name in ("master", "develop"):
+            self.assertTupleEqual((), self._merge_dispatcher.get_branch_queue_info(branch_name).users_queue)
+        self.assertTupleEqual(self._users(400), self._merge_dispatcher.get_branch_queue_info("release").users_queue)
+        self.assertListEqual([], self._merge_dispatcher.get_all_branches_with_user(100))
+        # Changes of all branches are delivered together, one message per user
+        self._notifier.notify.assert_not_called()
+        notifications = dict((call[0][0], call[0][1]) for call in self._notifier.notify_batch.call_args_list)
+        self.assertIn((NotifierActions.ready_to_merge, Notifier.ActionData(self._model.get_user(400), "release")),
+                      notifications[self._model.get_user(400)])
+
+    def test_shouldStartLinkedRequestsInOrderWithoutDeadlock(self):
+        self._merge_dispatcher.merge(300, "master")
+        self._merge_dispatcher.merge(400, "develop")
+        self._merge_dispatcher.merge_linked(100, ["master", "develop"])
+        self._merge_dispatcher.merge_linked(200, ["develop", "master"])
+        self._merge_dispatcher.done(300, "master")
+        self._merge_dispatcher.done(400, "develop")
+
+        self.assertFalse(self._merge_dispatcher.confirm_merge(200, "develop"))
+        self.assertTrue(self._merge_dispatcher.confirm_merge(100, "master"))
+        self._merge_dispatcher.done(100, "master")
+        self.assertFalse(self._merge_dispatcher.confirm_merge(200, "master"))
+        self._merge_dispatcher.done(100, "develop")
+        self.assertTrue(self._merge_dispatcher.confirm_merge(200, "master"))
+        self.assertListEqual(["develop", "master"], sorted(self._merge_dispatcher.get_active_user_branches(200)))
+
+    def test_shouldChangePriorityInAllBranches(self):
+        self._merge_dispatcher.merge(300, "master")
+        self._merge_dispatcher.merge(400, "develop")
+        for branch_name in ("master", "develop"):
+            self._merge_dispatcher.merge(200, branch_name)
+        self._merge_dispatcher.merge_linked(100, ["master", "develop"])
+
+        self.assertEqual(MergeRequestStatus.priority_changed,
+                         self._merge_dispatcher.merge(100, "master", Priority.hotfix))
+        for branch_name in ("master", "develop"):
+            queue_info = self._merge_dispatcher.get_branch_queue_info(branch_name)
+            self.assertTupleEqual(self._users(100, 200), queue_info.users_queue)
+            self.assertTupleEqual((Priority.hotfix, Priority.normal), queue_info.priorities)
+
+    def test_shouldSkipLinkedRequestInAllBranches(self):
+        self._merge_dispatcher.merge(300, "master")
+        self._merge_dispatcher.merge_linked(100, ["master", "develop"])
+        self._scheduler.run_pending(time.time() + 180)
+        self.assertTupleEqual(self._users(100), self._merge_dispatcher.get_branch_queue_info("develop").users_queue)
+
+        self._merge_dispatcher.done(300, "master")
+        self._scheduler.run_pending(time.time() + 180)
+        self.assertListEqual([], self._merge_dispatcher.get_all_branches_with_user(100))
+
+    def test_shouldRollbackLinkedRequestInBatch(self):
+        self._merge_dispatcher.merge(300, "master")
+        self._merge_dispatcher.merge_linked(100, ["master", "develop"])
+        result = self._merge_dispatcher.execute_batch([BatchOperation(BatchOperationType.cancel, 100, "master"),
+                                                       BatchOperation(BatchOperationType.done, 400, "master")])
+        self.assertFalse(result.is_committed())
+        queue_info = self._merge_dispatcher.get_branch_queue_info("develop")
+        self.assertTupleEqual(self._users(100), queue_info.users_queue)
+        self.assertTupleEqual(("master", "develop"), queue_info.get_linked_branches(self._model.get_user(100)))
+
+    def test_shouldReplayLinkedRequests(self):
+        self._merge_dispatcher.merge(300, "master")
+        self._merge_dispatcher.merge_linked(100, ["master", "develop"])
+        self._merge_dispatcher.merge_linked(200, ["develop", "release"])
+        self._merge_dispatcher.kick(300, 200, "release")
+        self._merge_dispatcher.merge_linked(400, ["master", "release"])
+
+        model = BotModel(self._config)
+        self._event_store.replay(model)
+        self.assertDictEqual(EventStore.get_model_state(self._model), EventStore.get_model_state(model))
+        self.assertTupleEqual(("master", "develop"),
+                              model.get_branches()["develop"].get_linked_branches(model.get_user(100)))
+
+        self._merge_dispatcher.done(300, "master")
+        self._merge_dispatcher.confirm_merge(100, "develop")
+        model = BotModel(self._config)
+        self._event_store.replay(model)
+        self.assertDictEqual(EventStore.get_model_state(self._model), EventStore.get_model_state(model))
+        self.assertEqual(model.get_user(100), model.get_branches()["develop"].active_user)
+
+
+class QueueStateAPITest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._model = BotModel(Config(["master", "develop", "release/*"]), backup_path=self._directory.name)
+        self._merge_dispatcher = Dispatcher(self._model, logger=logging.getLogger('Tests'))
+        for user_id in (100, 200, 300):
+            self._merge_dispatcher.update_user(user_id, "User", str(user_id))
+        self._queue_state = QueueStateAPI(self._merge_dispatcher)
+
+    def tearDown(self):
+        self._merge_dispatcher = None
+        self._directory.cleanup()
+
+    def test_shouldReportBranchQueue(self):
+        self._merge_dispatcher.merge(100, "master")
+        self._merge_dispatcher.merge(200, "master", Priority.hotfix)
+        self._merge_dispatcher.merge_linked(300, ["master", "develop"])
+        self._merge_dispatcher.subscribe(100, "master")
+
+        state = self._queue_state.get_report({"branch": "master"}).get_json_object()
+        self.assertDictEqual({"branch": "master",
+                              "generation": self._merge_dispatcher.get_branch_generation("master"),
+                              "merging": [{"id": 100, "name": "User 100", "priority": "normal"}],
+                              "queue": [{"id": 200, "name": "User 200", "priority": "hotfix"},
+                                        {"id": 300, "name": "User 300", "priority": "normal",
+                                         "linked": ["master", "develop"]}],
+                              "subscribers": 1}, state)
+        self.assertIsNone(self._queue_state.get_report({"branch": "unknown"}))
+
+    def test_shouldReportOwnPriorityOfEveryTrainMember(self):
+        self._merge_dispatcher.set_trains(TrainSizes({"master": 2}))
+        self._merge_dispatcher.merge(100, "master")
+        self._merge_dispatcher.merge(200, "master", Priority.hotfix)
+        self._merge_dispatcher.merge(300, "master")
+        self._merge_dispatcher.done(100, "master")
+
+        state = self._queue_state.get_report({"branch": "master"}).get_json_object()
+        self.assertListEqual([{"id": 200, "name": "User 200", "priority": "hotfix"},
+                              {"id": 300, "name": "User 300", "priority": "normal"}], state["merging"])
+
+    def test_shouldReportUnescapedNames(self):
+        self._merge_dispatcher.update_user(400, "Tom & Jerry", "<3")
+        self._merge_dispatcher.merge(400, "master")
+
+        state = self._queue_state.get_report({"branch": "master"}).get_json_object()
+        self.assertEqual("Tom & Jerry <3", state["merging"][0]["name"])
+
+    def test_shouldReuseResponseWhileGenerationIsTheSame(self):
+        self._merge_dispatcher.merge(100, "master")
+        response = self._queue_state.get_branch_state("master")
+        with patch.object(self._merge_dispatcher, "get_branch_queue_info") as get_branch_queue_info:
+            self.assertIs(response, self._queue_state.get_branch_state("master"))
+            get_branch_queue_info.assert_not_called()
+
+        self._merge_dispatcher.merge(200, "master")
+        changed_response = self._queue_state.get_branch_state("master")
+        self.assertNotEqual(response.get_etag(), changed_response.get_etag())
+        self.assertEqual(200, changed_response.get_json_object()["queue"][0]["id"])
+
+    def test_shouldRebuildAllBranchesOnlyWhenSomeBranchChanges(self):
+        self._merge_dispatcher.merge(100, "release/1.0")
+        response = self._queue_state.get_report({})
+        self.assertListEqual(["develop", "master", "release/1.0"], sorted(response.get_json_object()["branches"]))
+        self.assertIs(response, self._queue_state.get_report({}))
+
+        self._merge_dispatcher.merge(200, "develop")
+        changed_response = self._queue_state.get_report({})
+        self.assertNotEqual(response.get_etag(), changed_response.get_etag())
+        self.assertEqual(200, changed_response.get_json_object()["branches"]["develop"]["merging"][0]["id"])
+        self.assertIs(response.get_json_object()["branches"]["master"],
+                      changed_response.get_json_object()["branches"]["master"])
+
+
+class MergeHistoryTest(unittest.TestCase):
+    STARTED = 1500076800.0
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._history = MergeHistory(os.path.join(self._directory.name, "history.json"))
+        self._sequence = 0
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _apply(self, event_type, minutes, branch="default", user_id=100, target_id=None):
+        self._sequence += 1
+        self._history.apply(Event(event_type, self.STARTED + minutes * 60, branch, user_id, target_id,
+                                  sequence=self._sequence))
+
+    def _query(self, branch_name=None, user_id=None, days=7):
+        return self._history.query(self.STARTED, self.STARTED + days * MergeHistory.DAY, branch_name, user_id)
+
+    def test_shouldAggregateMergeDurationsAndWaits(self):
+        self._apply(EventType.starts_merge, 0)
+        self._apply(EventType.joins_queue, 5, user_id=200)
+        self._apply(EventType.done_merge, 20)
+        self._apply(EventType.starts_merge, 35, user_id=200)
+        self._apply(EventType.cancels_merge, 45, user_id=200)
+
+        rollup = self._query("default")
+        self.assertEqual(2, rollup.get_merges())
+        self.assertEqual(30 * 60, rollup.get_merge_time())
+        self.assertEqual(2, rollup.get_waits())
+        self.assertEqual(15 * 60, rollup.get_average_wait_time())
+        self.assertListEqual([(100, 20 * 60.0), (200, 10 * 60.0)], rollup.get_top_holders())
+        self.assertEqual(1, self._query(user_id=200).get_merges())
+        self.assertTrue(self._query("master").is_empty())
+
+    def test_shouldHandleFixAndKick(self):
+        self._apply(EventType.starts_merge, 0)
+        self._apply(EventType.starts_fix, 10, user_id=200)
+        self._apply(EventType.kicks_user, 20, user_id=300, target_id=200)
+        self._apply(EventType.starts_merge, 50)
+
+        rollup = self._query()
+        self.assertEqual(2, rollup.get_merges())
+        self.assertEqual(20 * 60, rollup.get_merge_time())
+        self.assertEqual(40 * 60, rollup.get_wait_time())
+
+    def test_shouldQueryOnlyGivenPeriod(self):
+        self._apply(EventType.starts_merge, 0)
+        self._apply(EventType.done_merge, 10)
+        self._apply(EventType.starts_merge, 3 * 24 * 60 + 90)
+        self._apply(EventType.done_merge, 3 * 24 * 60 + 100)
+
+        self.assertEqual(2, self._query(days=7).get_merges())
+        self.assertEqual(1, self._history.query(self.STARTED + MergeHistory.DAY + 3600,
+                                                self.STARTED + 4 * MergeHistory.DAY).get_merges())
+        day_buckets = self._history.scan(self.STARTED, self.STARTED + 7 * MergeHistory.DAY,
+                                         resolution=MergeHistory.DAY)
+        self.assertListEqual([self.STARTED, self.STARTED + 3 * MergeHistory.DAY],
+                             [bucket for bucket, _ in day_buckets])
+
+    def test_shouldIgnoreAlreadyAppliedEvents(self):
+        self._apply(EventType.starts_merge, 0)
+        self.assertFalse(self._history.apply(Event(EventType.done_merge, self.STARTED, "default", 100, sequence=1)))
+
+    def test_shouldRestoreFromDumpAndEventStore(self):
+        event_store = EventStore(os.path.join(self._directory.name, "events"))
+        for event_type, minutes in ((EventType.starts_merge, 0), (EventType.done_merge, 10)):
+            self._history.apply(event_store.append(Event(event_type, self.STARTED + minutes * 60, "default", 100)))
+        self._history.dump()
+        for event_type, minutes in ((EventType.starts_merge, 20), (EventType.done_merge, 50)):
+            event_store.append(Event(event_type, self.STARTED + minutes * 60, "default", 100))
+        event_store.close()
+
+        history = MergeHistory(os.path.join(self._directory.name, "history.json"))
+        with EventStore(os.path.join(self._directory.name, "events")) as event_store:
+            self.assertEqual(2, history.restore(event_store))
+        rollup = history.query(self.STARTED, self.STARTED + MergeHistory.DAY)
+        self.assertEqual(2, rollup.get_merges())
+        self.assertEqual(40 * 60, rollup.get_merge_time())
+
+    def test_shouldBuildReport(self):
+        self._apply(EventType.starts_merge, 0)
+        self._apply(EventType.done_merge, 10)
+        report = self._history.get_report({"branch": "default", "days": "1", "resolution": "hour"},
+                                          now=self.STARTED + MergeHistory.DAY)
+        self.assertEqual(1, report["summary"]["merges"])
+        self.assertEqual(600, report["summary"]["merge_time_p50"])
+        self.assertEqual(self.STARTED, report["buckets"][0]["start"])
+        with self.assertRaises(ValueError):
+            self._history.get_report({"days": "0"})
+        with self.assertRaises(ValueError):
+            self._history.get_report({"resolution": "week"})
+
+    def test_shouldSerializeRollup(self):
+        rollup = HistoryRollup()
+        rollup.add_merge(100, 120.0)
+        rollup.add_wait(30.0)
+        restored = HistoryRollup.from_json_object(rollup.to_json_object())
+        self.assertDictEqual(rollup.to_summary(), restored.to_summary())
+
+
+class MergeDispatcherHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self._history = MergeHistory()
+        self._merge_dispatcher = Dispatcher(BotModel(Config(["default"])), logger=logging.getLogger('Tests'),
+                                            history=self._history)
+        self._merge_dispatcher.update_user(100, "User", "100")
+
+    def test_shouldCollectHistoryWithoutEventStore(self):
+        self._merge_dispatcher.merge(100, "default")
+        self._merge_dispatcher.done(100, "default")
+        self.assertEqual(1, self._merge_dispatcher.get_merge_statistics(1, "default").get_merges())
+        self.assertEqual(1, self._merge_dispatcher.get_merge_statistics(1, user_id=100).get_merges())
+
+    def test_shouldReturnNoStatisticsWithoutHistory(self):
+        merge_dispatcher = Dispatcher(BotModel(Config(["default"])), logger=logging.getLogger('Tests'))
+        self.assertIsNone(merge_dispatcher.get_merge_statistics(1))
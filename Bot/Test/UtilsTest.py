@@ -1,6 +1,40 @@
+import gzip
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
 import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import MagicMock
+from unittest.mock import create_autospec
 
+from Bot.MergeDispatcher import ChromeTraceFileSink
+from Bot.MergeDispatcher import CompressingRotatingFileHandler
+from Bot.MergeDispatcher import ConfigWatcher
+from Bot.MergeDispatcher import IndexedPriorityQueue
 from Bot.MergeDispatcher import JSONConfigLoader
+from Bot.MergeDispatcher import JSONLinesFormatter
+from Bot.MergeDispatcher import JSONResponse
+from Bot.MergeDispatcher import LazyValue
+from Bot.MergeDispatcher import LogPipeline
+from Bot.MergeDispatcher import LRUCache
+from Bot.MergeDispatcher import MarkupCache
+from Bot.MergeDispatcher import MetricsRegistry
+from Bot.MergeDispatcher import MetricsServer
+from Bot.MergeDispatcher import RateLimiter
+from Bot.MergeDispatcher import SamplingProfiler
+from Bot.MergeDispatcher import Scheduler
+from Bot.MergeDispatcher import SetJournal
+from Bot.MergeDispatcher import StartupTimeline
+from Bot.MergeDispatcher import TimeoutPolicy
+from Bot.MergeDispatcher import TimerWheel
+from Bot.MergeDispatcher import Tracer
+from Bot.MergeDispatcher import current_trace_id
+from Bot.MergeDispatcher import span
 
 
 class JSONConfigLoaderTest(unittest.TestCase):
@@ -9,12 +43,799 @@ class JSONConfigLoaderTest(unittest.TestCase):
         config = JSONConfigLoader.parse_json(json)
         self.assertCountEqual(config.get_branches(), ["branch1", "branch2"])
 
+    def test_shouldParseAdmins(self):
+        json = '{"branches": ["branch1"], "admins": [123]}'
+        config = JSONConfigLoader.parse_json(json)
+        self.assertTrue(config.is_admin(123))
+        self.assertFalse(config.is_admin(456))
+
+    def test_shouldHaveNoAdminsIfNotGiven(self):
+        json = '{"branches": ["branch1"]}'
+        config = JSONConfigLoader.parse_json(json)
+        self.assertListEqual([], config.get_admins())
+
     def test_shouldReturnNoneIfNoBranchesInJSON(self):
         json = '{}'
         config = JSONConfigLoader.parse_json(json)
         self.assertIsNone(config)
 
+    def test_shouldParseBranchPatterns(self):
+        json = '{"branches": ["branch1", "release/*"]}'
+        config = JSONConfigLoader.parse_json(json)
+        self.assertListEqual(["branch1"], config.get_branches())
+        self.assertTrue(config.get_branch_patterns().matches("release/1.0"))
+
+    def test_shouldReturnNoneIfBranchPatternIncorrect(self):
+        json = '{"branches": ["re:release/("]}'
+        config = JSONConfigLoader.parse_json(json)
+        self.assertIsNone(config)
+
+    def test_shouldParseTimeoutsInMinutes(self):
+        json = '{"branches": ["branch1"], "timeouts": {"default": {"remind": 30, "release": 120}, ' \
+               '"branch1": {"skip": 10}}}'
+        config = JSONConfigLoader.parse_json(json)
+        self.assertEqual(TimeoutPolicy(remind_after=1800, skip_after=600, release_after=7200),
+                         config.get_timeouts().get_policy("branch1"))
+
+    def test_shouldHaveNoTimeoutsIfNotGiven(self):
+        json = '{"branches": ["branch1"]}'
+        config = JSONConfigLoader.parse_json(json)
+        self.assertTrue(config.get_timeouts().is_empty())
+
+    def test_shouldReturnNoneIfTimeoutIncorrect(self):
+        for timeouts in ('{"default": {"remind": -1}}', '{"default": {"later": 1}}', '{"default": {"skip": "1"}}'):
+            json = '{"branches": ["branch1"], "timeouts": ' + timeouts + '}'
+            self.assertIsNone(JSONConfigLoader.parse_json(json))
+
+    def test_shouldParseTrainSizes(self):
+        json = '{"branches": ["branch1", "branch2", "release/*"], "trains": {"branch1": 3, "release/*": 2}}'
+        trains = JSONConfigLoader.parse_json(json).get_trains()
+        self.assertListEqual([3, 1, 2], [trains.get_size(branch) for branch in ("branch1", "branch2", "release/1")])
+        self.assertTrue(JSONConfigLoader.parse_json('{"branches": ["branch1"]}').get_trains().is_empty())
+
+    def test_shouldReturnNoneIfTrainSizeIncorrect(self):
+        for trains in ('{"default": 0}', '{"branch1": 2.5}', '{"branch1": "3"}', '[3]'):
+            json = '{"branches": ["branch1"], "trains": ' + trains + '}'
+            self.assertIsNone(JSONConfigLoader.parse_json(json))
+
     def test_shouldReturnNoneIfJSONMalformed(self):
         json = 'Not a JSON hohoho'
         config = JSONConfigLoader.parse_json(json)
         self.assertIsNone(config)
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_shouldReturnStoredValue(self):
+        cache = LRUCache(2)
+        cache.put("key", "value")
+        self.assertEqual("value", cache.get("key"))
+
+    def test_shouldReturnDefaultIfKeyNotCached(self):
+        cache = LRUCache(2)
+        self.assertEqual("default", cache.get("key", "default"))
+
+    def test_shouldEvictLeastRecentlyUsedValue(self):
+        cache = LRUCache(2)
+        cache.put("first", 1)
+        cache.put("second", 2)
+        cache.get("first")
+        cache.put("third", 3)
+        self.assertIn("first", cache)
+        self.assertNotIn("second", cache)
+        self.assertIn("third", cache)
+
+    def test_shouldBeEmptyAfterClear(self):
+        cache = LRUCache(2)
+        cache.put("key", "value")
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def test_shouldRaiseExceptionIfCapacityIsNotPositive(self):
+        with self.assertRaises(ValueError):
+            LRUCache(0)
+
+
+class MarkupCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._cache = MarkupCache(4)
+        self._builds = []
+
+    def _build(self, markup):
+        def build():
+            self._builds.append(markup)
+            return markup
+        return build
+
+    def test_shouldBuildMarkupOnMiss(self):
+        self.assertEqual("first", self._cache.get(("branches", ("default",)), self._build("first")))
+        self.assertEqual("second", self._cache.get(("branches", ("release",)), self._build("second")))
+        self.assertListEqual(["first", "second"], self._builds)
+
+    def test_shouldReturnCachedMarkupOnHit(self):
+        self._cache.get(("branches", ("default",)), self._build("first"))
+        self.assertEqual("first", self._cache.get(("branches", ("default",)), self._build("rebuilt")))
+        self.assertListEqual(["first"], self._builds)
+
+    def test_shouldRebuildMarkupAfterInvalidation(self):
+        self._cache.get(("branches", ("default",)), self._build("first"))
+        self._cache.invalidate()
+        self.assertEqual(0, len(self._cache))
+        self.assertEqual("rebuilt", self._cache.get(("branches", ("default",)), self._build("rebuilt")))
+        self.assertListEqual(["first", "rebuilt"], self._builds)
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def test_shouldSumCounterIncrementsFromAllThreads(self):
+        counter = MetricsRegistry().counter("requests_total", "Requests", ("method",))
+
+        def increment():
+            for _ in range(100):
+                counter.inc(labels=("send",))
+
+        threads = [threading.Thread(target=increment) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(2000, counter.get_value(("send",)))
+        self.assertEqual(0, counter.get_value(("edit",)))
+
+    def test_shouldReturnSameMetricForSameName(self):
+        registry = MetricsRegistry()
+        self.assertIs(registry.counter("requests_total", "Requests"), registry.counter("requests_total", "Requests"))
+
+    def test_shouldRaiseExceptionIfMetricRegisteredWithOtherType(self):
+        registry = MetricsRegistry()
+        registry.counter("requests", "Requests")
+        with self.assertRaises(ValueError):
+            registry.histogram("requests", "Requests")
+
+    def test_shouldRaiseExceptionForWrongLabels(self):
+        counter = MetricsRegistry().counter("requests_total", "Requests", ("method",))
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_shouldRenderHistogramInPrometheusFormat(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Latency", ("handler",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, ("merge",))
+        histogram.observe(0.5, ("merge",))
+        histogram.observe(5, ("merge",))
+
+        lines = registry.render().splitlines()
+
+        self.assertListEqual(["# HELP latency_seconds Latency",
+                              "# TYPE latency_seconds histogram",
+                              'latency_seconds_bucket{handler="merge",le="0.1"} 1',
+                              'latency_seconds_bucket{handler="merge",le="1.0"} 2',
+                              'latency_seconds_bucket{handler="merge",le="+Inf"} 3',
+                              'latency_seconds_sum{handler="merge"} 5.55',
+                              'latency_seconds_count{handler="merge"} 3'], lines)
+
+    def test_shouldRenderGaugeFromCallback(self):
+        registry = MetricsRegistry()
+        registry.gauge("queue_length", "Queue length", lambda: {("default",): 2, ("re\"lease",): 0}, ("branch",))
+
+        lines = registry.render().splitlines()
+
+        self.assertIn('queue_length{branch="default"} 2', lines)
+        self.assertIn('queue_length{branch="re\\"lease"} 0', lines)
+
+    def test_shouldMeasureDurationWithTimer(self):
+        histogram = MetricsRegistry().histogram("latency_seconds", "Latency")
+        with histogram.time():
+            pass
+        self.assertEqual(1, histogram.get_count())
+
+
+class MetricsServerTest(unittest.TestCase):
+    def test_shouldServeMetrics(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests").inc(3)
+        server = MetricsServer(registry, 0, host="127.0.0.1")
+        server.start()
+        try:
+            url = "http://127.0.0.1:{}/metrics".format(server.get_port())
+            with urllib.request.urlopen(url, timeout=5) as response:
+                body = response.read().decode("utf-8")
+        finally:
+            server.stop()
+
+        self.assertIn("requests_total 3", body.splitlines())
+
+    def test_shouldServeJSONRoutes(self):
+        def stats_route(parameters):
+            if "days" in parameters and int(parameters["days"]) <= 0:
+                raise ValueError("Report period should be positive")
+            return {"branch": parameters.get("branch")}
+
+        server = MetricsServer(MetricsRegistry(), 0, host="127.0.0.1", routes={"/stats": stats_route})
+        server.start()
+        try:
+            url = "http://127.0.0.1:{}/stats".format(server.get_port())
+            with urllib.request.urlopen(url + "?branch=default", timeout=5) as response:
+                self.assertEqual({"branch": "default"}, json.loads(response.read().decode("utf-8")))
+                self.assertTrue(response.headers["Content-Type"].startswith("application/json"))
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + "?days=0", timeout=5)
+            self.assertEqual(400, error.exception.code)
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url.replace("/stats", "/unknown"), timeout=5)
+            self.assertEqual(404, error.exception.code)
+        finally:
+            server.stop()
+
+    def test_shouldAnswerNotModifiedForMatchingETag(self):
+        route_response = JSONResponse({"branch": "default"}, "1-5")
+        server = MetricsServer(MetricsRegistry(), 0, host="127.0.0.1", routes={"/queues": lambda _: route_response})
+        server.start()
+        try:
+            url = "http://127.0.0.1:{}/queues".format(server.get_port())
+            with urllib.request.urlopen(url, timeout=5) as response:
+                self.assertEqual({"branch": "default"}, json.loads(response.read().decode("utf-8")))
+                self.assertEqual("\"1-5\"", response.headers["ETag"])
+            request = urllib.request.Request(url, headers={"If-None-Match": "\"1-4\", \"1-5\""})
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(request, timeout=5)
+            self.assertEqual(304, error.exception.code)
+            request = urllib.request.Request(url, headers={"If-None-Match": "\"1-4\""})
+            with urllib.request.urlopen(request, timeout=5) as response:
+                self.assertEqual(200, response.status)
+        finally:
+            server.stop()
+
+
+class JSONResponseTest(unittest.TestCase):
+    def test_shouldMatchETagsFromHeader(self):
+        response = JSONResponse({"b": 1, "a": [2]}, "abc")
+        self.assertEqual("{\"a\": [2], \"b\": 1}", response.get_body())
+        self.assertTrue(response.matches("\"abc\""))
+        self.assertTrue(response.matches("W/\"abc\""))
+        self.assertTrue(response.matches("\"xyz\", \"abc\""))
+        self.assertTrue(response.matches("*"))
+        self.assertFalse(response.matches("\"abcd\""))
+        self.assertFalse(response.matches(None))
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        self._sink = create_autospec(ChromeTraceFileSink)
+
+    def test_shouldIgnoreSpansWithoutActiveTrace(self):
+        with span("dispatcher.merge") as ignored_span:
+            ignored_span.set_attribute("key", "value")
+        self.assertIsNone(current_trace_id())
+
+    def test_shouldRecordChildSpansOfTrace(self):
+        tracer = Tracer(self._sink, sample_rate=1.0)
+        with tracer.trace("handler.merge", user_id=1):
+            trace_id = current_trace_id()
+            with span("dispatcher.merge"):
+                with span("model.dump"):
+                    pass
+
+        self._sink.write.assert_called_once()
+        trace = self._sink.write.call_args[0][0]
+        self.assertEqual(trace_id, trace.get_trace_id())
+        self.assertListEqual(["model.dump", "dispatcher.merge", "handler.merge"],
+                             [trace_span.get_name() for trace_span in trace.get_spans()])
+        self.assertEqual({"user_id": 1}, trace.get_spans()[-1].get_attributes())
+        self.assertIsNone(current_trace_id())
+
+    def test_shouldNestTraceIntoActiveTrace(self):
+        tracer = Tracer(self._sink, sample_rate=1.0)
+        with tracer.trace("webhook.update"):
+            with tracer.trace("handler.merge"):
+                pass
+
+        self._sink.write.assert_called_once()
+        self.assertEqual(2, len(self._sink.write.call_args[0][0].get_spans()))
+
+    def test_shouldDropNotSampledFastTraces(self):
+        tracer = Tracer(self._sink, sample_rate=0.0, slow_threshold=10.0)
+        with tracer.trace("handler.merge"):
+            pass
+
+        self._sink.write.assert_not_called()
+        self.assertEqual(1, tracer.get_dropped_traces())
+
+    def test_shouldAlwaysKeepSlowTraces(self):
+        tracer = Tracer(self._sink, sample_rate=0.0, slow_threshold=0.0)
+        with tracer.trace("handler.merge"):
+            pass
+
+        self._sink.write.assert_called_once()
+        self.assertEqual(1, tracer.get_kept_traces())
+
+    def test_shouldRecordErrorOfSpan(self):
+        tracer = Tracer(self._sink, sample_rate=1.0)
+        with self.assertRaises(KeyError):
+            with tracer.trace("handler.merge"):
+                raise KeyError()
+
+        self.assertEqual("KeyError", self._sink.write.call_args[0][0].get_spans()[0].get_attributes()["error"])
+
+    def test_shouldRaiseExceptionForIncorrectSampleRate(self):
+        with self.assertRaises(ValueError):
+            Tracer(sample_rate=2.0)
+
+
+class ChromeTraceFileSinkTest(unittest.TestCase):
+    def test_shouldWriteTraceEvents(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            sink = ChromeTraceFileSink(os.path.join(work_dir, "traces.json"))
+            tracer = Tracer(sink, sample_rate=1.0)
+            for _ in range(2):
+                with tracer.trace("handler.merge"):
+                    with span("model.dump"):
+                        pass
+            with open(sink.get_path(), 'r') as trace_file:
+                events = json.loads(trace_file.read().rstrip().rstrip(',') + "]")
+
+        self.assertEqual(4, len(events))
+        self.assertEqual("model.dump", events[0]["name"])
+        self.assertEqual("X", events[0]["ph"])
+        self.assertEqual(events[0]["args"]["trace_id"], events[1]["args"]["trace_id"])
+        self.assertNotEqual(events[0]["args"]["trace_id"], events[2]["args"]["trace_id"])
+
+
+class LogPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self._work_dir = tempfile.TemporaryDirectory()
+        self._log_path = os.path.join(self._work_dir.name, "bot.log")
+        self._logger = logging.getLogger("Tests.LogPipeline")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+        self._work_dir.cleanup()
+
+    def _create_pipeline(self, max_bytes=0, queue_size=LogPipeline.DEFAULT_QUEUE_SIZE):
+        handler = CompressingRotatingFileHandler(self._log_path, maxBytes=max_bytes, backupCount=3)
+        handler.setFormatter(JSONLinesFormatter())
+        pipeline = LogPipeline([handler], queue_size)
+        self._logger.addHandler(pipeline.get_handler())
+        return pipeline
+
+    def _read_entries(self):
+        with open(self._log_path, 'r') as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_shouldWriteRecordsAsJSONLines(self):
+        pipeline = self._create_pipeline()
+        pipeline.start()
+        with Tracer(sample_rate=1.0).trace("handler.merge"):
+            self._logger.info("User %s has requested merge", "Jack")
+        pipeline.stop()
+
+        entries = self._read_entries()
+        self.assertEqual(1, len(entries))
+        self.assertEqual("User Jack has requested merge", entries[0]["message"])
+        self.assertEqual("INFO", entries[0]["level"])
+        self.assertEqual("Tests.LogPipeline", entries[0]["logger"])
+        self.assertIn("trace_id", entries[0])
+
+    def test_shouldFormatExceptionInCallerThread(self):
+        pipeline = self._create_pipeline()
+        pipeline.start()
+        try:
+            raise KeyError("branch")
+        except KeyError:
+            self._logger.error("Exception during merge command", exc_info=1)
+        pipeline.stop()
+
+        entries = self._read_entries()
+        self.assertEqual("Exception during merge command", entries[0]["message"])
+        self.assertIn("KeyError: 'branch'", entries[0]["exception"])
+
+    def test_shouldNotEvaluateLazyValuesOnDisabledLevel(self):
+        pipeline = self._create_pipeline()
+        function = MagicMock(return_value="Jack")
+
+        self._logger.debug("User %s", LazyValue(function, 1))
+        pipeline.stop()
+
+        function.assert_not_called()
+
+    def test_shouldEvaluateLazyValuesInCallerThread(self):
+        pipeline = self._create_pipeline()
+        names = {1: "Jack"}
+
+        self._logger.info("User %s", LazyValue(names.get, 1))
+        names[1] = "Johnny"
+        pipeline.start()
+        pipeline.stop()
+
+        self.assertEqual("User Jack", self._read_entries()[0]["message"])
+
+    def test_shouldDropRecordsIfQueueIsFull(self):
+        pipeline = self._create_pipeline(queue_size=1)
+        for index in range(3):
+            self._logger.info("Message %d", index)
+
+        self.assertEqual(2, pipeline.get_dropped_records())
+        pipeline.start()
+        pipeline.stop()
+
+    def test_shouldCompressRotatedSegments(self):
+        pipeline = self._create_pipeline(max_bytes=200)
+        pipeline.start()
+        for index in range(10):
+            self._logger.info("Message number %d", index)
+        pipeline.stop()
+
+        segment_path = self._log_path + ".1" + CompressingRotatingFileHandler.COMPRESSED_SUFFIX
+        self.assertTrue(os.path.exists(segment_path))
+        self.assertFalse(os.path.exists(self._log_path + ".1"))
+        with gzip.open(segment_path, 'rt') as segment_file:
+            entries = [json.loads(line) for line in segment_file]
+        self.assertTrue(entries)
+        self.assertTrue(all(entry["message"].startswith("Message number") for entry in entries))
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_shouldSpreadAcquisitionsOverTime(self):
+        limiter = RateLimiter(100)
+        started = time.monotonic()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_shouldShareRateBetweenThreads(self):
+        limiter = RateLimiter(100)
+        started = time.monotonic()
+        threads = [threading.Thread(target=lambda: [limiter.acquire() for _ in range(4)]) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    def test_shouldRaiseExceptionForIncorrectRate(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(0)
+
+
+class TimerWheelTest(unittest.TestCase):
+    def test_shouldExpireTimersInDeadlineOrder(self):
+        wheel = TimerWheel(0, tick=1, slots=8)
+        wheel.schedule(3.5, "second")
+        wheel.schedule(2.5, "first")
+        wheel.schedule(30, "later")
+        self.assertListEqual([], wheel.advance(2))
+        self.assertListEqual(["first", "second"], [timer.get_payload() for timer in wheel.advance(4)])
+        self.assertEqual(1, len(wheel))
+
+    def test_shouldKeepTimersScheduledAfterFullRotation(self):
+        wheel = TimerWheel(0, tick=1, slots=8)
+        wheel.schedule(10.5, "timer")
+        self.assertListEqual([], wheel.advance(3))
+        self.assertListEqual([], wheel.advance(7))
+        self.assertListEqual(["timer"], [timer.get_payload() for timer in wheel.advance(11)])
+
+    def test_shouldNotExpireCancelledTimer(self):
+        wheel = TimerWheel(0, tick=1, slots=8)
+        timer = wheel.schedule(1, "timer")
+        self.assertTrue(wheel.cancel(timer))
+        self.assertFalse(wheel.cancel(timer))
+        self.assertListEqual([], wheel.advance(5))
+        self.assertEqual(0, len(wheel))
+
+    def test_shouldExpireOverdueTimerOnNextAdvance(self):
+        wheel = TimerWheel(10, tick=1, slots=8)
+        wheel.schedule(5, "timer")
+        self.assertListEqual(["timer"], [timer.get_payload() for timer in wheel.advance(10)])
+
+
+class IndexedPriorityQueueTest(unittest.TestCase):
+    def test_shouldOrderByPriorityAndKeepOrderWithinPriority(self):
+        queue = IndexedPriorityQueue(["first", "second"])
+        queue.append("hotfix", 2)
+        queue.append("third")
+        queue.append("release", 1)
+        self.assertListEqual(["hotfix", "release", "first", "second", "third"], list(queue))
+        self.assertEqual("hotfix", queue[0])
+        self.assertEqual("third", queue[-1])
+
+    def test_shouldPutItemToFrontOfItsPriority(self):
+        queue = IndexedPriorityQueue()
+        queue.append("hotfix", 2)
+        queue.append("normal")
+        queue.appendleft("pushed back")
+        self.assertListEqual([("hotfix", 2), ("pushed back", 0), ("normal", 0)], queue.items())
+
+    def test_shouldRemoveAndPopItems(self):
+        queue = IndexedPriorityQueue(["first", "second", "third"])
+        queue.remove("second")
+        self.assertNotIn("second", queue)
+        self.assertEqual("first", queue.popleft())
+        self.assertListEqual(["third"], list(queue))
+        with self.assertRaises(ValueError):
+            queue.remove("second")
+        queue.clear()
+        with self.assertRaises(IndexError):
+            queue.popleft()
+
+    def test_shouldNotAddSameItemTwice(self):
+        queue = IndexedPriorityQueue(["first"])
+        with self.assertRaises(ValueError):
+            queue.append("first", 1)
+
+    def test_shouldMoveItemWhenPriorityUpdated(self):
+        queue = IndexedPriorityQueue(["first", "second", "third"])
+        queue.update_priority("third", 1)
+        self.assertListEqual(["third", "first", "second"], list(queue))
+        queue.update_priority("third", 0)
+        self.assertListEqual(["first", "second", "third"], list(queue))
+        self.assertEqual(0, queue.get_priority("third"))
+
+    def test_shouldMatchSortedListOnRandomOperations(self):
+        generator = random.Random(42)
+        queue = IndexedPriorityQueue()
+        expected = {}
+        order = 0
+        for _ in range(2000):
+            item = generator.randrange(50)
+            priority = generator.randrange(3)
+            if item in expected:
+                if generator.random() < 0.5:
+                    queue.remove(item)
+                    del expected[item]
+                else:
+                    queue.update_priority(item, priority)
+                    expected[item] = (priority, expected[item][1])
+            else:
+                order += 1
+                queue.append(item, priority)
+                expected[item] = (priority, order)
+            if expected and generator.random() < 0.1:
+                first = queue.popleft()
+                self.assertEqual(min(expected, key=lambda key: (-expected[key][0], expected[key][1])), first)
+                del expected[first]
+        self.assertListEqual(sorted(expected, key=lambda key: (-expected[key][0], expected[key][1])), list(queue))
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_shouldRunExpiredCallbacks(self):
+        scheduler = Scheduler(now=0)
+        callback = MagicMock()
+        scheduler.schedule(5, callback, "first")
+        scheduler.schedule(50, callback, "second")
+        self.assertEqual(1, scheduler.run_pending(10))
+        callback.assert_called_once_with("first")
+        self.assertEqual(1, len(scheduler))
+
+    def test_shouldNotRunCancelledCallback(self):
+        scheduler = Scheduler(now=0)
+        callback = MagicMock()
+        scheduler.cancel(scheduler.schedule(5, callback))
+        self.assertEqual(0, scheduler.run_pending(10))
+        callback.assert_not_called()
+
+    def test_shouldContinueAfterCallbackException(self):
+        scheduler = Scheduler(logger=create_autospec(logging.Logger), now=0)
+        callback = MagicMock()
+        scheduler.schedule(1, MagicMock(side_effect=RuntimeError("Test")))
+        scheduler.schedule(2, callback)
+        self.assertEqual(2, scheduler.run_pending(10))
+        callback.assert_called_once_with()
+
+    def test_shouldRunCallbacksInBackground(self):
+        scheduler = Scheduler(tick=0.01)
+        called = threading.Event()
+        scheduler.schedule(time.time(), called.set)
+        scheduler.start()
+        try:
+            self.assertTrue(called.wait(5))
+        finally:
+            scheduler.stop()
+
+
+class SetJournalTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, "journal")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _read_keys(self):
+        with SetJournal(self._path) as journal:
+            return journal.get_keys()
+
+    def test_shouldReplayAddedAndDiscardedKeys(self):
+        journal = SetJournal(self._path)
+        journal.add((1, 10))
+        journal.add((1, 11))
+        journal.add((2, 20))
+        journal.discard((1, 10))
+        journal.close()
+
+        self.assertSetEqual({(1, 11), (2, 20)}, self._read_keys())
+
+    def test_shouldAppendOnlyChangedKeys(self):
+        journal = SetJournal(self._path)
+        self.assertTrue(journal.add((1, 10)))
+        self.assertFalse(journal.add((1, 10)))
+        self.assertFalse(journal.discard((2, 20)))
+        self.assertEqual(1, journal.get_records())
+        journal.close()
+
+    def test_shouldCompactJournal(self):
+        journal = SetJournal(self._path)
+        for message_id in range(SetJournal.MIN_COMPACTION_RECORDS):
+            journal.add((1, message_id))
+            journal.discard((1, message_id))
+        journal.add((2, 20))
+        self.assertLessEqual(journal.get_records(), SetJournal.MIN_COMPACTION_RECORDS)
+        journal.close()
+
+        self.assertSetEqual({(2, 20)}, self._read_keys())
+
+    def test_shouldSkipIncompleteRecord(self):
+        journal = SetJournal(self._path)
+        journal.add((1, 10))
+        journal.close()
+        with open(self._path, 'a') as journal_file:
+            journal_file.write("[\"+\", 2")
+
+        journal = SetJournal(self._path)
+        self.assertSetEqual({(1, 10)}, journal.get_keys())
+        journal.add((3, 30))
+        journal.close()
+        self.assertSetEqual({(1, 10), (3, 30)}, self._read_keys())
+
+
+class StartupTimelineTest(unittest.TestCase):
+    def test_shouldRecordStagesInOrder(self):
+        timeline = StartupTimeline()
+        timeline.mark("import")
+        timeline.mark("config")
+        self.assertListEqual(["import", "config"], [stage for stage, _ in timeline.get_stages()])
+        self.assertAlmostEqual(timeline.get_total(), sum(duration for _, duration in timeline.get_stages()))
+
+    def test_shouldFinishOnlyOnce(self):
+        timeline = StartupTimeline()
+        self.assertTrue(timeline.finish("first_poll"))
+        self.assertFalse(timeline.finish("first_poll"))
+        self.assertTrue(timeline.is_finished())
+        self.assertEqual(1, len(timeline.get_stages()))
+
+    def test_shouldDescribeStages(self):
+        timeline = StartupTimeline(started=0.0)
+        timeline.mark("import")
+        self.assertRegex(str(timeline), r"^import \d+\.\d{3}s \(total \d+\.\d{3}s\)$")
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self._work_dir = tempfile.TemporaryDirectory()
+        self._profiler = SamplingProfiler(self._work_dir.name, interval=0.001)
+
+    def tearDown(self):
+        self._profiler.join()
+        self._work_dir.cleanup()
+
+    @staticmethod
+    def _busy_loop(stopped):
+        while not stopped.is_set():
+            sum(range(100))
+
+    def test_shouldWriteCollapsedStacksOfThreads(self):
+        stopped = threading.Event()
+        busy_thread = threading.Thread(target=self._busy_loop, args=(stopped,), name="BusyThread")
+        busy_thread.start()
+        try:
+            report = self._profiler.profile(0.1)
+        finally:
+            stopped.set()
+            busy_thread.join()
+
+        self.assertGreater(report.get_samples(), 0)
+        self.assertIsNone(report.get_allocations_path())
+        with open(report.get_stacks_path(), 'r') as stacks_file:
+            lines = stacks_file.read().splitlines()
+        busy_lines = [line for line in lines if line.startswith("BusyThread;")]
+        self.assertTrue(busy_lines)
+        self.assertTrue(all("_busy_loop" in line for line in busy_lines))
+        self.assertFalse(any(line.startswith("MainThread;") for line in lines))
+
+    def test_shouldWriteAllocationsReport(self):
+        report = self._profiler.profile(0.05, trace_allocations=True)
+
+        with open(report.get_allocations_path(), 'r') as allocations_file:
+            self.assertTrue(allocations_file.readline().startswith("Traced memory"))
+
+    def test_shouldNotStartSecondProfiling(self):
+        finished = threading.Event()
+        reports = []
+
+        def on_finished(report):
+            reports.append(report)
+            finished.set()
+
+        self.assertTrue(self._profiler.start(0.1, on_finished=on_finished))
+        self.assertFalse(self._profiler.start(0.1))
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(1, len(reports))
+
+    def test_shouldLogExceptionInCallback(self):
+        logged = threading.Event()
+        logger = create_autospec(logging.Logger)
+        logger.error.side_effect = lambda *args, **kwargs: logged.set()
+        profiler = SamplingProfiler(self._work_dir.name, interval=0.001, logger=logger)
+
+        def on_finished(report):
+            raise RuntimeError("Message was not sent")
+
+        self.assertTrue(profiler.start(0.05, on_finished=on_finished))
+        self.assertTrue(logged.wait(5))
+        self.assertFalse(profiler.is_running())
+
+    def test_shouldRaiseExceptionForIncorrectDuration(self):
+        with self.assertRaises(ValueError):
+            self._profiler.start(0)
+        with self.assertRaises(ValueError):
+            self._profiler.start(SamplingProfiler.MAX_DURATION + 1)
+
+
+class ConfigWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self._work_dir = tempfile.TemporaryDirectory()
+        self._config_path = os.path.join(self._work_dir.name, "config.json")
+        self._write_config('{"branches": ["default"]}', 1000)
+        self._configs = []
+        self._watcher = ConfigWatcher(self._config_path, self._configs.append, logging.getLogger('Tests'))
+
+    def tearDown(self):
+        self._work_dir.cleanup()
+
+    def _write_config(self, content, modification_time):
+        with open(self._config_path, 'w') as config_file:
+            config_file.write(content)
+        os.utime(self._config_path, (modification_time, modification_time))
+
+    def test_shouldNotReloadUnchangedConfig(self):
+        self.assertFalse(self._watcher.check())
+        self.assertListEqual([], self._configs)
+
+    def test_shouldReloadChangedConfig(self):
+        self._write_config('{"branches": ["default", "release"]}', 2000)
+
+        self.assertFalse(self._watcher.check())
+        self.assertTrue(self._watcher.check())
+        self.assertFalse(self._watcher.check())
+        self.assertEqual(1, len(self._configs))
+        self.assertListEqual(["default", "release"], self._configs[0].get_branches())
+
+    def test_shouldNotApplyIncorrectConfig(self):
+        self._write_config('{"branches": ["default", ', 2000)
+        self.assertFalse(self._watcher.check())
+        self.assertFalse(self._watcher.check())
+        self._write_config('{"branches": ["default", "release"]}', 3000)
+        self.assertFalse(self._watcher.check())
+        self.assertTrue(self._watcher.check())
+        self.assertEqual(1, len(self._configs))
+
+    def test_shouldNotApplyConfigWhileItIsWritten(self):
+        self._write_config('{"branches": ["default"], ', 2000)
+        self.assertFalse(self._watcher.check())
+        self._write_config('{"branches": ["default"], "admins": [123]}', 3000)
+        self.assertFalse(self._watcher.check())
+        self.assertListEqual([], self._configs)
+        self.assertTrue(self._watcher.check())
+        self.assertListEqual([123], self._configs[0].get_admins())
+
+    def test_shouldReloadConfigInBackground(self):
+        reloaded = threading.Event()
+        watcher = ConfigWatcher(self._config_path, lambda config: reloaded.set(), logging.getLogger('Tests'),
+                                interval=0.01)
+        watcher.start()
+        try:
+            self._write_config('{"branches": ["release"]}', 2000)
+            self.assertTrue(reloaded.wait(5))
+        finally:
+            watcher.stop()